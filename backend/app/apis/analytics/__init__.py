@@ -3,9 +3,12 @@ import databutton as db
 from fastapi import APIRouter, HTTPException, Depends, Query # Import Query
 from pydantic import BaseModel, Field
 from supabase.client import Client, create_client
-from typing import List, Dict, Any, Optional # Import Optional
+from typing import List, Dict, Any, Literal, Optional # Import Optional
+from datetime import date
 import uuid # Added for project_id type hint
-from collections import Counter
+from app.libs.analytics_counters import invalidate_summaries, load_counter_summary, load_data_version, rebuild_counters
+from app.libs.analytics_timeseries import load_timeseries, rebuild_timeseries
+from app.libs.response_cache import VersionedLRUCache
 
 # --- Supabase Client Dependency ---
 # (Keep the get_supabase_client function as is)
@@ -28,6 +31,9 @@ def get_supabase_client() -> Client:
 
 router = APIRouter()
 
+# Summaries and time series per (project, filters), each tagged with the project's analytics data version
+summary_cache = VersionedLRUCache(max_entries=512, ttl_seconds=300)
+
 # --- Pydantic Models ---
 # (Keep the Pydantic models as is)
 class TopicCount(BaseModel):
@@ -40,6 +46,36 @@ class AnalyticsSummaryResponse(BaseModel):
     complexity_distribution: Dict[str, int] = Field(default_factory=dict)
     top_topics: List[TopicCount] = Field(default_factory=list)
     error: str | None = None
+    source: str = Field(
+        "query",
+        description="'counters' when read from the maintained counters, 'query' when computed by the analytics_summary function.",
+    )
+    cached: bool = Field(False, description="Whether the summary was served from the response cache.")
+    cache_age_seconds: float = Field(0.0, description="Seconds since the served summary was computed.")
+
+class TopicSearchResult(BaseModel):
+    topic_name: str
+    document_count: int
+    prefix_match: bool
+
+class TimeseriesBucket(BaseModel):
+    bucket_start: date = Field(..., description="First day of the bucket (weeks start on Monday).")
+    total_documents: int
+    sentiment_distribution: Dict[str, int] = Field(default_factory=dict)
+    complexity_distribution: Dict[str, int] = Field(default_factory=dict)
+    top_topics: List[TopicCount] = Field(default_factory=list)
+
+class AnalyticsTimeseriesResponse(BaseModel):
+    project_id: uuid.UUID
+    date_field: str
+    resolution: str
+    buckets: List[TimeseriesBucket] = Field(default_factory=list)
+    cached: bool = Field(False, description="Whether the series was served from the response cache.")
+    cache_age_seconds: float = Field(0.0, description="Seconds since the served series was computed.")
+
+class RebuildCountersResponse(BaseModel):
+    project_id: uuid.UUID | None = None
+    documents_counted: int
 
 # --- API Endpoint ---
 @router.get("/summary", response_model=AnalyticsSummaryResponse)
@@ -48,138 +84,213 @@ def get_analytics_summary(
     project_id: uuid.UUID | None = Query(None, description="Filter analytics by project ID"), # ADDED
     sentiment_filter: Optional[str] = Query(None),
     complexity_filter: Optional[str] = Query(None),
-    topic_filter: Optional[str] = Query(None)
+    topic_filter: Optional[List[str]] = Query(
+        None, description="Topic terms; repeat the parameter to require documents matching all of them"
+    ),
 ) -> AnalyticsSummaryResponse:
-    """Fetches aggregated analytics data, applying filters if provided."""
+    """Fetches aggregated analytics data, applying filters if provided.
+
+    Without a topic filter the summary comes from the counters the database maintains;
+    otherwise the analytics_summary SQL function filters and groups the documents and
+    returns only the counts, resolving topic terms through the topic index. Summaries are cached per project and filters until the
+    project's analytics data version changes.
+    """
     print(f"Fetching analytics summary data with project_id: '{project_id}', filters: sentiment='{sentiment_filter}', complexity='{complexity_filter}', topic='{topic_filter}'")
-    
-    sentiment_dist = Counter()
-    complexity_dist = Counter()
-    topic_counts = Counter()
-    total_docs = 0
-    filtered_doc_ids = []
-    
+    top_n = 10 # Limit to top 10 topics
+    sentiment = sentiment_filter.strip().lower() if sentiment_filter and sentiment_filter.strip() else None
+    complexity = complexity_filter.strip() if complexity_filter and complexity_filter.strip() else None
+    topics = tuple(sorted({term.strip().lower() for term in topic_filter or [] if term.strip()})) or None
+    project_key = str(project_id) if project_id else None
+
+    cache_key = (project_key, sentiment, complexity, topics)
     try:
-        # --- Filtering Logic ---
-        document_ids_from_topic_filter = None
-        if topic_filter:
-            # 1. Find document IDs matching the topic filter (case-insensitive)
-            topic_query = supabase.table('document_topics')\
-                .select('document_id')\
-                .ilike('topic_name', f'%{topic_filter.strip()}%') # Case-insensitive partial match
-                
-            topic_response = topic_query.execute()
-            
-            if topic_response.data:
-                document_ids_from_topic_filter = list(set([item['document_id'] for item in topic_response.data]))
-                if not document_ids_from_topic_filter:
-                     print(f"No documents found for topic filter: '{topic_filter}'")
-                     # Return empty results if topic filter matches nothing
-                     return AnalyticsSummaryResponse(total_documents=0)
-            else:
-                 print(f"No documents found for topic filter: '{topic_filter}'")
-                 return AnalyticsSummaryResponse(total_documents=0)
-
-        # --- Document Query Construction ---
-        # Fetch 'analysis' field instead of 'complexity'
-        documents_query = supabase.table('documents')\
-            .select('id, overall_sentiment, analysis', count='exact')\
-            .eq('status', 'processed') # Always filter by processed status
-
-        if project_id:
-            documents_query = documents_query.eq('project_id', str(project_id))
-
-        # Apply filters conditionally
-        if sentiment_filter:
-            documents_query = documents_query.eq('overall_sentiment', sentiment_filter.strip().lower())
-        if complexity_filter:
-            # Filter based on the 'complexity_level' within the 'analysis' JSON field
-            documents_query = documents_query.eq('analysis->>complexity_level', complexity_filter.strip())
-        # Apply topic filter (if any results were found)
-        if document_ids_from_topic_filter is not None:
-             # Ensure we only query for IDs if the topic filter yielded results
-             if document_ids_from_topic_filter:
-                 documents_query = documents_query.in_('id', document_ids_from_topic_filter)
-             else:
-                 # If topic filter resulted in empty list, no documents match all criteria
-                 print("Topic filter resulted in no matching document IDs.")
-                 return AnalyticsSummaryResponse(total_documents=0)
-
-        # --- Execute Document Query ---
-        documents_response = documents_query.execute()
-
-        if documents_response.data:
-            documents = documents_response.data
-            total_docs = documents_response.count if documents_response.count is not None else len(documents)
-            filtered_doc_ids = [doc['id'] for doc in documents] # Get IDs of filtered docs
-            print(f"Processing {len(documents)} filtered documents (total matching count: {total_docs}) for analytics.")
-            
-            # Calculate distributions based on FILTERED documents
-            for doc in documents:
-                # Sentiment
-                sentiment = doc.get('overall_sentiment')
-                if sentiment:
-                    sentiment_dist[str(sentiment).strip().lower()] += 1
-                else:
-                    sentiment_dist['unknown'] += 1
-                
-                # Complexity from analysis field
-                analysis_data = doc.get('analysis')
-                complexity = None
-                if isinstance(analysis_data, dict):
-                    complexity = analysis_data.get('complexity_level')
-                    
-                if complexity:
-                    complexity_dist[str(complexity).strip()] += 1 
-                else:
-                    complexity_dist['unknown'] += 1
-        else:
-            # No documents matched the combined filters
-            total_docs = documents_response.count if documents_response.count is not None else 0
-            print("No documents found matching the specified filters.")
-            return AnalyticsSummaryResponse(total_documents=0)
-
-        # --- Topic Query Construction (based on filtered documents) ---
-        if filtered_doc_ids:
-             topics_query = supabase.table('document_topics')\
-                 .select('topic_name')\
-                 .in_('document_id', filtered_doc_ids) # Filter by the documents we actually found
-
-             topics_response = topics_query.execute()
-                 
-             if topics_response.data:
-                 print(f"Processing {len(topics_response.data)} topic entries from filtered documents.")
-                 for topic_entry in topics_response.data:
-                     topic_name = topic_entry.get('topic_name')
-                     if topic_name:
-                         normalized_topic = str(topic_name).strip().lower()
-                         if normalized_topic:
-                             topic_counts[normalized_topic] += 1
-             else:
-                 print("No topics found for the filtered documents.")
-        else:
-             # This case should ideally not happen if we returned earlier when documents_response.data was empty
-             print("Skipping topic query as no documents matched filters (or filtered_doc_ids list is empty).")
-             
-        # --- Prepare Top Topics ---
-        top_n = 10 # Limit to top 10 topics
-        top_topics_list = [
-            TopicCount(topic_name=name.capitalize(), count=count) 
-            for name, count in topic_counts.most_common(top_n)
-        ]
-        print(f"Top topics identified for filtered data: {top_topics_list}")
-
-        # --- Return successful response with filtered data ---
+        version = load_data_version(supabase, project_key)
+    except Exception as e:
+        print(f"Analytics data version unavailable, not caching the summary: {e}")
+        version = None
+    if version is not None:
+        hit = summary_cache.get(cache_key, version)
+        if hit is not None:
+            summary, age = hit
+            return summary.model_copy(update={"cached": True, "cache_age_seconds": round(age, 3)})
+
+    summary = _compute_summary(supabase, project_key, sentiment, complexity, topics, top_n)
+    if version is not None and summary.error is None:
+        summary_cache.put(cache_key, version, summary)
+    return summary
+
+
+def _compute_summary(
+    supabase: Client,
+    project_key: str | None,
+    sentiment: str | None,
+    complexity: str | None,
+    topics: tuple[str, ...] | None,
+    top_n: int,
+) -> AnalyticsSummaryResponse:
+    if topics is None:
+        try:
+            counters = load_counter_summary(
+                supabase,
+                project_id=project_key,
+                sentiment=sentiment,
+                complexity=complexity,
+                top_n=top_n,
+            )
+            return AnalyticsSummaryResponse(
+                total_documents=counters["total_documents"],
+                sentiment_distribution=counters["sentiment_distribution"],
+                complexity_distribution=counters["complexity_distribution"],
+                top_topics=[TopicCount(topic_name=name.capitalize(), count=count) for name, count in counters["top_topics"]],
+                source="counters",
+            )
+        except Exception as e:
+            print(f"Analytics counters unavailable, computing the summary in the database: {e}")
+
+    try:
+        summary = supabase.rpc(
+            "analytics_summary",
+            {
+                "p_project_id": project_key,
+                "p_sentiment": sentiment,
+                "p_complexity": complexity,
+                "p_topics": list(topics) if topics else None,
+                "p_top_n": top_n,
+            },
+        ).execute().data or {}
         return AnalyticsSummaryResponse(
-            total_documents=total_docs,
-            sentiment_distribution=dict(sentiment_dist),
-            complexity_distribution=dict(complexity_dist),
-            top_topics=top_topics_list
+            total_documents=summary.get("total_documents", 0),
+            sentiment_distribution=summary.get("sentiment_distribution") or {},
+            complexity_distribution=summary.get("complexity_distribution") or {},
+            top_topics=[
+                TopicCount(topic_name=entry["topic"].capitalize(), count=entry["topic_count"])
+                for entry in summary.get("top_topics") or []
+            ],
+            source="query",
         )
-
     except Exception as e:
         error_msg = f"Failed to fetch analytics summary: {e}"
         print(f"Error: {error_msg}")
-        # In case of error, return an error message, total_docs might be 0 or a partial count
-        return AnalyticsSummaryResponse(error=error_msg, total_documents=total_docs)
+        return AnalyticsSummaryResponse(error=error_msg, total_documents=0)
+
+
+@router.post("/summary/rebuild", response_model=RebuildCountersResponse)
+def rebuild_analytics_counters(
+    supabase: Client = Depends(get_supabase_client),
+    project_id: uuid.UUID | None = Query(None, description="Project to rebuild; all projects when omitted"),
+) -> RebuildCountersResponse:
+    """Recomputes the analytics counters and daily rollups from the documents and topics, repairing any drift."""
+    try:
+        documents_counted = rebuild_counters(supabase, str(project_id) if project_id else None)
+        rebuild_timeseries(supabase, str(project_id) if project_id else None)
+        invalidate_summaries(supabase, str(project_id) if project_id else None)
+    except Exception as e:
+        print(f"Error rebuilding analytics counters for project '{project_id}': {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to rebuild analytics counters: {e}")
+    print(f"Rebuilt analytics counters for project '{project_id}': {documents_counted} processed documents.")
+    return RebuildCountersResponse(project_id=project_id, documents_counted=documents_counted)
+
+
+@router.get("/topics/search", response_model=List[TopicSearchResult])
+def search_topics(
+    supabase: Client = Depends(get_supabase_client),
+    project_id: uuid.UUID | None = Query(None, description="Project whose topic dictionary to search"),
+    q: str = Query("", description="Topic prefix or approximate name"),
+    limit: int = Query(20, ge=1, le=100),
+) -> List[TopicSearchResult]:
+    """Searches the topic dictionary: prefix matches first, then the closest trigram matches."""
+    try:
+        rows = supabase.rpc(
+            "search_project_topics",
+            {"p_project_id": str(project_id) if project_id else None, "p_query": q, "p_limit": limit},
+        ).execute().data or []
+    except Exception as e:
+        print(f"Error searching topics for project '{project_id}' with query '{q}': {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to search topics: {e}")
+    return [
+        TopicSearchResult(
+            topic_name=row["topic"].capitalize(),
+            document_count=row["document_count"],
+            prefix_match=row["prefix_match"],
+        )
+        for row in rows
+    ]
+
+
+@router.get("/timeseries", response_model=AnalyticsTimeseriesResponse)
+def get_analytics_timeseries(
+    project_id: uuid.UUID = Query(..., description="Project to chart"),
+    supabase: Client = Depends(get_supabase_client),
+    date_field: Literal["processed_at", "response_date"] = Query(
+        "processed_at", description="Bucket by the day a document was processed or by its extracted response date"
+    ),
+    resolution: Literal["day", "week", "month"] = Query("week"),
+    start_date: Optional[date] = Query(None, description="First day to include"),
+    end_date: Optional[date] = Query(None, description="Last day to include"),
+    sentiment_filter: Optional[str] = Query(None),
+    complexity_filter: Optional[str] = Query(None),
+    top_n: int = Query(5, ge=0, le=50, description="Top topics per bucket"),
+) -> AnalyticsTimeseriesResponse:
+    """Sentiment, complexity and topic trends of processed documents, from the daily rollups.
+
+    Weekly and monthly buckets are summed from the daily rows in the database. Series are
+    cached like summaries, until the project's analytics data version changes.
+    """
+    print(
+        f"Fetching analytics timeseries for project '{project_id}': {date_field} by {resolution}, "
+        f"{start_date}..{end_date}"
+    )
+    if start_date and end_date and start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date.")
+    sentiment = sentiment_filter.strip().lower() if sentiment_filter and sentiment_filter.strip() else None
+    complexity = complexity_filter.strip() if complexity_filter and complexity_filter.strip() else None
+    project_key = str(project_id)
+
+    cache_key = ("timeseries", project_key, date_field, resolution, start_date, end_date, sentiment, complexity, top_n)
+    try:
+        version = load_data_version(supabase, project_key)
+    except Exception as e:
+        print(f"Analytics data version unavailable, not caching the timeseries: {e}")
+        version = None
+    if version is not None:
+        hit = summary_cache.get(cache_key, version)
+        if hit is not None:
+            series, age = hit
+            return series.model_copy(update={"cached": True, "cache_age_seconds": round(age, 3)})
+
+    try:
+        buckets = load_timeseries(
+            supabase,
+            project_key,
+            date_basis=date_field,
+            resolution=resolution,
+            start_date=start_date,
+            end_date=end_date,
+            sentiment=sentiment,
+            complexity=complexity,
+            top_n=top_n,
+        )
+    except Exception as e:
+        print(f"Error fetching analytics timeseries for project '{project_id}': {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch analytics timeseries: {e}")
 
+    series = AnalyticsTimeseriesResponse(
+        project_id=project_id,
+        date_field=date_field,
+        resolution=resolution,
+        buckets=[
+            TimeseriesBucket(
+                bucket_start=bucket["bucket_start"],
+                total_documents=bucket["total_documents"],
+                sentiment_distribution=bucket["sentiment_distribution"],
+                complexity_distribution=bucket["complexity_distribution"],
+                top_topics=[
+                    TopicCount(topic_name=name.capitalize(), count=count) for name, count in bucket["top_topics"]
+                ],
+            )
+            for bucket in buckets
+        ],
+    )
+    if version is not None:
+        summary_cache.put(cache_key, version, series)
+    return series
@@ -1,17 +1,16 @@
 # Tool code for modifying src/app/apis/custom_steps/__init__.py
-from fastapi import APIRouter, HTTPException, Depends, Query, Body
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Depends, Query, Body, Header
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel, Field, field_validator
-from typing import Dict, List, Any, Union, Literal, Tuple, Optional
+from typing import Dict, Iterable, List, Any, Union, Literal, Tuple, Optional
 import traceback
-from collections import Counter, defaultdict
+from collections import Counter
 import json
 import databutton as db
 import uuid
 import asyncio
 import os  # Added for path manipulation
 from docx import Document  # Added for DOCX processing
-import time
 import io  # Added for PDF processing
 import pypdf  # Added for PDF processing
 from datetime import datetime, timezone, UTC
@@ -20,6 +19,62 @@ from storage3 import (
     exceptions as storage3_exceptions,
 )  # Added for specific error handling MYA-63
 
+from app.libs.conditional_prompts import CONDITION_OUTPUT_SCHEMA, CONDITION_RESPONSE_INSTRUCTION, evaluate_condition_result
+from app.libs.prompt_templates import build_step_context, compact_json, render_prompt_template, strip_result_metadata
+from app.libs.llm_usage import RunUsageTracker, TokenUsage, load_run_usage, load_step_usage
+from app.libs.run_registry import ManagedRun, parse_last_event_id, run_registry
+from app.libs.run_control import CANCEL, PAUSE, RunControl, run_controls
+from app.libs.keyset_pagination import AdaptiveBatchSize, keyset_page
+from app.libs.fair_scheduler import WorkFlow, llm_scheduler
+from app.libs.run_history import (
+    STEP_RUNS_TABLE,
+    RunStats,
+    aggregate_runs,
+    record_run_finish,
+    record_run_start,
+    run_finish_fields,
+    run_start_row,
+)
+from app.libs.write_behind import WriteBehindBuffer
+from app.libs.run_estimate import (
+    TOKENIZER,
+    count_tokens,
+    estimate_cache,
+    estimate_cost_usd,
+    estimate_document_calls,
+    estimate_duration_seconds,
+    history_rates,
+    rate_limits_from_env,
+)
+from app.libs.work_leases import BatchLease, SupabaseLeaseStore, new_worker_id, plan_batches, run_worker
+from app.libs.step_fingerprint import document_text_hash, step_fingerprint
+from app.libs.step_pipeline import PipelineCycleError, order_steps_by_dependencies
+from app.libs.step_results import (
+    REPROCESS_SELECTIONS,
+    count_reprocess_documents,
+    delete_step_results,
+    failed_result,
+    iter_step_result_rows,
+    load_results_by_document,
+    reprocess_document_ids,
+    step_result_row,
+    upsert_step_results,
+)
+from app.libs.prefilter import SKIPPED_BY_FILTER_STATUS, PreFilter, count_llm_calls, evaluate_prefilter
+from app.libs.llm_settings import ModelSettings, completion_kwargs, resolve_model_settings
+from app.libs.prompt_config import (
+    DEFAULT_CONTEXT_TOKEN_BUDGET,
+    ConditionalBlockStructure,
+    PromptConfig,
+    PromptItem,
+)
+from app.libs.structured_output import (
+    drop_null_optionals,
+    parse_json_response,
+    response_format_for,
+    validate_output,
+)
+
 # Supabase client imports
 from supabase.client import Client, create_client
 from postgrest.exceptions import APIError as PostgrestAPIError
@@ -51,6 +106,64 @@ except ImportError:
             ) from e
 
 
+class StepRunContext:
+    """Per-run state shared by every prompt executed during one custom step run."""
+
+    def __init__(
+        self,
+        step_id: str,
+        usage_tracker: RunUsageTracker,
+        step_names_by_id: Optional[Dict[str, str]] = None,
+        model_settings: Optional[ModelSettings] = None,
+    ):
+        self.step_id = step_id
+        self.usage_tracker = usage_tracker
+        self.step_names_by_id: Dict[str, str] = step_names_by_id or {}
+        self.model_settings = model_settings  # Step-level defaults; prompts may override them
+        self.run_metrics: Counter = Counter()  # Persisted on the step (e.g. skipped action prompts, escalations)
+        self.writes: Optional[WriteBehindBuffer] = None  # Buffers document result and progress writes
+        self.fingerprint: Optional[str] = None  # Stamped on every result written by this run
+        self.text_hashes: Dict[str, str] = {}  # document id -> hash of the text its result is based on
+        self.flow: Optional[WorkFlow] = None  # Fair-share scheduling identity of the run (project, owner, priority)
+        self.stats = RunStats()  # Document latencies and LLM time, recorded in the run history
+
+    def metrics_snapshot(self) -> Dict[str, Union[int, float]]:
+        metrics: Dict[str, Union[int, float]] = dict(self.run_metrics)
+        if self.run_metrics["prompt_executions"]:
+            metrics["escalation_rate"] = round(
+                self.run_metrics["escalations"] / self.run_metrics["prompt_executions"], 4
+            )
+            # Prompts whose final answer (after any escalation) still could not be used
+            metrics["parse_failure_rate"] = round(
+                self.run_metrics["unusable_responses"] / self.run_metrics["prompt_executions"], 4
+            )
+        if self.writes is not None:
+            metrics.update({f"write_{name}": value for name, value in self.writes.metrics_snapshot().items()})
+        if self.flow is not None and self.flow.items:
+            metrics.update(self.flow.wait_stats())
+        return metrics
+
+
+async def _load_work_flow(supabase: Client, project_id: str, run_key: str) -> WorkFlow:
+    """The run's scheduling identity: the project's owner, priority and weight (defaults if unavailable)."""
+    flow = WorkFlow(run_key=run_key, project_id=project_id)
+    try:
+        response = await asyncio.to_thread(
+            supabase.table("projects")
+            .select("owner_user_id, scheduling_priority, scheduling_weight")
+            .eq("id", project_id)
+            .maybe_single()
+            .execute
+        )
+        project = (response.data if response else None) or {}
+        flow.user_id = project.get("owner_user_id")
+        flow.priority = project.get("scheduling_priority") or 0
+        flow.project_weight = float(project.get("scheduling_weight") or 1.0)
+    except Exception as e:
+        print(f"[SCHEDULER_WARN] Could not load scheduling settings of project {project_id}: {e}. Using defaults.")
+    return flow
+
+
 async def _execute_prompt_config_and_get_results(
     prompt_config: "PromptConfig",
     doc_content_full: str,  # Full document content
@@ -59,27 +172,43 @@ async def _execute_prompt_config_and_get_results(
     current_step_id: str,  # For filtering inter-step context
     openai_client: "OpenAI",
     current_doc_id_for_log: str,  # For logging
+    run_context: Optional[StepRunContext] = None,  # Step names for {{steps.*}} references, usage and model settings
 ) -> tuple[Optional[dict], Optional[str]]:
     """
     Constructs the prompt based on PromptConfig, executes it,
     and returns parsed JSON and raw text results.
+
+    Other steps' results only reach the prompt through {{steps.<name>.<field>}} references
+    (or, if the prompt opts in with include_other_steps_context, as one compact block).
+    All context is serialized compactly within the prompt's context token budget.
     """
     doc_id_for_log = current_doc_id_for_log  # Renaming for clarity within this scope
+    context_token_budget = prompt_config.context_token_budget or DEFAULT_CONTEXT_TOKEN_BUDGET
 
     # 1. Determine document content to include for this specific prompt
     doc_content_for_llm = ""
     if prompt_config.include_document_context:
         doc_content_for_llm = doc_content_full
-    else:
-        # Optional: could add a placeholder if desired, e.g.,
-        # doc_content_for_llm = "(Document content intentionally omitted for this specific prompt instruction. Focus on prior extracted data.)"
-        pass  # Defaults to empty string
 
-    # 2. Prepare intra-step context (results from prior prompts in this step)
+    # 2. Render {{steps.*}} / {{current.*}} references in the user's instruction
+    step_names_by_id = run_context.step_names_by_id if run_context else {}
+    step_context = build_step_context(current_doc_custom_analysis_results, step_names_by_id, current_step_id)
+    rendered_prompt_text, unresolved_references = render_prompt_template(
+        prompt_config.text,
+        steps=step_context,
+        current=prior_results_in_step,
+        token_budget=context_token_budget,
+    )
+    if unresolved_references:
+        print(
+            f"[WARN_EXEC_PROMPT] Unresolved template references for doc {doc_id_for_log}, step {current_step_id}: {unresolved_references}"
+        )
+
+    # 3. Prepare intra-step context (results from prior prompts in this step)
     intra_step_context_section = ""
     if prior_results_in_step:
         try:
-            prior_results_json = json.dumps(prior_results_in_step, indent=2)
+            prior_results_json = compact_json(prior_results_in_step, context_token_budget)
             intra_step_context_section = f"""
 
 Information Extracted So Far (Current Step - use this to inform your answer for the current instruction. Do NOT simply copy this information.):
@@ -90,21 +219,17 @@ Information Extracted So Far (Current Step - use this to inform your answer for
             )
             intra_step_context_section = "\n\n(Note: Information from the current step was available but could not be serialized for the prompt.)\n"
 
-    # 3. Prepare inter-step context (results from other analysis steps)
-    # This reuses the existing logic for pre_extracted_info_section
-    existing_custom_results_from_other_steps = current_doc_custom_analysis_results
+    # 4. Inter-step context is only dumped wholesale when the prompt explicitly asks for it
     inter_step_context_section = ""
-    if (
-        existing_custom_results_from_other_steps
-        and isinstance(existing_custom_results_from_other_steps, dict)
-        and existing_custom_results_from_other_steps
-    ):
+    if prompt_config.include_other_steps_context and isinstance(current_doc_custom_analysis_results, dict):
         try:
             filtered_results_for_prompt = {
-                k: v for k, v in existing_custom_results_from_other_steps.items() if k != current_step_id
+                step_names_by_id.get(k, k): strip_result_metadata(v)
+                for k, v in current_doc_custom_analysis_results.items()
+                if k != current_step_id
             }
             if filtered_results_for_prompt:
-                inter_step_context_json = json.dumps(filtered_results_for_prompt, indent=2)
+                inter_step_context_json = compact_json(filtered_results_for_prompt, context_token_budget)
                 inter_step_context_section = f"""
 
 Pre-extracted Information from Other Analysis Steps (This is context from DIFFERENT analysis tasks. Use it to inform your answer to the current instruction IF RELEVANT. Do NOT simply copy this information.):
@@ -115,95 +240,139 @@ Pre-extracted Information from Other Analysis Steps (This is context from DIFFER
             )
             inter_step_context_section = "\n\n(Note: Previous analysis data from other steps was available but could not be serialized for the prompt.)\n"
 
-    # 4. Construct the final prompt using the text from PromptConfig
-    # The user's core instruction is prompt_config.text
-    # We then append the document content (if included), then intra-step context, then inter-step context.
-    # Finally, the JSON guidance.
-
-    final_prompt = f"""{prompt_config.text}
+    # Construct the final prompt: the rendered instruction, the document content (if included),
+    # then whatever context was selected, and finally the JSON guidance.
+    final_prompt = f"""{rendered_prompt_text}
 
 Document Content:
-{doc_content_for_llm}
-intra step context section:
-{intra_step_context_section}
-inter step context section:
-{inter_step_context_section}
+{doc_content_for_llm}{intra_step_context_section}{inter_step_context_section}
 
 Respond ONLY with the valid JSON object as described in the instructions provided by the user (which is the text at the beginning of this entire message, before 'Document Content:'). Do not include explanations or markdown formatting in your response.
 The JSON object should be the direct answer to the instructions, based on the Document Content (if provided) and informed by any other contextual information given."""
 
-    # 5. Execute LLM call
-    raw_text_response = None
-    parsed_json_result = None
-    try:
+    # 5. Execute LLM call: the step's (cheap) model first, escalating only if its answer is unusable
+    model_settings = resolve_model_settings(
+        run_context.model_settings if run_context else None, prompt_config.model_settings
+    )
+    print(
+        f'[INFO_EXEC_PROMPT] Executing LLM call ({model_settings.model}) for doc {doc_id_for_log}, step {current_step_id}, prompt text: "{prompt_config.text[:100]}..."'
+    )
+    print(f"[DEBUG_EXEC_PROMPT] Full prompt for doc {doc_id_for_log}, step {current_step_id}:\n{final_prompt}") # For debugging, can be very verbose
+
+    output_schema = prompt_config.output_schema
+    raw_text_response, parsed_json_result, answer_unusable = await _call_llm_for_json(
+        openai_client, model_settings, model_settings.model, final_prompt, doc_id_for_log, current_step_id, run_context,
+        output_schema,
+    )
+    if run_context is not None:
+        run_context.run_metrics["prompt_executions"] += 1
+
+    # Only answers that fail to parse or validate escalate; API, network and rate-limit errors would
+    # most likely fail the same way on the escalation model and only double the calls.
+    escalation_model = model_settings.escalation_model
+    if answer_unusable and escalation_model and escalation_model != model_settings.model:
         print(
-            f'[INFO_EXEC_PROMPT] Executing LLM call for doc {doc_id_for_log}, step {current_step_id}, prompt text: "{prompt_config.text[:100]}..."'
+            f"[INFO_EXEC_PROMPT] Escalating doc {doc_id_for_log}, step {current_step_id} from {model_settings.model} to {escalation_model} after an unusable response."
         )
-        print(f"[DEBUG_EXEC_PROMPT] Full prompt for doc {doc_id_for_log}, step {current_step_id}:\n{final_prompt}") # For debugging, can be very verbose
+        if run_context is not None:
+            run_context.run_metrics["escalations"] += 1
+        escalated_raw, escalated_parsed, _ = await _call_llm_for_json(
+            openai_client, model_settings, escalation_model, final_prompt, doc_id_for_log, current_step_id, run_context,
+            output_schema,
+        )
+        if escalated_parsed is not None:
+            raw_text_response, parsed_json_result = escalated_raw, escalated_parsed
 
-        completion = await asyncio.to_thread(
-            openai_client.chat.completions.create,
-            model="gpt-4o-mini",  # Consider making this configurable
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an AI assistant that processes documents and extracts information as a structured JSON object according to user instructions. Follow the JSON output requirements strictly.",
-                },
-                {"role": "user", "content": final_prompt},
-            ],
-            temperature=0.2,  # Consider making this configurable
-        )
-        raw_text_response = completion.choices[0].message.content
-
-        if raw_text_response:
-            # Attempt to parse the raw_text_response as JSON
-            # Remove potential markdown code block fences if present
-            cleaned_response = raw_text_response.strip()
-            if cleaned_response.startswith("```json"):
-                cleaned_response = cleaned_response[7:]
-                if cleaned_response.endswith("```"):
-                    cleaned_response = cleaned_response[:-3]
-            elif cleaned_response.startswith("```"):  # Less specific, might be just ```
-                cleaned_response = cleaned_response[3:]
-                if cleaned_response.endswith("```"):
-                    cleaned_response = cleaned_response[:-3]
-
-            cleaned_response = cleaned_response.strip()
+    if parsed_json_result is None and run_context is not None:
+        run_context.run_metrics["unusable_responses"] += 1
 
+    return raw_text_response, parsed_json_result
+
+
+async def _call_llm_for_json(
+    openai_client: "OpenAI",
+    model_settings: ModelSettings,
+    model: str,
+    final_prompt: str,
+    doc_id_for_log: str,
+    current_step_id: str,
+    run_context: Optional["StepRunContext"] = None,
+    output_schema: Optional[Dict[str, Any]] = None,
+) -> tuple[Optional[str], Optional[Any], bool]:
+    """
+    Runs one chat completion constrained to a JSON object (or to output_schema, in strict
+    structured-output mode) and returns the raw text, the parsed result and whether the model's
+    answer was unusable. The parsed result is None if the call failed or the answer could not be
+    parsed or does not validate against the schema; only the latter two mark the answer unusable.
+    """
+    raw_text_response = None
+    parsed_json_result = None
+    answer_unusable = False
+    metrics = run_context.run_metrics if run_context is not None else Counter()
+    flow = run_context.flow if run_context is not None else None
+    try:
+        # Every LLM call waits for a fair share of the process-wide concurrency limit
+        async with llm_scheduler.slot(flow or WorkFlow(run_key=f"step:{current_step_id}", project_id="unknown")):
+            llm_started_at = run_context.stats.now() if run_context is not None else None
+            completion = await asyncio.to_thread(
+                openai_client.chat.completions.create,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "You are an AI assistant that processes documents and extracts information as a structured JSON object according to user instructions. Follow the JSON output requirements strictly.",
+                    },
+                    {"role": "user", "content": final_prompt},
+                ],
+                response_format=response_format_for(output_schema, name=f"step_{current_step_id}"),
+                **completion_kwargs(model_settings, model),
+            )
+            if run_context is not None:
+                run_context.stats.add_llm_time(llm_started_at)
+        if run_context is not None:
+            await run_context.usage_tracker.record(completion, doc_id_for_log, model)
+        message = completion.choices[0].message
+        raw_text_response = message.content
+
+        if getattr(message, "refusal", None):
+            metrics["parse_failures"] += 1
+            answer_unusable = True
+            print(
+                f"[WARN_EXEC_PROMPT] Model refused to answer for doc {doc_id_for_log}, step {current_step_id}: {message.refusal}"
+            )
+        elif not raw_text_response or not raw_text_response.strip():
+            metrics["parse_failures"] += 1
+            answer_unusable = True
+            print(
+                f"[WARN_EXEC_PROMPT] LLM response content was empty/None for doc {doc_id_for_log}, step {current_step_id}."
+            )
+        else:
             try:
-                # Ensure the response is not empty before trying to parse
-                if cleaned_response:
-                    parsed_json_result = json.loads(cleaned_response)
-                else:
-                    # Handle case where response is empty after stripping markdown
-                    print(
-                        f"[WARN_EXEC_PROMPT] LLM response was empty after stripping markdown for doc {doc_id_for_log}, step {current_step_id}."
-                    )
-                    parsed_json_result = {}  # Or None, depending on how you want to treat empty valid JSON responses
+                candidate = parse_json_response(raw_text_response)
             except json.JSONDecodeError as jde:
+                metrics["parse_failures"] += 1
+                answer_unusable = True
                 print(
                     f"[ERROR_EXEC_PROMPT] Failed to parse LLM JSON response for doc {doc_id_for_log}, step {current_step_id}. Error: {jde}. Raw response: {raw_text_response[:500]}..."
                 )
-                # Keep raw_text_response, parsed_json_result remains None
-                # Optionally, store the error or the raw response in a special field if needed later.
-            except Exception as e_parse:
-                print(
-                    f"[ERROR_EXEC_PROMPT] Unexpected error parsing LLM JSON response for doc {doc_id_for_log}, step {current_step_id}. Error: {e_parse}. Raw response: {raw_text_response[:500]}..."
-                )
-        else:
-            print(
-                f"[WARN_EXEC_PROMPT] LLM response content was empty/None for doc {doc_id_for_log}, step {current_step_id}."
-            )
+            else:
+                candidate = drop_null_optionals(candidate, output_schema)
+                validation_errors = validate_output(candidate, output_schema)
+                if validation_errors:
+                    metrics["validation_failures"] += 1
+                    answer_unusable = True
+                    print(
+                        f"[ERROR_EXEC_PROMPT] LLM response for doc {doc_id_for_log}, step {current_step_id} does not match the output schema: {validation_errors}"
+                    )
+                else:
+                    parsed_json_result = candidate
 
     except Exception as e_openai:
         print(
             f"[ERROR_EXEC_PROMPT] OpenAI API call failed for doc {doc_id_for_log}, step {current_step_id}. Error: {e_openai}"
         )
-        # raw_text_response and parsed_json_result remain None
-        # Re-raise or handle as appropriate for the calling function
-        # For now, we'll let the calling function decide how to handle this (e.g., by seeing Nones)
+        # raw_text_response and parsed_json_result remain None; the caller decides how to handle it
 
-    return raw_text_response, parsed_json_result
+    return raw_text_response, parsed_json_result, answer_unusable
 
 
 router = APIRouter(prefix="/api/custom-steps", tags=["Processing Steps"])
@@ -238,32 +407,14 @@ class DeleteStepResultsResponse(BaseModel):
     step_reset: bool
 
 
-# --- New Pydantic Models for Conditional Prompts ---
-class PromptConfig(BaseModel):
-    text: str
-    include_document_context: bool = True
-
-
-class StandardPromptStructure(BaseModel):
-    type: Literal["standard_prompt"] = "standard_prompt"
-    prompt: PromptConfig
-
-
-class ConditionalBlockStructure(BaseModel):
-    type: Literal["conditional_block"] = "conditional_block"
-    condition_prompt: PromptConfig
-    action_prompts: list[PromptConfig]
-
-
-PromptItem = Union[StandardPromptStructure, ConditionalBlockStructure]
-
-
 # --- Pydantic Models ---
 
 
 class StepActionResponse(BaseModel):
     step_id: uuid.UUID
-    action: Literal["pause_requested", "resume_requested", "pause_failed", "resume_failed"]
+    action: Literal[
+        "pause_requested", "resume_requested", "cancel_requested", "pause_failed", "resume_failed", "cancel_failed"
+    ]
     message: str
     details: Optional[str] = None
 
@@ -322,6 +473,7 @@ class ProcessingProgress(BaseModel):
     current_doc_index: Optional[int] = Field(default=None, alias="currentDocIndex")  # Alias for serialization
     message: Optional[str] = None
     error: Optional[str] = None
+    run_metrics: Optional[Dict[str, Union[int, float]]] = None  # e.g. skipped action prompts, model escalations
 
     class Config:
         populate_by_name = True
@@ -358,6 +510,19 @@ class CustomStepBase(BaseModel):
         default=None,
         description="Configuration for project-wide dynamic analysis. Only applicable if processing_mode is 'project_wide_dynamic_analysis'.",
     )
+    token_budget: Optional[int] = Field(
+        default=None,
+        gt=0,
+        description="Maximum prompt + completion tokens a single run of this step may spend. The run pauses cleanly once it is exceeded.",
+    )
+    model_settings: Optional[ModelSettings] = Field(
+        default=None,
+        description="Model, temperature, max_tokens and optional escalation model used by this step's prompts.",
+    )
+    pre_filter: Optional[PreFilter] = Field(
+        default=None,
+        description="Local rules (keywords, regex, minimum length, analysis fields) a document must match before any LLM call.",
+    )
 
     @field_validator("prompts", mode="before")
     @classmethod
@@ -391,6 +556,9 @@ class CustomStepUpdate(BaseModel):
     prompts: Optional[list[PromptItem]] = None  # New field for sequential prompts
     processing_mode: Optional[Literal["document_by_document", "project_wide_dynamic_analysis"]] = None
     analysis_pipeline_config: Optional[AnalysisPipelineConfig] = None
+    token_budget: Optional[int] = Field(default=None, gt=0)
+    model_settings: Optional[ModelSettings] = None
+    pre_filter: Optional[PreFilter] = None
 
     @field_validator("prompts", mode="before")
     @classmethod
@@ -421,6 +589,7 @@ class CustomStepResponse(CustomStepBase):
     updated_at: Optional[datetime] = None
     last_reprocess_type: Optional[str] = None
     run_status: Optional[str] = None
+    prompt_fingerprint: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -468,6 +637,11 @@ async def create_custom_step(step_data: CustomStepCreate, supabase: Client = Dep
                 step_data.analysis_pipeline_config.model_dump() if step_data.analysis_pipeline_config else None
             ),
             "run_status": "idle",
+            "token_budget": step_data.token_budget,
+            "model_settings": (
+                step_data.model_settings.model_dump(exclude_none=True) if step_data.model_settings else None
+            ),
+            "pre_filter": step_data.pre_filter.model_dump(exclude_defaults=True) if step_data.pre_filter else None,
         }
 
         # Handle the new 'prompts' field
@@ -483,6 +657,7 @@ async def create_custom_step(step_data: CustomStepCreate, supabase: Client = Dep
             insert_payload["prompts"] = [step_data.description] # This line might need review if description can be complex
         else:
             insert_payload["prompts"] = None
+        insert_payload["prompt_fingerprint"] = step_fingerprint(insert_payload)
 
         if step_data.processing_mode == "document_by_document" and step_data.analysis_pipeline_config is not None:
             raise HTTPException(
@@ -632,6 +807,8 @@ async def update_custom_step(
             return CustomStepResponse(**current_step_db_data)
 
         update_payload["updated_at"] = datetime.now(timezone.utc).isoformat()
+        # Results stamped with an older fingerprint become "stale" once prompts or model settings change
+        update_payload["prompt_fingerprint"] = step_fingerprint({**current_step_db_data, **update_payload})
 
         response = await asyncio.to_thread(
             supabase.table("custom_processing_steps")
@@ -683,19 +860,7 @@ async def delete_custom_step(
                 detail=f"Custom step {step_id} not found or does not belong to project {project_id}.",
             )
 
-        docs_response = await asyncio.to_thread(
-            supabase.table("documents").select("id, custom_analysis_results").eq("project_id", str(project_id)).execute
-        )
-        if docs_response.data:
-            for doc in docs_response.data:
-                if doc.get("custom_analysis_results") and str(step_id) in doc["custom_analysis_results"]:
-                    del doc["custom_analysis_results"][str(step_id)]
-                    await asyncio.to_thread(
-                        supabase.table("documents")
-                        .update({"custom_analysis_results": doc["custom_analysis_results"]})
-                        .eq("id", str(doc["id"]))
-                        .execute
-                    )
+        await asyncio.to_thread(delete_step_results, supabase, str(step_id), str(project_id))
         delete_response = await asyncio.to_thread(
             supabase.table("custom_processing_steps")
             .delete()
@@ -746,41 +911,9 @@ async def delete_step_results_and_reset_progress(
                 detail=f"Custom step {step_id} not found or does not belong to project {project_id}.",
             )
 
-        # 1. Clear results from 'documents' table
+        # 1. Delete the step's rows from the step results table
         print(f"[INFO] Clearing results for step {step_id} from documents in project {project_id}...")
-        docs_response = await asyncio.to_thread(
-            supabase.table("documents")
-            .select("id, custom_analysis_results")
-            .eq("project_id", str(project_id))
-            # .neq("custom_analysis_results", None) # Optimization: only fetch docs with results
-            .execute
-        )
-
-        if docs_response.data:
-            for doc in docs_response.data:
-                doc_id = doc.get("id")
-                current_custom_results = doc.get("custom_analysis_results")
-                if (
-                    current_custom_results
-                    and isinstance(current_custom_results, dict)
-                    and str(step_id) in current_custom_results
-                ):
-                    print(f"[INFO] Removing results for step {step_id} from document {doc_id}")
-                    del current_custom_results[str(step_id)]
-                    # If custom_analysis_results becomes empty, Supabase might store it as null or {}
-                    # depending on its handling of JSONB empty objects. This is fine.
-                    update_doc_response = await asyncio.to_thread(
-                        supabase.table("documents")
-                        .update({"custom_analysis_results": current_custom_results})
-                        .eq("id", str(doc_id))
-                        .execute
-                    )
-                    if update_doc_response.data:
-                        results_cleared_count += 1
-                    else:
-                        print(
-                            f"[WARN] Failed to update document {doc_id} after removing step results. Error: {update_doc_response.error.message if update_doc_response.error else 'Unknown'}"
-                        )
+        results_cleared_count = await asyncio.to_thread(delete_step_results, supabase, str(step_id), str(project_id))
 
         print(f"[INFO] Cleared results for step {step_id} from {results_cleared_count} documents.")
 
@@ -813,8 +946,7 @@ async def delete_step_results_and_reset_progress(
             step_id=step_id,
             project_id=project_id,
             message=f"Results cleared for {results_cleared_count} documents. Step progress reset: {step_reset_done}.",
-            results_cleared=results_cleared_count > 0
-            or not docs_response.data,  # True if any cleared or no docs to clear
+            results_cleared=True,  # The delete succeeded (possibly with nothing to clear)
             step_reset=step_reset_done,
         )
 
@@ -956,131 +1088,102 @@ async def execute_document_assignment_endpoint(
 
 
 # --- Helper Function for Analysis ---
+class ResultsSummaryAggregator:
+    """Summarizes step results fed one at a time, in the shapes ``analyze_results`` returns.
+
+    Only counters of distinct keys and values are kept, so results can be streamed from the
+    database page by page without holding them all in memory. As before, the first result
+    decides the dict shape: "key_value" when its values are simple, "nested_key_value" when
+    they are dicts of simple values (only the first outer key is summarized).
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.all_simple = True
+        self.all_dicts = True
+        self.shape: Optional[str] = None
+        self.outer_key: Any = None
+        self.simple_counts: Counter = Counter()
+        self.value_counts: Dict[Any, Counter] = {}  # key_value: item keys; nested: inner keys of outer_key
+        self.key_occurrences: Counter = Counter()
+
+    @staticmethod
+    def _is_simple(value: Any) -> bool:
+        return not isinstance(value, (dict, list))
+
+    def _first_result_shape(self, item: Any) -> Optional[str]:
+        if not isinstance(item, dict) or not item:
+            return None
+        if all(self._is_simple(v) for v in item.values()):
+            return "key_value"
+        if all(isinstance(v, dict) and all(self._is_simple(iv) for iv in v.values()) for v in item.values()):
+            self.outer_key = next(iter(item))
+            return "nested_key_value"
+        return None
+
+    def _count(self, values: Dict[Any, Any]) -> None:
+        for key, value in values.items():
+            self.value_counts.setdefault(key, Counter())[value] += 1
+            self.key_occurrences[key] += 1
+
+    def add(self, item: Any) -> None:
+        if self.count == 0:
+            self.shape = self._first_result_shape(item)
+        self.count += 1
+        if not self._is_simple(item):
+            self.all_simple = False
+            self.simple_counts.clear()
+        elif self.all_simple:
+            self.simple_counts[item] += 1
+        if not isinstance(item, dict):
+            self.all_dicts = False
+            self.value_counts.clear()
+        elif self.all_dicts:
+            if self.shape == "key_value":
+                self._count(item)
+            elif self.shape == "nested_key_value" and isinstance(item.get(self.outer_key), dict):
+                self._count(item[self.outer_key])
+
+    def _key_distributions(self) -> List[KeyValueDistribution]:
+        return [
+            KeyValueDistribution(
+                key_name=key_name,
+                total_occurrences=self.key_occurrences[key_name],
+                value_distribution=[SimpleValueDistribution(value=val, count=c) for val, c in counts.items()],
+            )
+            for key_name, counts in self.value_counts.items()
+        ]
+
+    def result(
+        self,
+    ) -> Tuple[
+        Literal["simple_value", "key_value", "nested_key_value", "mixed", "empty"],
+        SummaryData | None,
+    ]:
+        if self.count == 0:
+            return "empty", None
+        if self.all_simple:
+            return "simple_value", [SimpleValueDistribution(value=k, count=v) for k, v in self.simple_counts.items()]
+        if self.all_dicts and self.shape == "key_value":
+            return "key_value", self._key_distributions()
+        if self.all_dicts and self.shape == "nested_key_value" and self.value_counts:
+            return "nested_key_value", NestedKeyValueSummary(
+                outer_key_name=self.outer_key, inner_key_summary=self._key_distributions()
+            )
+        # A mix of types, an empty or deeper first dict, or no inner values under the outer key
+        return "mixed", None
+
+
 def analyze_results(
-    results: List[Any],
+    results: Iterable[Any],
 ) -> Tuple[
     Literal["simple_value", "key_value", "nested_key_value", "mixed", "empty"],
     SummaryData | None,
 ]:
-    if not results:
-        return "empty", None
-
-    # Check if all items are simple types (not dicts or lists)
-    if all(not isinstance(item, (dict, list)) for item in results):
-        distribution = [SimpleValueDistribution(value=k, count=v) for k, v in Counter(results).items()]
-        return "simple_value", distribution
-
-    # Check if all items are dicts with a consistent structure (for key_value or nested_key_value)
-    if all(isinstance(item, dict) for item in results):
-        # Simplified: Check first item's structure for key-value or nested_key_value
-        # This is a heuristic and might need refinement for more complex mixed structures.
-        first_item = results[0]
-        if not first_item:  # Handle empty dicts
-            return "mixed", None  # Or treat as empty/error appropriately
-
-        # Check for simple key-value (all values are simple types)
-        if all(not isinstance(v, (dict, list)) for v in first_item.values()):
-            # Aggregate distributions for each key
-            key_data = defaultdict(list)
-            for item in results:
-                for k, v in item.items():
-                    key_data[k].append(v)
-
-            key_distributions = []
-            for key_name, values_list in key_data.items():
-                value_counts = Counter(values_list)
-                dist = [SimpleValueDistribution(value=val, count=c) for val, c in value_counts.items()]
-                key_distributions.append(
-                    KeyValueDistribution(
-                        key_name=key_name,
-                        total_occurrences=len(values_list),
-                        value_distribution=dist,
-                    )
-                )
-            return "key_value", key_distributions
-
-        # Check for nested_key_value (first level keys, second level are simple key-values)
-        # This is a very specific check for { "outer_key": { "inner_key": "value" } }
-        # And assumes all items follow this pattern if the first one does.
-        is_nested = True
-        for outer_key, inner_dict in first_item.items():
-            if not isinstance(inner_dict, dict):
-                is_nested = False
-                break
-            if not all(not isinstance(v, (dict, list)) for v in inner_dict.values()):
-                is_nested = False
-                break
-
-        if is_nested:
-            # This requires a more complex aggregation to fit NestedKeyValueSummary
-            # For now, let's assume if it's nested, it's one primary outer key we are interested in summarizing.
-            # This is a simplification for MYA-64 and needs robust generalization.
-            # Let's try to summarize the *first* outer key found as an example.
-            if not first_item:
-                return (
-                    "mixed",
-                    None,
-                )  # Should not happen if first_item was checked before
-
-            # Aggregate all inner dicts under their respective outer keys
-            outer_key_to_inner_dicts_list = defaultdict(list)
-            for item in results:
-                for outer_k, inner_d in item.items():
-                    if isinstance(inner_d, dict):  # Ensure it is a dict
-                        outer_key_to_inner_dicts_list[outer_k].append(inner_d)
-
-            summarized_outer_keys = []
-            for outer_k, list_of_inner_dicts in outer_key_to_inner_dicts_list.items():
-                # For each outer key, summarize its list of inner dicts
-                # Each inner dict is like a "key_value" structure itself
-                inner_key_data = defaultdict(list)
-                for single_inner_dict in list_of_inner_dicts:
-                    for inner_k_specific, inner_v_specific in single_inner_dict.items():
-                        inner_key_data[inner_k_specific].append(inner_v_specific)
-
-                inner_key_distributions = []
-                for inner_key_name, inner_values_list in inner_key_data.items():
-                    inner_value_counts = Counter(inner_values_list)
-                    inner_dist = [SimpleValueDistribution(value=val, count=c) for val, c in inner_value_counts.items()]
-                    inner_key_distributions.append(
-                        KeyValueDistribution(
-                            key_name=inner_key_name,
-                            total_occurrences=len(inner_values_list),
-                            value_distribution=inner_dist,
-                        )
-                    )
-                summarized_outer_keys.append(
-                    NestedKeyValueSummary(
-                        outer_key_name=outer_k,
-                        inner_key_summary=inner_key_distributions,
-                    )
-                )
-
-            # For now, if multiple outer keys exist, we return a list of their summaries.
-            # The StepResultsSummaryResponse expects a single NestedKeyValueSummary or List[KeyValueDistribution] etc.
-            # This part needs to align with how frontend expects to consume it. For now, returning the list of summaries directly in summary_data
-            # and setting type to "nested_key_value" - frontend will need to handle list if multiple outer keys exist.
-            # Or, more strictly, assume only ONE outer key is expected for this summary type.
-            # Let's adjust to return the first one if available, or handle as "mixed" if structure varies too much.
-            if summarized_outer_keys:
-                # This still doesn't quite fit `SummaryData = Union[..., NestedKeyValueSummary]` if there are multiple outer keys.
-                # For now, let's return a list of KeyValueDistribution for the inner keys of the *first* outer key found.
-                # This simplifies the return type to fit existing Union better, but loses multiple outer key info.
-                # A better approach would be to have SummaryData = Union[..., List[NestedKeyValueSummary]] or similar.
-                # Forcing a specific structure for now for "nested_key_value":
-                # Assume we want to show the summary for EACH inner key of the FIRST outer key.
-                if summarized_outer_keys[0].inner_key_summary:  # If the first outer key has inner summaries
-                    return (
-                        "nested_key_value",
-                        summarized_outer_keys[0],
-                    )  # Return the whole NestedKeyValueSummary object
-                else:
-                    return "mixed", None  # Not fitting the expected nested structure
-            else:
-                return "mixed", None  # No valid nested structure found
-
-    # If it's a mix or unrecognized structure
-    return "mixed", None
+    aggregator = ResultsSummaryAggregator()
+    for item in results:
+        aggregator.add(item)
+    return aggregator.result()
 
 
 @router.get("/{project_id}/{step_id}/results-summary", response_model=StepResultsSummaryResponse)
@@ -1093,7 +1196,6 @@ async def get_step_results_summary(
     step_name = "Unknown Step"
     total_project_documents = 0
     total_documents_analyzed_for_step = 0
-    step_specific_results_list = []
 
     try:
         # 1. Fetch custom step details to get the name
@@ -1112,28 +1214,22 @@ async def get_step_results_summary(
             )
         step_name = step_details_response.data.get("name", "Unnamed Step")
 
-        # 2. Fetch all documents for the project to get total count and their analysis results
-        documents_response = await asyncio.to_thread(
-            supabase.table("documents")
-            .select(
-                "id, custom_analysis_results, project_id"
-            )  # Ensure project_id is part of select for filtering clarity if needed
-            .eq("project_id", str(project_id))
-            .execute
+        # 2. Count the project's documents and load only this step's results
+        count_response = await asyncio.to_thread(
+            supabase.table("documents").select("id", count="exact").eq("project_id", str(project_id)).limit(1).execute
         )
-
-        if documents_response.data:
-            total_project_documents = len(documents_response.data)
-            for doc in documents_response.data:
-                custom_results = doc.get("custom_analysis_results")
-                if custom_results and isinstance(custom_results, dict):
-                    step_result = custom_results.get(str(step_id))
-                    if step_result is not None:  # Check if result for this step_id exists
-                        step_specific_results_list.append(step_result)
-                        total_documents_analyzed_for_step += 1
-
-        # 3. Analyze the collected results
-        summary_type, summary_data = analyze_results(step_specific_results_list)
+        total_project_documents = count_response.count or 0
+        # 3. Stream the results through the aggregator page by page (keyset-paged, bounded memory)
+        def summarize_step_results() -> ResultsSummaryAggregator:
+            aggregator = ResultsSummaryAggregator()
+            for row in iter_step_result_rows(supabase, "result", project_id=str(project_id), step_id=str(step_id)):
+                if row.get("result") is not None:
+                    aggregator.add(row["result"])
+            return aggregator
+
+        aggregator = await asyncio.to_thread(summarize_step_results)
+        total_documents_analyzed_for_step = aggregator.count
+        summary_type, summary_data = aggregator.result()
 
         return StepResultsSummaryResponse(
             step_name=step_name,
@@ -1175,6 +1271,373 @@ async def get_step_results_summary(
         )
 
 
+# --- Token Usage ---
+
+
+class TokenUsageSummary(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    total_tokens: int = 0
+    calls: int = 0
+
+    @classmethod
+    def from_usage(cls, usage: TokenUsage, **extra) -> "TokenUsageSummary":
+        return cls(**usage.model_dump(), total_tokens=usage.total_tokens, **extra)
+
+
+class RunTokenUsage(TokenUsageSummary):
+    run_id: Optional[str] = None
+
+
+class DocumentTokenUsage(TokenUsageSummary):
+    document_id: Optional[str] = None
+
+
+class StepUsageResponse(BaseModel):
+    step_id: uuid.UUID
+    project_id: uuid.UUID
+    token_budget: Optional[int] = None
+    step_totals: TokenUsageSummary
+    project_totals: TokenUsageSummary
+    runs: List[RunTokenUsage] = Field(default_factory=list)
+    documents: List[DocumentTokenUsage] = Field(default_factory=list, description="Most expensive documents first.")
+
+
+@router.get("/{project_id}/{step_id}/usage", response_model=StepUsageResponse)
+async def get_step_token_usage(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    document_limit: int = Query(100, ge=0, le=10000, description="Maximum number of per-document entries to return."),
+    supabase: Client = Depends(get_supabase_client),
+):
+    """Token usage recorded for a custom step, broken down by run and document, plus the project's totals."""
+    try:
+        step_response = await asyncio.to_thread(
+            supabase.table("custom_processing_steps")
+            .select("id, token_budget")
+            .eq("id", str(step_id))
+            .eq("project_id", str(project_id))
+            .maybe_single()
+            .execute
+        )
+        if not step_response.data:
+            raise HTTPException(status_code=404, detail=f"Custom step {step_id} not found in project {project_id}.")
+
+        usage = await asyncio.to_thread(load_step_usage, supabase, str(project_id), str(step_id), document_limit)
+        runs = [RunTokenUsage.from_usage(run_usage, run_id=run_id) for run_id, run_usage in usage["runs"]]
+        documents = [
+            DocumentTokenUsage.from_usage(document_usage, document_id=document_id)
+            for document_id, document_usage in usage["documents"]
+        ]
+
+        return StepUsageResponse(
+            step_id=step_id,
+            project_id=project_id,
+            token_budget=step_response.data.get("token_budget"),
+            step_totals=TokenUsageSummary.from_usage(usage["step_totals"]),
+            project_totals=TokenUsageSummary.from_usage(usage["project_totals"]),
+            runs=runs,
+            documents=documents,
+        )
+    except HTTPException:
+        raise
+    except PostgrestAPIError as e:
+        print(f"[DB_ERROR] Supabase API error fetching usage for step {step_id}, project {project_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error fetching token usage: {e.message}")
+    except Exception as e:
+        print(f"[ERROR] Failed to get token usage for step {step_id}: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error fetching token usage: {e}")
+
+
+# --- Run History ---
+
+
+class StepRunRecord(BaseModel):
+    run_id: str
+    step_id: Optional[str] = None
+    reprocess_type: Optional[str] = None
+    status: str
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    duration_ms: Optional[int] = None
+    total_documents: int = 0
+    processed_count: int = 0
+    failed_count: int = 0
+    docs_per_minute: Optional[float] = None
+    latency_p50_ms: Optional[float] = Field(None, description="Median wall time of one document through the step.")
+    latency_p95_ms: Optional[float] = None
+    llm_time_ms: Optional[int] = None
+    llm_time_share: Optional[float] = Field(None, description="Share of the run's wall time spent in LLM calls (0..1).")
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    llm_calls: int = 0
+    run_metrics: Optional[Dict[str, Any]] = None
+
+
+class StepRunAggregate(BaseModel):
+    runs: int = 0
+    finished_runs: int = 0
+    documents_processed: int = 0
+    documents_failed: int = 0
+    total_tokens: int = 0
+    avg_docs_per_minute: Optional[float] = None
+    avg_latency_p50_ms: Optional[float] = None
+    avg_latency_p95_ms: Optional[float] = None
+    avg_llm_time_share: Optional[float] = None
+
+
+class StepRunHistoryResponse(BaseModel):
+    step_id: uuid.UUID
+    project_id: uuid.UUID
+    runs: List[StepRunRecord] = Field(default_factory=list, description="Newest first.")
+    aggregate: StepRunAggregate = Field(description="Totals and averages over the returned runs.")
+
+
+def _step_run_record(row: Dict[str, Any]) -> StepRunRecord:
+    return StepRunRecord(**{key: value for key, value in row.items() if value is not None})
+
+
+@router.get("/{project_id}/{step_id}/runs", response_model=StepRunHistoryResponse)
+async def list_step_runs(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of runs to return."),
+    since: Optional[datetime] = Query(None, description="Only runs started at or after this time."),
+    supabase: Client = Depends(get_supabase_client),
+):
+    """Recorded runs of a custom step with their throughput, latency and token totals, newest first."""
+    try:
+        query = (
+            supabase.table(STEP_RUNS_TABLE)
+            .select("*")
+            .eq("project_id", str(project_id))
+            .eq("step_id", str(step_id))
+        )
+        if since is not None:
+            query = query.gte("started_at", since.isoformat())
+        response = await asyncio.to_thread(query.order("started_at", desc=True).limit(limit).execute)
+        rows = response.data or []
+        return StepRunHistoryResponse(
+            step_id=step_id,
+            project_id=project_id,
+            runs=[_step_run_record(row) for row in rows],
+            aggregate=StepRunAggregate(**aggregate_runs(rows)),
+        )
+    except PostgrestAPIError as e:
+        print(f"[DB_ERROR] Supabase API error listing runs for step {step_id}, project {project_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error fetching run history: {e.message}")
+    except Exception as e:
+        print(f"[ERROR] Failed to list runs for step {step_id}: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error fetching run history: {e}")
+
+
+@router.get("/{project_id}/{step_id}/runs/{run_id}", response_model=StepRunRecord)
+async def get_step_run(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    run_id: uuid.UUID,
+    supabase: Client = Depends(get_supabase_client),
+):
+    """One recorded run of a custom step."""
+    try:
+        response = await asyncio.to_thread(
+            supabase.table(STEP_RUNS_TABLE)
+            .select("*")
+            .eq("project_id", str(project_id))
+            .eq("step_id", str(step_id))
+            .eq("run_id", str(run_id))
+            .limit(1)
+            .execute
+        )
+        if not response.data:
+            raise HTTPException(status_code=404, detail=f"Run {run_id} of step {step_id} not found.")
+        return _step_run_record(response.data[0])
+    except HTTPException:
+        raise
+    except PostgrestAPIError as e:
+        print(f"[DB_ERROR] Supabase API error fetching run {run_id} of step {step_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error fetching run: {e.message}")
+    except Exception as e:
+        print(f"[ERROR] Failed to get run {run_id} of step {step_id}: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error fetching run: {e}")
+
+
+# --- Run Estimates ---
+
+
+class RunEstimateResponse(BaseModel):
+    step_id: uuid.UUID
+    project_id: uuid.UUID
+    reprocess_type: str
+    step_fingerprint: str
+    documents_in_scope: int
+    documents_sampled: int
+    documents_to_process: float = Field(
+        description="Documents in scope minus the share of the sample the pre-filter skips."
+    )
+    llm_calls_per_document: int = Field(description="Upper bound: every action prompt of a conditional block counted.")
+    estimated_llm_calls: int
+    document_tokens_avg: float = Field(description="Average tokens of a sampled document's extracted text.")
+    estimated_input_tokens: int
+    estimated_output_tokens: int
+    estimated_total_tokens: int
+    tokens_by_model: Dict[str, Dict[str, int]] = Field(default_factory=dict)
+    estimated_cost_usd: Optional[float] = Field(None, description="None when a model's price is unknown.")
+    call_latency_ms: float
+    runs_used_for_rates: int = Field(description="Recorded runs the latency and output size come from (0: defaults).")
+    workers: int
+    processing_seconds: float
+    rate_limit_seconds: float = Field(description="Minimum time the configured tokens/requests per minute allow.")
+    estimated_seconds: float
+    tokenizer: Literal["tiktoken", "chars_per_token"]
+    cached: bool = False
+
+
+@router.get("/{project_id}/{step_id}/estimate", response_model=RunEstimateResponse)
+async def estimate_step_run(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    reprocess_type: Literal["all", "failed", "pending", "stale"] = Query("all"),
+    workers: int = Query(1, ge=1, le=64, description="Worker loops the run would use (distributed runs)."),
+    sample_size: int = Query(
+        200, ge=1, le=5000, description="Documents whose text is tokenized; the rest is extrapolated."
+    ),
+    refresh: bool = Query(False, description="Ignore a cached estimate."),
+    supabase: Client = Depends(get_supabase_client),
+):
+    """Dry run: predicts LLM calls, tokens, cost and wall-clock time of a step run without calling the LLM."""
+    step_response = await asyncio.to_thread(
+        supabase.table("custom_processing_steps")
+        .select("id, description, prompts, model_settings, pre_filter")
+        .eq("id", str(step_id))
+        .eq("project_id", str(project_id))
+        .maybe_single()
+        .execute
+    )
+    if not step_response or not step_response.data:
+        raise HTTPException(status_code=404, detail=f"Custom step {step_id} not found in project {project_id}.")
+    step_config = step_response.data
+    fingerprint = step_fingerprint(step_config)
+    cache_key = (str(step_id), reprocess_type, workers, sample_size)
+    cached = None if refresh else estimate_cache.get(cache_key, fingerprint)
+    if cached is not None:
+        return cached[0].model_copy(update={"cached": True})
+
+    try:
+        project_id_as_str, step_id_as_str = str(project_id), str(step_id)
+        document_columns = "id, extracted_text, analysis"
+        if reprocess_type in REPROCESS_SELECTIONS:
+            documents_in_scope = await asyncio.to_thread(
+                count_reprocess_documents, supabase, project_id_as_str, step_id_as_str, reprocess_type, fingerprint
+            )
+            sample_ids = await asyncio.to_thread(
+                reprocess_document_ids,
+                supabase,
+                project_id_as_str,
+                step_id_as_str,
+                reprocess_type,
+                None,
+                sample_size,
+                fingerprint=fingerprint,
+            )
+            sample = []
+            if sample_ids:
+                sample_response = await asyncio.to_thread(
+                    supabase.table("documents").select(document_columns).in_("id", sample_ids).execute
+                )
+                sample = sample_response.data or []
+        else:
+            count_response = await asyncio.to_thread(
+                supabase.table("documents")
+                .select("id", count="exact")
+                .eq("project_id", project_id_as_str)
+                .limit(1)
+                .execute
+            )
+            documents_in_scope = count_response.count or 0
+            sample_response = await asyncio.to_thread(
+                keyset_page(
+                    supabase.table("documents").select(document_columns).eq("project_id", project_id_as_str),
+                    None,
+                    sample_size,
+                ).execute
+            )
+            sample = sample_response.data or []
+
+        runs_response = await asyncio.to_thread(
+            supabase.table(STEP_RUNS_TABLE)
+            .select("step_id, duration_ms, llm_time_ms, llm_calls, processed_count, failed_count, completion_tokens")
+            .eq("project_id", project_id_as_str)
+            .not_.is_("finished_at", "null")
+            .order("started_at", desc=True)
+            .limit(50)
+            .execute
+        )
+        project_runs = runs_response.data or []
+        step_runs = [row for row in project_runs if row.get("step_id") == step_id_as_str]
+        rates = history_rates(step_runs if any(row.get("llm_calls") for row in step_runs) else project_runs)
+    except PostgrestAPIError as e:
+        print(f"[DB_ERROR] Supabase API error estimating a run of step {step_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Database error estimating run: {e.message}")
+
+    prompts = _normalize_step_prompts(step_config)
+    step_settings = ModelSettings(**step_config["model_settings"]) if step_config.get("model_settings") else None
+    pre_filter = PreFilter(**step_config["pre_filter"]) if step_config.get("pre_filter") else None
+    skip_reasons = evaluate_prefilter(pre_filter, sample) if pre_filter else {}
+    processed_sample = [doc for doc in sample if not skip_reasons.get(str(doc["id"]))]
+    document_model = resolve_model_settings(step_settings).model
+    document_tokens = [count_tokens(doc.get("extracted_text"), document_model) for doc in processed_sample]
+    # Documents without stored text are extracted during the run; assume they are like the others
+    known_tokens = [tokens for tokens in document_tokens if tokens]
+    document_tokens_avg = sum(known_tokens) / len(known_tokens) if known_tokens else 0.0
+
+    documents_to_process = documents_in_scope * (len(processed_sample) / len(sample) if sample else 1.0)
+    per_document_calls = estimate_document_calls(
+        prompts, round(document_tokens_avg), rates["output_tokens_per_call"], step_settings
+    )
+    tokens_by_model: Dict[str, Dict[str, int]] = {}
+    for call in per_document_calls:
+        model_tokens = tokens_by_model.setdefault(call["model"], {"input_tokens": 0, "output_tokens": 0})
+        model_tokens["input_tokens"] += round(call["input_tokens"] * documents_to_process)
+        model_tokens["output_tokens"] += round(call["output_tokens"] * documents_to_process)
+    input_tokens = sum(tokens["input_tokens"] for tokens in tokens_by_model.values())
+    output_tokens = sum(tokens["output_tokens"] for tokens in tokens_by_model.values())
+    estimated_calls = round(len(per_document_calls) * documents_to_process)
+    duration = estimate_duration_seconds(
+        documents_to_process, estimated_calls, input_tokens + output_tokens, rates, workers, rate_limits_from_env()
+    )
+
+    estimate = RunEstimateResponse(
+        step_id=step_id,
+        project_id=project_id,
+        reprocess_type=reprocess_type,
+        step_fingerprint=fingerprint,
+        documents_in_scope=documents_in_scope,
+        documents_sampled=len(sample),
+        documents_to_process=round(documents_to_process, 1),
+        llm_calls_per_document=len(per_document_calls),
+        estimated_llm_calls=estimated_calls,
+        document_tokens_avg=round(document_tokens_avg, 1),
+        estimated_input_tokens=input_tokens,
+        estimated_output_tokens=output_tokens,
+        estimated_total_tokens=input_tokens + output_tokens,
+        tokens_by_model=tokens_by_model,
+        estimated_cost_usd=estimate_cost_usd(tokens_by_model),
+        call_latency_ms=round(rates["call_latency_ms"], 1),
+        runs_used_for_rates=rates["runs_used"],
+        workers=workers,
+        tokenizer=TOKENIZER,
+        **duration,
+    )
+    estimate_cache.put(cache_key, fingerprint, estimate)
+    return estimate
+
+
 # --- Bulk Reprocessing Logic & Endpoints ---
 
 
@@ -1189,7 +1652,11 @@ async def _update_step_status_and_progress(
     total_documents_cache: Optional[int] = None,
     current_doc_id_cache: Optional[str] = None,
     last_processed_document_offset: Optional[int] = None,  # Added MYA-63
-):
+    run_metrics: Optional[Dict[str, Union[int, float]]] = None,
+    last_processed_document_id: Optional[str] = None,
+    clear_document_checkpoint: bool = False,
+) -> Optional[str]:
+    """Updates the step's run state and returns its run_status as stored after the update (None on failure)."""
     payload = {}
     if run_status is not None:
         payload["run_status"] = run_status
@@ -1207,11 +1674,17 @@ async def _update_step_status_and_progress(
     #     payload["current_doc_id_cache"] = current_doc_id_cache
     if last_processed_document_offset is not None:  # Added MYA-63
         payload["last_processed_document_offset"] = last_processed_document_offset
+    if clear_document_checkpoint:
+        payload["last_processed_document_id"] = None
+    elif last_processed_document_id is not None:
+        payload["last_processed_document_id"] = last_processed_document_id
+    if run_metrics is not None:
+        payload["run_metrics"] = run_metrics
 
     if payload:
         payload["updated_at"] = datetime.now(timezone.utc).isoformat()
         try:
-            await asyncio.to_thread(
+            response = await asyncio.to_thread(
                 supabase.table("custom_processing_steps")
                 .update(payload)
                 .eq("id", str(step_id))
@@ -1219,24 +1692,409 @@ async def _update_step_status_and_progress(
                 .execute
             )
             print(f"[PROGRESS_UPDATE] Step {step_id} in project {project_id} updated with: {payload}")
+            # The updated row comes back anyway; its run_status lets runs notice pauses made by other workers
+            if response.data:
+                return response.data[0].get("run_status")
         except Exception as e:
             print(f"[PROGRESS_ERROR] Failed to update step {step_id} status/progress: {e}")
             traceback.print_exc()
+    return None
 
 
-async def _bulk_reprocess_generator(
-    project_id: uuid.UUID,
-    step_id: uuid.UUID,
-    reprocess_type: Literal["all", "new", "failed", "pending"],  # Added 'failed', 'pending' for MYA-63
+async def _write_step_results(
     supabase: Client,
-    openai_client: OpenAI,
+    step_id: str,
+    project_id: str,
+    results_by_document: Dict[str, Dict[str, Any]],
+    run_context: Optional[StepRunContext] = None,
 ):
-    step_id_as_str = str(step_id)
-    project_id_as_str = str(project_id)
-    current_status_for_finally = "running"
+    """Upserts this step's result row for each document in one round trip, stamped with what it was produced from."""
+    fingerprint = run_context.fingerprint if run_context else None
+    text_hashes = run_context.text_hashes if run_context else {}
+    rows = [
+        step_result_row(doc_id, step_id, project_id, result, fingerprint, text_hashes.get(doc_id))
+        for doc_id, result in results_by_document.items()
+    ]
+    await asyncio.to_thread(upsert_step_results, supabase, rows)
 
-    # Initial status update
-    await _update_step_status_and_progress(
+
+async def _execute_prompt_and_merge_results(
+    prompt_config: PromptConfig,
+    prompt_label: str,
+    doc_id: str,
+    doc_content: str,
+    step_id_as_str: str,
+    accumulated_results_for_this_step_this_doc: dict,
+    current_doc_custom_analysis_results: dict,
+    openai_client: OpenAI,
+    run_context: Optional[StepRunContext] = None,
+) -> bool:
+    """
+    Runs a single prompt for a document and merges its JSON output into the step's results.
+    Partial results are persisted after every prompt. Returns False if the document should
+    stop being processed for this step (the failure is recorded in the step results).
+    """
+    step_results = current_doc_custom_analysis_results.setdefault(step_id_as_str, {})
+    try:
+        _raw_resp_str, parsed_output_dict = await _execute_prompt_config_and_get_results(
+            openai_client=openai_client,
+            current_step_id=step_id_as_str,
+            current_doc_id_for_log=doc_id,
+            doc_content_full=doc_content,
+            prompt_config=prompt_config,
+            prior_results_in_step=accumulated_results_for_this_step_this_doc,  # Use the per-document accumulator
+            current_doc_custom_analysis_results=current_doc_custom_analysis_results,
+            run_context=run_context,
+        )
+        print(f"[MYA-91_DEBUG] _raw_resp_str from _execute_prompt: {'Non-empty' if _raw_resp_str else 'Empty/None'}")
+        print(f"[MYA-91_DEBUG] parsed_output_dict from _execute_prompt: {type(parsed_output_dict).__name__} - {str(parsed_output_dict)[:500]}")
+
+        if _raw_resp_str is None or parsed_output_dict is None:
+            # Error occurred in helper _execute_prompt_config_and_get_results.
+            error_detail_for_storage = f"LLM call or JSON parsing failed for legacy prompt #{prompt_label}. Raw: {_raw_resp_str[:200] if _raw_resp_str else 'N/A'}"
+            step_results[f"prompt_{prompt_label}_error"] = error_detail_for_storage
+            step_results["status"] = "error_in_legacy_prompt_execution"
+            print(f"[STREAM_ERROR_LEGACY_EXEC] {error_detail_for_storage}")
+            return False
+
+        if isinstance(parsed_output_dict, dict):
+            accumulated_results_for_this_step_this_doc.update(parsed_output_dict)  # Update the per-document accumulator
+            step_results.update(parsed_output_dict)
+            print(f"[MYA-91_DEBUG] accumulated_results_for_this_step_this_doc AFTER update (dict): {accumulated_results_for_this_step_this_doc}")
+            step_results["status"] = "partial_success"  # Mark as partial success until all prompts done
+        else:
+            # LLM output was not a dictionary, store it separately
+            non_dict_output_key = f"prompt_{prompt_label}_raw_non_dict_llm_output"
+            print(
+                f"[WARN_LEGACY_NON_DICT_OUTPUT] For doc {doc_id}, step {step_id_as_str}, legacy prompt #{prompt_label}, expected dict from LLM but got {type(parsed_output_dict).__name__}. Storing raw output in '{non_dict_output_key}'."
+            )
+            step_results[non_dict_output_key] = str(parsed_output_dict)  # Ensure it's a string for JSON
+            step_results["status"] = "partial_success_with_non_dict_output"
+            # Do not update accumulated_results_for_this_step_this_doc as it expects a dict
+
+        # Update last processed prompt index
+        step_results["last_processed_prompt_index"] = prompt_label
+
+        # Persist after each successful sub-prompt or non-dict output (through the run's write buffer).
+        try:
+            if run_context is not None and run_context.writes is not None:
+                run_context.writes.put_document(doc_id, step_results)
+            print(f"[STREAM_SUB_PROMPT_SUCCESS_LEGACY] Doc {doc_id}, Step {step_id_as_str}, Prompt #{prompt_label} success, results merged.")
+        except Exception as db_update_err_legacy:
+            error_msg = f"Failed to persist partial results for legacy prompt #{prompt_label}, doc {doc_id}. DB Error: {db_update_err_legacy}"
+            print(f"[STREAM_ERROR_DB_UPDATE_LEGACY] {error_msg}")
+            step_results[f"prompt_{prompt_label}_db_error"] = error_msg
+            step_results["status"] = "failed_db_update_legacy"
+            return False
+
+    except Exception as e_sub_prompt:
+        error_msg = f"Error during sub-prompt #{prompt_label} for doc {doc_id}, step {step_id_as_str}: {type(e_sub_prompt).__name__} - {str(e_sub_prompt)}"
+        print(f"[STREAM_ERROR_SUB_PROMPT] {error_msg}")
+        traceback.print_exc()  # Log the full traceback for the sub-prompt error
+        step_results[f"prompt_{prompt_label}_error"] = error_msg
+        step_results["status"] = "failed_sub_prompt_execution"
+        return False
+
+    return True
+
+
+async def _evaluate_conditional_block(
+    block: ConditionalBlockStructure,
+    block_label: str,
+    doc_id: str,
+    doc_content: str,
+    step_id_as_str: str,
+    accumulated_results_for_this_step_this_doc: dict,
+    current_doc_custom_analysis_results: dict,
+    openai_client: OpenAI,
+    run_context: Optional[StepRunContext] = None,
+) -> Optional[bool]:
+    """
+    Runs the condition prompt of a conditional block and returns whether its action prompts
+    should run for this document. Returns None (and records the error) if the condition could
+    not be evaluated.
+    """
+    step_results = current_doc_custom_analysis_results.setdefault(step_id_as_str, {})
+    condition_config = block.condition_prompt.model_copy(
+        update={
+            "text": f"{block.condition_prompt.text}\n\n{CONDITION_RESPONSE_INSTRUCTION}",
+            "output_schema": block.condition_prompt.output_schema or CONDITION_OUTPUT_SCHEMA,
+        }
+    )
+    _raw_resp_str, parsed_condition = await _execute_prompt_config_and_get_results(
+        openai_client=openai_client,
+        current_step_id=step_id_as_str,
+        current_doc_id_for_log=doc_id,
+        doc_content_full=doc_content,
+        prompt_config=condition_config,
+        prior_results_in_step=accumulated_results_for_this_step_this_doc,
+        current_doc_custom_analysis_results=current_doc_custom_analysis_results,
+        run_context=run_context,
+    )
+    condition_met = evaluate_condition_result(parsed_condition) if parsed_condition is not None else None
+    if condition_met is None:
+        error_detail = f"Condition prompt #{block_label} did not return a boolean result. Raw: {_raw_resp_str[:200] if _raw_resp_str else 'N/A'}"
+        step_results[f"prompt_{block_label}_error"] = error_detail
+        step_results["status"] = "error_in_condition_evaluation"
+        print(f"[STREAM_ERROR_CONDITION] Doc {doc_id}, step {step_id_as_str}: {error_detail}")
+        return None
+
+    step_results.setdefault("conditions", {})[block_label] = condition_met
+    print(f"[STREAM_CONDITION] Doc {doc_id}, step {step_id_as_str}, block #{block_label}: condition_met={condition_met}")
+    return condition_met
+
+
+def _normalize_step_prompts(step_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The step's prompts as a list of prompt structures (legacy string prompts and descriptions converted)."""
+    prompts_to_execute = []
+    # Check for 'prompts' field first (new multi-prompt structure)
+    step_prompts_list = step_config.get("prompts")
+    # Check if it's a list and its elements are dicts (our new prompt objects) or strings (legacy)
+    if isinstance(step_prompts_list, list) and step_prompts_list:
+        # If the first item is a dictionary, assume it's the new structure
+        if isinstance(step_prompts_list[0], dict):
+            prompts_to_execute = step_prompts_list  # Use the list of prompt objects directly
+        # Else, if the first item is a string, assume it's a list of legacy string prompts
+        elif isinstance(step_prompts_list[0], str):
+            prompts_to_execute = [
+                {"type": "standard_prompt", "prompt": {"text": p.strip(), "include_document_context": True}}
+                for p in step_prompts_list
+                if isinstance(p, str) and p.strip()
+            ]
+        # Else, it's an unknown format, initialize as empty to fall through to error or legacy description
+        else:
+            prompts_to_execute = []
+
+    # If 'prompts' was not the new structure or was empty/invalid, try legacy single-prompt
+    if not prompts_to_execute:
+        legacy_description = step_config.get("description")
+        if isinstance(legacy_description, str) and legacy_description.strip():
+            # Convert legacy description to a StandardPromptStructure for consistency
+            prompts_to_execute = [
+                {
+                    "type": "standard_prompt",
+                    "prompt": {
+                        "text": legacy_description.strip(),
+                        "include_document_context": True,
+                    },
+                }
+            ]
+    return prompts_to_execute
+
+
+async def _download_and_extract_text(supabase: Client, doc_data: Dict[str, Any]) -> str:
+    """Downloads a document's file from storage and returns its text (PDF or DOCX). Raises on any failure."""
+    doc_id = doc_data.get("id")
+    doc_file_name = doc_data.get("file_name", "Unknown Filename")
+    doc_storage_path = doc_data.get("storage_path")
+    if not doc_storage_path:
+        raise ValueError(f"Document ID {doc_id} ({doc_file_name}) is missing 'storage_path'.")
+
+    print(f"[STREAM_STORAGE_DOWNLOAD] Downloading {doc_storage_path} for doc {doc_id} ({doc_file_name}).")
+    file_bytes_response = await asyncio.to_thread(
+        supabase.storage.from_("pdf-documents").download,
+        doc_storage_path,
+    )
+    file_bytes = file_bytes_response  # In Python SDK, download() returns bytes directly
+
+    if not file_bytes:
+        raise ValueError(
+            f"Downloaded 0 bytes for {doc_storage_path} (doc {doc_id}, {doc_file_name}). File might be empty, non-existent, or download failed."
+        )
+    print(f"[STREAM_STORAGE_DOWNLOAD_SUCCESS] Downloaded {len(file_bytes)} bytes for {doc_storage_path}.")
+
+    # Determine file type and extract text accordingly
+    file_extension = doc_file_name.split(".")[-1].lower() if "." in doc_file_name else ""
+    temp_doc_content = ""
+
+    if file_extension == "pdf":
+        print(f"[STREAM_EXTRACT_INFO] Attempting PDF extraction for {doc_file_name}")
+        with io.BytesIO(file_bytes) as pdf_file_like:
+            pdf_reader = pypdf.PdfReader(pdf_file_like)
+            if not pdf_reader.pages:
+                raise ValueError(
+                    f"PDF {doc_storage_path} (doc {doc_id}, {doc_file_name}) has no pages or is not a valid PDF."
+                )
+            for page_num in range(len(pdf_reader.pages)):
+                page_text = pdf_reader.pages[page_num].extract_text()
+                if page_text:
+                    temp_doc_content += page_text + "\n"
+        print(f"[STREAM_PDF_EXTRACT_SUCCESS] Extracted {len(temp_doc_content)} chars from PDF: {doc_file_name}")
+    elif file_extension == "docx":
+        print(f"[STREAM_EXTRACT_INFO] Attempting DOCX extraction for {doc_file_name}")
+        try:
+            document = Document(io.BytesIO(file_bytes))
+            all_text_parts = [para.text for para in document.paragraphs if para.text]
+            temp_doc_content = "\n\n".join(all_text_parts)
+            print(
+                f"[STREAM_DOCX_EXTRACT_SUCCESS] Extracted {len(temp_doc_content)} chars from DOCX: {doc_file_name}"
+            )
+        except Exception as docx_err:
+            raise ValueError(f"Failed to parse DOCX content for {doc_file_name}: {docx_err}") from docx_err
+    else:
+        raise ValueError(
+            f"Unsupported file type '{file_extension}' for text extraction in {doc_file_name} (doc_id: {doc_id})."
+        )
+
+    if not temp_doc_content.strip():
+        raise ValueError(f"Extracted text from {doc_file_name} (doc {doc_id}) is empty after processing.")
+    return temp_doc_content.strip()
+
+
+def _final_run_status(current_status_for_finally: str) -> str:
+    """Maps how a run ended to the run_status stored for it."""
+    if "error" in current_status_for_finally:
+        return "error"
+    if current_status_for_finally == "completed_with_errors":
+        return "error"  # Or "completed_with_errors" if we add that status
+    if current_status_for_finally in ("paused", "budget_exceeded"):
+        return "paused"  # Budget stops are resumable with reprocess_type="new"
+    # completed_ok, completed_empty and cancelled all leave the step idle
+    return "idle"
+
+
+# Outcomes of running one step's prompts over one document
+DOCUMENT_SUCCEEDED = "succeeded"
+DOCUMENT_FAILED = "failed"
+DOCUMENT_INTERRUPTED = "interrupted"
+
+
+async def _run_step_prompts_for_document(
+    prompts_to_execute: List[Dict[str, Any]],
+    doc_id: str,
+    doc_content: str,
+    step_id_as_str: str,
+    current_doc_custom_analysis_results: dict,
+    openai_client: OpenAI,
+    run_context: StepRunContext,
+    run_control: RunControl,
+) -> str:
+    """
+    Runs a step's prompts (and conditional blocks) in order over one document's text.
+    The step's result is left in current_doc_custom_analysis_results[step_id_as_str]; finished
+    results (success or failure) are also handed to the run's write buffer. Returns one of
+    DOCUMENT_SUCCEEDED, DOCUMENT_FAILED or DOCUMENT_INTERRUPTED (a pause/cancel stopped it
+    between prompts; nothing final is written then, so the document is redone on resume).
+    """
+    if not isinstance(current_doc_custom_analysis_results.get(step_id_as_str), dict):
+        current_doc_custom_analysis_results[step_id_as_str] = {}
+
+    doc_processed_successfully_by_all_prompts = True  # Flag for this document
+    # Initialize accumulator for results specific to this step and this document
+    accumulated_results_for_this_step_this_doc = {}
+    print(f"[MYA-91_DEBUG] Initialized accumulated_results_for_this_step_this_doc for doc {doc_id}, step {step_id_as_str}: {{}}")
+    interrupted_mid_document = False  # Set when a pause/cancel stops this document between prompts
+
+    for prompt_idx, prompt_container in enumerate(prompts_to_execute):
+        print(f"[MYA-91_DEBUG] --------------- PROMPT #{prompt_idx + 1} for doc {doc_id} ---------------")
+        # MYA-94: Stop before the next prompt once a pause/cancel was requested (in-memory check)
+        if run_control.stop_requested:
+            interrupted_mid_document = True
+            break
+        if run_context.writes is not None:
+            await run_context.writes.maybe_flush()  # Also how a pause made by another worker is noticed
+
+        print(f"[MYA-91_DEBUG] Current prompt_container: {prompt_container}")
+        print(f"[MYA-91_DEBUG] accumulated_results_for_this_step_this_doc BEFORE _execute_prompt: {accumulated_results_for_this_step_this_doc}")
+
+        if prompt_container.get("type") == "conditional_block":
+            # Run the condition prompt first; the action prompts only run if it holds.
+            block = ConditionalBlockStructure(**prompt_container)
+            run_context.run_metrics["conditions_evaluated"] += 1
+            condition_met = await _evaluate_conditional_block(
+                block=block,
+                block_label=str(prompt_idx + 1),
+                doc_id=doc_id,
+                doc_content=doc_content,
+                step_id_as_str=step_id_as_str,
+                accumulated_results_for_this_step_this_doc=accumulated_results_for_this_step_this_doc,
+                current_doc_custom_analysis_results=current_doc_custom_analysis_results,
+                openai_client=openai_client,
+                run_context=run_context,
+            )
+            if condition_met is None:
+                doc_processed_successfully_by_all_prompts = False
+                break  # Stop processing this document for this step
+            if not condition_met:
+                run_context.run_metrics["conditions_false"] += 1
+                run_context.run_metrics["action_prompts_skipped"] += len(block.action_prompts)
+                continue  # Short-circuit: skip all action prompts of this block
+            labelled_prompt_configs = [
+                (f"{prompt_idx + 1}.{action_idx + 1}", action_prompt)
+                for action_idx, action_prompt in enumerate(block.action_prompts)
+            ]
+        else:
+            labelled_prompt_configs = [(str(prompt_idx + 1), PromptConfig(**prompt_container["prompt"]))]
+
+        for prompt_label, prompt_config in labelled_prompt_configs:
+            if run_control.stop_requested:
+                interrupted_mid_document = True
+                break
+            if not await _execute_prompt_and_merge_results(
+                prompt_config=prompt_config,
+                prompt_label=prompt_label,
+                doc_id=doc_id,
+                doc_content=doc_content,
+                step_id_as_str=step_id_as_str,
+                accumulated_results_for_this_step_this_doc=accumulated_results_for_this_step_this_doc,
+                current_doc_custom_analysis_results=current_doc_custom_analysis_results,
+                openai_client=openai_client,
+                run_context=run_context,
+            ):
+                doc_processed_successfully_by_all_prompts = False
+                break
+        if not doc_processed_successfully_by_all_prompts or interrupted_mid_document:
+            break  # Stop processing this document for this step
+
+    if interrupted_mid_document:
+        return DOCUMENT_INTERRUPTED
+    step_result = current_doc_custom_analysis_results[step_id_as_str]
+    if doc_processed_successfully_by_all_prompts:
+        step_result["status"] = "success"
+        step_result.pop("last_processed_prompt_index", None)  # Clean up temp field
+        print(f"[STREAM_SUCCESS] Doc {doc_id} fully processed by step {step_id_as_str}.")
+    else:
+        # The error status and details were recorded by the prompt that failed
+        print(
+            f"[STREAM_DOC_FAILED] Doc {doc_id} failed processing for step {step_id_as_str}. Status: {step_result.get('status')}"
+        )
+    if run_context.writes is not None:
+        run_context.writes.put_document(doc_id, step_result)
+    return DOCUMENT_SUCCEEDED if doc_processed_successfully_by_all_prompts else DOCUMENT_FAILED
+
+
+async def _bulk_reprocess_generator(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    reprocess_type: Literal["all", "new", "failed", "pending", "stale"],  # Added 'failed', 'pending' for MYA-63
+    supabase: Client,
+    openai_client: OpenAI,
+    run_id: Optional[str] = None,
+):
+    step_id_as_str = str(step_id)
+    project_id_as_str = str(project_id)
+    current_status_for_finally = "running"
+    run_id = run_id or str(uuid.uuid4())  # Tags this run's token usage and events
+    run_context = StepRunContext(
+        step_id=step_id_as_str,
+        usage_tracker=RunUsageTracker(supabase, project_id_as_str, step_id_as_str, run_id=run_id),
+    )
+    usage_tracker = run_context.usage_tracker
+
+    async def write_step_progress(fields: Dict[str, Any]):
+        run_control.observe_db_status(await _update_step_status_and_progress(step_id, project_id, supabase, **fields))
+
+    # Result and progress writes are coalesced and flushed every few documents / seconds, and on every stop
+    write_buffer = WriteBehindBuffer(
+        write_documents=lambda results: _write_step_results(
+            supabase, step_id_as_str, project_id_as_str, results, run_context
+        ),
+        write_step=write_step_progress,
+    )
+    run_context.writes = write_buffer
+
+    # Initial status update. "new" runs keep the checkpoint so they resume after the last processed document.
+    await _update_step_status_and_progress(
         step_id=step_id,
         project_id=project_id,
         supabase=supabase,
@@ -1246,10 +2104,12 @@ async def _bulk_reprocess_generator(
         failed_count_cache=0,
         total_documents_cache=0,
         current_doc_id_cache=None,
-        last_processed_document_offset=-1,  # Start before the first doc for 'new' logic
+        last_processed_document_offset=-1 if reprocess_type != "new" else None,
+        clear_document_checkpoint=reprocess_type != "new",
     )
 
     yield_counter = 0
+    run_metrics = run_context.run_metrics  # Per-run counters persisted on the step (e.g. skipped action prompts)
     processed_count_this_run = 0
     failed_count_this_run = 0
     last_sent_processed_count = -1
@@ -1257,7 +2117,7 @@ async def _bulk_reprocess_generator(
     last_sent_percent = -1.0
 
     # MYA-77 Debug: Send an immediate init event to test stream viability
-    init_event_string = f"event: init\ndata: {json.dumps({'message': 'Stream initiated for step ' + step_id_as_str, 'project_id': project_id_as_str})}\n\n"
+    init_event_string = f"event: init\ndata: {json.dumps({'message': 'Stream initiated for step ' + step_id_as_str, 'project_id': project_id_as_str, 'run_id': run_id})}\n\n"
     print(f"[SSE_YIELD_DEBUG] Yielding init: {init_event_string.strip()}")
     try:
         yield init_event_string
@@ -1275,7 +2135,7 @@ async def _bulk_reprocess_generator(
         step_details_response = await asyncio.to_thread(
             supabase.table("custom_processing_steps")
             .select(
-                "id, name, description, prompts, run_status, last_processed_document_offset, total_documents_cache, processed_count_cache, failed_count_cache"  # Added 'prompts'
+                "id, name, description, prompts, token_budget, model_settings, pre_filter, run_status, last_processed_document_offset, last_processed_document_id, total_documents_cache, processed_count_cache, failed_count_cache"  # Added 'prompts'
             )
             .eq("id", step_id_as_str)
             .eq("project_id", project_id_as_str)
@@ -1322,36 +2182,14 @@ async def _bulk_reprocess_generator(
         return
 
     step_config = step_details_response.data
+    usage_tracker.token_budget = step_config.get("token_budget")
+    if step_config.get("model_settings"):
+        run_context.model_settings = ModelSettings(**step_config["model_settings"])
+    pre_filter = PreFilter(**step_config["pre_filter"]) if step_config.get("pre_filter") else None
+    run_context.fingerprint = step_fingerprint(step_config)
+    run_context.flow = await _load_work_flow(supabase, project_id_as_str, step_id_as_str)
 
-    prompts_to_execute = []
-    # Check for 'prompts' field first (new multi-prompt structure)
-    step_prompts_list = step_config.get("prompts")
-    # Check if it's a list and its elements are dicts (our new prompt objects) or strings (legacy)
-    if isinstance(step_prompts_list, list) and step_prompts_list:
-        # If the first item is a dictionary, assume it's the new structure
-        if isinstance(step_prompts_list[0], dict):
-            prompts_to_execute = step_prompts_list  # Use the list of prompt objects directly
-        # Else, if the first item is a string, assume it's a list of legacy string prompts
-        elif isinstance(step_prompts_list[0], str):
-            prompts_to_execute = [p for p in step_prompts_list if isinstance(p, str) and p.strip()]
-        # Else, it's an unknown format, initialize as empty to fall through to error or legacy description
-        else:
-            prompts_to_execute = []
-
-    # If 'prompts' was not the new structure or was empty/invalid, try legacy single-prompt
-    if not prompts_to_execute:
-        legacy_description = step_config.get("description")
-        if isinstance(legacy_description, str) and legacy_description.strip():
-            # Convert legacy description to a StandardPromptStructure for consistency
-            prompts_to_execute = [
-                {
-                    "type": "standard_prompt",
-                    "prompt": {
-                        "text": legacy_description.strip(),
-                        "include_document_context": True,
-                    },
-                }
-            ]
+    prompts_to_execute = _normalize_step_prompts(step_config)
 
     if not prompts_to_execute:
         error_message = f"No valid prompt templates found for step {step_id_as_str}. Either 'prompts' list must be non-empty or 'description' must be set."
@@ -1369,30 +2207,64 @@ async def _bulk_reprocess_generator(
         )
         return
 
-    # Define the main query for data fetching with all necessary columns
-    # This will also have .order() applied based on reprocess_type
-    query_for_data = (
-        supabase.table("documents")
-        .select(
-            "id, file_name, extracted_text, custom_analysis_results, created_at, storage_path"  # Added storage_path
-        )
-        .eq("project_id", project_id_as_str)
-    )
+    llm_calls_per_document = count_llm_calls(prompts_to_execute)  # Reported as savings when the pre-filter skips a doc
 
+    # Step names let prompts reference other steps' results, e.g. {{steps.Sentiment.stance}}
+    try:
+        project_steps_response = await asyncio.to_thread(
+            supabase.table("custom_processing_steps").select("id, name").eq("project_id", project_id_as_str).execute
+        )
+        run_context.step_names_by_id = {str(step["id"]): step["name"] for step in (project_steps_response.data or [])}
+    except Exception as e_step_names:
+        print(f"[STREAM_WARN] Could not fetch step names for project {project_id_as_str}: {e_step_names}. Name-based step references will not resolve.")
+
+    # Documents are paged with a keyset cursor (id > last id) rather than offsets, so every batch
+    # costs the same and documents added or removed mid-run never shift the remaining pages.
+    # "failed" and "pending" runs let the database pick the documents whose result for this step
+    # needs redoing, so they only touch (and count) those documents.
+    selection = reprocess_type if reprocess_type in REPROCESS_SELECTIONS else None
+    document_columns = "id, file_name, extracted_text, analysis, created_at, storage_path"
+
+    def fetch_documents_batch(after_id: Optional[str], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str], bool]:
+        """Returns the next batch of documents in scope, the cursor after it and whether more may follow."""
+        if selection is None:
+            rows = keyset_page(
+                supabase.table("documents").select(document_columns).eq("project_id", project_id_as_str),
+                after_id,
+                limit,
+            ).execute().data or []
+            return rows, (rows[-1]["id"] if rows else after_id), len(rows) == limit
+        document_ids = reprocess_document_ids(
+            supabase, project_id_as_str, step_id_as_str, selection, after_id, limit, fingerprint=run_context.fingerprint
+        )
+        if not document_ids:
+            return [], after_id, False
+        rows = supabase.table("documents").select(document_columns).in_("id", document_ids).execute().data or []
+        position = {document_id: index for index, document_id in enumerate(document_ids)}
+        rows.sort(key=lambda row: position[str(row["id"])])
+        return rows, document_ids[-1], len(document_ids) == limit
+
+    resume_after_id: Optional[str] = None
     initial_offset = 0
     if reprocess_type == "new":
-        query_for_data = query_for_data.order("id", desc=False)
-        last_offset_db = step_config.get("last_processed_document_offset", -1)
-        initial_offset = last_offset_db + 1
+        resume_after_id = step_config.get("last_processed_document_id")
+        if resume_after_id:
+            try:
+                # Only used for progress display; the cursor alone decides where the run resumes
+                done_count_response = await asyncio.to_thread(
+                    supabase.table("documents")
+                    .select("id", count="exact")
+                    .eq("project_id", project_id_as_str)
+                    .lte("id", resume_after_id)
+                    .limit(1)
+                    .execute
+                )
+                initial_offset = done_count_response.count or 0
+            except Exception as e_resume_count:
+                print(f"[STREAM_WARN] Could not count documents before checkpoint {resume_after_id}: {e_resume_count}")
         print(
-            f"[STREAM_INFO] Reprocess type 'new'. Starting from offset: {initial_offset} (last_processed_document_offset from DB: {last_offset_db})"
+            f"[STREAM_INFO] Reprocess type 'new'. Resuming after document id {resume_after_id or '<start>'} (position {initial_offset})."
         )
-    elif reprocess_type == "failed":
-        query_for_data = query_for_data.order("id", desc=False)
-    elif reprocess_type == "pending":
-        query_for_data = query_for_data.order("id", desc=False)
-    else:  # "all" or any other case
-        query_for_data = query_for_data.order("id", desc=False)  # Default order
 
     # For counting, use a simpler query that is less likely to fail due to missing columns
     # not essential for the count itself. Filters should match.
@@ -1403,8 +2275,18 @@ async def _bulk_reprocess_generator(
     total_docs_for_progress = 0
     try:
         print(f"[STREAM_DEBUG_QUERY_COUNT] Attempting to execute document count query for project {project_id_as_str}")
-        count_response = await asyncio.to_thread(query_for_count.execute)  # Use query_for_count
-        total_docs_for_progress = count_response.count if count_response.count is not None else 0
+        if selection is not None:
+            total_docs_for_progress = await asyncio.to_thread(
+                count_reprocess_documents,
+                supabase,
+                project_id_as_str,
+                step_id_as_str,
+                selection,
+                run_context.fingerprint,
+            )
+        else:
+            count_response = await asyncio.to_thread(query_for_count.execute)  # Use query_for_count
+            total_docs_for_progress = count_response.count if count_response.count is not None else 0
         print(
             f"[STREAM_DEBUG_QUERY_COUNT_SUCCESS] Successfully executed document count query. Total docs: {total_docs_for_progress}"
         )
@@ -1425,7 +2307,9 @@ async def _bulk_reprocess_generator(
     print(f"[STREAM_DEBUG_TOTAL_DOCS] total_docs_for_progress: {total_docs_for_progress}")  # MYA-77 Debug
 
     if total_docs_for_progress == 0:
-        print(f"[STREAM_INFO] No documents found for project {project_id_as_str}. Nothing to process.")
+        print(
+            f"[STREAM_INFO] No {selection + ' ' if selection else ''}documents found for project {project_id_as_str}. Nothing to process."
+        )
         # Removed progress event yield for zero-doc case to simplify client handling (MYA-77)
         current_status_for_finally = "completed_empty"
         await _update_step_status_and_progress(
@@ -1437,7 +2321,12 @@ async def _bulk_reprocess_generator(
             processed_count_cache=0,
             failed_count_cache=0,
         )
-        sse_end_stream_event = f"event: end_stream\ndata: {json.dumps({'message': 'No documents found for project, stream ended cleanly.'})}\n\n"
+        end_message = (
+            f"No {selection} documents for this step, stream ended cleanly."
+            if selection
+            else "No documents found for project, stream ended cleanly."
+        )
+        sse_end_stream_event = f"event: end_stream\ndata: {json.dumps({'message': end_message})}\n\n"
         print(f"[SSE_YIELD_DEBUG] Yielding end_stream: {sse_end_stream_event.strip()}")  # MYA-77 Debug
         yield sse_end_stream_event
         return
@@ -1448,82 +2337,148 @@ async def _bulk_reprocess_generator(
     )
 
     # Batch processing variables
-    BATCH_SIZE = 10  # Number of documents to fetch per Supabase call
-    current_batch_offset = initial_offset
+    batch_size = AdaptiveBatchSize(initial=10, maximum=50)  # Documents per Supabase call, adapted to text size
+    batch_cursor = resume_after_id  # Id of the last document fetched
+    last_completed_doc_id = resume_after_id  # Checkpoint: every document up to this id is done for this run
     has_more_documents = True
     doc_index_overall = initial_offset - 1  # To track overall document index for `last_processed_document_offset`
 
+    run_context.stats = RunStats()  # Timed from here so setup queries do not count as processing
+    await record_run_start(
+        supabase, run_start_row(run_id, project_id_as_str, step_id_as_str, reprocess_type, total_docs_for_progress)
+    )
+    # Pause/cancel requests arrive in-process from the manage endpoint, or via the run_status
+    # returned by our own progress writes when another worker handled the request. Registered
+    # right before the try whose finally releases it, so setup errors and early returns cannot leak it.
+    run_control = run_controls.register(step_id_as_str)
     try:
         while has_more_documents:
-            # Check run_status before processing each batch (for pause)
-            latest_step_status_resp = await asyncio.to_thread(
-                supabase.table("custom_processing_steps")
-                .select("run_status")
-                .eq("id", step_id_as_str)
-                .eq("project_id", project_id_as_str)
-                .single()
-                .execute
-            )
-            if latest_step_status_resp.data and latest_step_status_resp.data.get("run_status") == "paused":
-                print(f"[STREAM_PAUSE] Step {step_id_as_str} is paused. Pausing generator.")
+            # Stop between batches once a pause or cancel was requested (no database query needed)
+            if run_control.stop_requested:
+                paused = run_control.stop_reason == PAUSE
+                print(f"[STREAM_PAUSE] Step {step_id_as_str}: {run_control.stop_reason} requested. Stopping generator.")
                 percent_complete = (
                     (processed_count_this_run + failed_count_this_run) / total_docs_for_progress * 100
                     if total_docs_for_progress > 0
                     else 0
                 )
                 progress_payload_json = ProcessingProgress(
-                    status="paused",
+                    status="paused" if paused else "cancelled",
                     total=total_docs_for_progress,
                     processed=processed_count_this_run,
                     failed=failed_count_this_run,
                     percent=percent_complete,
-                    message="Processing paused by user.",
+                    message="Processing paused by user." if paused else "Processing cancelled.",
                 ).model_dump_json(by_alias=True)
                 yield f"event: progress\ndata: {progress_payload_json}\n\n"
-                # No further status update to DB here, already paused.
-                current_status_for_finally = "paused"
-                # We need to store the current doc_index_overall so resume can pick up
-                await _update_step_status_and_progress(
-                    step_id,
-                    project_id,
-                    supabase,
+                current_status_for_finally = "paused" if paused else "cancelled"
+                # Store the checkpoint so resume picks up exactly after the last completed document
+                write_buffer.put_step(
                     last_processed_document_offset=doc_index_overall,
+                    last_processed_document_id=last_completed_doc_id,
                 )
+                await write_buffer.flush()
                 return  # Stop the generator
-            elif latest_step_status_resp.data and latest_step_status_resp.data.get("run_status") != "running":
-                # If status is error, completed, idle, etc., stop.
-                current_run_status = latest_step_status_resp.data.get("run_status")
-                print(f"[STREAM_STOP] Step {step_id_as_str} status is '{current_run_status}'. Stopping generator.")
-                current_status_for_finally = latest_step_status_resp.data.get("run_status", "error_unexpected_stop")
-                # Do not yield progress here as it might be confusing. Final status will be set in finally.
-                return
 
+            requested_batch_size = batch_size.size
             print(
-                f"[STREAM_BATCH] Fetching documents for step {step_id_as_str}: offset={current_batch_offset}, limit={BATCH_SIZE}"
+                f"[STREAM_BATCH] Fetching documents for step {step_id_as_str}: after id={batch_cursor}, limit={requested_batch_size}"
             )
-            docs_response = await asyncio.to_thread(
-                query_for_data.range(current_batch_offset, current_batch_offset + BATCH_SIZE - 1).execute
+            batch_documents, batch_cursor, has_more_documents = await asyncio.to_thread(
+                fetch_documents_batch, batch_cursor, requested_batch_size
             )
 
-            if not docs_response.data:
-                print(
-                    f"[STREAM_BATCH] No more documents found for step {step_id_as_str} at offset {current_batch_offset}."
-                )
-                has_more_documents = False
+            if not batch_documents:
+                if has_more_documents:
+                    continue  # Every selected document of this page was deleted meanwhile
+                print(f"[STREAM_BATCH] No more documents found for step {step_id_as_str} after id {batch_cursor}.")
                 break
 
-            if len(docs_response.data) < BATCH_SIZE:
-                has_more_documents = False  # This is the last batch
+            batch_size.update(batch_documents)
+            for doc in batch_documents:
+                run_context.text_hashes[str(doc["id"])] = document_text_hash(doc.get("extracted_text"))
+
+            # Existing results of every step for this batch (prompts may reference other steps' results)
+            batch_results_by_doc = await asyncio.to_thread(
+                load_results_by_document, supabase, document_ids=[doc["id"] for doc in batch_documents]
+            )
+            for doc in batch_documents:
+                doc["custom_analysis_results"] = batch_results_by_doc.get(str(doc["id"]), {})
+
+            # Evaluate the step's pre-filter over the whole batch before any LLM call
+            skip_reasons_by_doc_id = evaluate_prefilter(pre_filter, batch_documents) if pre_filter else {}
+
+            for doc_data in batch_documents:
+                await write_buffer.maybe_flush()
+                if usage_tracker.budget_exceeded:
+                    # Stop cleanly before starting another document; the run can be resumed with 'new'.
+                    budget_message = f"Token budget of {usage_tracker.token_budget} exceeded ({usage_tracker.totals.total_tokens} tokens used). Run stopped."
+                    print(f"[STREAM_BUDGET] Step {step_id_as_str}: {budget_message}")
+                    budget_progress = ProcessingProgress(
+                        status="budget_exceeded",
+                        total=total_docs_for_progress,
+                        processed=processed_count_this_run,
+                        failed=failed_count_this_run,
+                        percent=(
+                            ((processed_count_this_run + failed_count_this_run) / total_docs_for_progress * 100)
+                            if total_docs_for_progress > 0
+                            else 0
+                        ),
+                        message=budget_message,
+                        run_metrics=run_context.metrics_snapshot(),
+                    )
+                    yield f"event: progress\ndata: {budget_progress.model_dump_json(by_alias=True)}\n\n"
+                    current_status_for_finally = "budget_exceeded"
+                    write_buffer.put_step(
+                        last_processed_document_offset=doc_index_overall,
+                        last_processed_document_id=last_completed_doc_id,
+                    )
+                    await write_buffer.flush()
+                    return
 
-            for doc_data in docs_response.data:
                 doc_index_overall += 1  # Increment before processing, so it represents the current doc index
                 doc_id = doc_data.get("id")
                 doc_file_name = doc_data.get("file_name", "Unknown Filename")  # Added
-                doc_storage_path = doc_data.get("storage_path")  # Added
                 # doc_content = doc_data.get("extracted_text") # Old line, will be replaced by new logic
                 current_custom_results = doc_data.get("custom_analysis_results") or {}
                 doc_content = None  # Initialize for new logic
 
+                skip_reason = skip_reasons_by_doc_id.get(str(doc_id))
+                if skip_reason:
+                    # Not relevant to this step: record it and move on without downloading or calling the LLM
+                    processed_count_this_run += 1
+                    run_metrics["skipped_by_filter"] += 1
+                    run_metrics["llm_calls_saved"] += llm_calls_per_document
+                    current_custom_results[step_id_as_str] = {
+                        "status": SKIPPED_BY_FILTER_STATUS,
+                        "skip_reason": skip_reason,
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                    }
+                    write_buffer.put_document(doc_id, current_custom_results[step_id_as_str])
+                    print(f"[STREAM_SKIP_FILTER] Doc {doc_id} skipped by pre-filter of step {step_id_as_str}: {skip_reason}")
+                    progress_data_skip_doc = ProcessingProgress(
+                        status="running",
+                        total=total_docs_for_progress,
+                        processed=processed_count_this_run,
+                        failed=failed_count_this_run,
+                        percent=(
+                            ((processed_count_this_run + failed_count_this_run) / total_docs_for_progress * 100)
+                            if total_docs_for_progress > 0
+                            else 0
+                        ),
+                        currentDocId=doc_id,
+                        currentDocIndex=doc_index_overall,
+                        message=f"Skipped doc {doc_index_overall + 1}/{total_docs_for_progress} ({doc_file_name}): {skip_reason}",
+                    )
+                    yield f"event: progress\ndata: {progress_data_skip_doc.model_dump_json(by_alias=True)}\n\n"
+                    last_completed_doc_id = doc_id
+                    if reprocess_type == "new" or reprocess_type == "all":
+                        write_buffer.put_step(
+                            last_processed_document_offset=doc_index_overall,
+                            last_processed_document_id=doc_id,
+                        )
+                    continue
+
                 # Yield initial progress for starting this document - MOVED AND REFINED
                 yield_counter += 1
                 progress_data_start_doc = ProcessingProgress(
@@ -1545,73 +2500,11 @@ async def _bulk_reprocess_generator(
                 )
                 print(f"[SSE_YIELD_DEBUG] Yielding progress (doc start): {sse_event_string_start_doc.strip()}")
                 yield sse_event_string_start_doc
-                time.sleep(0.05)
+                doc_started_at = run_context.stats.now()
 
                 # PDF Download and Text Extraction Block - NEW
                 try:
-                    if not doc_storage_path:
-                        raise ValueError(f"Document ID {doc_id} ({doc_file_name}) is missing 'storage_path'.")
-
-                    print(
-                        f"[STREAM_STORAGE_DOWNLOAD] Downloading {doc_storage_path} for doc {doc_id} ({doc_file_name})."
-                    )
-                    file_bytes_response = await asyncio.to_thread(
-                        supabase.storage.from_("pdf-documents").download,
-                        doc_storage_path,
-                    )
-                    file_bytes = file_bytes_response  # In Python SDK, download() returns bytes directly
-
-                    if not file_bytes:
-                        raise ValueError(
-                            f"Downloaded 0 bytes for {doc_storage_path} (doc {doc_id}, {doc_file_name}). File might be empty, non-existent, or download failed."
-                        )
-                    print(
-                        f"[STREAM_STORAGE_DOWNLOAD_SUCCESS] Downloaded {len(file_bytes)} bytes for {doc_storage_path}."
-                    )
-
-                    # Determine file type and extract text accordingly
-                    file_extension = doc_file_name.split(".")[-1].lower() if "." in doc_file_name else ""
-                    temp_doc_content = ""
-
-                    if file_extension == "pdf":
-                        print(f"[STREAM_EXTRACT_INFO] Attempting PDF extraction for {doc_file_name}")
-                        with io.BytesIO(file_bytes) as pdf_file_like:
-                            pdf_reader = pypdf.PdfReader(pdf_file_like)
-                            if not pdf_reader.pages:
-                                raise ValueError(
-                                    f"PDF {doc_storage_path} (doc {doc_id}, {doc_file_name}) has no pages or is not a valid PDF."
-                                )
-                            for page_num in range(len(pdf_reader.pages)):
-                                page_text = pdf_reader.pages[page_num].extract_text()
-                                if page_text:
-                                    temp_doc_content += page_text + "\\n"
-                        print(
-                            f"[STREAM_PDF_EXTRACT_SUCCESS] Extracted {len(temp_doc_content)} chars from PDF: {doc_file_name}"
-                        )
-                    elif file_extension == "docx":
-                        print(f"[STREAM_EXTRACT_INFO] Attempting DOCX extraction for {doc_file_name}")
-                        try:
-                            document = Document(io.BytesIO(file_bytes))
-                            all_text_parts = [para.text for para in document.paragraphs if para.text]
-                            temp_doc_content = "\\n\\n".join(all_text_parts)
-                            print(
-                                f"[STREAM_DOCX_EXTRACT_SUCCESS] Extracted {len(temp_doc_content)} chars from DOCX: {doc_file_name}"
-                            )
-                        except Exception as docx_err:
-                            raise ValueError(
-                                f"Failed to parse DOCX content for {doc_file_name}: {docx_err}"
-                            ) from docx_err
-                    else:
-                        raise ValueError(
-                            f"Unsupported file type '{file_extension}' for text extraction in {doc_file_name} (doc_id: {doc_id})."
-                        )
-
-                    if not temp_doc_content.strip():
-                        raise ValueError(
-                            f"Extracted text from {doc_file_name} (doc {doc_id}) is empty after processing."
-                        )
-
-                    doc_content = temp_doc_content.strip()
+                    doc_content = await _download_and_extract_text(supabase, doc_data)
 
                 except Exception as e_extract:
                     failed_count_this_run += 1
@@ -1623,17 +2516,7 @@ async def _bulk_reprocess_generator(
                         "status": "failed_extraction",
                         "timestamp": datetime.now(timezone.utc).isoformat(),
                     }
-                    try:
-                        await asyncio.to_thread(
-                            supabase.table("documents")
-                            .update({"custom_analysis_results": current_custom_results})
-                            .eq("id", doc_id)
-                            .execute
-                        )
-                    except Exception as db_update_err:
-                        print(
-                            f"[STREAM_ERROR_DB_UPDATE] Failed to update document {doc_id} with extraction error: {db_update_err}"
-                        )
+                    write_buffer.put_document(doc_id, current_custom_results[step_id_as_str])
 
                     progress_data_fail_doc = ProcessingProgress(
                         status="processing_doc_failed",
@@ -1654,206 +2537,62 @@ async def _bulk_reprocess_generator(
                         f"event: progress\ndata: {progress_data_fail_doc.model_dump_json(by_alias=True)}\n\n"
                     )
                     yield sse_event_string_fail_doc
+                    run_context.stats.document_finished(doc_started_at)
+                    last_completed_doc_id = doc_id
                     # This continue is CRITICAL: if extraction fails, we skip AI analysis for this doc
                     # The original "if not doc_content:" check later will be removed.
                     continue
 
                 try:
                     current_doc_custom_analysis_results = doc_data.get("custom_analysis_results") or {}
-                    if step_id_as_str not in current_doc_custom_analysis_results or not isinstance(
-                        current_doc_custom_analysis_results[step_id_as_str], dict
-                    ):
-                        current_doc_custom_analysis_results[step_id_as_str] = {}
-
-                    doc_processed_successfully_by_all_prompts = True  # Flag for this document
-                    # Initialize accumulator for results specific to this step and this document
-                    accumulated_results_for_this_step_this_doc = {} 
-                    print(f"[MYA-91_DEBUG] Initialized accumulated_results_for_this_step_this_doc for doc {doc_id}, step {step_id_as_str}: {{}}")
-
-                    for prompt_idx, prompt_container in enumerate(prompts_to_execute):
-                        print(f"[MYA-91_DEBUG] --------------- PROMPT #{prompt_idx + 1} for doc {doc_id} ---------------")
-                        # MYA-94: Check for pause before processing each prompt for this document
-                        try:
-                            latest_step_status_resp_prompt_check = await asyncio.to_thread(
-                                supabase.table("custom_processing_steps")
-                                .select("run_status")
-                                .eq("id", step_id_as_str)
-                                .eq("project_id", project_id_as_str)
-                                .single()
-                                .execute
-                            )
-                            if latest_step_status_resp_prompt_check.data and latest_step_status_resp_prompt_check.data.get("run_status") == "paused":
-                                print(f"[STREAM_PAUSE_PROMPT_LEVEL] Step {step_id_as_str} is paused (checked before prompt {prompt_idx+1} for doc {doc_id}). Pausing generator.")
-                                current_status_for_finally = "paused"
-                                paused_progress_payload = ProcessingProgress(
-                                    status="paused",
-                                    total=total_docs_for_progress,
-                                    processed=processed_count_this_run,
-                                    failed=failed_count_this_run,
-                                    percent=(
-                                        ((processed_count_this_run + failed_count_this_run) / total_docs_for_progress * 100)
-                                        if total_docs_for_progress > 0
-                                        else 0
-                                    ),
-                                    currentDocId=doc_id, 
-                                    currentDocIndex=doc_index_overall,
-                                    message="Processing paused by user (before starting next prompt).",
-                                ).model_dump_json(by_alias=True)
-                                yield f"event: progress\\ndata: {paused_progress_payload}\\n\\n"
-                                yield_counter += 1
-                                
-                                await _update_step_status_and_progress(
-                                    step_id,
-                                    project_id,
-                                    supabase,
-                                    run_status="paused", 
-                                    last_processed_document_offset=doc_index_overall -1 if prompt_idx == 0 else doc_index_overall, 
-                                    # If it's the first prompt for this doc, offset is previous doc.
-                                    # Otherwise, this doc is partially processed, so current offset.
-                                )
-                                return 
-                        except Exception as e_pause_check_prompt:
-                            print(f"[STREAM_WARN_PAUSE_CHECK_PROMPT] Failed to check pause status before prompt for doc {doc_id}: {e_pause_check_prompt}. Processing continues for this prompt.")
-
-                        print(f"[MYA-91_DEBUG] Current prompt_container: {prompt_container}")
-                        print(f"[MYA-91_DEBUG] accumulated_results_for_this_step_this_doc BEFORE _execute_prompt: {accumulated_results_for_this_step_this_doc}")
-                        # The original 'try:' and subsequent lines follow here
-                        try:
-                            # For legacy prompts (simple strings), we construct a PromptConfig on the fly.
-                            # The _execute_prompt_config_and_get_results helper will handle context and OpenAI call.
-                            # This section handles the old List[str] format for prompts.
-
-                                # REMOVED: if "accumulated_legacy_results" not in locals() or prompt_idx == 0:
-                                # REMOVED:     accumulated_legacy_results = {}
-
-
-                            include_document_context = (
-                                prompt_container
-                                .get("prompt", {})
-                                .get("include_document_context", True) 
-                            )
-                            
-                            # Call the unified helper.
-                            _raw_resp_str, parsed_output_dict = await _execute_prompt_config_and_get_results(
-                                # supabase_client=supabase,
-                                openai_client=openai_client,
-                                # project_id=project_id,
-                                current_step_id=step_id_as_str,
-                                current_doc_id_for_log=doc_id,
-                                doc_content_full=doc_content,
-                                prompt_config=PromptConfig(
-                                    text=prompt_container["prompt"]["text"],
-                                    include_document_context=include_document_context,
-                                ),  # Legacy prompts always include doc
-                                prior_results_in_step=accumulated_results_for_this_step_this_doc, # Use the per-document accumulator
-                                current_doc_custom_analysis_results=current_doc_custom_analysis_results,
-                            )
-                            print(f"[MYA-91_DEBUG] _raw_resp_str from _execute_prompt: {'Non-empty' if _raw_resp_str else 'Empty/None'}")
-                            print(f"[MYA-91_DEBUG] parsed_output_dict from _execute_prompt: {type(parsed_output_dict).__name__} - {str(parsed_output_dict)[:500]}")
-
-
-                            if _raw_resp_str is None or parsed_output_dict is None:
-                                # Error occurred in helper _execute_prompt_config_and_get_results.
-                                # The helper returns Nones, and the calling code (this loop) must handle error state.
-                                error_detail_for_storage = f"LLM call or JSON parsing failed for legacy prompt #{prompt_idx + 1}. Raw: {_raw_resp_str[:200] if _raw_resp_str else 'N/A'}"
-                                current_doc_custom_analysis_results.setdefault(step_id_as_str, {})[f"prompt_{prompt_idx+1}_error"] = error_detail_for_storage
-                                current_doc_custom_analysis_results.setdefault(step_id_as_str, {})["status"] = "error_in_legacy_prompt_execution"
-                                print(f"[STREAM_ERROR_LEGACY_EXEC] {error_detail_for_storage}")
-                                doc_processed_successfully_by_all_prompts = False
-                                break  # Stop processing this document for this step
-
-                            # If successful, parsed_output_dict contains the results of THIS prompt.
-                            # The calling code (this loop) is responsible for merging these results
-                            # into accumulated_legacy_results and current_doc_custom_analysis_results[step_id_as_str].
-                            
-                            if isinstance(parsed_output_dict, dict):
-                                accumulated_results_for_this_step_this_doc.update(parsed_output_dict) # Update the per-document accumulator
-                                current_doc_custom_analysis_results.setdefault(step_id_as_str, {}).update(parsed_output_dict)
-                                print(f"[MYA-91_DEBUG] accumulated_results_for_this_step_this_doc AFTER update (dict): {accumulated_results_for_this_step_this_doc}")
-                                current_doc_custom_analysis_results.setdefault(step_id_as_str, {})["status"] = (
-                                    "partial_success"  # Mark as partial success until all prompts done
-                                )
-                            else:
-                                print(f"[MYA-91_DEBUG] parsed_output_dict was NOT a dict. Type: {type(parsed_output_dict).__name__}. Not updating accumulator.")
-                                # LLM output was not a dictionary, store it separately
-                                non_dict_output_key = f"prompt_{prompt_idx+1}_raw_non_dict_llm_output"
-                                warning_msg = f"[WARN_LEGACY_NON_DICT_OUTPUT] For doc {doc_id}, step {step_id_as_str}, legacy prompt #{prompt_idx + 1}, expected dict from LLM but got {type(parsed_output_dict).__name__}. Storing raw output in '{non_dict_output_key}'."
-                                print(warning_msg)
-                                current_doc_custom_analysis_results.setdefault(step_id_as_str, {})[non_dict_output_key] = str(parsed_output_dict) # Ensure it's a string for JSON
-                                current_doc_custom_analysis_results.setdefault(step_id_as_str, {})["status"] = (
-                                    "partial_success_with_non_dict_output"
-                                )
-                                # Do not update accumulated_results_for_this_step_this_doc as it expects a dict
-
-                            # Update last processed prompt index
-                            current_doc_custom_analysis_results.setdefault(step_id_as_str, {})["last_processed_prompt_index"] = (
-                                prompt_idx
-                            )
+                    outcome = await _run_step_prompts_for_document(
+                        prompts_to_execute=prompts_to_execute,
+                        doc_id=doc_id,
+                        doc_content=doc_content,
+                        step_id_as_str=step_id_as_str,
+                        current_doc_custom_analysis_results=current_doc_custom_analysis_results,
+                        openai_client=openai_client,
+                        run_context=run_context,
+                        run_control=run_control,
+                    )
 
-                            # Persist after each successful sub-prompt or non-dict output within the legacy loop.
-                            try:
-                                await asyncio.to_thread(
-                                    supabase.table("documents")
-                                    .update({"custom_analysis_results": current_doc_custom_analysis_results})
-                                    .eq("id", doc_id)
-                                    .execute
-                                )
-                                print(
-                                    f"[STREAM_SUB_PROMPT_SUCCESS_LEGACY] Doc {doc_id}, Step {step_id_as_str}, Legacy Prompt #{prompt_idx + 1} success, results merged by helper."
-                                )
-                            except Exception as db_update_err_legacy:
-                                error_msg = f"Failed to persist partial results for legacy prompt #{prompt_idx + 1}, doc {doc_id}. DB Error: {db_update_err_legacy}"
-                                print(f"[STREAM_ERROR_DB_UPDATE_LEGACY] {error_msg}")
-                                current_doc_custom_analysis_results[step_id_as_str][
-                                    f"prompt_{prompt_idx+1}_db_error"
-                                ] = error_msg
-                                current_doc_custom_analysis_results[step_id_as_str]["status"] = (
-                                    "failed_db_update_legacy"
-                                )
-                                doc_processed_successfully_by_all_prompts = False
-                                break  # Stop processing this document for this step
-
-                        except Exception as e_sub_prompt:
-                            error_msg = f"Error during sub-prompt #{prompt_idx + 1} for doc {doc_id}, step {step_id_as_str}: {type(e_sub_prompt).__name__} - {str(e_sub_prompt)}"
-                            print(f"[STREAM_ERROR_SUB_PROMPT] {error_msg}")
-                            traceback.print_exc()  # Log the full traceback for the sub-prompt error
-                            current_doc_custom_analysis_results[step_id_as_str][f"prompt_{prompt_idx+1}_error"] = (
-                                error_msg
-                            )
-                            current_doc_custom_analysis_results[step_id_as_str]["status"] = (
-                                "failed_sub_prompt_execution"
-                            )
-                            doc_processed_successfully_by_all_prompts = False
-                            break  # Stop processing this document for this step
+                    if outcome == DOCUMENT_INTERRUPTED:
+                        paused = run_control.stop_reason == PAUSE
+                        print(f"[STREAM_PAUSE_PROMPT_LEVEL] Step {step_id_as_str}: {run_control.stop_reason} requested during doc {doc_id}. Stopping generator.")
+                        current_status_for_finally = "paused" if paused else "cancelled"
+                        paused_progress_payload = ProcessingProgress(
+                            status="paused" if paused else "cancelled",
+                            total=total_docs_for_progress,
+                            processed=processed_count_this_run,
+                            failed=failed_count_this_run,
+                            percent=(
+                                ((processed_count_this_run + failed_count_this_run) / total_docs_for_progress * 100)
+                                if total_docs_for_progress > 0
+                                else 0
+                            ),
+                            currentDocId=doc_id,
+                            currentDocIndex=doc_index_overall,
+                            message=(
+                                "Processing paused by user (before starting next prompt)."
+                                if paused
+                                else "Processing cancelled (before starting next prompt)."
+                            ),
+                        ).model_dump_json(by_alias=True)
+                        yield f"event: progress\ndata: {paused_progress_payload}\n\n"
+                        yield_counter += 1
+                        # This document is not finished, so resume restarts it from its first prompt
+                        write_buffer.put_step(
+                            last_processed_document_offset=doc_index_overall - 1,
+                            last_processed_document_id=last_completed_doc_id,
+                        )
+                        await write_buffer.flush()
+                        return
 
-                    # After iterating through all prompts for the document (or breaking due to an error)
-                    if doc_processed_successfully_by_all_prompts:
+                    run_context.stats.document_finished(doc_started_at)
+                    if outcome == DOCUMENT_SUCCEEDED:
                         processed_count_this_run += 1
-                        current_doc_custom_analysis_results[step_id_as_str]["status"] = "success"
-                        current_doc_custom_analysis_results[step_id_as_str].pop(
-                            "last_processed_prompt_index", None
-                        )  # Clean up temp field
-                        # Final save for the document if all prompts were successful
-                        await asyncio.to_thread(
-                            supabase.table("documents")
-                            .update({"custom_analysis_results": current_doc_custom_analysis_results})
-                            .eq("id", doc_id)
-                            .execute
-                        )
-                        print(f"[STREAM_SUCCESS] Doc {doc_id} fully processed by step {step_id_as_str}.")
                     else:
                         failed_count_this_run += 1
-                        # The error status and details should already be in current_doc_custom_analysis_results[step_id_as_str]
-                        # Final save of error state for the document if any sub-prompt failed
-                        await asyncio.to_thread(
-                            supabase.table("documents")
-                            .update({"custom_analysis_results": current_doc_custom_analysis_results})
-                            .eq("id", doc_id)
-                            .execute
-                        )
-                        print(
-                            f"[STREAM_DOC_FAILED] Doc {doc_id} failed processing for step {step_id_as_str}. Status: {current_doc_custom_analysis_results[step_id_as_str].get('status')}"
-                        )
 
                 except Exception as e_doc_processing_loop:
                     # This is a catch-all for errors within the processing of a single document's prompt sequence
@@ -1863,22 +2602,17 @@ async def _bulk_reprocess_generator(
                     print(f"[STREAM_ERROR_DOC_OUTER_LOOP] {error_msg_doc}")
                     traceback.print_exc()  # Log the full traceback for this unexpected error
 
-                    # Ensure custom_analysis_results reflects this failure state
-                    if step_id_as_str not in current_doc_custom_analysis_results:
-                        current_doc_custom_analysis_results[step_id_as_str] = {}
-                    current_doc_custom_analysis_results[step_id_as_str]["error"] = error_msg_doc
-                    current_doc_custom_analysis_results[step_id_as_str]["status"] = "failed_document_processing_loop"
-                    try:
-                        await asyncio.to_thread(
-                            supabase.table("documents")
-                            .update({"custom_analysis_results": current_doc_custom_analysis_results})
-                            .eq("id", doc_id)
-                            .execute
-                        )
-                    except Exception as db_update_err:
-                        print(
-                            f"[STREAM_ERROR_DB_UPDATE] Failed to update document {doc_id} with outer loop error: {db_update_err}"
-                        )
+                    # One status-bearing result, so "failed" reruns select the document (a later
+                    # put_document would replace it, and a result without status counts as pending)
+                    safe_doc_content_snippet = (
+                        doc_content[:200] if doc_content else "Content not available for snippet."
+                    )
+                    current_doc_custom_analysis_results[step_id_as_str] = failed_result(
+                        "failed_document_processing_loop",
+                        error_msg_doc,
+                        original_content_snippet=safe_doc_content_snippet,
+                    )
+                    write_buffer.put_document(doc_id, current_doc_custom_analysis_results[step_id_as_str])
 
                     # Yield an SSE error event for this specific document
                     _sse_event_name = "error_processing_document"
@@ -1893,7 +2627,7 @@ async def _bulk_reprocess_generator(
                             "step_id": step_id_as_str,
                         }
                     )
-                    sse_doc_error_event_string = f"event: {_sse_event_name}\\ndata: {_sse_data_json}\\n\\n"
+                    sse_doc_error_event_string = f"event: {_sse_event_name}\ndata: {_sse_data_json}\n\n"
                     print(f"[SSE_YIELD_DEBUG] Yielding document processing error: {sse_doc_error_event_string.strip()}")
                     try:
                         yield sse_doc_error_event_string
@@ -1903,33 +2637,16 @@ async def _bulk_reprocess_generator(
                         )
                         traceback.print_exc()
 
-                    safe_doc_content_snippet = (
-                        doc_content[:200] if doc_content else "Content not available for snippet."
-                    )
-                    current_custom_results[step_id_as_str] = {
-                        "error": error_msg_doc,
-                        "original_content_snippet": safe_doc_content_snippet,
-                    }
-                    try:
-                        await asyncio.to_thread(
-                            supabase.table("documents")
-                            .update({"custom_analysis_results": current_custom_results})
-                            .eq("id", doc_id)
-                            .execute
-                        )
-                    except Exception as e_update_err:
-                        print(
-                            f"[STREAM_ERROR_DB_UPDATE] Failed to update doc {doc_id} with error status: {e_update_err}"
-                        )
+                    run_context.stats.document_finished(doc_started_at)
+                    last_completed_doc_id = doc_id
                     continue  # Move to the next document after handling the error for this one
 
-                # Update last_processed_document_offset for "new" or "all" runs for resumability
+                # Checkpoint the last processed document for "new" or "all" runs for resumability
+                last_completed_doc_id = doc_id
                 if reprocess_type == "new" or reprocess_type == "all":
-                    await _update_step_status_and_progress(
-                        step_id,
-                        project_id,
-                        supabase,
+                    write_buffer.put_step(
                         last_processed_document_offset=doc_index_overall,
+                        last_processed_document_id=doc_id,
                     )
 
                 # Send progress update if counts changed significantly (e.g., every doc or every N docs)
@@ -1948,10 +2665,7 @@ async def _bulk_reprocess_generator(
                     # If reprocess_type is "all", we reset it. Otherwise, we might increment.
                     # For MYA-63, let's simplify: processed_count_cache and failed_count_cache in DB reflect *this run*.
                     # They will be finalized at the end.
-                    await _update_step_status_and_progress(
-                        step_id,
-                        project_id,
-                        supabase,
+                    write_buffer.put_step(
                         processed_count_cache=processed_count_this_run,
                         failed_count_cache=failed_count_this_run,
                     )
@@ -1959,7 +2673,6 @@ async def _bulk_reprocess_generator(
                     last_sent_failed_count = failed_count_this_run
                     last_sent_percent = current_percent
 
-            current_batch_offset += BATCH_SIZE  # Move to the next batch
             await asyncio.sleep(0.1)  # Small delay between batches
 
         # Final progress update after loop finishes
@@ -1985,6 +2698,7 @@ async def _bulk_reprocess_generator(
             failed=failed_count_this_run,
             percent=final_percent,
             message=final_message,
+            run_metrics=run_context.metrics_snapshot(),
         )
         yield f"event: progress\ndata: {completed_progress.model_dump_json(by_alias=True)}\n\n"
         current_status_for_finally = "completed_ok" if failed_count_this_run == 0 else "completed_with_errors"
@@ -2033,18 +2747,16 @@ async def _bulk_reprocess_generator(
         yield sse_error_event_string
         current_status_for_finally = "error_unexpected_stream"
     finally:
-        final_db_status = "idle"  # Default to idle
-        if "error" in current_status_for_finally:
-            final_db_status = "error"
-        elif current_status_for_finally == "completed_ok":
-            final_db_status = "idle"  # Or "completed"
-        elif current_status_for_finally == "completed_with_errors":
-            final_db_status = "error"  # Or "completed_with_errors" if we add that status
-        elif current_status_for_finally == "paused":
-            final_db_status = "paused"
-        # If completed_empty, it should be idle.
-        elif current_status_for_finally == "completed_empty":
-            final_db_status = "idle"
+        # Write out whatever is still buffered before the final status (also on errors and shutdown)
+        try:
+            await write_buffer.flush()
+        except Exception as e_flush:
+            print(f"[STREAM_ERROR_DB_UPDATE] Failed to flush buffered writes for step {step_id_as_str}: {e_flush}")
+            traceback.print_exc()
+            if "error" not in current_status_for_finally:
+                current_status_for_finally = "error_db_flush"
+
+        final_db_status = _final_run_status(current_status_for_finally)
 
         print(
             f"[STREAM_FINALLY] Generator for step {step_id_as_str} finishing. Final DB status to set: {final_db_status}. Processed this run: {processed_count_this_run}, Failed this run: {failed_count_this_run}."
@@ -2056,29 +2768,527 @@ async def _bulk_reprocess_generator(
             run_status=final_db_status,
             processed_count_cache=processed_count_this_run,  # Store this run's counts
             failed_count_cache=failed_count_this_run,
+            run_metrics=run_context.metrics_snapshot(),
             # last_processed_document_offset is updated during the run for "new"/"all"
         )
+        await record_run_finish(
+            supabase,
+            run_id,
+            step_id_as_str,
+            run_finish_fields(
+                final_db_status,
+                run_context.stats,
+                processed_count_this_run,
+                failed_count_this_run,
+                total_docs_for_progress,
+                usage_tracker.totals,
+                run_context.metrics_snapshot(),
+            ),
+        )
+        run_controls.release(step_id_as_str, run_control)
         final_message_event_data = {
             "status": final_db_status,
             "message": f"Processing run for step {step_id_as_str} finished with status: {final_db_status}.",
             "processed_this_run": processed_count_this_run,
             "failed_this_run": failed_count_this_run,
             "total_documents_in_scope": total_docs_for_progress,
+            "run_metrics": run_context.metrics_snapshot(),
+            "run_id": run_id,
+            "token_usage": {**usage_tracker.totals.model_dump(), "total_tokens": usage_tracker.totals.total_tokens},
+            "token_budget_exceeded": current_status_for_finally == "budget_exceeded",
         }
         final_status_event_string = f"event: final_status\ndata: {json.dumps(final_message_event_data)}\n\n"
         print(f"[SSE_YIELD_DEBUG] Yielding final_status: {final_status_event_string.strip()}")  # MYA-77 Debug
         yield final_status_event_string
 
 
+def _pipeline_run_key(project_id: str) -> str:
+    """Registry/run-control key of a project's pipeline run (step runs are keyed by step id)."""
+    return f"pipeline:{project_id}"
+
+
+async def _update_project_pipeline_state(
+    project_id: uuid.UUID,
+    supabase: Client,
+    run_status: Optional[str] = None,
+    last_processed_document_id: Optional[str] = None,
+    clear_document_checkpoint: bool = False,
+) -> Optional[str]:
+    """Updates the project's pipeline run state and returns its pipeline_run_status after the update."""
+    payload: Dict[str, Any] = {}
+    if run_status is not None:
+        payload["pipeline_run_status"] = run_status
+    if clear_document_checkpoint:
+        payload["pipeline_last_processed_document_id"] = None
+    elif last_processed_document_id is not None:
+        payload["pipeline_last_processed_document_id"] = last_processed_document_id
+    if not payload:
+        return None
+    try:
+        response = await asyncio.to_thread(
+            supabase.table("projects").update(payload).eq("id", str(project_id)).execute
+        )
+        print(f"[PIPELINE_UPDATE] Project {project_id} pipeline state updated with: {payload}")
+        return response.data[0].get("pipeline_run_status") if response.data else None
+    except Exception as e:
+        print(f"[PIPELINE_UPDATE_ERROR] Failed to update pipeline state of project {project_id}: {e}")
+        traceback.print_exc()
+        return None
+
+
+async def _ensure_pipeline_not_running(supabase: Client, project_id: uuid.UUID) -> None:
+    """Raises 409 while the project's pipeline runs; it processes every document-by-document step."""
+    response = await asyncio.to_thread(
+        supabase.table("projects").select("pipeline_run_status").eq("id", str(project_id)).maybe_single().execute
+    )
+    if response and response.data and response.data.get("pipeline_run_status") == "running":
+        raise HTTPException(
+            status_code=409,
+            detail=f"The pipeline of project {project_id} is running. Wait, pause or cancel it first.",
+        )
+
+
+class _PipelineStep:
+    """One step of a pipeline run: its prompts, per-step run context (usage, writes) and counts."""
+
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        project_id: uuid.UUID,
+        supabase: Client,
+        run_id: str,
+        step_names_by_id: Dict[str, str],
+        run_control: RunControl,
+    ):
+        self.config = config
+        self.step_id = str(config["id"])
+        self.name = config.get("name") or self.step_id
+        self.prompts = _normalize_step_prompts(config)
+        self.pre_filter = PreFilter(**config["pre_filter"]) if config.get("pre_filter") else None
+        self.llm_calls_per_document = count_llm_calls(self.prompts)
+        self.run_context = StepRunContext(
+            step_id=self.step_id,
+            usage_tracker=RunUsageTracker(supabase, str(project_id), self.step_id, run_id=run_id),
+            step_names_by_id=step_names_by_id,
+            model_settings=ModelSettings(**config["model_settings"]) if config.get("model_settings") else None,
+        )
+        self.run_context.usage_tracker.token_budget = config.get("token_budget")
+        self.run_context.fingerprint = step_fingerprint(config)
+        self.processed = 0
+        self.failed = 0
+
+        async def write_step_progress(fields: Dict[str, Any]):
+            # A pause or cancel of any step (e.g. from another worker) stops the whole pipeline
+            run_control.observe_db_status(
+                await _update_step_status_and_progress(config["id"], project_id, supabase, **fields)
+            )
+
+        self.run_context.writes = WriteBehindBuffer(
+            write_documents=lambda results: _write_step_results(
+                supabase, self.step_id, str(project_id), results, self.run_context
+            ),
+            write_step=write_step_progress,
+        )
+
+    @property
+    def writes(self) -> WriteBehindBuffer:
+        return self.run_context.writes
+
+    def summary(self) -> Dict[str, Any]:
+        usage = self.run_context.usage_tracker.totals
+        return {
+            "name": self.name,
+            "processed": self.processed,
+            "failed": self.failed,
+            "run_metrics": self.run_context.metrics_snapshot(),
+            "token_usage": {**usage.model_dump(), "total_tokens": usage.total_tokens},
+        }
+
+
+async def _project_pipeline_generator(
+    project_id: uuid.UUID,
+    reprocess_type: Literal["all", "new"],
+    supabase: Client,
+    openai_client: OpenAI,
+    run_id: Optional[str] = None,
+):
+    """
+    Runs all document-by-document custom steps of a project in one pass over its documents.
+    Steps are ordered by their {{steps.*}} references; each document is downloaded and extracted
+    once and then goes through every step in that order, so later steps see earlier steps'
+    fresh results. The run has one checkpoint (on the project) and one progress stream.
+    """
+    project_id_as_str = str(project_id)
+    run_id = run_id or str(uuid.uuid4())
+    run_key = _pipeline_run_key(project_id_as_str)
+    current_status_for_finally = "running"
+    pipeline_steps: List[_PipelineStep] = []
+    processed_count_this_run = 0  # Documents every step handled without failure
+    failed_count_this_run = 0  # Documents at least one step failed on
+    total_docs_for_progress = 0
+    pending_checkpoint: Dict[str, Any] = {}
+    history_recorded = False  # Whether the steps' step_runs rows were inserted
+
+    async def flush_all():
+        # Results first, then the checkpoint, so the checkpoint never points past unwritten results
+        for pipeline_step in pipeline_steps:
+            await pipeline_step.writes.flush()
+        if pending_checkpoint:
+            fields = dict(pending_checkpoint)
+            pending_checkpoint.clear()
+            run_control.observe_db_status(await _update_project_pipeline_state(project_id, supabase, **fields))
+
+    def progress_event(
+        status: str, message: str, doc_id: Optional[str] = None, doc_index: Optional[int] = None
+    ) -> str:
+        done = processed_count_this_run + failed_count_this_run
+        progress = ProcessingProgress(
+            status=status,
+            total=total_docs_for_progress,
+            processed=processed_count_this_run,
+            failed=failed_count_this_run,
+            percent=(done / total_docs_for_progress * 100) if total_docs_for_progress > 0 else 0,
+            currentDocId=doc_id,
+            currentDocIndex=doc_index,
+            message=message,
+        )
+        return f"event: progress\ndata: {progress.model_dump_json(by_alias=True)}\n\n"
+
+    yield f"event: init\ndata: {json.dumps({'message': 'Pipeline stream initiated for project ' + project_id_as_str, 'project_id': project_id_as_str, 'run_id': run_id})}\n\n"
+
+    # Registered right before the try whose finally releases it: closing the stream at the
+    # init yield cannot leak it
+    run_control = run_controls.register(run_key)
+    try:
+        # Claimed before the steps load: single-step runs check the pipeline status and back off
+        await _update_project_pipeline_state(project_id, supabase, run_status="running")
+        steps_response = await asyncio.to_thread(
+            supabase.table("custom_processing_steps")
+            .select("id, name, description, prompts, token_budget, model_settings, pre_filter, processing_mode")
+            .eq("project_id", project_id_as_str)
+            .order("created_at")
+            .execute
+        )
+        step_configs = steps_response.data or []
+        step_names_by_id = {str(step["id"]): step["name"] for step in step_configs}
+        candidates = [
+            _PipelineStep(config, project_id, supabase, run_id, step_names_by_id, run_control)
+            for config in step_configs
+            if (config.get("processing_mode") or "document_by_document") == "document_by_document"
+        ]
+        candidates = [candidate for candidate in candidates if candidate.prompts]  # Steps without prompts have nothing to run
+        try:
+            ordered = order_steps_by_dependencies(
+                [{"id": candidate.step_id, "name": candidate.name, "prompts": candidate.prompts} for candidate in candidates]
+            )
+        except PipelineCycleError as e_cycle:
+            print(f"[PIPELINE_ERROR] Project {project_id_as_str}: {e_cycle}")
+            yield f"event: error\ndata: {json.dumps({'message': str(e_cycle)})}\n\n"
+            current_status_for_finally = "error_step_cycle"
+            return
+        candidates_by_id = {candidate.step_id: candidate for candidate in candidates}
+        pipeline_steps.extend(candidates_by_id[step["id"]] for step in ordered)
+        # All steps of the pipeline share one scheduling flow, so the pipeline counts as a single run
+        flow = await _load_work_flow(supabase, project_id_as_str, run_key)
+        for pipeline_step in pipeline_steps:
+            pipeline_step.run_context.flow = flow
+
+        if not pipeline_steps:
+            current_status_for_finally = "completed_empty"
+            yield f"event: end_stream\ndata: {json.dumps({'message': 'No document-by-document steps with prompts in this project.'})}\n\n"
+            return
+        print(f"[PIPELINE_SETUP] Project {project_id_as_str} step order: {[step.name for step in pipeline_steps]}")
+
+        for pipeline_step in pipeline_steps:
+            await _update_step_status_and_progress(
+                pipeline_step.step_id,
+                project_id,
+                supabase,
+                run_status="running",
+                last_reprocess_type="pipeline",
+                processed_count_cache=0,
+                failed_count_cache=0,
+            )
+
+        resume_after_id: Optional[str] = None
+        initial_offset = 0
+        if reprocess_type == "new":
+            project_state = await asyncio.to_thread(
+                supabase.table("projects").select("pipeline_last_processed_document_id").eq("id", project_id_as_str).single().execute
+            )
+            resume_after_id = (project_state.data or {}).get("pipeline_last_processed_document_id")
+            if resume_after_id:
+                done_count_response = await asyncio.to_thread(
+                    supabase.table("documents")
+                    .select("id", count="exact")
+                    .eq("project_id", project_id_as_str)
+                    .lte("id", resume_after_id)
+                    .limit(1)
+                    .execute
+                )
+                initial_offset = done_count_response.count or 0
+        await _update_project_pipeline_state(project_id, supabase, clear_document_checkpoint=reprocess_type != "new")
+
+        count_response = await asyncio.to_thread(
+            supabase.table("documents").select("id", count="exact").eq("project_id", project_id_as_str).limit(1).execute
+        )
+        total_docs_for_progress = count_response.count or 0
+        for pipeline_step in pipeline_steps:
+            pipeline_step.writes.put_step(total_documents_cache=total_docs_for_progress)
+            pipeline_step.run_context.stats = RunStats()
+            await record_run_start(
+                supabase,
+                run_start_row(run_id, project_id_as_str, pipeline_step.step_id, "pipeline", total_docs_for_progress),
+            )
+        history_recorded = True
+
+        document_columns = "id, file_name, extracted_text, analysis, created_at, storage_path"
+
+        def fetch_documents_batch(after_id: Optional[str], limit: int) -> List[Dict[str, Any]]:
+            return keyset_page(
+                supabase.table("documents").select(document_columns).eq("project_id", project_id_as_str),
+                after_id,
+                limit,
+            ).execute().data or []
+
+        batch_size = AdaptiveBatchSize(initial=10, maximum=50)
+        batch_cursor = resume_after_id
+        last_completed_doc_id = resume_after_id
+        doc_index_overall = initial_offset - 1
+        has_more_documents = True
+
+        def stop_run(status: str, message: str, doc_id: Optional[str] = None) -> str:
+            nonlocal current_status_for_finally
+            current_status_for_finally = status
+            pending_checkpoint["last_processed_document_id"] = last_completed_doc_id
+            return progress_event(status, message, doc_id=doc_id, doc_index=doc_index_overall)
+
+        while has_more_documents:
+            requested_batch_size = batch_size.size
+            batch_documents = await asyncio.to_thread(fetch_documents_batch, batch_cursor, requested_batch_size)
+            if not batch_documents:
+                break
+            has_more_documents = len(batch_documents) == requested_batch_size
+            batch_cursor = batch_documents[-1]["id"]
+            batch_size.update(batch_documents)
+
+            # Existing results of every step, loaded once per batch and shared by all steps of the pipeline
+            batch_results_by_doc = await asyncio.to_thread(
+                load_results_by_document, supabase, document_ids=[doc["id"] for doc in batch_documents]
+            )
+            skip_reasons_by_step = {
+                pipeline_step.step_id: evaluate_prefilter(pipeline_step.pre_filter, batch_documents)
+                for pipeline_step in pipeline_steps
+                if pipeline_step.pre_filter
+            }
+
+            for doc_data in batch_documents:
+                if any(pipeline_step.writes.due() for pipeline_step in pipeline_steps):
+                    await flush_all()
+                if run_control.stop_requested:
+                    paused = run_control.stop_reason == PAUSE
+                    yield stop_run(
+                        "paused" if paused else "cancelled",
+                        "Pipeline paused by user." if paused else "Pipeline cancelled.",
+                    )
+                    return
+                over_budget = next(
+                    (step for step in pipeline_steps if step.run_context.usage_tracker.budget_exceeded), None
+                )
+                if over_budget is not None:
+                    yield stop_run(
+                        "budget_exceeded",
+                        f"Token budget of step '{over_budget.name}' exceeded. Pipeline stopped; resume with reprocess_type=new.",
+                    )
+                    return
+
+                doc_index_overall += 1
+                doc_id = str(doc_data["id"])
+                doc_file_name = doc_data.get("file_name", "Unknown Filename")
+                doc_results = batch_results_by_doc.get(doc_id, {})
+                text_hash = document_text_hash(doc_data.get("extracted_text"))
+
+                active_steps: List[_PipelineStep] = []
+                for pipeline_step in pipeline_steps:
+                    pipeline_step.run_context.text_hashes[doc_id] = text_hash
+                    skip_reason = skip_reasons_by_step.get(pipeline_step.step_id, {}).get(doc_id)
+                    if not skip_reason:
+                        active_steps.append(pipeline_step)
+                        continue
+                    pipeline_step.processed += 1
+                    pipeline_step.run_context.run_metrics["skipped_by_filter"] += 1
+                    pipeline_step.run_context.run_metrics["llm_calls_saved"] += pipeline_step.llm_calls_per_document
+                    doc_results[pipeline_step.step_id] = {
+                        "status": SKIPPED_BY_FILTER_STATUS,
+                        "skip_reason": skip_reason,
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                    }
+                    pipeline_step.writes.put_document(doc_id, doc_results[pipeline_step.step_id])
+
+                doc_failed = False
+                if active_steps:
+                    yield progress_event(
+                        "running",
+                        f"Doc {doc_index_overall + 1}/{total_docs_for_progress} ({doc_file_name}): "
+                        + " -> ".join(step.name for step in active_steps),
+                        doc_id=doc_id,
+                        doc_index=doc_index_overall,
+                    )
+                    doc_content: Optional[str] = None
+                    try:
+                        doc_content = await _download_and_extract_text(supabase, doc_data)
+                    except Exception as e_extract:
+                        doc_failed = True
+                        error_detail = f"Failed to get content for doc {doc_id} ({doc_file_name}): {type(e_extract).__name__} - {str(e_extract)}"
+                        print(f"[PIPELINE_ERROR_EXTRACT] {error_detail}")
+                        for pipeline_step in active_steps:
+                            pipeline_step.failed += 1
+                            doc_results[pipeline_step.step_id] = {
+                                "error": error_detail,
+                                "status": "failed_extraction",
+                                "timestamp": datetime.now(timezone.utc).isoformat(),
+                            }
+                            pipeline_step.writes.put_document(doc_id, doc_results[pipeline_step.step_id])
+
+                    steps_to_run = active_steps if doc_content is not None else []
+                    for pipeline_step in steps_to_run:
+                        step_started_at = pipeline_step.run_context.stats.now()
+                        try:
+                            outcome = await _run_step_prompts_for_document(
+                                prompts_to_execute=pipeline_step.prompts,
+                                doc_id=doc_id,
+                                doc_content=doc_content,
+                                step_id_as_str=pipeline_step.step_id,
+                                current_doc_custom_analysis_results=doc_results,
+                                openai_client=openai_client,
+                                run_context=pipeline_step.run_context,
+                                run_control=run_control,
+                            )
+                        except Exception as e_step:
+                            print(f"[PIPELINE_ERROR_STEP] Doc {doc_id}, step {pipeline_step.step_id}: {type(e_step).__name__} - {e_step}")
+                            traceback.print_exc()
+                            doc_results[pipeline_step.step_id] = {
+                                "error": f"{type(e_step).__name__} - {e_step}",
+                                "status": "failed_document_processing_loop",
+                            }
+                            pipeline_step.writes.put_document(doc_id, doc_results[pipeline_step.step_id])
+                            outcome = DOCUMENT_FAILED
+                        if outcome != DOCUMENT_INTERRUPTED:
+                            pipeline_step.run_context.stats.document_finished(step_started_at)
+                        if outcome == DOCUMENT_INTERRUPTED:
+                            # The document is redone from its first step on resume
+                            paused = run_control.stop_reason == PAUSE
+                            yield stop_run(
+                                "paused" if paused else "cancelled",
+                                "Pipeline paused by user." if paused else "Pipeline cancelled.",
+                                doc_id=doc_id,
+                            )
+                            return
+                        if outcome == DOCUMENT_SUCCEEDED:
+                            pipeline_step.processed += 1
+                        else:
+                            pipeline_step.failed += 1
+                            doc_failed = True
+
+                if doc_failed:
+                    failed_count_this_run += 1
+                else:
+                    processed_count_this_run += 1
+                last_completed_doc_id = doc_id
+                pending_checkpoint["last_processed_document_id"] = doc_id
+                for pipeline_step in pipeline_steps:
+                    pipeline_step.writes.put_step(
+                        processed_count_cache=pipeline_step.processed, failed_count_cache=pipeline_step.failed
+                    )
+                yield progress_event(
+                    "processing_doc_failed" if doc_failed else "running",
+                    f"Finished doc {doc_index_overall + 1}/{total_docs_for_progress}: {doc_file_name}",
+                    doc_id=doc_id,
+                    doc_index=doc_index_overall,
+                )
+
+        current_status_for_finally = "completed_ok" if failed_count_this_run == 0 else "completed_with_errors"
+        yield progress_event(
+            "completed",
+            f"Pipeline complete. Processed: {processed_count_this_run}, Failed: {failed_count_this_run} of {total_docs_for_progress}.",
+        )
+    except Exception as e_main:
+        error_message = f"An unexpected error occurred during the pipeline run of project {project_id_as_str}: {type(e_main).__name__} - {str(e_main)}"
+        print(f"[PIPELINE_ERROR_UNEXPECTED] {error_message}")
+        traceback.print_exc()
+        yield f"event: error\ndata: {json.dumps({'message': error_message, 'details': str(e_main)})}\n\n"
+        current_status_for_finally = "error_unexpected_stream"
+    finally:
+        try:
+            await flush_all()
+        except Exception as e_flush:
+            print(f"[PIPELINE_ERROR_DB_UPDATE] Failed to flush buffered writes for project {project_id_as_str}: {e_flush}")
+            traceback.print_exc()
+            if "error" not in current_status_for_finally:
+                current_status_for_finally = "error_db_flush"
+
+        final_db_status = _final_run_status(current_status_for_finally)
+        print(f"[PIPELINE_FINALLY] Pipeline of project {project_id_as_str} finishing with status {final_db_status}.")
+        for pipeline_step in pipeline_steps:
+            await _update_step_status_and_progress(
+                pipeline_step.step_id,
+                project_id,
+                supabase,
+                run_status=final_db_status,
+                processed_count_cache=pipeline_step.processed,
+                failed_count_cache=pipeline_step.failed,
+                run_metrics=pipeline_step.run_context.metrics_snapshot(),
+            )
+            if history_recorded:
+                await record_run_finish(
+                    supabase,
+                    run_id,
+                    pipeline_step.step_id,
+                    run_finish_fields(
+                        final_db_status,
+                        pipeline_step.run_context.stats,
+                        pipeline_step.processed,
+                        pipeline_step.failed,
+                        total_docs_for_progress,
+                        pipeline_step.run_context.usage_tracker.totals,
+                        pipeline_step.run_context.metrics_snapshot(),
+                    ),
+                )
+        await _update_project_pipeline_state(project_id, supabase, run_status=final_db_status)
+        run_controls.release(run_key, run_control)
+        final_message_event_data = {
+            "status": final_db_status,
+            "message": f"Pipeline run for project {project_id_as_str} finished with status: {final_db_status}.",
+            "processed_this_run": processed_count_this_run,
+            "failed_this_run": failed_count_this_run,
+            "total_documents_in_scope": total_docs_for_progress,
+            "run_id": run_id,
+            "steps": {pipeline_step.step_id: pipeline_step.summary() for pipeline_step in pipeline_steps},
+            "token_budget_exceeded": current_status_for_finally == "budget_exceeded",
+        }
+        yield f"event: final_status\ndata: {json.dumps(final_message_event_data)}\n\n"
+
+
+def _stream_run_events(run: ManagedRun, last_event_id: Optional[int] = None) -> StreamingResponse:
+    """One SSE subscription to a run, resuming after ``last_event_id`` when the client reconnects."""
+    return StreamingResponse(
+        run.bus.subscribe(last_event_id=last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},  # Don't let proxies buffer the stream
+    )
+
+
 @router.get("/{project_id}/{step_id}/reprocess", tags=["stream"])
 async def legacy_trigger_bulk_basic_reprocessing(
     project_id: uuid.UUID,
     step_id: uuid.UUID,
-    reprocess_type: Literal["all", "new", "failed", "pending"] = Query(
-        "all", description="Type of reprocessing to perform."
+    reprocess_type: Literal["all", "new", "failed", "pending", "stale"] = Query(
+        "all",
+        description="Type of reprocessing to perform. 'stale' re-runs documents whose result came from older prompts or text.",
     ),
     supabase: Client = Depends(get_supabase_client),
     openai_client: OpenAI = Depends(get_openai_client),  # Add OpenAI client dependency
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
 ):
     print(
         f"[ENDPOINT_ENTRY_DEBUG] GET /api/custom-steps/{project_id}/{step_id}/reprocess?reprocess_type={reprocess_type} endpoint hit."
@@ -2086,6 +3296,22 @@ async def legacy_trigger_bulk_basic_reprocessing(
     print(
         f"Received request to reprocess documents for project {project_id}, step {step_id} with type '{reprocess_type}'"
     )
+    last_event_id = parse_last_event_id(last_event_id_header)
+    if last_event_id is not None:
+        # EventSource reconnecting after a dropped connection: resume the run it was following, never start a new one
+        recent_run = run_registry.get_recent(str(step_id))
+        if recent_run is None:
+            print(f"[SSE_ATTACH] Reconnect for step {step_id} after event {last_event_id}, but no run is known.")
+            return Response(status_code=204)  # Tells EventSource to stop reconnecting
+        return _stream_run_events(recent_run, last_event_id)
+
+    active_run = run_registry.get(str(step_id))
+    if active_run is not None:
+        # The step is already running in this process: attach to it instead of starting another run
+        print(f"[SSE_ATTACH] Step {step_id} already has run {active_run.run_id}; attaching a new subscriber.")
+        return _stream_run_events(active_run)
+
+    await _ensure_pipeline_not_running(supabase, project_id)
     # Check if already running for this step
     step_status_resp = await asyncio.to_thread(
         supabase.table("custom_processing_steps")
@@ -2122,10 +3348,38 @@ async def legacy_trigger_bulk_basic_reprocessing(
             detail=f"Step {step_id} is paused. Resume via manage endpoint or set reprocess_type='new'.",
         )
 
-    return StreamingResponse(
-        _bulk_reprocess_generator(project_id, step_id, reprocess_type, supabase, openai_client),
-        media_type="text/event-stream",
+    # The run executes as a server-side task; this response is just one subscriber to its events,
+    # so closing the connection no longer cancels the run.
+    run_id = str(uuid.uuid4())
+    run = run_registry.start(
+        str(step_id),
+        _bulk_reprocess_generator(project_id, step_id, reprocess_type, supabase, openai_client, run_id=run_id),
+        run_id=run_id,
     )
+    return _stream_run_events(run)
+
+
+@router.get("/{project_id}/{step_id}/events", tags=["stream"])
+async def stream_step_run_events(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    last_event_id: Optional[int] = Query(None, description="Resume after this event id (same as the Last-Event-ID header)."),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """Attaches to the events of the step's active run (any number of clients may attach).
+
+    Clients that send ``Last-Event-ID`` get every event they missed replayed first, also for a
+    run that finished moments ago.
+    """
+    header_event_id = parse_last_event_id(last_event_id_header)
+    resume_after = header_event_id if header_event_id is not None else last_event_id
+    run = run_registry.get_recent(str(step_id)) if resume_after is not None else run_registry.get(str(step_id))
+    if run is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Step {step_id} has no active run in this server. Use the progress endpoint for its last known state.",
+        )
+    return _stream_run_events(run, resume_after)
 
 
 @router.get("/{project_id}/{step_id}/progress", response_model=ProcessingProgress)
@@ -2138,7 +3392,7 @@ async def get_step_reprocessing_progress(
         response = await asyncio.to_thread(
             supabase.table("custom_processing_steps")
             .select(
-                "run_status, total_documents_cache, processed_count_cache, failed_count_cache, current_doc_id_cache, last_processed_document_offset"
+                "run_status, total_documents_cache, processed_count_cache, failed_count_cache, current_doc_id_cache, last_processed_document_offset, run_metrics"
             )
             .eq("id", str(step_id))
             .eq("project_id", str(project_id))
@@ -2181,6 +3435,7 @@ async def get_step_reprocessing_progress(
             currentDocId=current_doc_id,
             currentDocIndex=current_doc_index,
             message=f"Current status for step {step_id}: {status}",
+            run_metrics=data.get("run_metrics") or None,
         )
     except HTTPException:
         raise
@@ -2191,7 +3446,7 @@ async def get_step_reprocessing_progress(
 
 
 class StepActionRequest(BaseModel):
-    action: Literal["pause", "resume"]
+    action: Literal["pause", "resume", "cancel"]
 
 
 @router.post("/{project_id}/{step_id}/manage", response_model=StepActionResponse)
@@ -2223,11 +3478,16 @@ async def manage_step_reprocessing(
 
     if action == "pause":
         if current_status == "running":
+            # The stored status is what other workers (and the progress endpoint) see; a run in
+            # this process is signalled directly and stops before its next LLM call.
             await _update_step_status_and_progress(step_id, project_id, supabase, run_status="paused")
+            signalled = run_controls.request(step_id_str, PAUSE)
             return StepActionResponse(
                 step_id=step_id,
                 action="pause_requested",
-                message="Pause request accepted. Processing will halt shortly.",
+                message="Pause request accepted. Processing will halt after the current LLM call."
+                if signalled
+                else "Pause request accepted. Processing will halt shortly.",
             )
         elif current_status == "paused":
             return StepActionResponse(
@@ -2279,4 +3539,496 @@ async def manage_step_reprocessing(
                 message=f"Step status set to running (was {current_status}). Re-initiate reprocessing to start.",
             )
 
+    elif action == "cancel":
+        if current_status in ("running", "paused"):
+            # Pausing keeps the checkpoint for a later "new" run; cancelling just ends the run.
+            await _update_step_status_and_progress(step_id, project_id, supabase, run_status="idle")
+            run_controls.request(step_id_str, CANCEL)
+            return StepActionResponse(
+                step_id=step_id,
+                action="cancel_requested",
+                message="Cancel request accepted. Processing will stop after the current LLM call.",
+            )
+        return StepActionResponse(
+            step_id=step_id,
+            action="cancel_failed",
+            message=f"Step cannot be cancelled. Current status: {current_status}.",
+            details="Only running or paused steps can be cancelled.",
+        )
+
     raise HTTPException(status_code=400, detail="Invalid action.")
+
+
+class PipelineActionRequest(BaseModel):
+    action: Literal["pause", "cancel"]
+
+
+class PipelineActionResponse(BaseModel):
+    project_id: uuid.UUID
+    action: Literal["pause_requested", "cancel_requested", "action_failed"]
+    message: str
+
+
+@router.get("/pipeline/{project_id}/run", tags=["stream"])
+async def run_project_pipeline(
+    project_id: uuid.UUID,
+    reprocess_type: Literal["all", "new"] = Query(
+        "all", description="'all' processes every document; 'new' resumes after the pipeline's checkpoint."
+    ),
+    supabase: Client = Depends(get_supabase_client),
+    openai_client: OpenAI = Depends(get_openai_client),
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID"),
+):
+    """Runs every document-by-document step of the project in one pass per document (SSE progress stream)."""
+    run_key = _pipeline_run_key(str(project_id))
+    last_event_id = parse_last_event_id(last_event_id_header)
+    if last_event_id is not None:
+        recent_run = run_registry.get_recent(run_key)
+        if recent_run is None:
+            return Response(status_code=204)  # Tells EventSource to stop reconnecting
+        return _stream_run_events(recent_run, last_event_id)
+
+    active_run = run_registry.get(run_key)
+    if active_run is not None:
+        return _stream_run_events(active_run)
+
+    await _ensure_pipeline_not_running(supabase, project_id)  # Started by another server process
+    running_steps_response = await asyncio.to_thread(
+        supabase.table("custom_processing_steps")
+        .select("id, name")
+        .eq("project_id", str(project_id))
+        .eq("run_status", "running")
+        .execute
+    )
+    if running_steps_response.data:
+        names = ", ".join(step["name"] for step in running_steps_response.data)
+        raise HTTPException(
+            status_code=409,
+            detail=f"Steps already processing in project {project_id}: {names}. Wait, pause or cancel them first.",
+        )
+
+    run_id = str(uuid.uuid4())
+    run = run_registry.start(
+        run_key,
+        _project_pipeline_generator(project_id, reprocess_type, supabase, openai_client, run_id=run_id),
+        run_id=run_id,
+    )
+    return _stream_run_events(run)
+
+
+@router.post("/pipeline/{project_id}/control", response_model=PipelineActionResponse)
+async def control_project_pipeline(
+    project_id: uuid.UUID,
+    request_data: PipelineActionRequest,
+    supabase: Client = Depends(get_supabase_client),
+):
+    """Pauses (resumable with reprocess_type=new) or cancels the project's pipeline run."""
+    state_response = await asyncio.to_thread(
+        supabase.table("projects").select("pipeline_run_status").eq("id", str(project_id)).single().execute
+    )
+    if not state_response.data:
+        raise HTTPException(status_code=404, detail=f"Project {project_id} not found.")
+    current_status = state_response.data.get("pipeline_run_status")
+    if current_status not in ("running", "paused"):
+        return PipelineActionResponse(
+            project_id=project_id,
+            action="action_failed",
+            message=f"The pipeline is not running. Current status: {current_status}.",
+        )
+
+    run_key = _pipeline_run_key(str(project_id))
+    if request_data.action == "pause":
+        await _update_project_pipeline_state(project_id, supabase, run_status="paused")
+        run_controls.request(run_key, PAUSE)
+        return PipelineActionResponse(
+            project_id=project_id,
+            action="pause_requested",
+            message="Pause request accepted. The pipeline will halt before its next LLM call.",
+        )
+    await _update_project_pipeline_state(project_id, supabase, run_status="idle")
+    run_controls.request(run_key, CANCEL)
+    return PipelineActionResponse(
+        project_id=project_id, action="cancel_requested", message="Cancel request accepted."
+    )
+
+
+# --- Distributed Runs ---
+
+
+def _distributed_run_key(run_id: str, worker_id: str) -> str:
+    return f"distributed:{run_id}:{worker_id}"
+
+
+def _collect_run_document_ids(
+    supabase: Client,
+    project_id: str,
+    step_id: str,
+    reprocess_type: str,
+    fingerprint: Optional[str],
+    page_size: int = 1000,
+) -> List[str]:
+    """Ids of every document a run of ``reprocess_type`` processes, in id order (keyset-paged)."""
+    document_ids: List[str] = []
+    after_id: Optional[str] = None
+    while True:
+        if reprocess_type in REPROCESS_SELECTIONS:
+            page = reprocess_document_ids(
+                supabase, project_id, step_id, reprocess_type, after_id, page_size, fingerprint=fingerprint
+            )
+        else:
+            rows = keyset_page(
+                supabase.table("documents").select("id").eq("project_id", project_id), after_id, page_size
+            ).execute().data or []
+            page = [str(row["id"]) for row in rows]
+        document_ids.extend(page)
+        if len(page) < page_size:
+            return document_ids
+        after_id = page[-1]
+
+
+async def _distributed_worker_generator(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    run_id: str,
+    worker_id: str,
+    supabase: Client,
+    openai_client: OpenAI,
+):
+    """
+    One worker loop of a distributed run: claims batches of the run from the work table until
+    none are left, processes their documents like a regular run and reports the batch counts.
+    Several loops (in this process, other processes or other machines) work on a run at once;
+    they share the step's token budget, checked against the run's usage summed in the database.
+    """
+    step_id_as_str = str(step_id)
+    project_id_as_str = str(project_id)
+    store = SupabaseLeaseStore(supabase, project_id=project_id_as_str, step_id=step_id_as_str)
+    init_event_data = {"message": f"Worker {worker_id} joined run {run_id}", "run_id": run_id}
+    yield f"event: init\ndata: {json.dumps(init_event_data)}\n\n"
+
+    step_response = await asyncio.to_thread(
+        supabase.table("custom_processing_steps")
+        .select("id, name, description, prompts, token_budget, model_settings, pre_filter")
+        .eq("id", step_id_as_str)
+        .eq("project_id", project_id_as_str)
+        .single()
+        .execute
+    )
+    step_config = step_response.data
+    prompts_to_execute = _normalize_step_prompts(step_config)
+    pre_filter = PreFilter(**step_config["pre_filter"]) if step_config.get("pre_filter") else None
+    run_context = StepRunContext(
+        step_id=step_id_as_str,
+        usage_tracker=RunUsageTracker(supabase, project_id_as_str, step_id_as_str, run_id=run_id),
+        model_settings=ModelSettings(**step_config["model_settings"]) if step_config.get("model_settings") else None,
+    )
+    token_budget = step_config.get("token_budget")
+    budget_exceeded = False
+    run_context.fingerprint = step_fingerprint(step_config)
+    run_context.flow = await _load_work_flow(supabase, project_id_as_str, f"distributed:{run_id}")
+
+    async def write_step_progress(fields: Dict[str, Any]):
+        worker_control.observe_db_status(
+            await _update_step_status_and_progress(step_id, project_id, supabase, **fields)
+        )
+
+    run_context.writes = WriteBehindBuffer(
+        write_documents=lambda results: _write_step_results(
+            supabase, step_id_as_str, project_id_as_str, results, run_context
+        ),
+        write_step=write_step_progress,
+    )
+
+    async def process_batch(lease: BatchLease, batch_control: RunControl) -> Tuple[int, int]:
+        nonlocal budget_exceeded
+        processed = failed = 0
+        batch_documents = (
+            await asyncio.to_thread(
+                supabase.table("documents")
+                .select("id, file_name, extracted_text, analysis, storage_path")
+                .in_("id", lease.document_ids)
+                .order("id")
+                .execute
+            )
+        ).data or []
+        results_by_doc = await asyncio.to_thread(load_results_by_document, supabase, document_ids=lease.document_ids)
+        skip_reasons = evaluate_prefilter(pre_filter, batch_documents) if pre_filter else {}
+        for doc_data in batch_documents:
+            if token_budget is not None and not budget_exceeded:
+                run_usage = await asyncio.to_thread(load_run_usage, supabase, step_id_as_str, run_id)
+                if run_usage.total_tokens >= token_budget:
+                    # Stops every worker of the run in turn; the unfinished batches stay claimable
+                    print(
+                        f"[DISTRIBUTED_BUDGET] Run {run_id}: token budget of {token_budget} exceeded "
+                        f"({run_usage.total_tokens} tokens used). Worker {worker_id} stopping."
+                    )
+                    budget_exceeded = True
+                    worker_control.request_pause()
+            if batch_control.stop_requested or worker_control.stop_requested:
+                batch_control.request_cancel()
+                break
+            doc_id = str(doc_data["id"])
+            doc_results = results_by_doc.get(doc_id, {})
+            run_context.text_hashes[doc_id] = document_text_hash(doc_data.get("extracted_text"))
+            if skip_reasons.get(doc_id):
+                processed += 1
+                run_context.run_metrics["skipped_by_filter"] += 1
+                run_context.run_metrics["llm_calls_saved"] += count_llm_calls(prompts_to_execute)
+                run_context.writes.put_document(
+                    doc_id,
+                    {
+                        "status": SKIPPED_BY_FILTER_STATUS,
+                        "skip_reason": skip_reasons[doc_id],
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                    },
+                )
+                continue
+            doc_started_at = run_context.stats.now()
+            try:
+                doc_content = await _download_and_extract_text(supabase, doc_data)
+            except Exception as e_extract:
+                failed += 1
+                run_context.writes.put_document(
+                    doc_id,
+                    {
+                        "error": f"Failed to get content for doc {doc_id}: {type(e_extract).__name__} - {e_extract}",
+                        "status": "failed_extraction",
+                        "timestamp": datetime.now(timezone.utc).isoformat(),
+                    },
+                )
+                run_context.stats.document_finished(doc_started_at)
+                continue
+            # Lease loss and worker stops both interrupt the document via the batch's control
+            outcome = await _run_step_prompts_for_document(
+                prompts_to_execute=prompts_to_execute,
+                doc_id=doc_id,
+                doc_content=doc_content,
+                step_id_as_str=step_id_as_str,
+                current_doc_custom_analysis_results=doc_results,
+                openai_client=openai_client,
+                run_context=run_context,
+                run_control=batch_control,
+            )
+            if outcome == DOCUMENT_INTERRUPTED:
+                break
+            run_context.stats.document_finished(doc_started_at)
+            if outcome == DOCUMENT_SUCCEEDED:
+                processed += 1
+            else:
+                failed += 1
+        # Results are written before the batch is marked done, so a done batch never loses results
+        await run_context.writes.flush()
+        return processed, failed
+
+    totals: Dict[str, int] = {}
+    # Registered right before the try whose finally releases it, so a failed step fetch cannot leak it
+    worker_control = run_controls.register(_distributed_run_key(run_id, worker_id))
+    try:
+        totals = await run_worker(store, run_id, process_batch, worker_id=worker_id, stop=worker_control)
+    except Exception as e_worker:
+        print(f"[DISTRIBUTED_ERROR] Worker {worker_id} of run {run_id} stopped: {type(e_worker).__name__} - {e_worker}")
+        traceback.print_exc()
+        yield f"event: error\ndata: {json.dumps({'message': str(e_worker)})}\n\n"
+    finally:
+        run_controls.release(_distributed_run_key(run_id, worker_id), worker_control)
+        progress = await asyncio.to_thread(store.progress, run_id)
+        # Any worker may be the last one; the final step status is the same whichever writes it
+        step_fields: Dict[str, Any] = {
+            "processed_count_cache": progress["processed"],
+            "failed_count_cache": progress["failed"],
+            "run_metrics": run_context.metrics_snapshot(),
+        }
+        if budget_exceeded:
+            step_fields["run_status"] = "budget_exceeded"
+        elif progress["finished"] and not worker_control.stop_requested:
+            step_fields["run_status"] = "completed_ok" if progress["failed"] == 0 else "completed_with_errors"
+        await _update_step_status_and_progress(step_id, project_id, supabase, **step_fields)
+        if "run_status" in step_fields:
+            # Counts and tokens cover the whole run; timings are those of the worker that ended it
+            await record_run_finish(
+                supabase,
+                run_id,
+                step_id_as_str,
+                run_finish_fields(
+                    step_fields["run_status"],
+                    run_context.stats,
+                    progress["processed"],
+                    progress["failed"],
+                    progress["total_documents"],
+                    await asyncio.to_thread(load_run_usage, supabase, step_id_as_str, run_id),
+                    run_context.metrics_snapshot(),
+                ),
+            )
+        final_event_data = {
+            "run_id": run_id,
+            "worker_id": worker_id,
+            "worker_totals": totals,
+            "run_progress": progress,
+            "token_budget_exceeded": budget_exceeded,
+        }
+        yield f"event: final_status\ndata: {json.dumps(final_event_data)}\n\n"
+
+
+class DistributedRunRequest(BaseModel):
+    reprocess_type: Literal["all", "failed", "pending", "stale"] = "all"
+    batch_size: int = Field(25, ge=1, le=500, description="Documents per claimable batch.")
+    local_workers: int = Field(
+        1, ge=0, le=16, description="Worker loops to start on this server right away (0 to only plan the run)."
+    )
+
+
+class DistributedRunResponse(BaseModel):
+    run_id: str
+    total_documents: int
+    batches: int
+    workers_started: List[str] = Field(default_factory=list)
+
+
+class DistributedWorkersRequest(BaseModel):
+    workers: int = Field(1, ge=1, le=16, description="Worker loops to start on the server handling this request.")
+
+
+class DistributedRunProgress(BaseModel):
+    run_id: str
+    batches_total: int
+    batches_pending: int
+    batches_leased: int
+    batches_done: int
+    batches_failed: int
+    total_documents: int
+    processed: int
+    failed: int
+    percent: float
+    active_workers: List[str] = Field(default_factory=list, description="Workers currently holding a lease.")
+    finished: bool
+
+
+def _start_distributed_workers(
+    project_id: uuid.UUID, step_id: uuid.UUID, run_id: str, count: int, supabase: Client, openai_client: OpenAI
+) -> List[str]:
+    worker_ids = []
+    for _ in range(count):
+        worker_id = new_worker_id()
+        run_registry.start(
+            _distributed_run_key(run_id, worker_id),
+            _distributed_worker_generator(project_id, step_id, run_id, worker_id, supabase, openai_client),
+            run_id=run_id,
+        )
+        worker_ids.append(worker_id)
+    return worker_ids
+
+
+@router.post("/{project_id}/{step_id}/distributed-runs", response_model=DistributedRunResponse)
+async def create_distributed_run(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    request_data: DistributedRunRequest,
+    supabase: Client = Depends(get_supabase_client),
+    openai_client: OpenAI = Depends(get_openai_client),
+):
+    """
+    Splits a step run into batches of documents in the work table, so that worker loops on any
+    number of processes and machines can share it. More workers join with the workers endpoint.
+    """
+    step_response = await asyncio.to_thread(
+        supabase.table("custom_processing_steps")
+        .select("id, description, prompts, model_settings, pre_filter, run_status")
+        .eq("id", str(step_id))
+        .eq("project_id", str(project_id))
+        .maybe_single()
+        .execute
+    )
+    if not step_response or not step_response.data:
+        raise HTTPException(status_code=404, detail=f"Custom step {step_id} not found in project {project_id}.")
+    if step_response.data.get("run_status") == "running":
+        raise HTTPException(status_code=409, detail=f"Step {step_id} is already processing.")
+    await _ensure_pipeline_not_running(supabase, project_id)
+
+    document_ids = await asyncio.to_thread(
+        _collect_run_document_ids,
+        supabase,
+        str(project_id),
+        str(step_id),
+        request_data.reprocess_type,
+        step_fingerprint(step_response.data),
+    )
+    run_id = str(uuid.uuid4())
+    batches = plan_batches(document_ids, request_data.batch_size)
+    await asyncio.to_thread(
+        SupabaseLeaseStore(supabase).create_batches, run_id, str(project_id), str(step_id), batches
+    )
+    run_status = "running" if batches else "completed_empty"
+    await _update_step_status_and_progress(
+        step_id,
+        project_id,
+        supabase,
+        run_status=run_status,
+        last_reprocess_type=request_data.reprocess_type,
+        processed_count_cache=0,
+        failed_count_cache=0,
+        total_documents_cache=len(document_ids),
+    )
+    await record_run_start(
+        supabase, run_start_row(run_id, str(project_id), str(step_id), request_data.reprocess_type, len(document_ids))
+    )
+    if not batches:
+        await record_run_finish(
+            supabase, run_id, str(step_id), run_finish_fields(run_status, RunStats(), 0, 0, 0, TokenUsage())
+        )
+    workers = (
+        _start_distributed_workers(project_id, step_id, run_id, request_data.local_workers, supabase, openai_client)
+        if batches
+        else []
+    )
+    print(f"[DISTRIBUTED] Run {run_id} of step {step_id}: {len(document_ids)} documents in {len(batches)} batches.")
+    return DistributedRunResponse(
+        run_id=run_id, total_documents=len(document_ids), batches=len(batches), workers_started=workers
+    )
+
+
+@router.post("/{project_id}/{step_id}/distributed-runs/{run_id}/workers", response_model=DistributedRunResponse)
+async def join_distributed_run(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    run_id: uuid.UUID,
+    request_data: DistributedWorkersRequest,
+    supabase: Client = Depends(get_supabase_client),
+    openai_client: OpenAI = Depends(get_openai_client),
+):
+    """Starts more worker loops for a distributed run on the server (process) that handles this request."""
+    store = SupabaseLeaseStore(supabase, project_id=str(project_id), step_id=str(step_id))
+    progress = await asyncio.to_thread(store.progress, str(run_id))
+    if not progress["batches_total"]:
+        raise HTTPException(status_code=404, detail=f"Distributed run {run_id} of step {step_id} not found.")
+    workers = []
+    if not progress["finished"]:
+        workers = _start_distributed_workers(
+            project_id, step_id, str(run_id), request_data.workers, supabase, openai_client
+        )
+    return DistributedRunResponse(
+        run_id=str(run_id),
+        total_documents=progress["total_documents"],
+        batches=progress["batches_total"],
+        workers_started=workers,
+    )
+
+
+@router.get("/{project_id}/{step_id}/distributed-runs/{run_id}", response_model=DistributedRunProgress)
+async def get_distributed_run_progress(
+    project_id: uuid.UUID,
+    step_id: uuid.UUID,
+    run_id: uuid.UUID,
+    supabase: Client = Depends(get_supabase_client),
+):
+    """Progress of a distributed run, summed over the batches of all its workers."""
+    store = SupabaseLeaseStore(supabase, project_id=str(project_id), step_id=str(step_id))
+    progress = await asyncio.to_thread(store.progress, str(run_id))
+    if not progress["batches_total"]:
+        raise HTTPException(status_code=404, detail=f"Distributed run {run_id} of step {step_id} not found.")
+    return DistributedRunProgress(run_id=str(run_id), **progress)
+
+
+@router.get("/scheduler/status")
+async def get_llm_scheduler_status():
+    """Concurrency limit, active LLM calls and queued work per run of this server's fair-share scheduler."""
+    return llm_scheduler.snapshot()
@@ -16,6 +16,10 @@ from docx import Document # Added for DOCX processing
 import asyncio
 from pydantic import BaseModel, Field
 
+from app.libs.llm_settings import DEFAULT_MODEL, DEFAULT_TEMPERATURE
+from app.libs.step_results import load_results_by_document
+from app.libs.llm_usage import TokenUsage, record_llm_usage, usage_row
+
 # --- Model Definitions ---
 
 # --- Model for PDF Processing Request ---
@@ -274,7 +278,8 @@ async def _run_pdf_processing_task(
             openai_client=openai_client,
             document_id=document_id,
             storage_path=storage_path, # Still needed by helper in case of re-run without text
-            extracted_text=extracted_text # Pass the extracted text
+            extracted_text=extracted_text, # Pass the extracted text
+            project_id=project_id
         )
 
         # --- 3. Update Document Record with analysis and status ---
@@ -420,7 +425,8 @@ async def _perform_basic_analysis(
     openai_client: OpenAI,
     document_id: uuid.UUID,
     storage_path: str,
-    extracted_text: Optional[str] = None
+    extracted_text: Optional[str] = None,
+    project_id: Optional[uuid.UUID] = None # Only used to attribute token usage
 ) -> Dict[str, Any]:
     """
     Performs the initial LLM analysis using provided or extracted text.
@@ -524,14 +530,21 @@ Respond ONLY with the valid JSON object. Do not include explanations or markdown
 """
 
         completion = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
+            model=DEFAULT_MODEL,
             messages=[
                 {"role": "system", "content": "You are an AI assistant performing initial analysis on policy documents. Respond ONLY with valid JSON."},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.2,
+            temperature=DEFAULT_TEMPERATURE,
             response_format={"type": "json_object"}
         )
+        await record_llm_usage(supabase, usage_row(
+            TokenUsage.from_completion(completion),
+            model=DEFAULT_MODEL,
+            call_type="basic_analysis",
+            project_id=str(project_id) if project_id else None,
+            document_id=str(document_id),
+        ))
         llm_response_content = completion.choices[0].message.content
 
         # Parse LLM Response
@@ -946,7 +959,8 @@ async def _run_bulk_basic_reprocessing_task(document_ids: List[uuid.UUID], supab
                 openai_client=openai_client, 
                 document_id=doc_id, 
                 storage_path=storage_key or storage_path_supabase, # Pass the Supabase storage path used for download
-                extracted_text=extracted_text
+                extracted_text=extracted_text,
+                project_id=project_uuid
             )
             
             # 3. Update the document with the new analysis and processed_at timestamp
@@ -1006,13 +1020,17 @@ async def get_document_details(
              print(f"[WARN] Document {document_id}: Analysis data exists but is not a dictionary: {type(analysis_data)}")
 
         # 3. Prepare response
-        #    custom_analysis_results is already included in document_data from the SELECT *
+        #    Custom step results are stored per step in document_step_results
+        step_results_by_document = await asyncio.to_thread(
+            load_results_by_document, supabase, document_ids=[str(document_id)]
+        )
+        document_data["custom_analysis_results"] = step_results_by_document.get(str(document_id)) or None
 
         # 4. Return combined response
         return DocumentDetailsResponse(
             **document_data, # Unpack main document data
             # analysis=validated_analysis, # REMOVED - Already included in **document_data
-            # custom_analysis_results is already included via **document_data
+            # custom_analysis_results is included via **document_data
         )
             
     except APIError as e:
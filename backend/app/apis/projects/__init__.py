@@ -3,7 +3,7 @@ import uuid
 from fastapi import APIRouter, Depends, HTTPException, Path
 from supabase.client import Client
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any # Added Dict, Any
+from typing import Iterator, List, Optional, Dict, Any, Tuple # Added Dict, Any
 from datetime import datetime
 from postgrest.exceptions import APIError # ADDED
 
@@ -11,9 +11,12 @@ from postgrest.exceptions import APIError # ADDED
 # from app.dependencies import get_supabase_client 
 # For now, let's assume it's in this file or accessible
 from app.apis.documents.__init__ import get_supabase_client # Temporary, move to a central spot
+from app.libs.keyset_pagination import iter_keyset_rows
+from app.libs.step_results import load_results_by_document
 
 # Imports for CSV Export
 from fastapi.responses import StreamingResponse
+import asyncio
 import io
 import csv
 import json
@@ -56,6 +59,105 @@ def flatten_json(data: Any, parent_key: str = '', sep: str = '_') -> Dict[str, A
     return items
 
 
+# --- CSV export helpers ---
+EXPORT_PAGE_SIZE = 200  # Documents per page; also the size of one custom-results lookup
+# First cell of the row that ends an export cut short by an error (the headers were already sent)
+EXPORT_ERROR_MARKER = "#EXPORT_ERROR"
+
+
+def _iter_export_documents(supabase: Client, project_id: uuid.UUID) -> Iterator[Dict[str, Any]]:
+    """Yields the project's documents in id order with their custom step results attached."""
+    page: List[Dict[str, Any]] = []
+
+    def with_results(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Custom step results live in document_step_results; attach them in the old {step_id: result} shape
+        results_by_document = load_results_by_document(supabase, document_ids=[str(doc["id"]) for doc in docs])
+        for doc in docs:
+            doc["custom_analysis_results"] = results_by_document.get(str(doc.get("id")), {})
+        return docs
+
+    documents = iter_keyset_rows(
+        lambda: supabase.table("documents")
+        .select("id, file_name, created_at, status, analysis, project_id")
+        .eq("project_id", str(project_id)),
+        page_size=EXPORT_PAGE_SIZE,
+    )
+    for doc in documents:
+        page.append(doc)
+        if len(page) == EXPORT_PAGE_SIZE:
+            yield from with_results(page)
+            page = []
+    if page:
+        yield from with_results(page)
+
+
+def _flatten_export_document(
+    doc: Dict[str, Any], step_names_map: Dict[str, str]
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Flattened 'analysis' columns and flattened custom step result columns of one document."""
+    flat_analysis: Dict[str, Any] = {}
+    if doc.get("analysis") and isinstance(doc["analysis"], dict):
+        flat_analysis = flatten_json(doc["analysis"], parent_key="analysis")  # Prefix with 'analysis'
+
+    flat_custom: Dict[str, Any] = {}
+    if doc.get("custom_analysis_results") and isinstance(doc["custom_analysis_results"], dict):
+        for step_id, step_data in doc["custom_analysis_results"].items():
+            step_name = step_names_map.get(str(step_id), str(step_id))  # Use name if available, else ID
+            # Sanitize step_name to be a valid part of a header
+            safe_step_name = "".join(c if c.isalnum() else '_' for c in step_name)
+            if isinstance(step_data, dict):
+                flat_custom.update(flatten_json(step_data, parent_key=safe_step_name))
+            elif step_data is not None:  # Store scalar value directly under sanitized step name
+                flat_custom[safe_step_name] = step_data
+    return flat_analysis, flat_custom
+
+
+def _csv_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):  # Fallback for any unflattened complex types
+        return json.dumps(value)
+    return str(value)
+
+
+def _csv_export_chunks(
+    supabase: Client, project_id: uuid.UUID, headers: List[str], step_names_map: Dict[str, str]
+) -> Iterator[str]:
+    """CSV text of the header row and every document row, one chunk per page of documents.
+
+    An error while streaming cannot change the response status any more, so the export ends
+    with an ``EXPORT_ERROR_MARKER`` row saying where and why it stopped.
+    """
+    string_io = io.StringIO()
+    writer = csv.writer(string_io)
+    writer.writerow(headers)
+    written = 0
+    try:
+        for doc in _iter_export_documents(supabase, project_id):
+            row_data = {
+                "document_id": str(doc.get("id", "")),
+                "document_file_name": doc.get("file_name", ""),
+                "created_at": str(doc.get("created_at", "")),
+                "status": doc.get("status", ""),
+            }
+            flat_analysis, flat_custom = _flatten_export_document(doc, step_names_map)
+            row_data.update(flat_analysis)
+            row_data.update(flat_custom)
+            writer.writerow([_csv_value(row_data.get(header)) for header in headers])
+            written += 1
+            if written % EXPORT_PAGE_SIZE == 0:
+                yield string_io.getvalue()
+                string_io.seek(0)
+                string_io.truncate()
+    except Exception as e_rows:
+        print(f"Error streaming CSV rows for project {project_id} after {written} documents: {e_rows}")
+        traceback.print_exc()
+        message = f"Export incomplete: stopped after {written} documents ({type(e_rows).__name__}: {e_rows})"
+        writer.writerow([EXPORT_ERROR_MARKER, message] + [""] * (len(headers) - 2))
+    yield string_io.getvalue()
+    string_io.close()
+
+
 # --- Pydantic Models for Projects ---
 class ProjectBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=255, description="The name of the project.")
@@ -92,7 +194,12 @@ async def export_project_to_csv(
     project_id: uuid.UUID = Path(..., description="The ID of the project to export"),
     supabase: Client = Depends(get_supabase_client)
 ):
-    """Generates and streams a CSV file of documents for the given project."""
+    """Generates and streams a CSV file of documents for the given project.
+
+    The documents are walked twice with a keyset cursor, one page at a time: the first pass
+    collects the CSV headers, the second writes the rows as the response streams, so memory
+    stays bounded by the page size whatever the size of the project.
+    """
     try:
         # 0. Fetch custom processing step names
         step_names_map = {}
@@ -106,103 +213,20 @@ async def export_project_to_csv(
             print(f"Could not fetch custom processing step names: {e_steps}")
             # Decide if this is critical; for now, we'll proceed, and headers will use IDs if map is empty
 
-        # 1. Fetch project documents, now including the 'analysis' field
-        docs_response = (
-            supabase.table("documents")
-            .select("id, file_name, created_at, status, custom_analysis_results, analysis, project_id") # Added 'analysis'
-            .eq("project_id", str(project_id))
-            .execute()
-        )
+        # 1. First pass: collect every analysis and custom result key across the project's documents
+        def collect_headers() -> List[str]:
+            standard_headers = ["document_id", "document_file_name", "created_at", "status"]
+            analysis_field_keys = set()
+            custom_results_field_keys = set()
+            for doc in _iter_export_documents(supabase, project_id):
+                flat_analysis, flat_custom = _flatten_export_document(doc, step_names_map)
+                analysis_field_keys.update(flat_analysis.keys())
+                custom_results_field_keys.update(flat_custom.keys())
+            return standard_headers + sorted(analysis_field_keys) + sorted(custom_results_field_keys)
 
-        if hasattr(docs_response, 'error') and docs_response.error:
-            error_message = docs_response.error.message if hasattr(docs_response.error, 'message') else str(docs_response.error)
-            print(f"Supabase error fetching documents for project {project_id}: {error_message}")
-            raise HTTPException(status_code=500, detail=f"Supabase error fetching documents: {error_message}")
-        
-        documents = docs_response.data
-
-        # 2. Determine CSV Headers
-        standard_headers = ["document_id", "document_file_name", "created_at", "status"]
-        # Dynamically collect all possible keys from analysis and custom_analysis_results
-        analysis_field_keys = set()
-        custom_results_field_keys = set()
-
-        if documents:
-            for doc in documents:
-                # Process 'analysis' field
-                if doc.get("analysis") and isinstance(doc["analysis"], dict):
-                    flat_analysis = flatten_json(doc["analysis"], parent_key="analysis") # Prefix with 'analysis'
-                    analysis_field_keys.update(flat_analysis.keys())
-                
-                # Process 'custom_analysis_results' field
-                if doc.get("custom_analysis_results") and isinstance(doc["custom_analysis_results"], dict):
-                    for step_id, step_data in doc["custom_analysis_results"].items():
-                        step_name = step_names_map.get(step_id, step_id) # Use name if available, else ID
-                        # Sanitize step_name to be a valid part of a header
-                        safe_step_name = "".join(c if c.isalnum() else '_' for c in step_name)
-                        if isinstance(step_data, dict):
-                            flat_custom_step = flatten_json(step_data, parent_key=safe_step_name)
-                            custom_results_field_keys.update(flat_custom_step.keys())
-                        elif step_data is not None: # Handle cases where step_data might be a scalar
-                            custom_results_field_keys.add(safe_step_name) # Add the step name itself as a key
-        
-        # Combine and sort headers
-        sorted_analysis_keys = sorted(list(analysis_field_keys))
-        sorted_custom_results_keys = sorted(list(custom_results_field_keys))
-        
-        all_headers = standard_headers + sorted_analysis_keys + sorted_custom_results_keys
-
-        # 3. Prepare CSV Data in-memory
-        string_io = io.StringIO()
-        writer = csv.writer(string_io)
-        writer.writerow(all_headers)
-
-        if documents:
-            for doc in documents:
-                # Prepare data for the current row based on all_headers
-                row_data = {}
-
-                # Standard fields
-                row_data["document_id"] = str(doc.get("id", ""))
-                row_data["document_file_name"] = doc.get("file_name", "")
-                row_data["created_at"] = str(doc.get("created_at", ""))
-                row_data["status"] = doc.get("status", "")
-
-                # Flattened 'analysis' field
-                doc_analysis = doc.get("analysis")
-                if doc_analysis and isinstance(doc_analysis, dict):
-                    flat_analysis_data = flatten_json(doc_analysis, parent_key="analysis")
-                    row_data.update(flat_analysis_data)
-                
-                # Flattened 'custom_analysis_results' field
-                doc_custom_results = doc.get("custom_analysis_results")
-                if doc_custom_results and isinstance(doc_custom_results, dict):
-                    for step_id, step_data in doc_custom_results.items():
-                        step_name = step_names_map.get(str(step_id), str(step_id)) # Ensure step_id is string for map lookup
-                        safe_step_name = "".join(c if c.isalnum() else '_' for c in step_name)
-                        
-                        if isinstance(step_data, dict):
-                            flat_custom_data = flatten_json(step_data, parent_key=safe_step_name)
-                            row_data.update(flat_custom_data)
-                        elif step_data is not None:
-                            row_data[safe_step_name] = step_data # Store scalar value directly under sanitized step name
-                
-                # Construct the row in the order of all_headers
-                current_row_values = []
-                for header in all_headers:
-                    value = row_data.get(header)
-                    # Ensure consistent string representation, especially for None or complex types not fully flattened (shouldn't happen with current flatten_json)
-                    if value is None:
-                        current_row_values.append("")
-                    elif isinstance(value, (dict, list)): # Fallback for any unflattened complex types
-                        current_row_values.append(json.dumps(value))
-                    else:
-                        current_row_values.append(str(value))
-                writer.writerow(current_row_values)
-        
-        
-        # 4. Return CSV Response
-        string_io.seek(0)
+        all_headers = await asyncio.to_thread(collect_headers)
+
+        # 2. Return CSV Response; the second pass writes the rows while it streams
         project_name_cleaned = str(project_id) 
         try:
             project_info_resp = supabase.table("projects").select("name").eq("id", str(project_id)).single().execute()
@@ -215,11 +239,8 @@ async def export_project_to_csv(
             
         filename = f"{project_name_cleaned}_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
 
-        response_content = string_io.getvalue()
-        string_io.close()
-
         return StreamingResponse(
-            iter([response_content]),
+            _csv_export_chunks(supabase, project_id, all_headers, step_names_map),
             media_type="text/csv",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
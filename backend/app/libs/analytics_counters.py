@@ -0,0 +1,81 @@
+# src/app/libs/analytics_counters.py
+"""Reads of the incrementally maintained analytics counters.
+
+Database triggers keep ``project_analytics_counts`` (processed documents per project,
+sentiment and complexity) and ``project_topic_counts`` (their topics, per the same keys)
+up to date with every write to ``documents`` and ``document_topics``. A summary without a
+topic filter is therefore a read of a few counter rows plus one grouped topic query, no
+matter how many documents the project has. ``rebuild_analytics_counts`` recomputes the
+counters from the source tables if they ever drift.
+
+``project_analytics_versions`` holds a per-project data version bumped by the same writes;
+``load_data_version`` reads it so cached summaries can be checked against the database.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+ANALYTICS_COUNTS_TABLE = "project_analytics_counts"
+TOPIC_COUNTS_TABLE = "project_topic_counts"
+
+
+def summarize_counter_rows(count_rows: List[Dict[str, Any]]) -> Tuple[int, Dict[str, int], Dict[str, int]]:
+    """Total documents and the sentiment and complexity distributions from ``project_analytics_counts`` rows."""
+    sentiment_distribution: Counter = Counter()
+    complexity_distribution: Counter = Counter()
+    for row in count_rows:
+        count = row.get("document_count") or 0
+        if count <= 0:
+            continue
+        sentiment_distribution[row["sentiment"]] += count
+        complexity_distribution[row["complexity"]] += count
+    return sum(sentiment_distribution.values()), dict(sentiment_distribution), dict(complexity_distribution)
+
+
+def load_counter_summary(
+    supabase: Any,
+    project_id: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    complexity: Optional[str] = None,
+    top_n: int = 10,
+) -> Dict[str, Any]:
+    """Summary of processed documents from the counters: totals, distributions and top topics.
+
+    ``sentiment`` and ``complexity`` must already be normalized like the counter keys
+    (lower-cased sentiment, trimmed complexity level).
+    """
+    query = supabase.table(ANALYTICS_COUNTS_TABLE).select("sentiment, complexity, document_count")
+    if project_id is not None:
+        query = query.eq("project_id", project_id)
+    if sentiment is not None:
+        query = query.eq("sentiment", sentiment)
+    if complexity is not None:
+        query = query.eq("complexity", complexity)
+    total, sentiment_distribution, complexity_distribution = summarize_counter_rows(query.execute().data or [])
+
+    topic_rows = supabase.rpc(
+        "analytics_counter_top_topics",
+        {"p_project_id": project_id, "p_sentiment": sentiment, "p_complexity": complexity, "p_limit": top_n},
+    ).execute().data or []
+    return {
+        "total_documents": total,
+        "sentiment_distribution": sentiment_distribution,
+        "complexity_distribution": complexity_distribution,
+        "top_topics": [(row["topic"], row["topic_count"]) for row in topic_rows],
+    }
+
+
+def rebuild_counters(supabase: Any, project_id: Optional[str] = None) -> int:
+    """Recomputes the counters of one project (or all); returns the number of processed documents counted."""
+    data = supabase.rpc("rebuild_analytics_counts", {"p_project_id": project_id}).execute().data
+    return int(data or 0)
+
+
+def load_data_version(supabase: Any, project_id: Optional[str] = None) -> int:
+    """Current analytics data version of one project, or of all projects when ``project_id`` is None."""
+    data = supabase.rpc("analytics_data_version", {"p_project_id": project_id}).execute().data
+    return int(data or 0)
+
+
+def invalidate_summaries(supabase: Any, project_id: Optional[str] = None) -> None:
+    """Bumps the data version so every worker drops its cached summaries of the project (or all)."""
+    supabase.rpc("invalidate_analytics_summaries", {"p_project_id": project_id}).execute()
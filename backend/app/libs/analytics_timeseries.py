@@ -0,0 +1,68 @@
+# src/app/libs/analytics_timeseries.py
+"""Reads of the daily analytics rollups behind the trends view.
+
+Database triggers keep ``project_analytics_daily`` (processed documents per project, date
+basis, day, sentiment and complexity) and ``project_topic_daily`` (their topics) up to date,
+like the counters in ``analytics_counters.py``. Each document is bucketed twice: by the
+``response_date`` its analysis extracted and by the UTC day it was ``processed_at``.
+Weekly (Monday-based) and monthly series are rolled up from the daily rows by
+``analytics_timeseries``, never from the documents.
+"""
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+DAILY_TABLE = "project_analytics_daily"
+TOPIC_DAILY_TABLE = "project_topic_daily"
+
+DATE_BASES = ("processed_at", "response_date")
+RESOLUTIONS = ("day", "week", "month")
+
+
+def load_timeseries(
+    supabase: Any,
+    project_id: str,
+    date_basis: str = "processed_at",
+    resolution: str = "week",
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    sentiment: Optional[str] = None,
+    complexity: Optional[str] = None,
+    top_n: int = 5,
+) -> List[Dict[str, Any]]:
+    """Buckets oldest first, each with totals, distributions and ``top_topics`` as (topic, count) tuples.
+
+    ``sentiment`` and ``complexity`` must already be normalized like the counter keys.
+    Buckets without documents are omitted.
+    """
+    if date_basis not in DATE_BASES:
+        raise ValueError(f"Unknown date basis: {date_basis}")
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution: {resolution}")
+    buckets = supabase.rpc(
+        "analytics_timeseries",
+        {
+            "p_project_id": project_id,
+            "p_date_basis": date_basis,
+            "p_resolution": resolution,
+            "p_from": start_date.isoformat() if start_date else None,
+            "p_to": end_date.isoformat() if end_date else None,
+            "p_sentiment": sentiment,
+            "p_complexity": complexity,
+            "p_top_n": top_n,
+        },
+    ).execute().data or []
+    return [
+        {
+            "bucket_start": date.fromisoformat(str(bucket["bucket_start"])[:10]),
+            "total_documents": int(bucket.get("total_documents") or 0),
+            "sentiment_distribution": bucket.get("sentiment_distribution") or {},
+            "complexity_distribution": bucket.get("complexity_distribution") or {},
+            "top_topics": [(entry["topic"], entry["topic_count"]) for entry in bucket.get("top_topics") or []],
+        }
+        for bucket in buckets
+    ]
+
+
+def rebuild_timeseries(supabase: Any, project_id: Optional[str] = None) -> None:
+    """Recomputes the daily rollups of one project (or all) from the documents and topics."""
+    supabase.rpc("rebuild_analytics_timeseries", {"p_project_id": project_id}).execute()
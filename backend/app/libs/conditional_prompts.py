@@ -0,0 +1,62 @@
+# src/app/libs/conditional_prompts.py
+"""Helpers for evaluating the condition prompt of a conditional block.
+
+The condition prompt of a ``conditional_block`` is an ordinary LLM prompt whose
+JSON answer decides whether the block's action prompts run for a document.
+"""
+from typing import Any, Optional
+
+# Appended to every condition prompt so the model answers in a shape we can evaluate.
+CONDITION_RESPONSE_INSTRUCTION = (
+    'Answer ONLY with a JSON object of the form {"condition": true} or {"condition": false}, '
+    "where true means the condition described above is met for this document."
+)
+
+# Structured-output schema used for condition prompts that do not declare their own.
+CONDITION_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {"condition": {"type": "boolean"}},
+    "required": ["condition"],
+}
+
+# Keys checked (in order) when the model answers with an object instead of a bare boolean.
+CONDITION_RESULT_KEYS = ("condition", "condition_met", "result", "value", "answer", "met")
+
+_TRUE_STRINGS = {"true", "yes", "y", "1", "met"}
+_FALSE_STRINGS = {"false", "no", "n", "0", "not met", "none", "null", ""}
+
+
+def _coerce_bool(value: Any) -> Optional[bool]:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return value != 0
+    if isinstance(value, str):
+        normalized = value.strip().lower()
+        if normalized in _TRUE_STRINGS:
+            return True
+        if normalized in _FALSE_STRINGS:
+            return False
+    return None
+
+
+def evaluate_condition_result(parsed_result: Any) -> Optional[bool]:
+    """Returns the boolean outcome of a parsed condition prompt response.
+
+    Accepts a bare boolean/string/number, or a dict holding the answer under one of
+    CONDITION_RESULT_KEYS (or as its only value). Returns None when the response
+    cannot be interpreted as a boolean.
+    """
+    direct = _coerce_bool(parsed_result)
+    if direct is not None:
+        return direct
+
+    if isinstance(parsed_result, dict):
+        lowered = {str(k).lower(): v for k, v in parsed_result.items()}
+        for key in CONDITION_RESULT_KEYS:
+            if key in lowered:
+                return _coerce_bool(lowered[key])
+        if len(parsed_result) == 1:
+            return _coerce_bool(next(iter(parsed_result.values())))
+
+    return None
@@ -0,0 +1,159 @@
+# src/app/libs/fair_scheduler.py
+"""Fair-share scheduler for the LLM work of concurrent custom step runs.
+
+Every run describes itself as a ``WorkFlow`` (run, project, owning user, priority and
+project weight) and wraps each LLM call it makes for a document in ``scheduler.slot(flow)``.
+At most ``max_concurrency`` calls run at once across all runs of this process; when more are
+waiting, the next one is picked by:
+
+1. priority: waiting work of a higher-priority flow always goes first;
+2. user: start-time fair queuing across users, so each user gets an equal share of the slots
+   no matter how many runs they start;
+3. project: the same fair queuing across the projects of that user, weighted by project;
+4. arrival order.
+
+A huge project therefore only slows itself down, and each flow records how long its items
+waited for a slot.
+"""
+import asyncio
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+@dataclass
+class WorkFlow:
+    """Scheduling identity of one run, plus the queue-wait statistics of its work items."""
+
+    run_key: str
+    project_id: str
+    user_id: Optional[str] = None
+    priority: int = 0  # Higher goes first
+    project_weight: float = 1.0
+    items: int = 0
+    wait_ms_total: float = 0.0
+    wait_ms_max: float = 0.0
+
+    @property
+    def user_key(self) -> str:
+        # Projects without a known owner each count as their own user
+        return self.user_id or f"project:{self.project_id}"
+
+    def record_wait(self, wait_ms: float) -> None:
+        self.items += 1
+        self.wait_ms_total += wait_ms
+        self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+
+    def wait_stats(self) -> Dict[str, float]:
+        return {
+            "queued_items": self.items,
+            "queue_wait_ms_avg": round(self.wait_ms_total / self.items, 1) if self.items else 0.0,
+            "queue_wait_ms_max": round(self.wait_ms_max, 1),
+            "queue_wait_ms_total": round(self.wait_ms_total, 1),
+        }
+
+
+@dataclass
+class _Waiter:
+    flow: WorkFlow
+    future: asyncio.Future
+    enqueued_at: float
+    seq: int
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int = DEFAULT_MAX_CONCURRENCY, clock: Callable[[], float] = time.monotonic):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.max_concurrency = max_concurrency
+        self._clock = clock
+        self._active = 0
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Start-time fair queuing state: finish tag per user/project and the current virtual times
+        self._user_finish: Dict[str, float] = {}
+        self._project_finish: Dict[str, float] = {}
+        self._user_vtime = 0.0
+        self._project_vtime = 0.0
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _user_start(self, flow: WorkFlow) -> float:
+        return max(self._user_vtime, self._user_finish.get(flow.user_key, 0.0))
+
+    def _project_start(self, flow: WorkFlow) -> float:
+        return max(self._project_vtime, self._project_finish.get(flow.project_id, 0.0))
+
+    def _pick(self) -> _Waiter:
+        top_priority = max(waiter.flow.priority for waiter in self._waiters)
+        return min(
+            (waiter for waiter in self._waiters if waiter.flow.priority == top_priority),
+            key=lambda waiter: (self._user_start(waiter.flow), self._project_start(waiter.flow), waiter.seq),
+        )
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrency and self._waiters:
+            waiter = self._pick()
+            self._waiters.remove(waiter)
+            if waiter.future.done():
+                continue  # The caller stopped waiting
+            flow = waiter.flow
+            user_start, project_start = self._user_start(flow), self._project_start(flow)
+            self._user_finish[flow.user_key] = user_start + 1.0
+            self._project_finish[flow.project_id] = project_start + 1.0 / max(flow.project_weight, 1e-6)
+            self._user_vtime, self._project_vtime = user_start, project_start
+            flow.record_wait((self._clock() - waiter.enqueued_at) * 1000)
+            self._active += 1
+            waiter.future.set_result(None)
+
+    async def acquire(self, flow: WorkFlow) -> None:
+        """Waits for a slot; every acquire must be paired with a ``release``."""
+        waiter = _Waiter(flow, asyncio.get_running_loop().create_future(), self._clock(), next(self._seq))
+        self._waiters.append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()  # Granted just as the caller was cancelled
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        self._active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, flow: WorkFlow) -> AsyncIterator[None]:
+        await self.acquire(flow)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def snapshot(self) -> Dict[str, object]:
+        queued_by_run: Dict[str, int] = {}
+        for waiter in self._waiters:
+            queued_by_run[waiter.flow.run_key] = queued_by_run.get(waiter.flow.run_key, 0) + 1
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self._active,
+            "queued": len(self._waiters),
+            "queued_by_run": queued_by_run,
+        }
+
+
+# Shared by every run in this process
+llm_scheduler = FairScheduler(int(os.environ.get("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)))
@@ -0,0 +1,90 @@
+# src/app/libs/keyset_pagination.py
+"""Keyset (cursor) pagination helpers for walking large tables through PostgREST.
+
+Pages are fetched with ``id > last_id ORDER BY id LIMIT n`` instead of offsets, so every
+page costs the same no matter how deep into the table it is, and rows inserted or deleted
+behind the cursor never shift the remaining pages.
+
+``iter_keyset_rows`` walks a whole filtered query that way and yields its rows one by one,
+so callers can aggregate or stream tables of any size while holding a single page in
+memory, and never hit PostgREST's max-rows cap on a single response.
+"""
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+PAGE_SIZE = 1000  # PostgREST's default max rows per response
+
+
+class AdaptiveBatchSize:
+    """Sizes the next page so that a batch holds roughly ``target_chars`` of text.
+
+    Projects of short submissions are fetched in large pages, projects of long reports in
+    small ones, keeping each response (and the memory it takes) about the same size.
+    """
+
+    def __init__(
+        self,
+        initial: int = 10,
+        minimum: int = 1,
+        maximum: int = 100,
+        target_chars: int = 400_000,
+        text_fields: Iterable[str] = ("extracted_text",),
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_chars = target_chars
+        self.text_fields = tuple(text_fields)
+        self.size = max(minimum, min(maximum, initial))
+
+    def _row_chars(self, row: Dict[str, Any]) -> int:
+        return sum(len(row.get(field) or "") for field in self.text_fields if isinstance(row.get(field), str))
+
+    def update(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """Adjusts and returns the size of the next page from the rows just fetched."""
+        rows = list(rows)
+        if not rows:
+            return self.size
+        average_chars = sum(self._row_chars(row) for row in rows) / len(rows)
+        if average_chars <= 0:
+            self.size = self.maximum
+        else:
+            self.size = max(self.minimum, min(self.maximum, int(self.target_chars // average_chars)))
+        return self.size
+
+
+def keyset_page(query: Any, after_id: Optional[str], limit: int, key: str = "id") -> Any:
+    """Applies ``key > after_id ORDER BY key LIMIT limit`` to a fresh PostgREST query."""
+    if after_id is not None:
+        query = query.gt(key, after_id)
+    return query.order(key, desc=False).limit(limit)
+
+
+def _after_filter(keys: Sequence[str], values: Sequence[Any]) -> str:
+    """PostgREST ``or`` filter for the row-value comparison ``(k1, k2, ...) > (v1, v2, ...)``."""
+    terms = []
+    for index, key in enumerate(keys):
+        conditions = [f"{keys[j]}.eq.{values[j]}" for j in range(index)] + [f"{key}.gt.{values[index]}"]
+        terms.append(conditions[0] if len(conditions) == 1 else f"and({','.join(conditions)})")
+    return ",".join(terms)
+
+
+def iter_keyset_rows(
+    make_query: Callable[[], Any], keys: Sequence[str] = ("id",), page_size: int = PAGE_SIZE
+) -> Iterator[Dict[str, Any]]:
+    """Yields every row of a query in ``keys`` order, fetching ``page_size`` rows per request.
+
+    ``make_query`` returns a fresh filtered query (the selected columns must include ``keys``,
+    which must be unique together). Each page starts after the last row of the previous one.
+    """
+    keys = tuple(keys)
+    last: Optional[tuple] = None
+    while True:
+        query = make_query()
+        if last is not None:
+            query = query.gt(keys[0], last[0]) if len(keys) == 1 else query.or_(_after_filter(keys, last))
+        for key in keys:
+            query = query.order(key, desc=False)
+        rows = query.limit(page_size).execute().data or []
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last = tuple(rows[-1][key] for key in keys)
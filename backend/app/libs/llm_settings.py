@@ -0,0 +1,37 @@
+# src/app/libs/llm_settings.py
+"""Model settings for LLM calls, configurable per custom step and per prompt."""
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel, Field
+
+DEFAULT_MODEL = "gpt-4o-mini"
+DEFAULT_TEMPERATURE = 0.2
+
+
+class ModelSettings(BaseModel):
+    """Unset fields inherit from the enclosing level (prompt -> step -> defaults)."""
+
+    model: Optional[str] = Field(default=None, description=f"Chat model to call first (default {DEFAULT_MODEL}).")
+    temperature: Optional[float] = Field(default=None, ge=0, le=2)
+    max_tokens: Optional[int] = Field(default=None, gt=0)
+    escalation_model: Optional[str] = Field(
+        default=None,
+        description="Stronger model retried only when the first answer fails JSON parsing or validation.",
+    )
+
+
+def resolve_model_settings(*layers: Optional[ModelSettings]) -> ModelSettings:
+    """Merges settings from the least to the most specific layer and fills in defaults."""
+    merged: Dict[str, Any] = {"model": DEFAULT_MODEL, "temperature": DEFAULT_TEMPERATURE}
+    for layer in layers:
+        if layer is not None:
+            merged.update(layer.model_dump(exclude_none=True))
+    return ModelSettings(**merged)
+
+
+def completion_kwargs(settings: ModelSettings, model: Optional[str] = None) -> Dict[str, Any]:
+    """Keyword arguments for ``chat.completions.create`` (``model`` overrides e.g. for escalation)."""
+    kwargs: Dict[str, Any] = {"model": model or settings.model, "temperature": settings.temperature}
+    if settings.max_tokens is not None:
+        kwargs["max_tokens"] = settings.max_tokens
+    return kwargs
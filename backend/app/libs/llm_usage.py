@@ -0,0 +1,149 @@
+# src/app/libs/llm_usage.py
+"""Token usage accounting for LLM calls.
+
+Every chat completion made while analysing documents is recorded as one row in the
+``llm_usage_events`` table, tagged with the project, custom step, run and document it
+was made for, so usage can be aggregated at each of those levels. Reads over many rows
+aggregate in the database and only fetch the sums.
+"""
+import asyncio
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+USAGE_TABLE = "llm_usage_events"
+
+
+class TokenUsage(BaseModel):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    calls: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @classmethod
+    def from_completion(cls, completion: Any) -> "TokenUsage":
+        """Reads ``completion.usage`` from an OpenAI chat completion (missing fields count as 0)."""
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return cls(calls=1)
+        details = getattr(usage, "prompt_tokens_details", None)
+        return cls(
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            cached_tokens=(getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+            calls=1,
+        )
+
+    def __add__(self, other: "TokenUsage") -> "TokenUsage":
+        return TokenUsage(
+            prompt_tokens=self.prompt_tokens + other.prompt_tokens,
+            completion_tokens=self.completion_tokens + other.completion_tokens,
+            cached_tokens=self.cached_tokens + other.cached_tokens,
+            calls=self.calls + other.calls,
+        )
+
+
+def usage_row(
+    usage: TokenUsage,
+    model: str,
+    call_type: str,
+    project_id: Optional[str] = None,
+    step_id: Optional[str] = None,
+    run_id: Optional[str] = None,
+    document_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    return {
+        "project_id": project_id,
+        "step_id": step_id,
+        "run_id": run_id,
+        "document_id": document_id,
+        "model": model,
+        "call_type": call_type,
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": usage.cached_tokens,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+async def record_llm_usage(supabase: Any, row: Dict[str, Any]) -> None:
+    """Persists one usage row. Failures are logged, never raised: accounting must not break analysis."""
+    try:
+        await asyncio.to_thread(supabase.table(USAGE_TABLE).insert(row).execute)
+    except Exception as e:
+        print(f"[USAGE_WARN] Failed to record LLM usage {row}: {e}")
+
+
+class RunUsageTracker:
+    """Accumulates token usage for one custom step run and enforces its optional token budget."""
+
+    def __init__(
+        self,
+        supabase: Any,
+        project_id: str,
+        step_id: str,
+        run_id: Optional[str] = None,
+        token_budget: Optional[int] = None,
+    ):
+        self.supabase = supabase
+        self.project_id = project_id
+        self.step_id = step_id
+        self.run_id = run_id or str(uuid.uuid4())
+        self.token_budget = token_budget
+        self.totals = TokenUsage()
+        self.by_document: Dict[str, TokenUsage] = defaultdict(TokenUsage)
+
+    @property
+    def budget_exceeded(self) -> bool:
+        return self.token_budget is not None and self.totals.total_tokens >= self.token_budget
+
+    async def record(self, completion: Any, document_id: Optional[str], model: str, call_type: str = "custom_step_prompt") -> TokenUsage:
+        usage = TokenUsage.from_completion(completion)
+        self.totals = self.totals + usage
+        if document_id:
+            self.by_document[document_id] = self.by_document[document_id] + usage
+        await record_llm_usage(
+            self.supabase,
+            usage_row(usage, model, call_type, self.project_id, self.step_id, self.run_id, document_id),
+        )
+        return usage
+
+
+def load_run_usage(supabase: Any, step_id: str, run_id: str) -> TokenUsage:
+    """Usage of one run summed in the database, including the rows of its other workers."""
+    rows = supabase.rpc("step_run_token_usage", {"p_step_id": step_id, "p_run_id": run_id}).execute().data or []
+    return _row_totals(rows[0]) if rows else TokenUsage()
+
+
+def load_step_usage(supabase: Any, project_id: str, step_id: str, document_limit: int = 100) -> Dict[str, Any]:
+    """Usage of a step aggregated in the database (``step_token_usage``).
+
+    Returns ``step_totals`` and ``project_totals``, ``runs`` as (run_id, usage) pairs oldest
+    run first, and ``documents`` as (document_id, usage) pairs, the most expensive first.
+    """
+    data = supabase.rpc(
+        "step_token_usage",
+        {"p_project_id": project_id, "p_step_id": step_id, "p_document_limit": document_limit},
+    ).execute().data or {}
+    return {
+        "step_totals": _row_totals(data.get("step_totals") or {}),
+        "project_totals": _row_totals(data.get("project_totals") or {}),
+        "runs": [(row.get("run_id"), _row_totals(row)) for row in data.get("runs") or []],
+        "documents": [(row.get("document_id"), _row_totals(row)) for row in data.get("documents") or []],
+    }
+
+
+def _row_totals(row: Dict[str, Any]) -> TokenUsage:
+    return TokenUsage(
+        prompt_tokens=row.get("prompt_tokens") or 0,
+        completion_tokens=row.get("completion_tokens") or 0,
+        cached_tokens=row.get("cached_tokens") or 0,
+        calls=row.get("calls") or 0,
+    )
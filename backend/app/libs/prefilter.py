@@ -0,0 +1,155 @@
+# src/app/libs/prefilter.py
+"""Local, rule-based pre-filters that decide whether a custom step should run on a document.
+
+A step's pre-filter is evaluated over a whole batch of documents (their stored
+``extracted_text`` and basic ``analysis``) before any LLM call is made. Documents that do
+not match are marked ``skipped_by_filter`` instead of being sent to the model.
+"""
+import re
+from typing import Any, Dict, Iterable, List, Literal, Optional, Pattern
+
+from pydantic import BaseModel, Field, field_validator
+
+SKIPPED_BY_FILTER_STATUS = "skipped_by_filter"
+
+_MISSING = object()
+
+
+class AnalysisCondition(BaseModel):
+    """A condition on a field of the document's basic ``analysis``, e.g. overall_sentiment == "negative"."""
+
+    field: str = Field(description="Field in the document's analysis; dotted paths reach nested fields.")
+    op: Literal["eq", "ne", "in", "not_in", "gt", "gte", "lt", "lte", "exists", "contains"] = "eq"
+    value: Any = None
+
+
+class PreFilter(BaseModel):
+    """All configured rules must hold for a document to be processed by the step."""
+
+    keywords_any: List[str] = Field(default_factory=list, description="At least one of these terms must appear.")
+    keywords_all: List[str] = Field(default_factory=list, description="All of these terms must appear.")
+    exclude_keywords: List[str] = Field(default_factory=list, description="None of these terms may appear.")
+    regex: Optional[str] = Field(default=None, description="Regular expression that must match somewhere in the text.")
+    min_length: Optional[int] = Field(default=None, gt=0, description="Minimum number of characters of text.")
+    analysis_conditions: List[AnalysisCondition] = Field(default_factory=list)
+    case_sensitive: bool = False
+
+    @field_validator("regex")
+    @classmethod
+    def validate_regex(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            try:
+                re.compile(value)
+            except re.error as e:
+                raise ValueError(f"Invalid pre-filter regex: {e}") from e
+        return value
+
+    @property
+    def has_text_rules(self) -> bool:
+        return bool(self.keywords_any or self.keywords_all or self.exclude_keywords or self.regex or self.min_length)
+
+
+def _keyword_pattern(keywords: Iterable[str], flags: int) -> Optional[Pattern[str]]:
+    terms = [k.strip() for k in keywords if k and k.strip()]
+    if not terms:
+        return None
+    # Longest terms first so overlapping alternatives report the most specific match
+    alternatives = "|".join(re.escape(term) for term in sorted(set(terms), key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)", flags)
+
+
+def _lookup(data: Any, dotted_path: str) -> Any:
+    current = data
+    for part in dotted_path.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        else:
+            return _MISSING
+    return current
+
+
+def _condition_holds(condition: AnalysisCondition, analysis: Any) -> bool:
+    actual = _lookup(analysis, condition.field)
+    if condition.op == "exists":
+        present = actual is not _MISSING and actual is not None
+        return present if condition.value is None else present == bool(condition.value)
+    if actual is _MISSING:
+        return False
+    expected = condition.value
+    try:
+        if condition.op == "eq":
+            return actual == expected
+        if condition.op == "ne":
+            return actual != expected
+        if condition.op == "in":
+            return actual in (expected or [])
+        if condition.op == "not_in":
+            return actual not in (expected or [])
+        if condition.op == "contains":
+            return expected in actual if isinstance(actual, (list, str)) else False
+        if actual is None:
+            return False
+        if condition.op == "gt":
+            return actual > expected
+        if condition.op == "gte":
+            return actual >= expected
+        if condition.op == "lt":
+            return actual < expected
+        if condition.op == "lte":
+            return actual <= expected
+    except TypeError:
+        return False
+    return False
+
+
+def evaluate_prefilter(prefilter: Optional[PreFilter], documents: List[Dict[str, Any]]) -> Dict[str, Optional[str]]:
+    """Evaluates ``prefilter`` over a batch of document rows in one pass.
+
+    Each row needs ``id`` and may carry ``extracted_text`` and ``analysis``. Returns a mapping
+    of document id to the reason it should be skipped, or None if the step should run on it.
+    Text rules are not applied to documents without stored text (they are fetched and
+    analysed as before), so a missing ``extracted_text`` never causes a skip on its own.
+    """
+    if prefilter is None:
+        return {str(doc.get("id")): None for doc in documents}
+
+    flags = 0 if prefilter.case_sensitive else re.IGNORECASE
+    any_pattern = _keyword_pattern(prefilter.keywords_any, flags)
+    all_patterns = [(term, _keyword_pattern([term], flags)) for term in prefilter.keywords_all if term.strip()]
+    exclude_pattern = _keyword_pattern(prefilter.exclude_keywords, flags)
+    regex_pattern = re.compile(prefilter.regex, flags) if prefilter.regex else None
+
+    decisions: Dict[str, Optional[str]] = {}
+    for doc in documents:
+        reason = None
+        text = doc.get("extracted_text")
+        if isinstance(text, str) and prefilter.has_text_rules:
+            if prefilter.min_length and len(text.strip()) < prefilter.min_length:
+                reason = f"text shorter than {prefilter.min_length} characters"
+            elif any_pattern is not None and not any_pattern.search(text):
+                reason = "none of keywords_any found"
+            elif missing := [term for term, pattern in all_patterns if not pattern.search(text)]:
+                reason = f"missing keywords_all: {missing}"
+            elif exclude_pattern is not None and (excluded := exclude_pattern.search(text)):
+                reason = f"excluded keyword found: {excluded.group(0)!r}"
+            elif regex_pattern is not None and not regex_pattern.search(text):
+                reason = "regex did not match"
+        if reason is None:
+            analysis = doc.get("analysis") or {}
+            for condition in prefilter.analysis_conditions:
+                if not _condition_holds(condition, analysis):
+                    reason = f"analysis condition not met: {condition.field} {condition.op} {condition.value!r}"
+                    break
+        decisions[str(doc.get("id"))] = reason
+    return decisions
+
+
+def count_llm_calls(prompts: List[Dict[str, Any]]) -> int:
+    """Upper bound of LLM calls one document costs for a step's prompt list (used for savings)."""
+    calls = 0
+    for prompt_container in prompts:
+        if isinstance(prompt_container, dict) and prompt_container.get("type") == "conditional_block":
+            calls += 1 + len(prompt_container.get("action_prompts") or [])
+        else:
+            calls += 1
+    return calls
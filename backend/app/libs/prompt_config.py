@@ -0,0 +1,58 @@
+# src/app/libs/prompt_config.py
+"""Pydantic models of a custom step's prompts.
+
+A step's ``prompts`` list holds standard prompts and conditional blocks (a condition prompt
+whose answer decides whether its action prompts run). Prompts may override the step's
+model settings and declare the JSON Schema their answer must follow.
+"""
+from typing import Any, Dict, Literal, Optional, Union
+
+from pydantic import BaseModel, Field, field_validator
+
+from app.libs.llm_settings import ModelSettings
+from app.libs.structured_output import check_output_schema
+
+# Default size (in estimated tokens) of each piece of step context placed into a prompt.
+DEFAULT_CONTEXT_TOKEN_BUDGET = 1500
+
+
+class PromptConfig(BaseModel):
+    text: str  # May reference other steps' results, e.g. {{steps.Sentiment.stance}}
+    include_document_context: bool = True
+    include_other_steps_context: bool = Field(
+        default=False,
+        description="Append all other steps' results for the document instead of only the referenced fields.",
+    )
+    context_token_budget: Optional[int] = Field(
+        default=None,
+        gt=0,
+        description=f"Token budget for each block of step context in this prompt (default {DEFAULT_CONTEXT_TOKEN_BUDGET}).",
+    )
+    model_settings: Optional[ModelSettings] = Field(
+        default=None, description="Overrides the step's model settings for this prompt only."
+    )
+    output_schema: Optional[Dict[str, Any]] = Field(
+        default=None,
+        description="JSON Schema (type object) the answer must match. Sent as a strict structured-output format and validated before merging.",
+    )
+
+    @field_validator("output_schema")
+    @classmethod
+    def validate_output_schema(cls, value: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if value is not None:
+            check_output_schema(value)
+        return value
+
+
+class StandardPromptStructure(BaseModel):
+    type: Literal["standard_prompt"] = "standard_prompt"
+    prompt: PromptConfig
+
+
+class ConditionalBlockStructure(BaseModel):
+    type: Literal["conditional_block"] = "conditional_block"
+    condition_prompt: PromptConfig
+    action_prompts: list[PromptConfig]
+
+
+PromptItem = Union[StandardPromptStructure, ConditionalBlockStructure]
@@ -0,0 +1,162 @@
+# src/app/libs/prompt_templates.py
+"""Small template engine for custom step prompts.
+
+Prompts can reference results produced by other steps, or by earlier prompts of the
+same step, with ``{{ ... }}`` placeholders:
+
+    {{steps.Sentiment.stance}}      field ``stance`` of the step named "Sentiment"
+    {{steps.Sentiment}}             the whole result of that step
+    {{current.summary}}             field produced by an earlier prompt of this step
+
+Step names are matched case-insensitively, ignoring spaces, dashes and underscores, so
+``{{steps.overall_sentiment.label}}`` also finds a step called "Overall Sentiment".
+Unresolvable references render as ``null``.
+"""
+import json
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+TEMPLATE_PATTERN = re.compile(r"\{\{\s*([^{}]+?)\s*\}\}")
+
+# Keys written by the executor itself; they are never useful as prompt context.
+RESULT_METADATA_KEYS = {"status", "last_processed_prompt_index", "conditions", "timestamp"}
+
+# Rough chars-per-token ratio for English text; good enough for budgeting context.
+CHARS_PER_TOKEN = 4
+
+TRUNCATION_MARKER = "...(truncated)"
+
+
+def normalize_step_name(name: str) -> str:
+    return re.sub(r"[\s_\-]+", "", str(name)).lower()
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for context budgets."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def find_template_references(text: str) -> List[str]:
+    """Returns the placeholder paths used in a prompt, in order of appearance."""
+    return [match.group(1).strip() for match in TEMPLATE_PATTERN.finditer(text or "")]
+
+
+def referenced_step_names(text: str) -> Set[str]:
+    """Returns the normalized names of the steps a prompt refers to via ``{{steps.<name>...}}``."""
+    names = set()
+    for path in find_template_references(text):
+        parts = path.split(".")
+        if len(parts) >= 2 and parts[0] == "steps":
+            names.add(normalize_step_name(parts[1]))
+    return names
+
+
+def strip_result_metadata(result: Any) -> Any:
+    if isinstance(result, dict):
+        return {k: v for k, v in result.items() if k not in RESULT_METADATA_KEYS and not str(k).startswith("prompt_")}
+    return result
+
+
+def build_step_context(
+    results_by_step_id: Optional[Dict[str, Any]],
+    step_names_by_id: Optional[Dict[str, str]],
+    exclude_step_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Maps normalized step names (and step IDs) to that step's results for one document."""
+    context: Dict[str, Any] = {}
+    if not isinstance(results_by_step_id, dict):
+        return context
+    names = step_names_by_id or {}
+    for step_id, result in results_by_step_id.items():
+        if step_id == exclude_step_id:
+            continue
+        cleaned = strip_result_metadata(result)
+        context[normalize_step_name(step_id)] = cleaned
+        if step_id in names:
+            context[normalize_step_name(names[step_id])] = cleaned
+    return context
+
+
+def _resolve_path(path: str, steps: Dict[str, Any], current: Dict[str, Any]) -> Tuple[bool, Any]:
+    parts = [part for part in path.split(".") if part]
+    if not parts:
+        return False, None
+    root, rest = parts[0], parts[1:]
+    if root == "steps":
+        if not rest:
+            return False, None
+        key = normalize_step_name(rest[0])
+        if key not in steps:
+            return False, None
+        value, rest = steps[key], rest[1:]
+    elif root == "current":
+        value = current
+    else:
+        return False, None
+
+    for part in rest:
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return False, None
+    return True, value
+
+
+def render_prompt_template(
+    text: str,
+    steps: Optional[Dict[str, Any]] = None,
+    current: Optional[Dict[str, Any]] = None,
+    token_budget: Optional[int] = None,
+) -> Tuple[str, List[str]]:
+    """Substitutes ``{{...}}`` placeholders. Returns the rendered text and the unresolved paths.
+
+    Non-string values are inserted as compact JSON, each limited to ``token_budget`` tokens.
+    """
+    unresolved: List[str] = []
+
+    def _substitute(match: "re.Match") -> str:
+        path = match.group(1).strip()
+        found, value = _resolve_path(path, steps or {}, current or {})
+        if not found:
+            unresolved.append(path)
+            return "null"
+        if isinstance(value, str):
+            return value
+        return compact_json(value, token_budget)
+
+    return TEMPLATE_PATTERN.sub(_substitute, text or ""), unresolved
+
+
+def _shrink(value: Any, max_string_chars: int, max_list_items: int) -> Any:
+    if isinstance(value, str) and len(value) > max_string_chars:
+        return value[:max_string_chars] + TRUNCATION_MARKER
+    if isinstance(value, list):
+        shrunk = [_shrink(item, max_string_chars, max_list_items) for item in value[:max_list_items]]
+        if len(value) > max_list_items:
+            shrunk.append(TRUNCATION_MARKER)
+        return shrunk
+    if isinstance(value, dict):
+        return {k: _shrink(v, max_string_chars, max_list_items) for k, v in value.items()}
+    return value
+
+
+def compact_json(value: Any, token_budget: Optional[int] = None) -> str:
+    """Serializes ``value`` without whitespace, shrinking long strings and lists to fit the budget."""
+    serialized = json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+    if token_budget is None or estimate_tokens(serialized) <= token_budget:
+        return serialized
+
+    max_chars = token_budget * CHARS_PER_TOKEN
+    max_string_chars, max_list_items = 500, 20
+    while max_string_chars >= 20:
+        shrunk = json.dumps(
+            _shrink(value, max_string_chars, max_list_items), separators=(",", ":"), ensure_ascii=False, default=str
+        )
+        if len(shrunk) <= max_chars:
+            return shrunk
+        max_string_chars //= 2
+        max_list_items = max(1, max_list_items // 2)
+    return serialized[: max(0, max_chars - len(TRUNCATION_MARKER))] + TRUNCATION_MARKER
+
@@ -0,0 +1,50 @@
+# src/app/libs/response_cache.py
+"""Versioned in-process response cache with TTL and LRU bounds.
+
+Every entry is stored with the data version it was computed from. A lookup passes the
+current version (e.g. a per-project counter the database bumps on every relevant write),
+so an entry computed before a write is never served after it, in any worker: each worker
+keeps its own cache but they all compare against the same shared version. Entries also
+expire after ``ttl_seconds``, and the least recently used ones are evicted beyond
+``max_entries``.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional, Tuple
+
+
+class VersionedLRUCache:
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 300, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, Any]]" = OrderedDict()  # key -> (stored_at, version, value)
+        self._lock = threading.Lock()  # Sync endpoints run in a thread pool
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: Any) -> Optional[Tuple[Any, float]]:
+        """The cached value and its age in seconds, or None if missing, expired or from another version."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, stored_version, value = entry
+                age = self._clock() - stored_at
+                if stored_version == version and age <= self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value, age
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, version: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (self._clock(), version, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,81 @@
+# src/app/libs/run_control.py
+"""Pause/cancel signals for running custom step runs.
+
+The manage endpoint sets a run's flags directly when the run lives in the same process,
+and the run checks them between prompts without touching the database. For setups with
+several workers, a run also learns about a pause or cancel from the step's ``run_status``
+returned by the progress writes it makes anyway, so no extra polling query is needed.
+"""
+import asyncio
+from typing import Dict, Optional
+
+PAUSE = "pause"
+CANCEL = "cancel"
+
+
+class RunControl:
+    def __init__(self):
+        self.pause_requested = asyncio.Event()
+        self.cancel_requested = asyncio.Event()
+
+    @property
+    def stop_requested(self) -> bool:
+        return self.pause_requested.is_set() or self.cancel_requested.is_set()
+
+    @property
+    def stop_reason(self) -> Optional[str]:
+        if self.cancel_requested.is_set():
+            return CANCEL
+        if self.pause_requested.is_set():
+            return PAUSE
+        return None
+
+    def request_pause(self) -> None:
+        self.pause_requested.set()
+
+    def request_cancel(self) -> None:
+        self.cancel_requested.set()
+
+    def observe_db_status(self, run_status: Optional[str]) -> None:
+        """Applies a run_status read back from the database (set by another worker)."""
+        if run_status is None or run_status == "running":
+            return
+        if run_status == "paused":
+            self.request_pause()
+        else:
+            # idle/error/etc. written by someone else: this run is no longer wanted
+            self.request_cancel()
+
+
+class RunControlRegistry:
+    def __init__(self):
+        self._controls: Dict[str, RunControl] = {}
+
+    def register(self, key: str) -> RunControl:
+        control = RunControl()
+        self._controls[key] = control
+        return control
+
+    def get(self, key: str) -> Optional[RunControl]:
+        return self._controls.get(key)
+
+    def release(self, key: str, control: RunControl) -> None:
+        if self._controls.get(key) is control:
+            del self._controls[key]
+
+    def request(self, key: str, action: str) -> bool:
+        """Signals the run registered under ``key``; returns False if it is not running in this process."""
+        control = self._controls.get(key)
+        if control is None:
+            return False
+        if action == PAUSE:
+            control.request_pause()
+        elif action == CANCEL:
+            control.request_cancel()
+        else:
+            raise ValueError(f"Unknown run control action: {action}")
+        return True
+
+
+# Shared by every request handled by this process
+run_controls = RunControlRegistry()
@@ -0,0 +1,172 @@
+# src/app/libs/run_estimate.py
+"""Dry-run estimates of a custom step run: LLM calls, tokens, cost and wall-clock time.
+
+Input tokens per document are the tokenized document text (for prompts that include it),
+the prompt text, the context blocks the prompt may carry (each capped by its context token
+budget) and the fixed instructions around them. Output tokens and per-call latency come from
+the step's (or, failing that, the project's) recorded runs. Duration is the larger of the
+time the calls take one document after another and the time the configured rate limits
+allow for that many tokens and requests.
+
+Token counts use ``tiktoken`` (a backend requirement); environments without it count text
+at ``CHARS_PER_TOKEN`` characters per token. Estimates are cached per step under the step's
+fingerprint, so editing the step's prompts or settings invalidates them.
+"""
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.libs.llm_settings import ModelSettings, resolve_model_settings
+from app.libs.prompt_config import DEFAULT_CONTEXT_TOKEN_BUDGET
+from app.libs.prompt_templates import CHARS_PER_TOKEN, find_template_references
+from app.libs.response_cache import VersionedLRUCache
+
+try:
+    import tiktoken
+except ImportError:  # Installed from requirements.txt; fall back to the chars-per-token estimate without it
+    tiktoken = None
+
+TOKENIZER = "tiktoken" if tiktoken is not None else "chars_per_token"
+
+# System message, "Document Content:" header and the JSON answer instructions around each prompt
+PROMPT_OVERHEAD_TOKENS = 150
+# Used until the step or project has recorded runs
+DEFAULT_OUTPUT_TOKENS_PER_CALL = 250
+DEFAULT_CALL_LATENCY_MS = 4000.0
+DEFAULT_DOCUMENT_OVERHEAD_MS = 500.0  # Download, extraction and writes per document
+
+# USD per million (input, output) tokens; models not listed get no cost estimate
+MODEL_PRICES_PER_MILLION: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "o4-mini": (1.10, 4.40),
+}
+
+
+def count_tokens(text: Optional[str], model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    if tiktoken is not None:
+        try:
+            encoding = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("o200k_base")
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def rate_limits_from_env() -> Dict[str, Optional[float]]:
+    """The account's per-minute token and request limits (LLM_TOKENS_PER_MINUTE / LLM_REQUESTS_PER_MINUTE)."""
+    tokens = os.environ.get("LLM_TOKENS_PER_MINUTE")
+    requests = os.environ.get("LLM_REQUESTS_PER_MINUTE")
+    return {
+        "tokens_per_minute": float(tokens) if tokens else None,
+        "requests_per_minute": float(requests) if requests else None,
+    }
+
+
+def _prompt_calls(prompts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Every prompt config that may become an LLM call, conditional blocks counted in full (upper bound)."""
+    calls = []
+    for prompt_container in prompts or []:
+        if not isinstance(prompt_container, dict):
+            continue
+        if prompt_container.get("type") == "conditional_block":
+            nested = [prompt_container.get("condition_prompt")] + list(prompt_container.get("action_prompts") or [])
+        else:
+            nested = [prompt_container.get("prompt")]
+        calls.extend(prompt for prompt in nested if isinstance(prompt, dict))
+    return calls
+
+
+def estimate_document_calls(
+    prompts: List[Dict[str, Any]],
+    document_tokens: int,
+    output_tokens_per_call: float,
+    step_settings: Optional[ModelSettings] = None,
+) -> List[Dict[str, Any]]:
+    """Estimated ``model``, ``input_tokens`` and ``output_tokens`` of each LLM call for one document."""
+    estimates = []
+    for index, prompt in enumerate(_prompt_calls(prompts)):
+        model_settings = resolve_model_settings(
+            step_settings, ModelSettings(**prompt["model_settings"]) if prompt.get("model_settings") else None
+        )
+        budget = prompt.get("context_token_budget") or DEFAULT_CONTEXT_TOKEN_BUDGET
+        input_tokens = PROMPT_OVERHEAD_TOKENS + count_tokens(prompt.get("text"), model_settings.model)
+        if prompt.get("include_document_context", True):
+            input_tokens += document_tokens
+        # Earlier answers of the step come back as context, at most one budget's worth
+        input_tokens += min(budget, math.ceil(index * output_tokens_per_call))
+        if prompt.get("include_other_steps_context"):
+            input_tokens += budget
+        # A {{steps.*}} reference usually renders one short field
+        input_tokens += min(budget, 50) * len(find_template_references(prompt.get("text") or ""))
+        output_tokens = output_tokens_per_call
+        if model_settings.max_tokens is not None:
+            output_tokens = min(output_tokens, model_settings.max_tokens)
+        estimates.append({"model": model_settings.model, "input_tokens": input_tokens, "output_tokens": output_tokens})
+    return estimates
+
+
+def history_rates(run_rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Per-call latency, per-document overhead and output tokens per call from ``step_runs`` rows."""
+    calls = sum(row.get("llm_calls") or 0 for row in run_rows)
+    llm_time_ms = sum(row.get("llm_time_ms") or 0 for row in run_rows)
+    duration_ms = sum(row.get("duration_ms") or 0 for row in run_rows)
+    documents = sum((row.get("processed_count") or 0) + (row.get("failed_count") or 0) for row in run_rows)
+    completion_tokens = sum(row.get("completion_tokens") or 0 for row in run_rows)
+    if not calls:
+        return {
+            "runs_used": 0,
+            "call_latency_ms": DEFAULT_CALL_LATENCY_MS,
+            "document_overhead_ms": DEFAULT_DOCUMENT_OVERHEAD_MS,
+            "output_tokens_per_call": DEFAULT_OUTPUT_TOKENS_PER_CALL,
+        }
+    document_overhead_ms = DEFAULT_DOCUMENT_OVERHEAD_MS
+    if documents:
+        document_overhead_ms = max(0.0, duration_ms - llm_time_ms) / documents
+    return {
+        "runs_used": len(run_rows),
+        "call_latency_ms": llm_time_ms / calls,
+        "document_overhead_ms": document_overhead_ms,
+        "output_tokens_per_call": completion_tokens / calls,
+    }
+
+
+def estimate_cost_usd(tokens_by_model: Dict[str, Dict[str, float]]) -> Optional[float]:
+    """Total cost, or None when a model's price is unknown."""
+    cost = 0.0
+    for model, tokens in tokens_by_model.items():
+        prices = MODEL_PRICES_PER_MILLION.get(model)
+        if prices is None:
+            return None
+        cost += tokens["input_tokens"] / 1e6 * prices[0] + tokens["output_tokens"] / 1e6 * prices[1]
+    return round(cost, 4)
+
+
+def estimate_duration_seconds(
+    documents: float,
+    calls: float,
+    total_tokens: float,
+    rates: Dict[str, Any],
+    workers: int = 1,
+    rate_limits: Optional[Dict[str, Optional[float]]] = None,
+) -> Dict[str, float]:
+    """Wall time of the run: sequential processing per worker, bounded below by the rate limits."""
+    processing_ms = calls * rates["call_latency_ms"] + documents * rates["document_overhead_ms"]
+    processing = processing_ms / 1000 / max(workers, 1)
+    limits = rate_limits or {}
+    token_bound = total_tokens / limits["tokens_per_minute"] * 60 if limits.get("tokens_per_minute") else 0.0
+    request_bound = calls / limits["requests_per_minute"] * 60 if limits.get("requests_per_minute") else 0.0
+    return {
+        "processing_seconds": round(processing, 1),
+        "rate_limit_seconds": round(max(token_bound, request_bound), 1),
+        "estimated_seconds": round(max(processing, token_bound, request_bound), 1),
+    }
+
+
+# Keyed by step id and the estimate parameters, versioned by the step fingerprint
+estimate_cache = VersionedLRUCache(max_entries=256, ttl_seconds=600)
@@ -0,0 +1,143 @@
+# src/app/libs/run_history.py
+"""History of custom step runs in the ``step_runs`` table.
+
+Every run inserts one row per step when it starts and completes it when it ends, so runs
+can be compared over time instead of each run overwriting the step's progress counters.
+``RunStats`` collects the timing numbers that go into the row: per-document latency (for
+p50/p95 and throughput) and the time spent waiting on LLM calls.
+"""
+import asyncio
+import math
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from app.libs.llm_usage import TokenUsage
+
+STEP_RUNS_TABLE = "step_runs"
+
+# Latency samples kept per run for percentiles; past this, later documents overwrite older samples in rotation
+MAX_LATENCY_SAMPLES = 5000
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile (q in 0..100) of ``values``; None when empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class RunStats:
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self.started_at = clock()
+        self.documents = 0
+        self.latencies_ms: List[float] = []
+        self.llm_time_ms = 0.0
+
+    def now(self) -> float:
+        return self._clock()
+
+    def document_finished(self, started_at: float) -> None:
+        """Records one document that took from ``started_at`` (a ``now()`` value) until now."""
+        latency_ms = (self._clock() - started_at) * 1000
+        self.documents += 1
+        if len(self.latencies_ms) < MAX_LATENCY_SAMPLES:
+            self.latencies_ms.append(latency_ms)
+        else:
+            # Deterministic reservoir: spread replacements over the buffer
+            self.latencies_ms[self.documents % MAX_LATENCY_SAMPLES] = latency_ms
+
+    def add_llm_time(self, started_at: float) -> None:
+        self.llm_time_ms += (self._clock() - started_at) * 1000
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        duration_ms = (self._clock() - self.started_at) * 1000
+        minutes = duration_ms / 60000
+        p50, p95 = percentile(self.latencies_ms, 50), percentile(self.latencies_ms, 95)
+        return {
+            "duration_ms": round(duration_ms),
+            "docs_per_minute": round(self.documents / minutes, 2) if minutes > 0 else None,
+            "latency_p50_ms": round(p50, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95, 1) if p95 is not None else None,
+            "llm_time_ms": round(self.llm_time_ms),
+            "llm_time_share": round(min(self.llm_time_ms / duration_ms, 1.0), 4) if duration_ms > 0 else None,
+        }
+
+
+def run_start_row(
+    run_id: str, project_id: str, step_id: str, reprocess_type: str, total_documents: int = 0
+) -> Dict[str, Any]:
+    return {
+        "run_id": run_id,
+        "project_id": project_id,
+        "step_id": step_id,
+        "reprocess_type": reprocess_type,
+        "status": "running",
+        "total_documents": total_documents,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def run_finish_fields(
+    status: str,
+    stats: RunStats,
+    processed: int,
+    failed: int,
+    total_documents: int,
+    usage: TokenUsage,
+    run_metrics: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    return {
+        "status": status,
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "total_documents": total_documents,
+        "processed_count": processed,
+        "failed_count": failed,
+        **stats.summary(),
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "llm_calls": usage.calls,
+        "run_metrics": run_metrics,
+    }
+
+
+async def record_run_start(supabase: Any, row: Dict[str, Any]) -> None:
+    """Inserts the run's row. Failures are logged, never raised: history must not break analysis."""
+    try:
+        await asyncio.to_thread(supabase.table(STEP_RUNS_TABLE).insert(row).execute)
+    except Exception as e:
+        print(f"[RUN_HISTORY_WARN] Failed to record start of run {row.get('run_id')}: {e}")
+
+
+async def record_run_finish(supabase: Any, run_id: str, step_id: str, fields: Dict[str, Any]) -> None:
+    try:
+        await asyncio.to_thread(
+            supabase.table(STEP_RUNS_TABLE).update(fields).eq("run_id", run_id).eq("step_id", step_id).execute
+        )
+    except Exception as e:
+        print(f"[RUN_HISTORY_WARN] Failed to record end of run {run_id}: {e}")
+
+
+def aggregate_runs(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Totals and averages over finished ``step_runs`` rows, e.g. for charting a step's runs over time."""
+    finished = [row for row in rows if row.get("finished_at")]
+
+    def average(column: str) -> Optional[float]:
+        values = [row[column] for row in finished if row.get(column) is not None]
+        return round(sum(values) / len(values), 2) if values else None
+
+    return {
+        "runs": len(rows),
+        "finished_runs": len(finished),
+        "documents_processed": sum(row.get("processed_count") or 0 for row in finished),
+        "documents_failed": sum(row.get("failed_count") or 0 for row in finished),
+        "total_tokens": sum(row.get("total_tokens") or 0 for row in finished),
+        "avg_docs_per_minute": average("docs_per_minute"),
+        "avg_latency_p50_ms": average("latency_p50_ms"),
+        "avg_latency_p95_ms": average("latency_p95_ms"),
+        "avg_llm_time_share": average("llm_time_share"),
+    }
@@ -0,0 +1,237 @@
+# src/app/libs/run_registry.py
+"""In-process registry of custom step runs and the event bus their SSE clients listen on.
+
+A run executes as a server-side asyncio task that drains the step's event generator and
+publishes every SSE event on the run's bus. HTTP clients only subscribe to the bus, so a
+closed browser tab or a dropped proxy connection detaches that client without affecting
+the run. Any number of clients can attach to the same run at any time.
+
+Every published event gets a monotonic ``id:`` and is kept in a per-run ring buffer, so a
+reconnecting ``EventSource`` (which sends ``Last-Event-ID``) resumes exactly where it left
+off. Routine ``running`` progress events are coalesced into at most one event per
+``PROGRESS_WINDOW_SECONDS``, and idle subscribers receive comment heartbeats.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+# Per-subscriber buffer; a client that falls this far behind loses its oldest events.
+SUBSCRIBER_QUEUE_SIZE = 500
+# Events kept per run for Last-Event-ID replay
+REPLAY_BUFFER_SIZE = 1000
+# Routine progress updates are merged into one event per window
+PROGRESS_WINDOW_SECONDS = 0.5
+# Comment line sent to idle subscribers so proxies keep the connection open
+HEARTBEAT_SECONDS = 15.0
+HEARTBEAT_EVENT = ": heartbeat\n\n"
+# Finished runs stay available for replay to clients reconnecting shortly after the end
+FINISHED_RUN_TTL_SECONDS = 60.0
+
+_END_OF_RUN = None  # Queue sentinel telling subscribers the run has finished
+
+
+def sse_event_name(sse_event: str) -> Optional[str]:
+    """The ``event:`` field of a serialized SSE event, if any."""
+    for line in sse_event.splitlines():
+        if line.startswith("event:"):
+            return line[len("event:"):].strip()
+    return None
+
+
+def _is_routine_progress(sse_event: str) -> bool:
+    """True for ``progress`` events of a run that is simply still running (safe to coalesce)."""
+    if sse_event_name(sse_event) != "progress":
+        return False
+    for line in sse_event.splitlines():
+        if line.startswith("data:"):
+            try:
+                return json.loads(line[len("data:"):].strip()).get("status") == "running"
+            except (ValueError, AttributeError):
+                return False
+    return False
+
+
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+class RunEventBus:
+    """Numbers, buffers and fans the events of one run out to its current subscribers."""
+
+    def __init__(self, progress_window: float = PROGRESS_WINDOW_SECONDS, clock=time.monotonic):
+        self._subscribers: List[asyncio.Queue] = []
+        self._replay: Deque[Tuple[int, str]] = deque(maxlen=REPLAY_BUFFER_SIZE)
+        # Latest event of each type, replayed to new subscribers so they see the current state
+        self._latest_by_event: Dict[str, Tuple[int, str]] = {}
+        self._next_id = 1
+        self._progress_window = progress_window
+        self._clock = clock
+        self._last_progress_at: Optional[float] = None
+        self._pending_progress: Optional[str] = None
+        self._pending_flush: Optional[asyncio.TimerHandle] = None
+        self.coalesced_progress_events = 0
+        self.closed = False
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def last_event_id(self) -> int:
+        return self._next_id - 1
+
+    def _emit(self, sse_event: str) -> None:
+        event_id = self._next_id
+        self._next_id += 1
+        numbered = f"id: {event_id}\n{sse_event}"
+        self._replay.append((event_id, numbered))
+        self._latest_by_event[sse_event_name(sse_event) or "message"] = (event_id, numbered)
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()  # Never let a slow client hold the run back
+            queue.put_nowait(numbered)
+
+    def _flush_pending_progress(self) -> None:
+        if self._pending_flush is not None:
+            self._pending_flush.cancel()
+            self._pending_flush = None
+        if self._pending_progress is not None:
+            pending, self._pending_progress = self._pending_progress, None
+            self._last_progress_at = self._clock()
+            self._emit(pending)
+
+    def publish(self, sse_event: str) -> None:
+        if not _is_routine_progress(sse_event):
+            self._flush_pending_progress()  # Keep ordering: the latest progress goes out first
+            self._emit(sse_event)
+            return
+
+        now = self._clock()
+        if self._last_progress_at is None or now - self._last_progress_at >= self._progress_window:
+            self._flush_pending_progress()
+            self._last_progress_at = now
+            self._emit(sse_event)
+            return
+
+        if self._pending_progress is not None:
+            self.coalesced_progress_events += 1
+        self._pending_progress = sse_event  # Progress events carry totals, so the latest one suffices
+        if self._pending_flush is None:
+            delay = self._progress_window - (now - self._last_progress_at)
+            self._pending_flush = asyncio.get_running_loop().call_later(delay, self._flush_pending_progress)
+
+    def close(self) -> None:
+        self._flush_pending_progress()
+        self.closed = True
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(_END_OF_RUN)
+
+    def _backlog(self, last_event_id: Optional[int]) -> List[str]:
+        if last_event_id is not None and last_event_id > self.last_event_id:
+            last_event_id = None  # Ids restart per run: an id beyond ours comes from an earlier run of the step
+        if last_event_id is not None and self._replay and self._replay[0][0] <= last_event_id + 1:
+            return [event for event_id, event in self._replay if event_id > last_event_id]
+        # New subscriber, or the client missed more than the buffer holds: send the current state
+        latest = sorted(self._latest_by_event.values())
+        return [event for event_id, event in latest if last_event_id is None or event_id > last_event_id]
+
+    async def subscribe(
+        self, last_event_id: Optional[int] = None, heartbeat_seconds: float = HEARTBEAT_SECONDS
+    ) -> AsyncIterator[str]:
+        """Yields missed (or current-state) events, then every new event until the run ends or the caller stops."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        for sse_event in self._backlog(last_event_id)[-SUBSCRIBER_QUEUE_SIZE:]:
+            queue.put_nowait(sse_event)
+        if self.closed:
+            queue.put_nowait(_END_OF_RUN)
+        self._subscribers.append(queue)
+        try:
+            while True:
+                try:
+                    sse_event = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield HEARTBEAT_EVENT
+                    continue
+                if sse_event is _END_OF_RUN:
+                    return
+                yield sse_event
+        finally:
+            self._subscribers.remove(queue)
+
+
+class ManagedRun:
+    """A run executing in the background, keyed by the step it processes."""
+
+    def __init__(self, key: str, events: AsyncIterator[str], run_id: Optional[str] = None):
+        self.key = key
+        self.run_id = run_id
+        self.bus = RunEventBus()
+        self._events = events
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.task is not None and self.task.done()
+
+    async def _drive(self) -> None:
+        try:
+            async for sse_event in self._events:
+                self.bus.publish(sse_event)
+        except asyncio.CancelledError:
+            print(f"[RUN_REGISTRY] Run {self.key} was cancelled.")
+            raise
+        except Exception as e:
+            print(f"[RUN_REGISTRY] Run {self.key} failed: {type(e).__name__} - {e}")
+        finally:
+            aclose = getattr(self._events, "aclose", None)
+            if aclose is not None:
+                await aclose()  # Runs the generator's own cleanup (e.g. final status writes)
+            self.bus.close()
+
+
+class RunRegistry:
+    """Keeps the active run per key (and recently finished ones) and holds strong references to their tasks."""
+
+    def __init__(self, finished_run_ttl: float = FINISHED_RUN_TTL_SECONDS):
+        self._runs: Dict[str, ManagedRun] = {}
+        self._finished_run_ttl = finished_run_ttl
+
+    def get(self, key: str) -> Optional[ManagedRun]:
+        """The run for ``key`` if it is still executing."""
+        run = self._runs.get(key)
+        return run if run is not None and not run.done else None
+
+    def get_recent(self, key: str) -> Optional[ManagedRun]:
+        """The run for ``key`` if it is executing or finished less than the TTL ago (for replay)."""
+        return self._runs.get(key)
+
+    def start(self, key: str, events: AsyncIterator[str], run_id: Optional[str] = None) -> ManagedRun:
+        """Starts draining ``events`` in a background task. Raises RuntimeError if ``key`` is already running."""
+        if self.get(key) is not None:
+            raise RuntimeError(f"A run for {key} is already active.")
+        run = ManagedRun(key, events, run_id=run_id)
+        run.task = asyncio.create_task(run._drive(), name=f"run-{key}")
+        run.task.add_done_callback(lambda _task: self._schedule_forget(run))
+        self._runs[key] = run
+        return run
+
+    def _schedule_forget(self, run: ManagedRun) -> None:
+        asyncio.get_running_loop().call_later(self._finished_run_ttl, self._forget, run)
+
+    def _forget(self, run: ManagedRun) -> None:
+        if self._runs.get(run.key) is run:
+            del self._runs[run.key]
+
+    def active_keys(self) -> List[str]:
+        return [key for key, run in self._runs.items() if not run.done]
+
+
+# Shared by every request handled by this process
+run_registry = RunRegistry()
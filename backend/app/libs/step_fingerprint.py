@@ -0,0 +1,77 @@
+# src/app/libs/step_fingerprint.py
+"""Fingerprints that tell whether a stored custom step result is still current.
+
+A step's fingerprint is a hash of everything that shapes its results: the prompts (or the
+legacy description when there are none), the model settings and the pre-filter. Every
+result row is stamped with the fingerprint of the step configuration it was produced under
+and with the hash of the document text it read. The ``stale`` reprocess type re-runs the
+documents where either no longer matches.
+
+Each field is normalized through its pydantic model and dumped with the same options before
+hashing, so a step row, a create payload and a partial update produce the same fingerprint
+for the same configuration (defaults filled in, unset optional values left out).
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Type
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from app.libs.llm_settings import ModelSettings
+from app.libs.prefilter import PreFilter
+from app.libs.prompt_config import PromptItem
+
+# Step fields that change what a run produces; edits to anything else (name, token budget...) keep results current
+FINGERPRINT_FIELDS = ("prompts", "model_settings", "pre_filter")
+
+
+_PROMPT_ITEM = TypeAdapter(PromptItem)
+
+
+def _dump(model: BaseModel) -> Optional[Dict[str, Any]]:
+    return model.model_dump(mode="json", exclude_none=True) or None
+
+
+def _normalize_settings(value: Any, model: Type[BaseModel]) -> Any:
+    if value is None:
+        return None
+    try:
+        return _dump(value if isinstance(value, model) else model.model_validate(value))
+    except ValidationError:
+        return value  # Not expected for saved steps; hash it as stored
+
+
+def _normalize_prompts(prompts: Any) -> Any:
+    if not isinstance(prompts, list):
+        return prompts
+    normalized: List[Any] = []
+    for item in prompts:
+        if isinstance(item, str):
+            normalized.append(item)  # Legacy description stored as a bare prompt
+            continue
+        try:
+            normalized.append(_dump(item if isinstance(item, BaseModel) else _PROMPT_ITEM.validate_python(item)))
+        except ValidationError:
+            normalized.append(item)
+    return normalized
+
+
+_NORMALIZERS = {
+    "prompts": _normalize_prompts,
+    "model_settings": lambda value: _normalize_settings(value, ModelSettings),
+    "pre_filter": lambda value: _normalize_settings(value, PreFilter),
+}
+
+
+def step_fingerprint(step: Dict[str, Any]) -> str:
+    """Hex digest of the result-shaping configuration of a step row (or create/update payload)."""
+    material = {field: _NORMALIZERS[field](step.get(field)) for field in FINGERPRINT_FIELDS}
+    if not material["prompts"]:
+        material["description"] = step.get("description")  # Legacy single-prompt steps
+    canonical = json.dumps(material, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def document_text_hash(extracted_text: Optional[str]) -> str:
+    """Same value as the ``documents.extracted_text_hash`` column, ``md5(coalesce(extracted_text, ''))``."""
+    return hashlib.md5((extracted_text or "").encode("utf-8")).hexdigest()
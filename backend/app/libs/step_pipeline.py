@@ -0,0 +1,65 @@
+# src/app/libs/step_pipeline.py
+"""Ordering of a project's custom steps for a single-pass pipeline run.
+
+A step depends on another when one of its prompts references that step's results through
+``{{steps.<name>...}}`` (by name or id). The pipeline runs the steps of each document in an
+order where every step comes after the steps it references; steps without a dependency
+between them keep their original order. Prompts that only opt into the generic
+other-steps context do not create a dependency.
+"""
+from typing import Any, Dict, Iterator, List, Set
+
+from app.libs.prompt_templates import normalize_step_name, referenced_step_names
+
+
+class PipelineCycleError(ValueError):
+    """Raised when steps reference each other in a cycle, so no valid order exists."""
+
+
+def iter_prompt_texts(prompts: List[Dict[str, Any]]) -> Iterator[str]:
+    """Texts of every prompt in a step's normalized prompt list (including conditional blocks)."""
+    for prompt_container in prompts or []:
+        if not isinstance(prompt_container, dict):
+            continue
+        if prompt_container.get("type") == "conditional_block":
+            nested = [prompt_container.get("condition_prompt")] + list(prompt_container.get("action_prompts") or [])
+        else:
+            nested = [prompt_container.get("prompt")]
+        for prompt in nested:
+            if isinstance(prompt, dict) and isinstance(prompt.get("text"), str):
+                yield prompt["text"]
+
+
+def step_dependencies(steps: List[Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """Maps each step id to the ids of the (given) steps its prompts reference."""
+    ids_by_reference: Dict[str, str] = {}
+    for step in steps:
+        ids_by_reference[normalize_step_name(step["id"])] = str(step["id"])
+        ids_by_reference[normalize_step_name(step.get("name") or "")] = str(step["id"])
+    dependencies: Dict[str, Set[str]] = {}
+    for step in steps:
+        references: Set[str] = set()
+        for text in iter_prompt_texts(step.get("prompts")):
+            references |= referenced_step_names(text)
+        step_id = str(step["id"])
+        dependencies[step_id] = {
+            ids_by_reference[name] for name in references if name in ids_by_reference
+        } - {step_id}
+    return dependencies
+
+
+def order_steps_by_dependencies(steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Returns ``steps`` topologically sorted by their references; raises PipelineCycleError on cycles."""
+    dependencies = step_dependencies(steps)
+    ordered: List[Dict[str, Any]] = []
+    placed: Set[str] = set()
+    remaining = list(steps)
+    while remaining:
+        ready = next((step for step in remaining if dependencies[str(step["id"])] <= placed), None)
+        if ready is None:
+            names = ", ".join(str(step.get("name") or step["id"]) for step in remaining)
+            raise PipelineCycleError(f"Custom steps reference each other in a cycle: {names}")
+        ordered.append(ready)
+        placed.add(str(ready["id"]))
+        remaining.remove(ready)
+    return ordered
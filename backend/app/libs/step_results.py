@@ -0,0 +1,192 @@
+# src/app/libs/step_results.py
+"""Access to the ``document_step_results`` table.
+
+Each custom step stores its result for a document as its own row keyed by
+(document_id, step_id), instead of as one key inside the document's
+``custom_analysis_results`` JSONB blob. Steps therefore never overwrite each other's
+results, and readers only load the steps they need. ``result`` holds the same dict that
+used to live under the step's key (including ``status``); ``status`` is copied into its
+own column so runs and summaries can filter on it. ``step_fingerprint`` and ``text_hash``
+record what the result was produced from (see ``step_fingerprint.py``).
+
+The functions here are synchronous, like the Supabase client; call them through
+``asyncio.to_thread`` from async code.
+"""
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from app.libs.keyset_pagination import PAGE_SIZE, iter_keyset_rows
+
+STEP_RESULTS_TABLE = "document_step_results"
+# Old-shaped {step_id: result} object per document, for readers not yet moved to the table
+COMPAT_VIEW = "document_custom_analysis_results"
+
+# Reprocess types that only select some documents (see migrations 20261019000800 and 000900)
+REPROCESS_SELECTIONS = ("failed", "pending", "stale")
+_SELECTION_IDS_FUNCTION = "step_reprocess_document_ids"
+_SELECTION_COUNT_FUNCTION = "count_step_reprocess_documents"
+
+# Result statuses the "failed" selection picks up; a result without a status counts as pending
+FAILED_STATUS_PREFIXES = ("failed", "error")
+
+_IN_FILTER_CHUNK = 200  # Keeps "document_id=in.(...)" URLs well below proxy limits
+
+
+def step_result_row(
+    document_id: str,
+    step_id: str,
+    project_id: str,
+    result: Dict[str, Any],
+    step_fingerprint: Optional[str] = None,
+    text_hash: Optional[str] = None,
+) -> Dict[str, Any]:
+    status = result.get("status") if isinstance(result, dict) else None
+    return {
+        "document_id": str(document_id),
+        "step_id": str(step_id),
+        "project_id": str(project_id),
+        "status": status,
+        "result": result,
+        "step_fingerprint": step_fingerprint,
+        "text_hash": text_hash,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def failed_result(status: str, error: str, **details: Any) -> Dict[str, Any]:
+    """The result stored for a document the step failed on, with ``status`` set so "failed" reruns select it."""
+    if not status.startswith(FAILED_STATUS_PREFIXES):
+        raise ValueError(f"Failure status must start with one of {FAILED_STATUS_PREFIXES}: {status}")
+    return {"status": status, "error": error, **details}
+
+
+def status_selection(status: Optional[str]) -> Optional[str]:
+    """The reprocess selection ("failed" or "pending") a stored result status falls into, as in migration 000800."""
+    if status is None or status.startswith("partial_success"):
+        return "pending"
+    if status.startswith(FAILED_STATUS_PREFIXES):
+        return "failed"
+    return None
+
+
+def upsert_step_results(supabase: Any, rows: List[Dict[str, Any]]) -> None:
+    """Inserts or replaces the given (document_id, step_id) rows in one request."""
+    if rows:
+        supabase.table(STEP_RESULTS_TABLE).upsert(rows, on_conflict="document_id,step_id").execute()
+
+
+def _chunks(values: List[str], size: int) -> Iterator[List[str]]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def iter_step_result_rows(
+    supabase: Any,
+    columns: str,
+    project_id: Optional[str] = None,
+    step_id: Optional[str] = None,
+    document_ids: Optional[Iterable[str]] = None,
+    statuses: Optional[Iterable[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Yields matching rows, walking them page by page with a (document_id, step_id) keyset cursor.
+
+    ``columns`` needs not include the key columns; they are always selected.
+    """
+    selected = ", ".join(dict.fromkeys(["document_id", "step_id"] + [c.strip() for c in columns.split(",")]))
+
+    def base_query():
+        query = supabase.table(STEP_RESULTS_TABLE).select(selected)
+        if project_id is not None:
+            query = query.eq("project_id", str(project_id))
+        if step_id is not None:
+            query = query.eq("step_id", str(step_id))
+        if statuses is not None:
+            query = query.in_("status", list(statuses))
+        return query
+
+    keys = ("document_id", "step_id")
+    if document_ids is None:
+        yield from iter_keyset_rows(base_query, keys, PAGE_SIZE)
+        return
+    for chunk in _chunks([str(d) for d in document_ids], _IN_FILTER_CHUNK):
+        yield from iter_keyset_rows(lambda: base_query().in_("document_id", chunk), keys, PAGE_SIZE)
+
+
+def load_results_by_document(
+    supabase: Any,
+    project_id: Optional[str] = None,
+    document_ids: Optional[Iterable[str]] = None,
+    step_id: Optional[str] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Returns {document_id: {step_id: result}}, the shape of the old custom_analysis_results column."""
+    results_by_document: Dict[str, Dict[str, Any]] = {}
+    for row in iter_step_result_rows(
+        supabase, "document_id, step_id, result", project_id=project_id, step_id=step_id, document_ids=document_ids
+    ):
+        results_by_document.setdefault(str(row["document_id"]), {})[str(row["step_id"])] = row.get("result")
+    return results_by_document
+
+
+def delete_step_results(supabase: Any, step_id: str, project_id: Optional[str] = None) -> int:
+    """Deletes every stored result of a step and returns how many documents had one."""
+    # Only the count is needed, so don't have PostgREST send the deleted rows (and their result JSON) back
+    query = supabase.table(STEP_RESULTS_TABLE).delete(count="exact", returning="minimal").eq("step_id", str(step_id))
+    if project_id is not None:
+        query = query.eq("project_id", str(project_id))
+    response = query.execute()
+    return response.count or 0
+
+
+def _check_selection(selection: str, fingerprint: Optional[str]) -> None:
+    if selection not in REPROCESS_SELECTIONS:
+        raise ValueError(f"Unknown reprocess selection: {selection}")
+    if selection == "stale" and not fingerprint:
+        raise ValueError("The stale selection needs the step's current fingerprint.")
+
+
+def reprocess_document_ids(
+    supabase: Any,
+    project_id: str,
+    step_id: str,
+    selection: str,
+    after_id: Optional[str],
+    limit: int,
+    fingerprint: Optional[str] = None,
+) -> List[str]:
+    """Ids (ascending, after ``after_id``) of the documents a "failed", "pending" or "stale" run has to process.
+
+    "failed" selects documents whose result status starts with ``failed`` or ``error``; "pending"
+    selects documents without a result for the step or with an unfinished (``partial_success``) one;
+    "stale" selects documents whose result was produced under another ``fingerprint`` or from
+    a different document text.
+    """
+    _check_selection(selection, fingerprint)
+    response = supabase.rpc(
+        _SELECTION_IDS_FUNCTION,
+        {
+            "p_project_id": str(project_id),
+            "p_step_id": str(step_id),
+            "p_selection": selection,
+            "p_after_id": str(after_id) if after_id is not None else None,
+            "p_limit": limit,
+            "p_fingerprint": fingerprint,
+        },
+    ).execute()
+    # setof uuid comes back as plain values (older PostgREST versions wrap them in {function_name: value})
+    return [str(row[_SELECTION_IDS_FUNCTION]) if isinstance(row, dict) else str(row) for row in response.data or []]
+
+
+def count_reprocess_documents(
+    supabase: Any, project_id: str, step_id: str, selection: str, fingerprint: Optional[str] = None
+) -> int:
+    _check_selection(selection, fingerprint)
+    response = supabase.rpc(
+        _SELECTION_COUNT_FUNCTION,
+        {
+            "p_project_id": str(project_id),
+            "p_step_id": str(step_id),
+            "p_selection": selection,
+            "p_fingerprint": fingerprint,
+        },
+    ).execute()
+    return int(response.data or 0)
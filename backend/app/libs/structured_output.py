@@ -0,0 +1,186 @@
+# src/app/libs/structured_output.py
+"""JSON Schema support for custom prompt outputs.
+
+A prompt may declare the JSON Schema its answer must follow. The schema is sent to the
+model as a strict structured-output ``response_format`` and the parsed answer is validated
+against the original schema before it is merged into the document's results.
+"""
+import copy
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+from jsonschema import Draft202012Validator
+from jsonschema.exceptions import SchemaError
+
+# Used when a prompt declares no schema: the model must still answer with a JSON object.
+JSON_OBJECT_FORMAT: Dict[str, Any] = {"type": "json_object"}
+
+_MAX_REPORTED_ERRORS = 5
+
+
+# Keywords whose value is a single subschema, a list of subschemas, or a {name: subschema} map
+_SUBSCHEMA_KEYWORDS = ("items", "additionalProperties", "not")
+_SUBSCHEMA_LIST_KEYWORDS = ("anyOf", "oneOf", "allOf", "prefixItems")
+_SUBSCHEMA_MAP_KEYWORDS = ("properties", "$defs", "definitions")
+
+
+def _object_schemas_without_properties(schema: Any, path: str) -> List[str]:
+    """Locations of object schemas that declare no ``properties`` (strict mode cannot express them)."""
+    if not isinstance(schema, dict):
+        return []
+    missing = []
+    is_object = schema.get("type") == "object" or (
+        isinstance(schema.get("type"), list) and "object" in schema["type"]
+    )
+    if is_object and not (isinstance(schema.get("properties"), dict) and schema["properties"]):
+        missing.append(path)
+    for keyword in _SUBSCHEMA_KEYWORDS:
+        missing += _object_schemas_without_properties(schema.get(keyword), f"{path}/{keyword}")
+    for keyword in _SUBSCHEMA_LIST_KEYWORDS:
+        if isinstance(schema.get(keyword), list):
+            for index, item in enumerate(schema[keyword]):
+                missing += _object_schemas_without_properties(item, f"{path}/{keyword}/{index}")
+    for keyword in _SUBSCHEMA_MAP_KEYWORDS:
+        if isinstance(schema.get(keyword), dict):
+            for name, item in schema[keyword].items():
+                missing += _object_schemas_without_properties(item, f"{path}/{keyword}/{name}")
+    return missing
+
+
+def check_output_schema(schema: Dict[str, Any]) -> None:
+    """Raises ValueError if ``schema`` is not a valid JSON Schema describing an object.
+
+    Every object in the schema, at any depth, must declare its ``properties``: strict
+    structured outputs reject open-ended objects, so such a schema would fail every call.
+    """
+    try:
+        Draft202012Validator.check_schema(schema)
+    except SchemaError as e:
+        raise ValueError(f"Invalid output_schema: {e.message}") from e
+    if schema.get("type") != "object":
+        raise ValueError('output_schema must describe a JSON object (top-level "type": "object").')
+    missing = _object_schemas_without_properties(schema, "#")
+    if missing:
+        raise ValueError(
+            "output_schema objects must declare non-empty \"properties\" for strict structured outputs; "
+            f"missing at: {', '.join(missing[:_MAX_REPORTED_ERRORS])}"
+        )
+
+
+def _strict_schema(schema: Any) -> Any:
+    """Returns a copy of ``schema`` that satisfies the structured-output strict-mode rules.
+
+    Strict mode requires every object to list all of its properties as required and to forbid
+    additional properties. Properties that were optional become nullable instead, so the model
+    can still leave them out by answering null (nulls are dropped again by ``drop_null_optionals``).
+    """
+    if isinstance(schema, list):
+        return [_strict_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    strict = {key: _strict_schema(value) for key, value in schema.items()}
+    properties = strict.get("properties")
+    if strict.get("type") == "object" and isinstance(properties, dict):
+        required = set(schema.get("required", []))
+        for name, prop_schema in properties.items():
+            if name not in required and isinstance(prop_schema, dict):
+                properties[name] = {"anyOf": [prop_schema, {"type": "null"}]}
+        strict["required"] = list(properties)
+        strict["additionalProperties"] = False
+    return strict
+
+
+def response_format_for(schema: Optional[Dict[str, Any]], name: str = "prompt_output") -> Dict[str, Any]:
+    """The ``response_format`` argument for a chat completion answering with ``schema``."""
+    if not schema:
+        return JSON_OBJECT_FORMAT
+    safe_name = re.sub(r"[^a-zA-Z0-9_-]", "_", name)[:64] or "prompt_output"
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": safe_name, "schema": _strict_schema(copy.deepcopy(schema)), "strict": True},
+    }
+
+
+def _resolve_ref(schema: Dict[str, Any], root: Dict[str, Any]) -> Dict[str, Any]:
+    """Follows a local ``#/$defs/...`` (or ``#/definitions/...``) reference; other schemas are returned as is."""
+    ref = schema.get("$ref")
+    if not isinstance(ref, str) or not ref.startswith("#/"):
+        return schema
+    target: Any = root
+    for part in ref[2:].split("/"):
+        target = target.get(part) if isinstance(target, dict) else None
+    return _resolve_ref(target, root) if isinstance(target, dict) else schema
+
+
+def _drop_null_optionals(value: Any, schema: Any, root: Dict[str, Any]) -> Any:
+    if not isinstance(schema, dict):
+        return value
+    schema = _resolve_ref(schema, root)
+
+    branches = [branch for branch in schema.get("anyOf") or schema.get("oneOf") or [] if isinstance(branch, dict)]
+    if branches and value is not None:
+        # Clean the value against the first branch it then satisfies (fall back to the first branch)
+        candidates = [_drop_null_optionals(value, branch, root) for branch in branches]
+        for branch, candidate in zip(branches, candidates):
+            if not _validator(_resolve_ref(branch, root), root).is_valid(candidate):
+                continue
+            return candidate
+        return candidates[0]
+
+    if isinstance(value, list) and isinstance(schema.get("items"), dict):
+        return [_drop_null_optionals(item, schema["items"], root) for item in value]
+
+    if not isinstance(value, dict) or not isinstance(schema.get("properties"), dict):
+        return value
+    required = set(schema.get("required", []))
+    cleaned = {}
+    for key, item in value.items():
+        prop_schema = schema["properties"].get(key)
+        if item is None and key not in required and prop_schema is not None:
+            continue
+        cleaned[key] = _drop_null_optionals(item, prop_schema, root)
+    return cleaned
+
+
+def _validator(schema: Dict[str, Any], root: Dict[str, Any]) -> Draft202012Validator:
+    # Branches may $ref into the root's $defs, so validate them with the root's definitions in scope
+    definitions = {key: root[key] for key in ("$defs", "definitions") if key in root}
+    return Draft202012Validator({**definitions, **schema})
+
+
+def drop_null_optionals(value: Any, schema: Optional[Dict[str, Any]]) -> Any:
+    """Removes null values the strict format forced into properties the schema left optional.
+
+    Walks the schema the way ``_strict_schema`` does: object properties, array ``items``,
+    ``anyOf``/``oneOf`` branches and local ``$defs`` references, at any depth.
+    """
+    if not schema:
+        return value
+    return _drop_null_optionals(value, schema, schema)
+
+
+def validate_output(value: Any, schema: Optional[Dict[str, Any]]) -> List[str]:
+    """Returns human-readable validation errors for ``value`` (empty if it matches ``schema``)."""
+    if not schema:
+        return [] if isinstance(value, dict) else [f"expected a JSON object, got {type(value).__name__}"]
+    errors = sorted(Draft202012Validator(schema).iter_errors(value), key=lambda e: list(e.absolute_path))
+    messages = []
+    for error in errors[:_MAX_REPORTED_ERRORS]:
+        location = "/".join(str(part) for part in error.absolute_path) or "<root>"
+        messages.append(f"{location}: {error.message}")
+    return messages
+
+
+def parse_json_response(raw_text: str) -> Any:
+    """Parses a model answer, tolerating markdown code fences around the JSON.
+
+    Raises json.JSONDecodeError if the text is not valid JSON.
+    """
+    cleaned = raw_text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned[7:] if cleaned.startswith("```json") else cleaned[3:]
+        if cleaned.endswith("```"):
+            cleaned = cleaned[:-3]
+    return json.loads(cleaned.strip())
@@ -0,0 +1,405 @@
+# src/app/libs/work_leases.py
+"""Lease-based claiming of document batches, so one step run can use many workers.
+
+A distributed run is split up front into batches of document ids stored in a work table.
+Any number of worker loops, in any process on any machine, claim batches with an atomic
+claim-with-expiry: the claim marks the batch ``leased`` by that worker until
+``lease_expires_at``. Workers extend the lease with heartbeats while processing, mark the
+batch ``done`` with its counts, or give it back on failure. A batch whose worker died
+becomes claimable again when its lease expires; after ``max_attempts`` claims it is marked
+``failed``. Run progress is the sum over the run's batches, whichever workers processed them.
+A store created for a project and step only claims and reports batches of that step's runs.
+
+``SupabaseLeaseStore`` keeps the batches in the ``step_run_batches`` table (the claim is a
+``FOR UPDATE SKIP LOCKED`` function); ``SqliteLeaseStore`` implements the same semantics on
+a local SQLite file for single-machine, multi-process runs and tests.
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.libs.run_control import RunControl
+
+BATCHES_TABLE = "step_run_batches"
+
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+@dataclass
+class BatchLease:
+    batch_id: int
+    run_id: str
+    batch_index: int
+    document_ids: List[str]
+    worker_id: str
+    attempts: int
+
+
+def new_worker_id() -> str:
+    """Identifies one worker loop: host, process and a random suffix (a process may run several loops)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def plan_batches(document_ids: List[str], batch_size: int) -> List[List[str]]:
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1")
+    return [document_ids[start:start + batch_size] for start in range(0, len(document_ids), batch_size)]
+
+
+def aggregate_progress(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Run progress from its batch rows (status, document_ids, processed/failed counts, lease_owner)."""
+    by_status = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+    for row in rows:
+        by_status[row["status"]] = by_status.get(row["status"], 0) + 1
+    total_documents = sum(len(row.get("document_ids") or []) for row in rows)
+    processed = sum(row.get("processed_count") or 0 for row in rows)
+    failed = sum(row.get("failed_count") or 0 for row in rows)
+    # Documents of batches that ran out of attempts count as failed
+    failed += sum(len(row.get("document_ids") or []) for row in rows if row["status"] == FAILED)
+    return {
+        "batches_total": len(rows),
+        "batches_pending": by_status[PENDING],
+        "batches_leased": by_status[LEASED],
+        "batches_done": by_status[DONE],
+        "batches_failed": by_status[FAILED],
+        "total_documents": total_documents,
+        "processed": processed,
+        "failed": failed,
+        "percent": round((processed + failed) / total_documents * 100, 2) if total_documents else 100.0,
+        "active_workers": sorted(
+            {row["lease_owner"] for row in rows if row["status"] == LEASED and row.get("lease_owner")}
+        ),
+        "finished": by_status[PENDING] == 0 and by_status[LEASED] == 0,
+    }
+
+
+class SupabaseLeaseStore:
+    """Batches in the ``step_run_batches`` table; claims and heartbeats use database time."""
+
+    def __init__(
+        self,
+        supabase: Any,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        project_id: Optional[str] = None,
+        step_id: Optional[str] = None,
+    ):
+        self.supabase = supabase
+        self.max_attempts = max_attempts
+        self.project_id = project_id
+        self.step_id = step_id
+
+    def create_batches(self, run_id: str, project_id: str, step_id: str, batches: List[List[str]]) -> int:
+        rows = [
+            {"run_id": run_id, "project_id": project_id, "step_id": step_id, "batch_index": index, "document_ids": ids}
+            for index, ids in enumerate(batches)
+        ]
+        for start in range(0, len(rows), 500):
+            self.supabase.table(BATCHES_TABLE).insert(rows[start:start + 500]).execute()
+        return len(rows)
+
+    def claim(self, run_id: str, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[BatchLease]:
+        response = self.supabase.rpc(
+            "claim_step_run_batch",
+            {
+                "p_run_id": run_id,
+                "p_worker": worker_id,
+                "p_lease_seconds": lease_seconds,
+                "p_max_attempts": self.max_attempts,
+                "p_project_id": self.project_id,
+                "p_step_id": self.step_id,
+            },
+        ).execute()
+        if not response.data:
+            return None
+        row = response.data[0]
+        return BatchLease(
+            batch_id=row["id"],
+            run_id=run_id,
+            batch_index=row["batch_index"],
+            document_ids=[str(doc_id) for doc_id in row["document_ids"]],
+            worker_id=worker_id,
+            attempts=row["attempts"],
+        )
+
+    def heartbeat(self, lease: BatchLease, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extends the lease; False when the worker no longer holds it (expired and claimed by another)."""
+        response = self.supabase.rpc(
+            "heartbeat_step_run_batch",
+            {"p_batch_id": lease.batch_id, "p_worker": lease.worker_id, "p_lease_seconds": lease_seconds},
+        ).execute()
+        return bool(response.data)
+
+    def complete(self, lease: BatchLease, processed: int, failed: int) -> bool:
+        response = (
+            self.supabase.table(BATCHES_TABLE)
+            .update({"status": DONE, "processed_count": processed, "failed_count": failed, "lease_expires_at": None})
+            .eq("id", lease.batch_id)
+            .eq("lease_owner", lease.worker_id)
+            .eq("status", LEASED)
+            .execute()
+        )
+        return bool(response.data)
+
+    def release(self, lease: BatchLease, error: str, count_attempt: bool = True) -> None:
+        """Gives the batch back after a failure (marked failed once it used up its attempts).
+
+        With ``count_attempt=False`` (the worker was stopped, the batch did not fail) the claim
+        does not count against the batch's attempts.
+        """
+        status = FAILED if count_attempt and lease.attempts >= self.max_attempts else PENDING
+        attempts = lease.attempts if count_attempt else lease.attempts - 1
+        (
+            self.supabase.table(BATCHES_TABLE)
+            .update(
+                {
+                    "status": status,
+                    "attempts": attempts,
+                    "lease_owner": None,
+                    "lease_expires_at": None,
+                    "last_error": error[:2000],
+                }
+            )
+            .eq("id", lease.batch_id)
+            .eq("lease_owner", lease.worker_id)
+            .eq("status", LEASED)
+            .execute()
+        )
+
+    def progress(self, run_id: str) -> Dict[str, Any]:
+        query = (
+            self.supabase.table(BATCHES_TABLE)
+            .select("status, document_ids, processed_count, failed_count, lease_owner")
+            .eq("run_id", run_id)
+        )
+        if self.project_id is not None:
+            query = query.eq("project_id", self.project_id)
+        if self.step_id is not None:
+            query = query.eq("step_id", self.step_id)
+        return aggregate_progress(query.execute().data or [])
+
+
+class SqliteLeaseStore:
+    """The same lease semantics on a local SQLite file, shared by the processes of one machine."""
+
+    def __init__(
+        self,
+        path: str,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        clock: Callable[[], float] = time.time,
+        project_id: Optional[str] = None,
+        step_id: Optional[str] = None,
+    ):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._clock = clock
+        self.project_id = project_id
+        self.step_id = step_id
+        with closing(self._connect()) as connection:
+            connection.execute(
+                f"""create table if not exists {BATCHES_TABLE} (
+                    id integer primary key autoincrement,
+                    run_id text not null,
+                    project_id text,
+                    step_id text,
+                    batch_index integer not null,
+                    document_ids text not null,
+                    status text not null default '{PENDING}',
+                    lease_owner text,
+                    lease_expires_at real,
+                    attempts integer not null default 0,
+                    processed_count integer not null default 0,
+                    failed_count integer not null default 0,
+                    last_error text,
+                    unique (run_id, batch_index)
+                )"""
+            )
+
+    def _scope(self) -> Tuple[str, Tuple[Any, ...]]:
+        """SQL condition (and its values) limiting a run's batches to the store's project and step."""
+        conditions, values = "", ()
+        for column, value in (("project_id", self.project_id), ("step_id", self.step_id)):
+            if value is not None:
+                conditions += f" and {column} = ?"
+                values += (value,)
+        return conditions, values
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode; writes that must be atomic open their own IMMEDIATE transaction
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def create_batches(self, run_id: str, project_id: str, step_id: str, batches: List[List[str]]) -> int:
+        with closing(self._connect()) as connection:
+            connection.execute("begin immediate")
+            connection.executemany(
+                f"insert into {BATCHES_TABLE} (run_id, project_id, step_id, batch_index, document_ids) "
+                "values (?, ?, ?, ?, ?)",
+                [(run_id, project_id, step_id, index, json.dumps(ids)) for index, ids in enumerate(batches)],
+            )
+            connection.execute("commit")
+        return len(batches)
+
+    def claim(self, run_id: str, worker_id: str, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> Optional[BatchLease]:
+        now = self._clock()
+        scope, scope_values = self._scope()
+        with closing(self._connect()) as connection:
+            connection.execute("begin immediate")  # Takes the write lock, so no two claims pick the same batch
+            connection.execute(
+                f"update {BATCHES_TABLE} set status = ?, lease_owner = null, last_error = 'lease expired' "
+                f"where run_id = ?{scope} and status = ? and lease_expires_at < ? and attempts >= ?",
+                (FAILED, run_id) + scope_values + (LEASED, now, self.max_attempts),
+            )
+            row = connection.execute(
+                f"select id, batch_index, document_ids, attempts from {BATCHES_TABLE} "
+                f"where run_id = ?{scope} and (status = ? or (status = ? and lease_expires_at < ?)) "
+                "order by batch_index limit 1",
+                (run_id,) + scope_values + (PENDING, LEASED, now),
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    f"update {BATCHES_TABLE} set status = ?, lease_owner = ?, lease_expires_at = ?, "
+                    "attempts = attempts + 1 where id = ?",
+                    (LEASED, worker_id, now + lease_seconds, row[0]),
+                )
+            connection.execute("commit")
+        if row is None:
+            return None
+        return BatchLease(
+            batch_id=row[0],
+            run_id=run_id,
+            batch_index=row[1],
+            document_ids=json.loads(row[2]),
+            worker_id=worker_id,
+            attempts=row[3] + 1,
+        )
+
+    def _update_held(self, lease: BatchLease, assignments: str, values: Tuple[Any, ...]) -> bool:
+        with closing(self._connect()) as connection:
+            cursor = connection.execute(
+                f"update {BATCHES_TABLE} set {assignments} where id = ? and lease_owner = ? and status = ?",
+                values + (lease.batch_id, lease.worker_id, LEASED),
+            )
+            return cursor.rowcount == 1
+
+    def heartbeat(self, lease: BatchLease, lease_seconds: int = DEFAULT_LEASE_SECONDS) -> bool:
+        return self._update_held(lease, "lease_expires_at = ?", (self._clock() + lease_seconds,))
+
+    def complete(self, lease: BatchLease, processed: int, failed: int) -> bool:
+        return self._update_held(
+            lease,
+            "status = ?, processed_count = ?, failed_count = ?, lease_expires_at = null",
+            (DONE, processed, failed),
+        )
+
+    def release(self, lease: BatchLease, error: str, count_attempt: bool = True) -> None:
+        status = FAILED if count_attempt and lease.attempts >= self.max_attempts else PENDING
+        attempts = lease.attempts if count_attempt else lease.attempts - 1
+        self._update_held(
+            lease,
+            "status = ?, attempts = ?, lease_owner = null, lease_expires_at = null, last_error = ?",
+            (status, attempts, error[:2000]),
+        )
+
+    def progress(self, run_id: str) -> Dict[str, Any]:
+        scope, scope_values = self._scope()
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                f"select status, document_ids, processed_count, failed_count, lease_owner from {BATCHES_TABLE} "
+                f"where run_id = ?{scope}",
+                (run_id,) + scope_values,
+            ).fetchall()
+        return aggregate_progress(
+            [
+                {
+                    "status": status,
+                    "document_ids": json.loads(document_ids),
+                    "processed_count": processed,
+                    "failed_count": failed,
+                    "lease_owner": owner,
+                }
+                for status, document_ids, processed, failed, owner in rows
+            ]
+        )
+
+
+# Processes one claimed batch; returns (processed, failed) document counts. It should stop
+# early (returning what it finished) once the control's stop is requested: the lease was lost.
+BatchProcessor = Callable[[BatchLease, RunControl], Awaitable[Tuple[int, int]]]
+
+
+async def run_worker(
+    store: Any,
+    run_id: str,
+    process_batch: BatchProcessor,
+    worker_id: Optional[str] = None,
+    lease_seconds: int = DEFAULT_LEASE_SECONDS,
+    heartbeat_seconds: Optional[float] = None,
+    stop: Optional[RunControl] = None,
+) -> Dict[str, int]:
+    """Claims and processes batches of ``run_id`` until none are left (or ``stop`` is requested).
+
+    Store calls are blocking and run in threads. While a batch is processed, a heartbeat
+    extends its lease every ``heartbeat_seconds`` (a third of the lease by default); if the
+    lease is lost the batch's control is cancelled and its results are not counted here.
+    """
+    worker_id = worker_id or new_worker_id()
+    heartbeat_seconds = heartbeat_seconds or lease_seconds / 3
+    totals = {"batches": 0, "processed": 0, "failed": 0, "batches_lost": 0, "batches_released": 0}
+
+    while stop is None or not stop.stop_requested:
+        lease = await asyncio.to_thread(store.claim, run_id, worker_id, lease_seconds)
+        if lease is None:
+            break
+        control = RunControl()
+
+        async def keep_lease() -> None:
+            while True:
+                await asyncio.sleep(heartbeat_seconds)
+                try:
+                    held = await asyncio.to_thread(store.heartbeat, lease, lease_seconds)
+                except Exception as e:
+                    # A missed heartbeat is retried; the lease only ends if it expires in the meantime
+                    print(f"[WORK_LEASE_WARN] Heartbeat for batch {lease.batch_id} failed: {e}")
+                    continue
+                if not held:
+                    print(f"[WORK_LEASE_WARN] Worker {worker_id} lost the lease on batch {lease.batch_id}.")
+                    control.request_cancel()
+                    return
+                if stop is not None and stop.stop_requested:
+                    control.request_cancel()
+
+        heartbeat_task = asyncio.create_task(keep_lease())
+        try:
+            processed, failed = await process_batch(lease, control)
+        except Exception as e:
+            print(f"[WORK_LEASE_ERROR] Batch {lease.batch_id} failed on worker {worker_id}: {type(e).__name__} - {e}")
+            await asyncio.to_thread(store.release, lease, f"{type(e).__name__}: {e}")
+            totals["batches_released"] += 1
+            continue
+        finally:
+            heartbeat_task.cancel()
+
+        if control.stop_requested:
+            # Lost lease or stopping: the batch is redone by whoever claims it next
+            await asyncio.to_thread(store.release, lease, "interrupted", False)
+            totals["batches_lost"] += 1
+            continue
+        if await asyncio.to_thread(store.complete, lease, processed, failed):
+            totals["batches"] += 1
+            totals["processed"] += processed
+            totals["failed"] += failed
+        else:
+            totals["batches_lost"] += 1
+    return totals
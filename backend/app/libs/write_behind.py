@@ -0,0 +1,120 @@
+# src/app/libs/write_behind.py
+"""Write-behind buffer for the database writes of a custom step run.
+
+Instead of writing a document's results after every prompt and the step's progress after
+every document, a run records them here. Updates to the same document (or to the step)
+coalesce in memory and are flushed together as one bulk write every ``max_documents``
+documents or ``max_delay_ms`` milliseconds, and whenever the run pauses, fails or stops.
+"""
+import copy
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+DocumentWriter = Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]]  # document id -> latest payload
+StepWriter = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        write_documents: DocumentWriter,
+        write_step: StepWriter,
+        max_documents: int = 10,
+        max_delay_ms: int = 2000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._write_documents = write_documents
+        self._write_step = write_step
+        self.max_documents = max_documents
+        self.max_delay_ms = max_delay_ms
+        self._clock = clock
+        self._documents: Dict[str, Dict[str, Any]] = {}  # document id -> latest step result
+        self._step_fields: Dict[str, Any] = {}
+        self._oldest_pending_at: Optional[float] = None
+        self.metrics: Dict[str, float] = {
+            "flushes": 0,
+            "documents_flushed": 0,
+            "writes_coalesced": 0,
+            "max_flush_size": 0,
+            "last_flush_lag_ms": 0.0,
+            "max_flush_lag_ms": 0.0,
+        }
+
+    @property
+    def pending_documents(self) -> int:
+        return len(self._documents)
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._documents or self._step_fields)
+
+    def _mark_pending(self) -> None:
+        if self._oldest_pending_at is None:
+            self._oldest_pending_at = self._clock()
+
+    def put_document(self, document_id: str, payload: Dict[str, Any]) -> None:
+        """Records the latest result of a document; earlier pending versions are replaced."""
+        if document_id in self._documents:
+            self.metrics["writes_coalesced"] += 1
+        self._documents[document_id] = payload
+        self._mark_pending()
+
+    def put_step(self, **fields: Any) -> None:
+        """Records step progress fields (e.g. counts or the checkpoint); later values win."""
+        if self._step_fields:
+            self.metrics["writes_coalesced"] += 1
+        self._step_fields.update(fields)
+        self._mark_pending()
+
+    def due(self) -> bool:
+        if not self.has_pending:
+            return False
+        if len(self._documents) >= self.max_documents:
+            return True
+        return (self._clock() - self._oldest_pending_at) * 1000 >= self.max_delay_ms
+
+    async def maybe_flush(self) -> bool:
+        """Flushes if enough documents are pending or the oldest pending write is old enough."""
+        if self.due():
+            await self.flush()
+            return True
+        return False
+
+    async def flush(self) -> None:
+        """Writes everything pending. Documents are written before step progress, so a
+        checkpoint never points past results that are not yet stored."""
+        if not self.has_pending:
+            return
+        # Snapshot now: the run keeps mutating these dicts while the write runs in a thread
+        documents = {document_id: copy.deepcopy(payload) for document_id, payload in self._documents.items()}
+        step_fields = dict(self._step_fields)
+        lag_ms = (self._clock() - self._oldest_pending_at) * 1000 if self._oldest_pending_at is not None else 0.0
+        self._documents = {}
+        self._step_fields = {}
+        self._oldest_pending_at = None
+
+        try:
+            if documents:
+                await self._write_documents(documents)
+            if step_fields:
+                await self._write_step(step_fields)
+        except Exception:
+            # Put the unwritten state back (unless newer versions arrived meanwhile) so the next flush retries it
+            for document_id, payload in documents.items():
+                self._documents.setdefault(document_id, payload)
+            for key, value in step_fields.items():
+                self._step_fields.setdefault(key, value)
+            self._mark_pending()
+            raise
+
+        self.metrics["flushes"] += 1
+        self.metrics["documents_flushed"] += len(documents)
+        self.metrics["max_flush_size"] = max(self.metrics["max_flush_size"], len(documents))
+        self.metrics["last_flush_lag_ms"] = round(lag_ms, 1)
+        self.metrics["max_flush_lag_ms"] = max(self.metrics["max_flush_lag_ms"], round(lag_ms, 1))
+
+    def metrics_snapshot(self) -> Dict[str, float]:
+        snapshot = dict(self.metrics)
+        if snapshot["flushes"]:
+            snapshot["avg_flush_size"] = round(snapshot["documents_flushed"] / snapshot["flushes"], 2)
+        return snapshot
@@ -0,0 +1,195 @@
+import sys
+import os
+import re
+import types
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _split_terms(filters):
+    """Splits a PostgREST ``or``/``and`` filter list on its top-level commas."""
+    terms, depth, start = [], 0, 0
+    for index, char in enumerate(filters):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            terms.append(filters[start:index])
+            start = index + 1
+    terms.append(filters[start:])
+    return terms
+
+
+_OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+}
+
+
+def _matches_term(row, term):
+    nested = re.fullmatch(r"(and|or)\((.*)\)", term)
+    if nested:
+        combine = all if nested.group(1) == "and" else any
+        return combine(_matches_term(row, part) for part in _split_terms(nested.group(2)))
+    column, operator, value = term.split(".", 2)
+    cell = row.get(column)
+    return _OPERATORS[operator](str(cell) if cell is not None else None, value)
+
+
+class FakeQuery:
+    """In-memory PostgREST query builder: filters, ``or`` cursors, order, limit, insert and update.
+
+    Every call is recorded in ``calls`` as a tuple, e.g. ``("gt", "id", "doc-5")``, and every
+    executed query is appended to its client's ``executed`` list.
+    """
+
+    def __init__(self, client=None, table=None, rows=None):
+        self.client, self.table, self.rows = client, table, rows if rows is not None else []
+        self.calls = []
+        self._limit = None
+        self._single = False
+        self._count = None
+        self._write = None
+
+    def _record(self, *call):
+        self.calls.append(call)
+        return self
+
+    def select(self, columns="*", count=None):
+        self._count = count
+        return self._record("select", columns)
+
+    def eq(self, column, value):
+        return self._record("eq", column, value)
+
+    def neq(self, column, value):
+        return self._record("neq", column, value)
+
+    def gt(self, column, value):
+        return self._record("gt", column, value)
+
+    def gte(self, column, value):
+        return self._record("gte", column, value)
+
+    def lt(self, column, value):
+        return self._record("lt", column, value)
+
+    def lte(self, column, value):
+        return self._record("lte", column, value)
+
+    def in_(self, column, values):
+        return self._record("in", column, list(values))
+
+    def or_(self, filters):
+        return self._record("or", filters)
+
+    def order(self, column, desc=False):
+        return self._record("order", column, desc)
+
+    def limit(self, count):
+        self._limit = count
+        return self._record("limit", count)
+
+    def single(self):
+        self._single = True
+        return self
+
+    def maybe_single(self):
+        return self.single()
+
+    def insert(self, rows):
+        self._write = ("insert", rows if isinstance(rows, list) else [rows])
+        return self
+
+    def update(self, fields):
+        self._write = ("update", fields)
+        return self
+
+    def delete(self, count=None, returning="representation"):
+        self._count = count
+        self._write = ("delete", returning)
+        return self
+
+    @property
+    def cursor(self):
+        """The keyset cursor of the query (its last ``gt`` or ``or`` call), or None for a first page."""
+        cursors = [call for call in self.calls if call[0] in ("gt", "or")]
+        return cursors[-1] if cursors else None
+
+    def filter_values(self, operator):
+        """Values of the query's ``operator`` filters, e.g. ``filter_values("in")``."""
+        return [call[2] for call in self.calls if call[0] == operator]
+
+    def _matches(self, row):
+        for call in self.calls:
+            if call[0] == "in":
+                if row.get(call[1]) not in call[2]:
+                    return False
+            elif call[0] == "or":
+                if not any(_matches_term(row, term) for term in _split_terms(call[1])):
+                    return False
+            elif call[0] in _OPERATORS and not _OPERATORS[call[0]](row.get(call[1]), call[2]):
+                return False
+        return True
+
+    def execute(self):
+        if self.client is not None:
+            self.client.executed.append(self)
+        if self._write is not None and self._write[0] == "insert":
+            self.rows.extend(self._write[1])
+            return types.SimpleNamespace(data=self._write[1], count=None)
+        matching = [row for row in self.rows if self._matches(row)]
+        if self._write is not None:
+            if self._write[0] == "update":
+                for row in matching:
+                    row.update(self._write[1])
+            else:
+                self.rows[:] = [row for row in self.rows if row not in matching]
+                if self._write[1] == "minimal":
+                    return types.SimpleNamespace(data=[], count=len(matching) if self._count else None)
+            return types.SimpleNamespace(data=matching, count=len(matching) if self._count else None)
+        for _, column, desc in reversed([call for call in self.calls if call[0] == "order"]):
+            matching.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        count = len(matching) if self._count else None
+        if self._limit is not None:
+            matching = matching[:self._limit]
+        if self._single:
+            return types.SimpleNamespace(data=matching[0] if matching else None, count=count)
+        return types.SimpleNamespace(data=matching, count=count)
+
+
+class FakeSupabase:
+    """Supabase client over in-memory ``tables`` ({name: rows}); ``rpc_results`` maps function
+    names to their data, or to a callable building it from the call's params."""
+
+    def __init__(self, tables=None, rpc_results=None):
+        self.tables = tables if tables is not None else {}
+        self.rpc_results = rpc_results or {}
+        self.executed = []
+        self.rpc_calls = []
+
+    def table(self, name):
+        return FakeQuery(self, name, self.tables.setdefault(name, []))
+
+    def rpc(self, name, params):
+        self.rpc_calls.append((name, params))
+        result = self.rpc_results.get(name)
+        data = result(params) if callable(result) else result
+        return types.SimpleNamespace(execute=lambda: types.SimpleNamespace(data=data))
+
+    def executed_on(self, table):
+        return [query for query in self.executed if query.table == table]
+
+
+@pytest.fixture
+def fake_supabase():
+    """Builds a ``FakeSupabase``: ``fake_supabase(tables=..., rpc_results=...)``."""
+    return FakeSupabase
@@ -0,0 +1,37 @@
+import sys
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.analytics_counters import ANALYTICS_COUNTS_TABLE, load_counter_summary, summarize_counter_rows
+
+COUNT_ROWS = [
+    {"project_id": "p1", "sentiment": "positive", "complexity": "High", "document_count": 3},
+    {"project_id": "p1", "sentiment": "positive", "complexity": "Low", "document_count": 2},
+    {"project_id": "p1", "sentiment": "negative", "complexity": "High", "document_count": 4},
+    {"project_id": "p1", "sentiment": "neutral", "complexity": "unknown", "document_count": 0},  # Emptied by deletes
+    {"project_id": "p2", "sentiment": "positive", "complexity": "High", "document_count": 8},
+]
+
+
+def test_summarize_counter_rows_skips_empty_keys():
+    total, sentiments, complexities = summarize_counter_rows(COUNT_ROWS[:4])
+    assert total == 9
+    assert sentiments == {"positive": 5, "negative": 4}
+    assert complexities == {"High": 7, "Low": 2}
+
+
+def test_load_counter_summary_filters_counters_and_topics(fake_supabase):
+    topics = [{"topic": "housing", "topic_count": 5}, {"topic": "transport", "topic_count": 2}]
+    supabase = fake_supabase({ANALYTICS_COUNTS_TABLE: list(COUNT_ROWS)}, {"analytics_counter_top_topics": topics})
+    summary = load_counter_summary(supabase, project_id="p1", sentiment="positive", top_n=5)
+    assert summary["total_documents"] == 5
+    assert summary["complexity_distribution"] == {"High": 3, "Low": 2}
+    assert summary["top_topics"] == [("housing", 5), ("transport", 2)]
+    assert supabase.rpc_calls == [
+        (
+            "analytics_counter_top_topics",
+            {"p_project_id": "p1", "p_sentiment": "positive", "p_complexity": None, "p_limit": 5},
+        )
+    ]
@@ -0,0 +1,59 @@
+import sys
+import os
+from datetime import date
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.analytics_timeseries import load_timeseries
+
+BUCKETS = [
+    {
+        "bucket_start": "2026-09-28",
+        "total_documents": 4,
+        "sentiment_distribution": {"positive": 3, "negative": 1},
+        "complexity_distribution": {"High": 4},
+        "top_topics": [{"topic": "housing", "topic_count": 3}],
+    },
+    {
+        "bucket_start": "2026-10-05",
+        "total_documents": 1,
+        "sentiment_distribution": {"neutral": 1},
+        "complexity_distribution": None,
+        "top_topics": [],
+    },
+]
+
+
+def test_load_timeseries_passes_filters_and_parses_buckets(fake_supabase):
+    supabase = fake_supabase(rpc_results={"analytics_timeseries": BUCKETS})
+    buckets = load_timeseries(
+        supabase, "p1", date_basis="response_date", resolution="week", start_date=date(2026, 9, 1), sentiment="positive"
+    )
+    assert [b["bucket_start"] for b in buckets] == [date(2026, 9, 28), date(2026, 10, 5)]
+    assert buckets[0]["top_topics"] == [("housing", 3)]
+    assert buckets[1]["complexity_distribution"] == {}
+    assert supabase.rpc_calls == [
+        (
+            "analytics_timeseries",
+            {
+                "p_project_id": "p1",
+                "p_date_basis": "response_date",
+                "p_resolution": "week",
+                "p_from": "2026-09-01",
+                "p_to": None,
+                "p_sentiment": "positive",
+                "p_complexity": None,
+                "p_top_n": 5,
+            },
+        )
+    ]
+
+
+def test_load_timeseries_rejects_unknown_options(fake_supabase):
+    with pytest.raises(ValueError):
+        load_timeseries(fake_supabase(), "p1", resolution="quarter")
+    with pytest.raises(ValueError):
+        load_timeseries(fake_supabase(), "p1", date_basis="created_at")
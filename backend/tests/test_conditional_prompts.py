@@ -0,0 +1,30 @@
+import sys
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.conditional_prompts import evaluate_condition_result
+
+
+def test_bare_values():
+    assert evaluate_condition_result(True) is True
+    assert evaluate_condition_result(False) is False
+    assert evaluate_condition_result("Yes") is True
+    assert evaluate_condition_result("no") is False
+
+
+def test_condition_key_in_object():
+    assert evaluate_condition_result({"condition": True}) is True
+    assert evaluate_condition_result({"Condition_Met": "false"}) is False
+    assert evaluate_condition_result({"reason": "mentions AI", "result": True}) is True
+
+
+def test_single_valued_object():
+    assert evaluate_condition_result({"mentions_ai": False}) is False
+
+
+def test_uninterpretable_results():
+    assert evaluate_condition_result({"a": 1, "b": 2}) is None
+    assert evaluate_condition_result("maybe") is None
+    assert evaluate_condition_result([True]) is None
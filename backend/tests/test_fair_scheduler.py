@@ -0,0 +1,78 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.fair_scheduler import FairScheduler, WorkFlow
+
+
+async def _grant_order(scheduler, blocker, waiting):
+    """Holds the only slot with ``blocker``, queues ``waiting`` (label, flow) pairs and records the grant order."""
+    order = []
+    await scheduler.acquire(blocker)
+
+    async def work(label, flow):
+        async with scheduler.slot(flow):
+            order.append(label)
+
+    tasks = []
+    for label, flow in waiting:
+        tasks.append(asyncio.create_task(work(label, flow)))
+        await asyncio.sleep(0)
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_projects_share_slots_instead_of_first_come_first_served():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1)
+        big, small = WorkFlow("run-big", "big", user_id="u1"), WorkFlow("run-small", "small", user_id="u2")
+        waiting = [("big", big)] * 4 + [("small", small)] * 2
+        return await _grant_order(scheduler, WorkFlow("blocker", "x", user_id="u0"), waiting), big, small
+
+    order, big, small = asyncio.run(scenario())
+    assert order == ["big", "small", "big", "small", "big", "big"]
+    assert big.items == 4 and small.items == 2
+    assert big.wait_stats()["queued_items"] == 4
+
+
+def test_priority_and_weights():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1)
+        heavy = WorkFlow("run-heavy", "heavy", user_id="u1", project_weight=2.0)
+        light = WorkFlow("run-light", "light", user_id="u1")
+        urgent = WorkFlow("run-urgent", "urgent", user_id="u3", priority=5)
+        waiting = [("heavy", heavy)] * 4 + [("light", light)] * 2 + [("urgent", urgent)]
+        return await _grant_order(scheduler, WorkFlow("blocker", "x"), waiting)
+
+    order = asyncio.run(scenario())
+    assert order[0] == "urgent"
+    # Of one user's slots, a project with twice the weight gets two for every one of the other project
+    assert order[1:4].count("heavy") == 2
+    assert order[1:] == ["heavy", "light", "heavy", "heavy", "light", "heavy"]
+
+
+def test_concurrency_limit_and_cancelled_waiters():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=2)
+        flow = WorkFlow("run", "p")
+        await scheduler.acquire(flow)
+        await scheduler.acquire(flow)
+        waiter = asyncio.create_task(scheduler.acquire(flow))
+        await asyncio.sleep(0)
+        assert (scheduler.active, scheduler.queued) == (2, 1)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.queued == 0
+        scheduler.release()
+        return scheduler.active
+
+    assert asyncio.run(scenario()) == 1
+    with pytest.raises(ValueError):
+        FairScheduler(max_concurrency=0)
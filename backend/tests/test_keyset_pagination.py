@@ -0,0 +1,47 @@
+import sys
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.keyset_pagination import AdaptiveBatchSize, iter_keyset_rows, keyset_page
+
+
+def test_keyset_page_filters_after_cursor(fake_supabase):
+    query = keyset_page(fake_supabase().table("documents"), "doc-5", 20)
+    assert query.calls == [("gt", "id", "doc-5"), ("order", "id", False), ("limit", 20)]
+    assert keyset_page(fake_supabase().table("documents"), None, 10).calls == [("order", "id", False), ("limit", 10)]
+
+
+def test_batch_size_adapts_to_text_length():
+    sizer = AdaptiveBatchSize(initial=10, minimum=2, maximum=50, target_chars=10_000)
+    assert sizer.update([{"extracted_text": "x" * 100}] * 3) == 50
+    assert sizer.update([{"extracted_text": "x" * 2_000}]) == 5
+    assert sizer.update([{"extracted_text": "x" * 100_000}]) == 2
+    assert sizer.update([{"extracted_text": None}]) == 50
+    assert sizer.update([]) == 50
+
+
+def _cursors(supabase):
+    return [query.cursor for query in supabase.executed]
+
+
+def test_iter_keyset_rows_walks_every_page(fake_supabase):
+    supabase = fake_supabase({"documents": [{"id": f"doc-{i}"} for i in range(5)]})
+    rows = list(iter_keyset_rows(lambda: supabase.table("documents").select("id"), page_size=2))
+    assert [r["id"] for r in rows] == [f"doc-{i}" for i in range(5)]
+    assert _cursors(supabase) == [None, ("gt", "id", "doc-1"), ("gt", "id", "doc-3")]
+    # An exactly full last page costs one extra, empty request
+    supabase = fake_supabase({"documents": [{"id": "a"}, {"id": "b"}]})
+    assert len(list(iter_keyset_rows(lambda: supabase.table("documents").select("id"), page_size=2))) == 2
+    assert _cursors(supabase) == [None, ("gt", "id", "b")]
+
+
+def test_iter_keyset_rows_composite_cursor(fake_supabase):
+    keys = [("d1", "s1"), ("d1", "s2"), ("d2", "s1")]
+    supabase = fake_supabase({"results": [{"document_id": d, "step_id": s} for d, s in reversed(keys)]})
+    rows = list(
+        iter_keyset_rows(lambda: supabase.table("results").select("*"), keys=("document_id", "step_id"), page_size=2)
+    )
+    assert [(r["document_id"], r["step_id"]) for r in rows] == keys
+    assert _cursors(supabase)[1] == ("or", "document_id.gt.d1,and(document_id.eq.d1,step_id.gt.s2)")
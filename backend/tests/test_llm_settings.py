@@ -0,0 +1,30 @@
+import sys
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.llm_settings import DEFAULT_MODEL, ModelSettings, completion_kwargs, resolve_model_settings
+
+
+def test_resolve_uses_defaults_when_nothing_configured():
+    settings = resolve_model_settings(None, None)
+    assert settings.model == DEFAULT_MODEL
+    assert settings.escalation_model is None
+
+
+def test_prompt_settings_override_step_settings():
+    step = ModelSettings(model="gpt-4o-mini", escalation_model="gpt-4o", temperature=0.5)
+    prompt = ModelSettings(temperature=0.0, max_tokens=300)
+    settings = resolve_model_settings(step, prompt)
+    assert settings.model == "gpt-4o-mini"
+    assert settings.escalation_model == "gpt-4o"
+    assert settings.temperature == 0.0
+    assert settings.max_tokens == 300
+
+
+def test_completion_kwargs_model_override():
+    settings = resolve_model_settings(ModelSettings(escalation_model="gpt-4o"))
+    kwargs = completion_kwargs(settings, model=settings.escalation_model)
+    assert kwargs["model"] == "gpt-4o"
+    assert "max_tokens" not in kwargs
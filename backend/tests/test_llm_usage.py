@@ -0,0 +1,68 @@
+import sys
+import os
+import asyncio
+import types
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.llm_usage import (
+    RunUsageTracker,
+    TokenUsage,
+    load_run_usage,
+    load_step_usage,
+)
+
+
+def _completion(prompt, completion, cached=0):
+    usage = types.SimpleNamespace(
+        prompt_tokens=prompt,
+        completion_tokens=completion,
+        prompt_tokens_details=types.SimpleNamespace(cached_tokens=cached),
+    )
+    return types.SimpleNamespace(usage=usage)
+
+
+def test_from_completion_reads_cached_tokens():
+    usage = TokenUsage.from_completion(_completion(100, 20, cached=64))
+    assert (usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens, usage.calls) == (100, 20, 64, 1)
+    assert TokenUsage.from_completion(types.SimpleNamespace()).total_tokens == 0
+
+
+def test_tracker_records_rows_and_enforces_budget(fake_supabase):
+    rows = []
+    supabase = fake_supabase({"llm_usage_events": rows})
+    tracker = RunUsageTracker(supabase, 'p', 's', token_budget=250)
+
+    asyncio.run(tracker.record(_completion(100, 20), 'doc-1', 'gpt-4o-mini'))
+    assert not tracker.budget_exceeded
+    asyncio.run(tracker.record(_completion(100, 40), 'doc-2', 'gpt-4o-mini'))
+    assert tracker.budget_exceeded
+    assert [row['document_id'] for row in rows] == ['doc-1', 'doc-2']
+    assert tracker.by_document['doc-2'].total_tokens == 140
+
+
+def test_load_run_usage_sums_in_the_database(fake_supabase):
+    row = {"prompt_tokens": 300, "completion_tokens": 45, "cached_tokens": 0, "calls": 3}
+    supabase = fake_supabase(rpc_results={"step_run_token_usage": [row]})
+    usage = load_run_usage(supabase, 's', 'r')
+    assert (usage.total_tokens, usage.calls) == (345, 3)
+    assert supabase.rpc_calls == [("step_run_token_usage", {"p_step_id": 's', "p_run_id": 'r'})]
+
+
+def test_load_step_usage_reads_database_aggregates(fake_supabase):
+    data = {
+        "step_totals": {"prompt_tokens": 300, "completion_tokens": 60, "cached_tokens": 64, "calls": 3},
+        "project_totals": {"prompt_tokens": 900, "completion_tokens": 100, "cached_tokens": 64, "calls": 7},
+        "runs": [{"run_id": "r1", "prompt_tokens": 300, "completion_tokens": 60, "cached_tokens": 64, "calls": 3}],
+        "documents": [
+            {"document_id": "doc-2", "prompt_tokens": 200, "completion_tokens": 40, "cached_tokens": 0, "calls": 2},
+            {"document_id": "doc-1", "prompt_tokens": 100, "completion_tokens": 20, "cached_tokens": 64, "calls": 1},
+        ],
+    }
+    supabase = fake_supabase(rpc_results={"step_token_usage": data})
+    usage = load_step_usage(supabase, 'p', 's', document_limit=2)
+    assert supabase.rpc_calls == [("step_token_usage", {"p_project_id": 'p', "p_step_id": 's', "p_document_limit": 2})]
+    assert (usage["step_totals"].total_tokens, usage["project_totals"].calls) == (360, 7)
+    assert [(run_id, run.cached_tokens) for run_id, run in usage["runs"]] == [("r1", 64)]
+    assert [document_id for document_id, _ in usage["documents"]] == ["doc-2", "doc-1"]
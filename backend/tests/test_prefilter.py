@@ -0,0 +1,60 @@
+import sys
+import os
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.prefilter import AnalysisCondition, PreFilter, count_llm_calls, evaluate_prefilter
+
+DOCS = [
+    {"id": "a", "extracted_text": "We urge stricter AI regulation of facial recognition.", "analysis": {"overall_sentiment": "negative"}},
+    {"id": "b", "extracted_text": "Thanks for the consultation.", "analysis": {"overall_sentiment": "positive"}},
+    {"id": "c", "extracted_text": None, "analysis": {"overall_sentiment": "negative"}},
+]
+
+
+def test_no_filter_runs_everything():
+    assert evaluate_prefilter(None, DOCS) == {"a": None, "b": None, "c": None}
+
+
+def test_keywords_and_min_length():
+    decisions = evaluate_prefilter(PreFilter(keywords_any=["regulation", "ban"], min_length=10), DOCS)
+    assert decisions["a"] is None
+    assert "keywords_any" in decisions["b"]
+    # Documents without stored text are never skipped by text rules
+    assert decisions["c"] is None
+
+
+def test_keywords_match_whole_terms_case_insensitively():
+    assert evaluate_prefilter(PreFilter(keywords_all=["ai"]), DOCS)["a"] is None
+    assert evaluate_prefilter(PreFilter(keywords_all=["AI"], case_sensitive=True), DOCS)["a"] is None
+    assert evaluate_prefilter(PreFilter(keywords_any=["regulat"]), DOCS)["a"] is not None
+    assert "excluded" in evaluate_prefilter(PreFilter(exclude_keywords=["facial recognition"]), DOCS)["a"]
+
+
+def test_regex_and_analysis_conditions():
+    prefilter = PreFilter(
+        regex=r"regulat(ion|e)",
+        analysis_conditions=[AnalysisCondition(field="overall_sentiment", op="in", value=["negative", "neutral"])],
+    )
+    decisions = evaluate_prefilter(prefilter, DOCS)
+    assert decisions["a"] is None
+    assert decisions["b"] == "regex did not match"
+    assert decisions["c"] is None
+    only_positive = PreFilter(analysis_conditions=[AnalysisCondition(field="overall_sentiment", value="positive")])
+    assert evaluate_prefilter(only_positive, DOCS)["a"].startswith("analysis condition not met")
+
+
+def test_invalid_regex_is_rejected():
+    with pytest.raises(ValueError):
+        PreFilter(regex="(unclosed")
+
+
+def test_count_llm_calls():
+    prompts = [
+        {"type": "standard_prompt", "prompt": {"text": "x"}},
+        {"type": "conditional_block", "condition_prompt": {"text": "c"}, "action_prompts": [{"text": "a"}, {"text": "b"}]},
+    ]
+    assert count_llm_calls(prompts) == 4
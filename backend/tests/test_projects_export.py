@@ -0,0 +1,65 @@
+import sys
+import types
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+# Stub external dependencies so app.apis.projects can be imported without them
+sys.modules.setdefault('supabase', types.ModuleType('supabase'))
+sys.modules.setdefault('supabase.client', types.ModuleType('supabase.client'))
+sys.modules['supabase.client'].Client = object
+sys.modules.setdefault('postgrest.exceptions', types.SimpleNamespace(APIError=Exception))
+# Stub documents dependency
+stub_doc_mod = types.ModuleType('app.apis.documents.__init__')
+stub_doc_mod.get_supabase_client = lambda: None
+sys.modules['app.apis.documents'] = stub_doc_mod
+sys.modules['app.apis.documents.__init__'] = stub_doc_mod
+
+from app.apis import projects
+
+HEADERS = ["document_id", "document_file_name", "created_at", "status", "analysis_n"]
+
+
+def _tables():
+    documents = [{"id": f"d{i}", "project_id": "p1", "analysis": {"n": i}} for i in range(3)]
+    documents.append({"id": "d9", "project_id": "p2"})
+    results = [{"document_id": "d2", "step_id": "s1", "result": {"stance": "for"}}]
+    return {"documents": documents, "document_step_results": results}
+
+
+def test_export_documents_are_keyset_paged_with_results(monkeypatch, fake_supabase):
+    monkeypatch.setattr(projects, "EXPORT_PAGE_SIZE", 2)
+    supabase = fake_supabase(_tables())
+
+    exported = list(projects._iter_export_documents(supabase, "p1"))
+    assert [doc["id"] for doc in exported] == ["d0", "d1", "d2"]
+    assert exported[2]["custom_analysis_results"] == {"s1": {"stance": "for"}}
+    flat_analysis, flat_custom = projects._flatten_export_document(exported[2], {"s1": "Stance step"})
+    assert flat_analysis == {"analysis_n": 2}
+    assert flat_custom == {"Stance_step_stance": "for"}
+    # Two document pages (the second after "d1"), each followed by one results lookup for its ids
+    assert [(query.table, query.cursor, query.filter_values("in")) for query in supabase.executed] == [
+        ("documents", None, []),
+        ("document_step_results", None, [["d0", "d1"]]),
+        ("documents", ("gt", "id", "d1"), []),
+        ("document_step_results", None, [["d2"]]),
+    ]
+
+
+def test_csv_export_ends_with_error_row_when_streaming_fails(monkeypatch, fake_supabase):
+    monkeypatch.setattr(projects, "EXPORT_PAGE_SIZE", 2)
+    supabase = fake_supabase(_tables())
+    table = supabase.table
+
+    def failing_table(name):
+        if name == "documents" and supabase.executed_on("documents"):
+            raise RuntimeError("connection reset")
+        return table(name)
+
+    supabase.table = failing_table
+    lines = "".join(projects._csv_export_chunks(supabase, "p1", HEADERS, {})).splitlines()
+    assert lines[0] == ",".join(HEADERS)
+    assert [line.split(",")[0] for line in lines[1:3]] == ["d0", "d1"]
+    assert lines[3].startswith(f"{projects.EXPORT_ERROR_MARKER},Export incomplete: stopped after 2 documents")
+    assert len(lines) == 4
@@ -0,0 +1,49 @@
+import sys
+import os
+import json
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.prompt_templates import (
+    build_step_context,
+    compact_json,
+    estimate_tokens,
+    referenced_step_names,
+    render_prompt_template,
+)
+
+
+def test_render_step_field_by_name():
+    steps = build_step_context(
+        {'step-1': {'stance': 'oppose', 'status': 'success'}, 'step-2': {'x': 1}},
+        {'step-1': 'Sentiment', 'step-2': 'Other'},
+        exclude_step_id='step-2',
+    )
+    rendered, unresolved = render_prompt_template('Stance was {{ steps.sentiment.stance }}.', steps=steps)
+    assert rendered == 'Stance was oppose.'
+    assert unresolved == []
+    assert 'other' not in steps
+
+
+def test_render_objects_compactly_and_strip_metadata():
+    steps = build_step_context({'s1': {'a': [1, 2], 'status': 'success'}}, {'s1': 'Facts'})
+    rendered, _ = render_prompt_template('{{steps.Facts}} / {{current.k}}', steps=steps, current={'k': {'v': True}})
+    assert rendered == '{"a":[1,2]} / {"v":true}'
+
+
+def test_unresolved_references_render_null():
+    rendered, unresolved = render_prompt_template('{{steps.Missing.field}}', steps={})
+    assert rendered == 'null'
+    assert unresolved == ['steps.Missing.field']
+
+
+def test_referenced_step_names():
+    assert referenced_step_names('{{steps.Overall Sentiment.label}} {{current.x}}') == {'overallsentiment'}
+
+
+def test_compact_json_respects_budget():
+    value = {'long': 'x' * 5000, 'items': list(range(200))}
+    serialized = compact_json(value, token_budget=100)
+    assert estimate_tokens(serialized) <= 100
+    json.loads(serialized)
@@ -0,0 +1,42 @@
+import sys
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.response_cache import VersionedLRUCache
+
+
+def _cache(**kwargs):
+    now = [0.0]
+    return VersionedLRUCache(clock=lambda: now[0], **kwargs), now
+
+
+def test_hit_reports_age_until_version_changes():
+    cache, now = _cache(ttl_seconds=60)
+    cache.put(("p1", None), 3, "summary")
+    now[0] = 12.5
+    assert cache.get(("p1", None), 3) == ("summary", 12.5)
+    # A write bumped the project's version: the entry is dropped, not served
+    assert cache.get(("p1", None), 4) is None
+    assert cache.get(("p1", None), 3) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_entries_expire_after_ttl():
+    cache, now = _cache(ttl_seconds=10)
+    cache.put("k", 1, "v")
+    now[0] = 10.5
+    assert cache.get("k", 1) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache, _ = _cache(max_entries=2)
+    cache.put("a", 1, "A")
+    cache.put("b", 1, "B")
+    assert cache.get("a", 1) is not None  # "b" is now the least recently used
+    cache.put("c", 1, "C")
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1)[0] == "A"
+    assert cache.get("c", 1)[0] == "C"
@@ -0,0 +1,44 @@
+import sys
+import os
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.run_control import CANCEL, PAUSE, RunControlRegistry
+
+
+def test_request_signals_registered_run_only():
+    registry = RunControlRegistry()
+    assert registry.request("step-1", PAUSE) is False
+    control = registry.register("step-1")
+    assert not control.stop_requested
+    assert registry.request("step-1", PAUSE) is True
+    assert control.stop_requested and control.stop_reason == PAUSE
+    registry.request("step-1", CANCEL)
+    assert control.stop_reason == CANCEL
+    with pytest.raises(ValueError):
+        registry.request("step-1", "explode")
+
+
+def test_db_status_fallback():
+    control = RunControlRegistry().register("step-1")
+    control.observe_db_status("running")
+    control.observe_db_status(None)
+    assert not control.stop_requested
+    control.observe_db_status("paused")
+    assert control.stop_reason == PAUSE
+    other = RunControlRegistry().register("step-2")
+    other.observe_db_status("idle")
+    assert other.stop_reason == CANCEL
+
+
+def test_release_ignores_newer_registration():
+    registry = RunControlRegistry()
+    old = registry.register("step-1")
+    new = registry.register("step-1")
+    registry.release("step-1", old)
+    assert registry.get("step-1") is new
+    registry.release("step-1", new)
+    assert registry.get("step-1") is None
@@ -0,0 +1,67 @@
+import sys
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs import run_estimate
+from app.libs.run_estimate import (
+    PROMPT_OVERHEAD_TOKENS,
+    estimate_cost_usd,
+    estimate_document_calls,
+    estimate_duration_seconds,
+    history_rates,
+)
+
+
+def test_count_tokens_falls_back_to_chars_per_token(monkeypatch):
+    monkeypatch.setattr(run_estimate, "tiktoken", None)
+    assert run_estimate.count_tokens("x" * 401) == 101
+    assert run_estimate.count_tokens(None) == 0
+
+
+def test_document_calls_cover_conditional_blocks_and_context(monkeypatch):
+    monkeypatch.setattr(run_estimate, "tiktoken", None)
+    prompts = [
+        {"type": "standard_prompt", "prompt": {"text": "x" * 40}},
+        {
+            "type": "conditional_block",
+            "condition_prompt": {"text": "x" * 40, "include_document_context": False},
+            "action_prompts": [
+                {"text": "x" * 40, "include_other_steps_context": True, "context_token_budget": 300},
+                {"text": "y" * 40, "model_settings": {"model": "gpt-4o", "max_tokens": 50}},
+            ],
+        },
+    ]
+    calls = estimate_document_calls(prompts, document_tokens=1000, output_tokens_per_call=200)
+    assert [call["input_tokens"] - PROMPT_OVERHEAD_TOKENS - 10 for call in calls] == [
+        1000,  # Document only
+        200,  # Earlier answer as context, no document
+        1000 + 300 + 300,  # Context capped at the prompt's budget, plus the other steps' block
+        1000 + 600,
+    ]
+    assert [call["model"] for call in calls] == ["gpt-4o-mini", "gpt-4o-mini", "gpt-4o-mini", "gpt-4o"]
+    assert calls[3]["output_tokens"] == 50
+
+
+def test_history_rates_and_duration():
+    assert history_rates([])["runs_used"] == 0
+    rates = history_rates(
+        [
+            {"llm_calls": 10, "llm_time_ms": 20000, "duration_ms": 25000, "processed_count": 5, "completion_tokens": 1000},
+            {"llm_calls": 10, "llm_time_ms": 20000, "duration_ms": 25000, "processed_count": 4, "failed_count": 1},
+        ]
+    )
+    assert (rates["call_latency_ms"], rates["document_overhead_ms"], rates["output_tokens_per_call"]) == (2000, 1000, 50)
+
+    duration = estimate_duration_seconds(documents=100, calls=200, total_tokens=600_000, rates=rates, workers=2)
+    assert duration["estimated_seconds"] == (200 * 2 + 100 * 1) / 2
+    limited = estimate_duration_seconds(
+        100, 200, 600_000, rates, workers=2, rate_limits={"tokens_per_minute": 100_000, "requests_per_minute": None}
+    )
+    assert (limited["rate_limit_seconds"], limited["estimated_seconds"]) == (360, 360)
+
+
+def test_cost():
+    assert estimate_cost_usd({"gpt-4o-mini": {"input_tokens": 2_000_000, "output_tokens": 1_000_000}}) == 0.9
+    assert estimate_cost_usd({"some-private-model": {"input_tokens": 1, "output_tokens": 1}}) is None
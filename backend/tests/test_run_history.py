@@ -0,0 +1,63 @@
+import sys
+import os
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.llm_usage import TokenUsage
+from app.libs.run_history import RunStats, aggregate_runs, percentile, run_finish_fields
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_percentile_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile([7.0], 95) == 7
+    assert percentile([], 50) is None
+
+
+def test_run_stats_summary():
+    clock = _Clock()
+    stats = RunStats(clock=clock)
+    for seconds in (1.0, 2.0, 3.0, 10.0):
+        doc_started_at = stats.now()
+        llm_started_at = stats.now()
+        clock.now += seconds / 2
+        stats.add_llm_time(llm_started_at)
+        clock.now += seconds / 2
+        stats.document_finished(doc_started_at)
+    clock.now += 4.0  # Time outside documents (batch queries, writes)
+
+    summary = stats.summary()
+    assert summary["duration_ms"] == 20000
+    assert summary["docs_per_minute"] == 12.0
+    assert summary["latency_p50_ms"] == 2000
+    assert summary["latency_p95_ms"] == 10000
+    assert summary["llm_time_ms"] == 8000
+    assert summary["llm_time_share"] == 0.4
+
+
+def test_finish_fields_and_aggregate():
+    stats = RunStats(clock=_Clock())
+    fields = run_finish_fields("completed", stats, 3, 1, 4, TokenUsage(prompt_tokens=10, completion_tokens=5, calls=2))
+    assert fields["docs_per_minute"] is None  # No time elapsed
+    assert (fields["total_tokens"], fields["llm_calls"]) == (15, 2)
+
+    rows = [
+        {"finished_at": "t2", "processed_count": 3, "failed_count": 1, "total_tokens": 15, "docs_per_minute": 10.0},
+        {"finished_at": "t1", "processed_count": 5, "failed_count": 0, "total_tokens": 5, "docs_per_minute": 20.0},
+        {"finished_at": None, "processed_count": 2, "total_tokens": 100},  # Still running
+    ]
+    aggregate = aggregate_runs(rows)
+    assert (aggregate["runs"], aggregate["finished_runs"]) == (3, 2)
+    assert (aggregate["documents_processed"], aggregate["documents_failed"], aggregate["total_tokens"]) == (8, 1, 20)
+    assert aggregate["avg_docs_per_minute"] == 15.0
+    assert aggregate["avg_latency_p95_ms"] is None
@@ -0,0 +1,141 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.run_registry import HEARTBEAT_EVENT, RunEventBus, RunRegistry, parse_last_event_id, sse_event_name
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {data}\n\n"
+
+
+async def _run_events(release: asyncio.Event, finished: list):
+    try:
+        yield _event("init", "start")
+        await release.wait()
+        yield _event("progress", "1")
+        yield _event("final_status", "done")
+    finally:
+        finished.append(True)
+
+
+async def _collect(subscription):
+    return [event async for event in subscription]
+
+
+def test_sse_event_name():
+    assert sse_event_name(_event("progress", "{}")) == "progress"
+    assert sse_event_name("data: x\n\n") is None
+
+
+def test_run_survives_subscriber_disconnect_and_fans_out():
+    async def scenario():
+        registry = RunRegistry()
+        release, finished = asyncio.Event(), []
+        run = registry.start("step-1", _run_events(release, finished), run_id="r1")
+        with pytest.raises(RuntimeError):
+            registry.start("step-1", _run_events(release, finished))
+
+        # A client that attaches and then goes away does not stop the run
+        dropped = run.bus.subscribe()
+        assert await dropped.__anext__() == "id: 1\n" + _event("init", "start")
+        await dropped.aclose()
+
+        late = asyncio.create_task(_collect(run.bus.subscribe()))
+        await asyncio.sleep(0)
+        release.set()
+        events = await late
+        await run.task
+        return registry, run, events, finished
+
+    registry, run, events, finished = asyncio.run(scenario())
+    assert [sse_event_name(e) for e in events] == ["init", "progress", "final_status"]
+    assert finished == [True]
+    assert run.bus.subscriber_count == 0
+    assert registry.get("step-1") is None
+
+
+def test_late_subscriber_after_run_end_gets_last_state():
+    async def scenario():
+        registry = RunRegistry()
+        release, finished = asyncio.Event(), []
+        release.set()
+        run = registry.start("step-2", _run_events(release, finished))
+        await run.task
+        return await _collect(run.bus.subscribe())
+
+    events = asyncio.run(scenario())
+    assert [sse_event_name(e) for e in events] == ["init", "progress", "final_status"]
+
+
+def _event_ids(events):
+    return [int(e.split("\n", 1)[0][len("id: "):]) for e in events]
+
+
+def test_reconnect_replays_events_after_last_event_id():
+    async def scenario():
+        bus = RunEventBus()
+        for i in range(5):
+            bus.publish(_event("document_processing_error", str(i)))
+        bus.close()
+        return await _collect(bus.subscribe(last_event_id=3)), await _collect(bus.subscribe())
+
+    resumed, fresh = asyncio.run(scenario())
+    assert _event_ids(resumed) == [4, 5]
+    # Without an id only the latest event of each type is sent
+    assert _event_ids(fresh) == [5]
+    assert parse_last_event_id("7") == 7
+    assert parse_last_event_id("abc") is None
+
+
+def test_stale_last_event_id_from_earlier_run_gets_current_state():
+    async def scenario():
+        bus = RunEventBus()
+        bus.publish(_event("init", "start"))
+        bus.publish(_event("document_processing_error", "0"))
+        bus.close()
+        # The client last saw event 40 of a previous, longer run of the same step
+        return await _collect(bus.subscribe(last_event_id=40))
+
+    assert _event_ids(asyncio.run(scenario())) == [1, 2]
+
+
+def test_running_progress_is_coalesced_within_window():
+    now = [0.0]
+
+    async def scenario():
+        bus = RunEventBus(progress_window=0.5, clock=lambda: now[0])
+        subscription = _collect(bus.subscribe())
+        task = asyncio.create_task(subscription)
+        await asyncio.sleep(0)
+        for i in range(4):
+            bus.publish(_event("progress", f'{{"status": "running", "processed": {i}}}'))
+        bus.publish(_event("final_status", '{"status": "completed"}'))
+        bus.close()
+        return bus, await task
+
+    bus, events = asyncio.run(scenario())
+    # First update goes out at once, the middle ones merge into the latest, which precedes final_status
+    assert [e.split("data: ")[1].strip() for e in events] == [
+        '{"status": "running", "processed": 0}',
+        '{"status": "running", "processed": 3}',
+        '{"status": "completed"}',
+    ]
+    assert _event_ids(events) == [1, 2, 3]
+    assert bus.coalesced_progress_events == 2
+
+
+def test_idle_subscriber_receives_heartbeat():
+    async def scenario():
+        bus = RunEventBus()
+        subscription = bus.subscribe(heartbeat_seconds=0.01)
+        first = await subscription.__anext__()
+        await subscription.aclose()
+        return first
+
+    assert asyncio.run(scenario()) == HEARTBEAT_EVENT
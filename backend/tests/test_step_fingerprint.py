@@ -0,0 +1,68 @@
+import sys
+import os
+import hashlib
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.step_fingerprint import document_text_hash, step_fingerprint
+
+
+def _step(**overrides):
+    step = {
+        "name": "Stance",
+        "prompts": [{"type": "standard_prompt", "prompt": {"text": "Classify the stance."}}],
+        "model_settings": {"model": "gpt-4o-mini"},
+        "pre_filter": None,
+        "token_budget": 1000,
+    }
+    step.update(overrides)
+    return step
+
+
+def test_fingerprint_tracks_result_shaping_fields_only():
+    base = step_fingerprint(_step())
+    assert base == step_fingerprint(_step(name="Renamed", token_budget=5000, run_status="running"))
+    assert base != step_fingerprint(_step(prompts=[{"type": "standard_prompt", "prompt": {"text": "Other"}}]))
+    assert base != step_fingerprint(_step(model_settings={"model": "gpt-4o"}))
+    assert base != step_fingerprint(_step(pre_filter={"min_length": 200}))
+
+
+def test_fingerprint_is_key_order_independent_and_uses_legacy_description():
+    assert step_fingerprint({"model_settings": {"model": "m", "temperature": 0.5}}) == step_fingerprint(
+        {"model_settings": {"temperature": 0.5, "model": "m"}}
+    )
+    assert step_fingerprint({"prompts": None, "description": "Old"}) != step_fingerprint(
+        {"prompts": None, "description": "New"}
+    )
+
+
+def test_document_text_hash_matches_postgres_md5_of_coalesced_text():
+    assert document_text_hash("Réponse") == hashlib.md5("Réponse".encode("utf-8")).hexdigest()
+    assert document_text_hash(None) == document_text_hash("") == "d41d8cd98f00b204e9800998ecf8427e"
+
+
+def test_fingerprint_normalizes_defaults_the_same_way_for_create_and_update_payloads():
+    # Create dumps prompts with exclude_none (defaults kept); update dumps with exclude_unset (defaults dropped)
+    created = _step(
+        prompts=[
+            {
+                "type": "standard_prompt",
+                "prompt": {
+                    "text": "Classify the stance.",
+                    "include_document_context": True,
+                    "include_other_steps_context": False,
+                },
+            }
+        ],
+        model_settings={"model": "gpt-4o-mini"},
+        pre_filter={"min_length": 200},
+    )
+    updated = _step(
+        prompts=[{"prompt": {"text": "Classify the stance."}}],
+        model_settings={"model": "gpt-4o-mini", "temperature": None},
+        pre_filter={"min_length": 200, "keywords_any": [], "case_sensitive": False},
+    )
+    assert step_fingerprint(created) == step_fingerprint(updated)
+    assert step_fingerprint(_step(model_settings={})) == step_fingerprint(_step(model_settings=None))
+    assert step_fingerprint(_step(prompts=["Legacy prompt"])) != step_fingerprint(_step(prompts=["Other"]))
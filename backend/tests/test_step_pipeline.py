@@ -0,0 +1,47 @@
+import sys
+import os
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.step_pipeline import PipelineCycleError, order_steps_by_dependencies, step_dependencies
+
+
+def _step(step_id, name, *texts, conditional=False):
+    if conditional:
+        prompts = [
+            {
+                "type": "conditional_block",
+                "condition_prompt": {"text": texts[0]},
+                "action_prompts": [{"text": text} for text in texts[1:]],
+            }
+        ]
+    else:
+        prompts = [{"type": "standard_prompt", "prompt": {"text": text}} for text in texts]
+    return {"id": step_id, "name": name, "prompts": prompts}
+
+
+def test_steps_run_after_the_steps_they_reference():
+    steps = [
+        _step("s1", "Summary", "Summarize given stance {{steps.Stance.label}}"),
+        _step("s2", "Topics", "List the topics."),
+        _step("s3", "Stance", "Is it about {{ steps.topics }}?", "Stance?", conditional=True),
+    ]
+    assert step_dependencies(steps) == {"s1": {"s3"}, "s2": set(), "s3": {"s2"}}
+    assert [s["id"] for s in order_steps_by_dependencies(steps)] == ["s2", "s3", "s1"]
+
+
+def test_unknown_and_self_references_are_ignored_and_order_is_stable():
+    steps = [
+        _step("s1", "A", "{{steps.A.x}} {{steps.Missing.y}} {{current.z}}"),
+        _step("s2", "B", "Plain prompt"),
+    ]
+    assert [s["id"] for s in order_steps_by_dependencies(steps)] == ["s1", "s2"]
+
+
+def test_cycles_are_rejected():
+    steps = [_step("s1", "A", "{{steps.B}}"), _step("s2", "B", "{{steps.a.field}}")]
+    with pytest.raises(PipelineCycleError):
+        order_steps_by_dependencies(steps)
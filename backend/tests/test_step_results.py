@@ -0,0 +1,95 @@
+import sys
+import os
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs import step_results
+from app.libs.step_results import (
+    delete_step_results, failed_result, load_results_by_document, status_selection, step_result_row,
+)
+
+
+def test_step_result_row_copies_status():
+    row = step_result_row("d1", "s1", "p1", {"status": "success", "stance": "for"})
+    assert row["status"] == "success"
+    assert row["result"] == {"status": "success", "stance": "for"}
+    assert (row["document_id"], row["step_id"], row["project_id"]) == ("d1", "s1", "p1")
+
+
+def test_outer_loop_failure_is_selected_by_failed_reruns():
+    result = failed_result("failed_document_processing_loop", "Outer loop error", original_content_snippet="Dear")
+    row = step_result_row("d1", "s1", "p1", result)
+    assert row["status"] == "failed_document_processing_loop"
+    assert row["result"]["original_content_snippet"] == "Dear"
+    assert status_selection(row["status"]) == "failed"
+    # Without a status the result would fall into the pending selection instead
+    assert status_selection(step_result_row("d1", "s1", "p1", {"error": "Outer loop error"})["status"]) == "pending"
+    assert status_selection("partial_success_some_prompts_failed") == "pending"
+    assert status_selection("success") is None
+    with pytest.raises(ValueError):
+        failed_result("success", "not a failure")
+
+
+def test_load_results_by_document_pages_and_groups(monkeypatch, fake_supabase):
+    monkeypatch.setattr(step_results, "PAGE_SIZE", 2)
+    rows = [
+        {"document_id": "d1", "step_id": "s1", "project_id": "p1", "result": {"a": 1}},
+        {"document_id": "d1", "step_id": "s2", "project_id": "p1", "result": {"b": 2}},
+        {"document_id": "d2", "step_id": "s1", "project_id": "p1", "result": {"a": 3}},
+        {"document_id": "d3", "step_id": "s1", "project_id": "p2", "result": {"a": 4}},
+    ]
+    supabase = fake_supabase({step_results.STEP_RESULTS_TABLE: rows})
+    results = load_results_by_document(supabase, project_id="p1")
+    assert results == {"d1": {"s1": {"a": 1}, "s2": {"b": 2}}, "d2": {"s1": {"a": 3}}}
+    assert [query.cursor for query in supabase.executed] == [
+        None,
+        ("or", "document_id.gt.d1,and(document_id.eq.d1,step_id.gt.s2)"),
+    ]
+    assert load_results_by_document(supabase, document_ids=["d2", "d3"]) == {
+        "d2": {"s1": {"a": 3}},
+        "d3": {"s1": {"a": 4}},
+    }
+
+
+def test_delete_step_results_counts_without_returning_rows(fake_supabase):
+    rows = [
+        {"document_id": "doc-1", "step_id": "step-1", "project_id": "p1", "result": {"big": "x"}},
+        {"document_id": "doc-2", "step_id": "step-1", "project_id": "p1", "result": {"big": "y"}},
+        {"document_id": "doc-3", "step_id": "step-2", "project_id": "p1", "result": {}},
+    ]
+    supabase = fake_supabase(tables={step_results.STEP_RESULTS_TABLE: rows})
+
+    assert delete_step_results(supabase, "step-1", "p1") == 2
+    assert [row["document_id"] for row in rows] == ["doc-3"]
+    assert delete_step_results(supabase, "step-1", "p1") == 0
+
+
+def test_reprocess_document_ids_pages_through_rpc(fake_supabase):
+    supabase = fake_supabase(rpc_results={"step_reprocess_document_ids": ["d2", "d5"]})
+    ids = step_results.reprocess_document_ids(supabase, "p1", "s1", "failed", after_id="d1", limit=2)
+    assert ids == ["d2", "d5"]
+    name, params = supabase.rpc_calls[0]
+    assert name == "step_reprocess_document_ids"
+    assert params == {
+        "p_project_id": "p1",
+        "p_step_id": "s1",
+        "p_selection": "failed",
+        "p_after_id": "d1",
+        "p_limit": 2,
+        "p_fingerprint": None,
+    }
+    # Older PostgREST versions wrap scalar set members in objects
+    wrapped = fake_supabase(rpc_results={"step_reprocess_document_ids": [{"step_reprocess_document_ids": "d9"}]})
+    assert step_results.reprocess_document_ids(wrapped, "p1", "s1", "pending", None, 10) == ["d9"]
+
+
+def test_reprocess_selection_rejects_unknown_types(fake_supabase):
+    supabase = fake_supabase(rpc_results={"count_step_reprocess_documents": 40})
+    with pytest.raises(ValueError):
+        step_results.count_reprocess_documents(supabase, "p1", "s1", "all")
+    assert step_results.count_reprocess_documents(supabase, "p1", "s1", "failed") == 40
+    with pytest.raises(ValueError):
+        step_results.reprocess_document_ids(supabase, "p1", "s1", "stale", None, 10)
@@ -0,0 +1,111 @@
+import sys
+import os
+import json
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.structured_output import (
+    JSON_OBJECT_FORMAT,
+    check_output_schema,
+    drop_null_optionals,
+    parse_json_response,
+    response_format_for,
+    validate_output,
+)
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "stance": {"type": "string", "enum": ["support", "oppose", "neutral"]},
+        "details": {"type": "object", "properties": {"quote": {"type": "string"}}},
+    },
+    "required": ["stance"],
+}
+
+
+def test_response_format_without_schema_is_json_object():
+    assert response_format_for(None) == JSON_OBJECT_FORMAT
+
+
+def test_strict_format_requires_all_properties_and_keeps_optionals_nullable():
+    fmt = response_format_for(SCHEMA, name="step 1")
+    strict = fmt["json_schema"]["schema"]
+    assert fmt["json_schema"]["strict"] is True
+    assert fmt["json_schema"]["name"] == "step_1"
+    assert strict["additionalProperties"] is False
+    assert set(strict["required"]) == {"stance", "details"}
+    assert {"type": "null"} in strict["properties"]["details"]["anyOf"]
+    assert strict["properties"]["details"]["anyOf"][0]["additionalProperties"] is False
+    # The declared schema itself is left untouched
+    assert "additionalProperties" not in SCHEMA
+
+
+def test_validate_output_reports_errors():
+    assert validate_output({"stance": "support"}, SCHEMA) == []
+    errors = validate_output({"stance": "maybe"}, SCHEMA)
+    assert errors and errors[0].startswith("stance:")
+    assert validate_output(["not", "an", "object"], None)
+
+
+def test_null_optionals_are_dropped_before_validation():
+    answer = drop_null_optionals({"stance": "neutral", "details": None}, SCHEMA)
+    assert answer == {"stance": "neutral"}
+    assert validate_output(answer, SCHEMA) == []
+
+
+PEOPLE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "people": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+                "required": ["name"],
+            },
+        },
+        "lead": {"anyOf": [{"$ref": "#/$defs/person"}, {"type": "string"}]},
+    },
+    "required": ["people"],
+    "$defs": {
+        "person": {
+            "type": "object",
+            "properties": {"name": {"type": "string"}, "age": {"type": "integer"}},
+            "required": ["name"],
+        }
+    },
+}
+
+
+def test_null_optionals_are_dropped_in_array_items_and_refs():
+    answer = {"people": [{"name": "Ada", "age": None}, {"name": "Bo", "age": 3}], "lead": {"name": "Ada", "age": None}}
+    cleaned = drop_null_optionals(answer, PEOPLE_SCHEMA)
+    assert cleaned == {"people": [{"name": "Ada"}, {"name": "Bo", "age": 3}], "lead": {"name": "Ada"}}
+    assert validate_output(cleaned, PEOPLE_SCHEMA) == []
+    assert drop_null_optionals({"people": [], "lead": "Ada"}, PEOPLE_SCHEMA) == {"people": [], "lead": "Ada"}
+    check_output_schema(PEOPLE_SCHEMA)
+
+
+def test_check_output_schema_rejects_objects_without_properties():
+    with pytest.raises(ValueError):
+        check_output_schema({"type": "object"})
+    with pytest.raises(ValueError, match="#/properties/meta"):
+        check_output_schema({"type": "object", "properties": {"meta": {"type": "object"}}})
+    with pytest.raises(ValueError, match="#/properties/rows/items"):
+        check_output_schema({"type": "object", "properties": {"rows": {"type": "array", "items": {"type": "object"}}}})
+
+
+def test_check_output_schema_rejects_non_object_schemas():
+    with pytest.raises(ValueError):
+        check_output_schema({"type": "array"})
+    with pytest.raises(ValueError):
+        check_output_schema({"type": "object", "properties": {"x": {"type": "nope"}}})
+
+
+def test_parse_json_response_strips_fences():
+    assert parse_json_response('```json\n{"a": 1}\n```') == {"a": 1}
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_response("not json")
@@ -0,0 +1,134 @@
+import sys
+import os
+import asyncio
+import multiprocessing
+import time
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.work_leases import SqliteLeaseStore, plan_batches, run_worker
+
+DOCUMENT_SECONDS = 0.02  # Simulated I/O-bound work (LLM call) per document
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _store(tmp_path, **kwargs):
+    return SqliteLeaseStore(str(tmp_path / "leases.db"), **kwargs)
+
+
+def test_plan_batches():
+    assert plan_batches(["a", "b", "c", "d", "e"], 2) == [["a", "b"], ["c", "d"], ["e"]]
+    assert plan_batches([], 10) == []
+    with pytest.raises(ValueError):
+        plan_batches(["a"], 0)
+
+
+def test_claims_are_exclusive_and_expired_leases_are_reclaimed(tmp_path):
+    clock = _Clock()
+    store = _store(tmp_path, max_attempts=2, clock=clock)
+    store.create_batches("r1", "p1", "s1", [["d1", "d2"], ["d3"]])
+
+    first = store.claim("r1", "w1", lease_seconds=10)
+    second = store.claim("r1", "w2", lease_seconds=10)
+    assert (first.document_ids, second.document_ids) == (["d1", "d2"], ["d3"])
+    assert store.claim("r1", "w3", lease_seconds=10) is None
+    assert store.progress("r1")["active_workers"] == ["w1", "w2"]
+
+    # w1 dies; once its lease expires, w3 takes the batch over and w1's late writes are rejected
+    assert store.heartbeat(second, lease_seconds=10)
+    clock.now += 11
+    taken_over = store.claim("r1", "w3", lease_seconds=10)
+    assert (taken_over.batch_id, taken_over.attempts) == (first.batch_id, 2)
+    assert not store.heartbeat(first)
+    assert not store.complete(first, 2, 0)
+    assert store.complete(taken_over, 1, 1)
+    assert store.complete(second, 1, 0)
+
+    progress = store.progress("r1")
+    assert (progress["processed"], progress["failed"], progress["finished"]) == (2, 1, True)
+
+
+def test_release_retries_until_attempts_are_used_up(tmp_path):
+    store = _store(tmp_path, max_attempts=2)
+    store.create_batches("r1", "p1", "s1", [["d1", "d2"]])
+
+    store.release(store.claim("r1", "w1"), "boom")
+    stopped = store.claim("r1", "w1")
+    store.release(stopped, "interrupted", count_attempt=False)  # Stops do not use up attempts
+    store.release(store.claim("r1", "w2"), "boom again")
+    assert store.claim("r1", "w3") is None
+
+    progress = store.progress("r1")
+    assert (progress["batches_failed"], progress["failed"], progress["finished"]) == (1, 2, True)
+
+
+def test_scoped_store_only_sees_its_steps_runs(tmp_path):
+    _store(tmp_path).create_batches("r1", "p1", "s1", [["d1"]])
+    other_step = _store(tmp_path, project_id="p1", step_id="s2")
+    assert other_step.claim("r1", "w1") is None
+    assert other_step.progress("r1")["batches_total"] == 0
+
+    own_step = _store(tmp_path, project_id="p1", step_id="s1")
+    assert own_step.claim("r1", "w1").document_ids == ["d1"]
+    assert own_step.progress("r1")["active_workers"] == ["w1"]
+
+
+def test_run_worker_gives_back_failed_batches(tmp_path):
+    store = _store(tmp_path, max_attempts=3)
+    store.create_batches("r1", "p1", "s1", plan_batches([f"d{i}" for i in range(6)], 2))
+    failures = []
+
+    async def process(lease, control):
+        if lease.batch_index == 1 and not failures:
+            failures.append(lease.batch_id)
+            raise RuntimeError("transient")
+        return len(lease.document_ids), 0
+
+    totals = asyncio.run(run_worker(store, "r1", process, worker_id="w1", heartbeat_seconds=0.01))
+    assert totals["batches"] == 3 and totals["batches_released"] == 1
+    assert store.progress("r1")["processed"] == 6
+
+
+def _worker_process(path: str, run_id: str) -> None:
+    store = SqliteLeaseStore(path)
+
+    async def process(lease, control):
+        for _ in lease.document_ids:
+            await asyncio.sleep(DOCUMENT_SECONDS)
+        return len(lease.document_ids), 0
+
+    asyncio.run(run_worker(store, run_id, process, heartbeat_seconds=1))
+
+
+def _timed_run(tmp_path, run_id: str, workers: int) -> float:
+    path = str(tmp_path / "leases.db")
+    store = SqliteLeaseStore(path)
+    store.create_batches(run_id, "p1", "s1", plan_batches([f"d{i}" for i in range(96)], 4))
+    context = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    processes = [context.Process(target=_worker_process, args=(path, run_id)) for _ in range(workers)]
+    started_at = time.monotonic()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+    elapsed = time.monotonic() - started_at
+    progress = store.progress(run_id)
+    assert (progress["processed"], progress["batches_done"]) == (96, 24)
+    return elapsed
+
+
+def test_multiple_worker_processes_scale_near_linearly(tmp_path):
+    single = _timed_run(tmp_path, "single", 1)
+    four = _timed_run(tmp_path, "four", 4)
+    # 96 documents x 20 ms: ~1.9 s with one worker, ~0.5 s with four (plus process start-up)
+    assert single / four >= 2.5
@@ -0,0 +1,76 @@
+import sys
+import os
+import asyncio
+
+import pytest
+
+# Ensure backend package is on the path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from app.libs.write_behind import WriteBehindBuffer
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _buffer(clock, written, fail=False, **kwargs):
+    async def write_documents(rows):
+        if fail:
+            raise RuntimeError("db down")
+        written.append(("documents", rows))
+
+    async def write_step(fields):
+        written.append(("step", fields))
+
+    return WriteBehindBuffer(write_documents, write_step, clock=clock, **kwargs)
+
+
+def test_writes_coalesce_and_flush_every_n_documents():
+    clock, written = _Clock(), []
+    buffer = _buffer(clock, written, max_documents=2, max_delay_ms=10_000)
+
+    async def scenario():
+        results = {"step": {"status": "partial_success"}}
+        buffer.put_document("d1", results)
+        results["step"]["status"] = "success"
+        buffer.put_document("d1", results)
+        buffer.put_step(processed_count_cache=1)
+        buffer.put_step(processed_count_cache=2, last_processed_document_id="d1")
+        assert not await buffer.maybe_flush()
+        buffer.put_document("d2", {"step": {"status": "success"}})
+        assert await buffer.maybe_flush()
+
+    asyncio.run(scenario())
+    assert written == [
+        ("documents", {"d1": {"step": {"status": "success"}}, "d2": {"step": {"status": "success"}}}),
+        ("step", {"processed_count_cache": 2, "last_processed_document_id": "d1"}),
+    ]
+    metrics = buffer.metrics_snapshot()
+    assert metrics["flushes"] == 1 and metrics["max_flush_size"] == 2 and metrics["writes_coalesced"] == 2
+
+
+def test_flushes_after_delay_and_reports_lag():
+    clock, written = _Clock(), []
+    buffer = _buffer(clock, written, max_documents=100, max_delay_ms=500)
+    buffer.put_step(processed_count_cache=1)
+    clock.now = 0.2
+    assert not asyncio.run(buffer.maybe_flush())
+    clock.now = 0.6
+    assert asyncio.run(buffer.maybe_flush())
+    assert buffer.metrics["last_flush_lag_ms"] == 600.0
+    assert not buffer.has_pending
+
+
+def test_failed_flush_keeps_pending_writes():
+    clock, written = _Clock(), []
+    buffer = _buffer(clock, written, fail=True)
+    buffer.put_document("d1", {"a": 1})
+    with pytest.raises(RuntimeError):
+        asyncio.run(buffer.flush())
+    assert buffer.pending_documents == 1
+    assert buffer.metrics["flushes"] == 0
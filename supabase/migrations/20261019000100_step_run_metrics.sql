@@ -0,0 +1,4 @@
+-- Per-run counters for custom processing steps (conditional block evaluations,
+-- skipped action prompts, ...). Overwritten at the end of every run.
+alter table public.custom_processing_steps
+    add column if not exists run_metrics jsonb not null default '{}'::jsonb;
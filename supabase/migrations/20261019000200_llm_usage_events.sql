@@ -0,0 +1,21 @@
+-- One row per LLM call made while analysing documents (basic analysis and custom steps).
+create table if not exists public.llm_usage_events (
+    id bigint generated always as identity primary key,
+    project_id uuid references public.projects (id) on delete cascade,
+    step_id uuid references public.custom_processing_steps (id) on delete cascade,
+    run_id uuid,
+    document_id uuid references public.documents (id) on delete cascade,
+    model text not null,
+    call_type text not null,
+    prompt_tokens integer not null default 0,
+    completion_tokens integer not null default 0,
+    cached_tokens integer not null default 0,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists llm_usage_events_project_idx on public.llm_usage_events (project_id);
+create index if not exists llm_usage_events_step_run_idx on public.llm_usage_events (step_id, run_id);
+
+-- Optional per-run token budget for a custom step.
+alter table public.custom_processing_steps
+    add column if not exists token_budget integer check (token_budget is null or token_budget > 0);
@@ -0,0 +1,6 @@
+-- Per-step model routing: model, temperature, max_tokens and an optional escalation model
+alter table public.custom_processing_steps
+    add column if not exists model_settings jsonb;
+
+comment on column public.custom_processing_steps.model_settings is
+    'Model settings for this step''s prompts, e.g. {"model": "gpt-4o-mini", "escalation_model": "gpt-4o"}';
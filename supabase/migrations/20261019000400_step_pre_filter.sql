@@ -0,0 +1,6 @@
+-- Local pre-filter rules evaluated before a custom step sends a document to the LLM
+alter table public.custom_processing_steps
+    add column if not exists pre_filter jsonb;
+
+comment on column public.custom_processing_steps.pre_filter is
+    'Keyword, regex, minimum-length and analysis-field rules; non-matching documents are marked skipped_by_filter';
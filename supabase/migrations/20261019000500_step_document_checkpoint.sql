@@ -0,0 +1,6 @@
+-- Keyset checkpoints: runs resume after the last processed document id instead of an offset
+alter table public.custom_processing_steps
+    add column if not exists last_processed_document_id uuid;
+
+-- Supports "project_id = ? and id > ? order by id limit ?" paging of a project's documents
+create index if not exists documents_project_id_id_idx on public.documents (project_id, id);
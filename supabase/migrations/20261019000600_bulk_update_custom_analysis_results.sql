@@ -0,0 +1,20 @@
+-- Bulk write used by the custom step run write-behind buffer:
+-- updates custom_analysis_results of many documents in a single round trip.
+-- updates is a JSON array of {"id": <uuid>, "custom_analysis_results": <jsonb>}.
+create or replace function public.bulk_update_custom_analysis_results(updates jsonb)
+returns integer
+language sql
+security invoker
+as $$
+    with rows as (
+        select (item ->> 'id')::uuid as id, item -> 'custom_analysis_results' as results
+        from jsonb_array_elements(updates) as item
+    ), updated as (
+        update public.documents d
+        set custom_analysis_results = rows.results
+        from rows
+        where d.id = rows.id
+        returning 1
+    )
+    select count(*)::integer from updated;
+$$;
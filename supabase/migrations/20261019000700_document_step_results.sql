@@ -0,0 +1,43 @@
+-- Custom step results stored per (document, step) instead of inside documents.custom_analysis_results.
+create table if not exists public.document_step_results (
+    document_id uuid not null references public.documents (id) on delete cascade,
+    step_id uuid not null references public.custom_processing_steps (id) on delete cascade,
+    project_id uuid not null references public.projects (id) on delete cascade,
+    status text,
+    result jsonb not null default '{}'::jsonb,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now(),
+    primary key (document_id, step_id)
+);
+
+create index if not exists document_step_results_step_status_idx
+    on public.document_step_results (step_id, status);
+create index if not exists document_step_results_project_step_idx
+    on public.document_step_results (project_id, step_id);
+
+-- Backfill from the JSONB blob (only keys that belong to an existing step of the document's project)
+insert into public.document_step_results (document_id, step_id, project_id, status, result)
+select d.id, s.id, d.project_id, entry.value ->> 'status', entry.value
+from public.documents d
+cross join lateral jsonb_each(d.custom_analysis_results) as entry(key, value)
+join public.custom_processing_steps s
+    on s.id::text = entry.key and s.project_id = d.project_id
+where jsonb_typeof(d.custom_analysis_results) = 'object'
+  and jsonb_typeof(entry.value) = 'object'
+on conflict (document_id, step_id) do nothing;
+
+-- Compatibility view: the old {step_id: result} object per document, built from the new table
+create or replace view public.document_custom_analysis_results
+with (security_invoker = true) as
+select
+    r.document_id,
+    r.project_id,
+    jsonb_object_agg(r.step_id::text, r.result) as custom_analysis_results
+from public.document_step_results r
+group by r.document_id, r.project_id;
+
+comment on column public.documents.custom_analysis_results is
+    'Deprecated: no longer written. Read document_step_results or the document_custom_analysis_results view.';
+
+-- Runs now upsert into document_step_results directly
+drop function if exists public.bulk_update_custom_analysis_results(jsonb);
@@ -0,0 +1,57 @@
+-- Document selection for the "failed" and "pending" custom step reprocess types.
+-- failed:  the step's result status starts with 'failed' or 'error' (e.g. failed_extraction, error_in_condition_evaluation)
+-- pending: the document has no result for the step yet, or its result was left unfinished (partial_success*)
+-- Ids are returned in id order after p_after_id so runs page through them with a keyset cursor.
+
+create index if not exists document_step_results_failed_idx
+    on public.document_step_results (step_id, document_id)
+    where status like 'failed%' or status like 'error%';
+
+create or replace function public.step_reprocess_document_ids(
+    p_project_id uuid,
+    p_step_id uuid,
+    p_selection text,
+    p_after_id uuid default null,
+    p_limit integer default 50
+)
+returns setof uuid
+language sql
+stable
+security invoker
+as $$
+    select d.id
+    from public.documents d
+    left join public.document_step_results r
+        on r.document_id = d.id and r.step_id = p_step_id
+    where d.project_id = p_project_id
+      and (p_after_id is null or d.id > p_after_id)
+      and case p_selection
+            when 'failed' then r.status like 'failed%' or r.status like 'error%'
+            when 'pending' then r.document_id is null or r.status is null or r.status like 'partial_success%'
+            else false
+          end
+    order by d.id
+    limit p_limit;
+$$;
+
+create or replace function public.count_step_reprocess_documents(
+    p_project_id uuid,
+    p_step_id uuid,
+    p_selection text
+)
+returns bigint
+language sql
+stable
+security invoker
+as $$
+    select count(*)
+    from public.documents d
+    left join public.document_step_results r
+        on r.document_id = d.id and r.step_id = p_step_id
+    where d.project_id = p_project_id
+      and case p_selection
+            when 'failed' then r.status like 'failed%' or r.status like 'error%'
+            when 'pending' then r.document_id is null or r.status is null or r.status like 'partial_success%'
+            else false
+          end;
+$$;
@@ -0,0 +1,76 @@
+-- Prompt-version fingerprints for custom step results and the "stale" reprocess type.
+
+alter table public.custom_processing_steps
+    add column if not exists prompt_fingerprint text;
+
+comment on column public.custom_processing_steps.prompt_fingerprint is
+    'Hash of the prompts, model settings and pre-filter; set on create/update.';
+
+-- Kept in sync by Postgres; results store the value they were produced from
+alter table public.documents
+    add column if not exists extracted_text_hash text
+    generated always as (md5(coalesce(extracted_text, ''))) stored;
+
+alter table public.document_step_results
+    add column if not exists step_fingerprint text,
+    add column if not exists text_hash text;
+
+-- The selection functions gain a fingerprint parameter (used by the 'stale' selection)
+drop function if exists public.step_reprocess_document_ids(uuid, uuid, text, uuid, integer);
+drop function if exists public.count_step_reprocess_documents(uuid, uuid, text);
+
+-- stale: the document has a result whose step fingerprint or text hash no longer matches
+create or replace function public.step_reprocess_document_ids(
+    p_project_id uuid,
+    p_step_id uuid,
+    p_selection text,
+    p_after_id uuid default null,
+    p_limit integer default 50,
+    p_fingerprint text default null
+)
+returns setof uuid
+language sql
+stable
+security invoker
+as $$
+    select d.id
+    from public.documents d
+    left join public.document_step_results r
+        on r.document_id = d.id and r.step_id = p_step_id
+    where d.project_id = p_project_id
+      and (p_after_id is null or d.id > p_after_id)
+      and case p_selection
+            when 'failed' then r.status like 'failed%' or r.status like 'error%'
+            when 'pending' then r.document_id is null or r.status is null or r.status like 'partial_success%'
+            when 'stale' then r.document_id is not null
+                and (r.step_fingerprint is distinct from p_fingerprint or r.text_hash is distinct from d.extracted_text_hash)
+            else false
+          end
+    order by d.id
+    limit p_limit;
+$$;
+
+create or replace function public.count_step_reprocess_documents(
+    p_project_id uuid,
+    p_step_id uuid,
+    p_selection text,
+    p_fingerprint text default null
+)
+returns bigint
+language sql
+stable
+security invoker
+as $$
+    select count(*)
+    from public.documents d
+    left join public.document_step_results r
+        on r.document_id = d.id and r.step_id = p_step_id
+    where d.project_id = p_project_id
+      and case p_selection
+            when 'failed' then r.status like 'failed%' or r.status like 'error%'
+            when 'pending' then r.document_id is null or r.status is null or r.status like 'partial_success%'
+            when 'stale' then r.document_id is not null
+                and (r.step_fingerprint is distinct from p_fingerprint or r.text_hash is distinct from d.extracted_text_hash)
+            else false
+          end;
+$$;
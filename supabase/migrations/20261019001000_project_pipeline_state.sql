@@ -0,0 +1,7 @@
+-- Run state of the project-level custom step pipeline (all document-by-document steps in one pass).
+alter table public.projects
+    add column if not exists pipeline_run_status text not null default 'idle',
+    add column if not exists pipeline_last_processed_document_id uuid;
+
+comment on column public.projects.pipeline_last_processed_document_id is
+    'Checkpoint of the pipeline run: every document up to this id went through all steps.';
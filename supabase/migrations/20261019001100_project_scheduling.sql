@@ -0,0 +1,7 @@
+-- Fair-share scheduling of LLM work across concurrent custom step runs.
+-- Work of a higher-priority project is always scheduled first; within a priority, a project
+-- with weight 2 gets twice the share of its owner's slots as a project with weight 1.
+alter table public.projects
+    add column if not exists scheduling_priority integer not null default 0,
+    add column if not exists scheduling_weight real not null default 1
+        check (scheduling_weight > 0);
@@ -0,0 +1,31 @@
+-- History of custom step runs: one row per run and step (a pipeline run has one row per step,
+-- all with the same run_id), inserted when processing starts and completed when the run ends.
+create table if not exists public.step_runs (
+    id uuid primary key default gen_random_uuid(),
+    run_id uuid not null,
+    project_id uuid not null references public.projects (id) on delete cascade,
+    step_id uuid not null references public.custom_processing_steps (id) on delete cascade,
+    reprocess_type text not null,
+    status text not null default 'running',
+    started_at timestamptz not null default now(),
+    finished_at timestamptz,
+    duration_ms bigint,
+    total_documents integer not null default 0,
+    processed_count integer not null default 0,
+    failed_count integer not null default 0,
+    docs_per_minute real,
+    latency_p50_ms real,
+    latency_p95_ms real,
+    llm_time_ms bigint,
+    llm_time_share real,
+    prompt_tokens bigint not null default 0,
+    completion_tokens bigint not null default 0,
+    total_tokens bigint not null default 0,
+    llm_calls integer not null default 0,
+    run_metrics jsonb,
+    unique (run_id, step_id)
+);
+
+-- Run history of a step, newest first
+create index if not exists step_runs_step_started_idx on public.step_runs (step_id, started_at desc);
+create index if not exists step_runs_project_started_idx on public.step_runs (project_id, started_at desc);
@@ -0,0 +1,83 @@
+-- Work table of distributed custom step runs: each run is split into batches of document ids
+-- that any number of workers claim with an expiring lease, heartbeat, and complete or give back.
+create table if not exists public.step_run_batches (
+    id bigint generated always as identity primary key,
+    run_id uuid not null,
+    project_id uuid not null references public.projects (id) on delete cascade,
+    step_id uuid not null references public.custom_processing_steps (id) on delete cascade,
+    batch_index integer not null,
+    document_ids uuid[] not null,
+    status text not null default 'pending' check (status in ('pending', 'leased', 'done', 'failed')),
+    lease_owner text,
+    lease_expires_at timestamptz,
+    attempts integer not null default 0,
+    processed_count integer not null default 0,
+    failed_count integer not null default 0,
+    last_error text,
+    created_at timestamptz not null default now(),
+    unique (run_id, batch_index)
+);
+
+-- Claims only look at the unfinished batches of a run
+create index if not exists step_run_batches_open_idx
+    on public.step_run_batches (run_id, batch_index)
+    where status in ('pending', 'leased');
+
+-- Atomically leases the next claimable batch of a run to p_worker: a pending batch, or a leased one
+-- whose lease expired (its worker died). Concurrent claims skip each other's locked rows instead of
+-- waiting. Expired batches that used up their attempts are marked failed first.
+create or replace function public.claim_step_run_batch(
+    p_run_id uuid,
+    p_worker text,
+    p_lease_seconds integer default 120,
+    p_max_attempts integer default 3
+)
+returns setof public.step_run_batches
+language plpgsql
+security invoker
+as $$
+begin
+    update public.step_run_batches
+    set status = 'failed', lease_owner = null, last_error = 'lease expired'
+    where run_id = p_run_id
+      and status = 'leased'
+      and lease_expires_at < now()
+      and attempts >= p_max_attempts;
+
+    return query
+    update public.step_run_batches b
+    set status = 'leased',
+        lease_owner = p_worker,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        attempts = b.attempts + 1
+    where b.id = (
+        select c.id
+        from public.step_run_batches c
+        where c.run_id = p_run_id
+          and (c.status = 'pending' or (c.status = 'leased' and c.lease_expires_at < now()))
+        order by c.batch_index
+        limit 1
+        for update skip locked
+    )
+    returning b.*;
+end;
+$$;
+
+-- Extends p_worker's lease on a batch; returns false when the worker no longer holds it.
+create or replace function public.heartbeat_step_run_batch(
+    p_batch_id bigint,
+    p_worker text,
+    p_lease_seconds integer default 120
+)
+returns boolean
+language sql
+security invoker
+as $$
+    with extended as (
+        update public.step_run_batches
+        set lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+        where id = p_batch_id and lease_owner = p_worker and status = 'leased'
+        returning id
+    )
+    select exists (select 1 from extended);
+$$;
@@ -0,0 +1,260 @@
+-- Incrementally maintained analytics counters for the dashboard summary.
+-- Processed documents are counted per project, sentiment and complexity, and their topics per
+-- project, sentiment, complexity and topic. Triggers on documents and document_topics apply
+-- every change in the same transaction as the write, so the summary reads a handful of counter
+-- rows instead of every document. rebuild_analytics_counts() recomputes them to repair drift.
+--
+-- Keys are normalized like the Python summary: sentiment lower(trim()), complexity trim() of
+-- analysis->>'complexity_level', topics lower(trim()); missing values count as 'unknown'.
+
+create table if not exists public.project_analytics_counts (
+    project_id uuid not null references public.projects (id) on delete cascade,
+    sentiment text not null,
+    complexity text not null,
+    document_count bigint not null default 0,
+    primary key (project_id, sentiment, complexity)
+);
+
+create table if not exists public.project_topic_counts (
+    project_id uuid not null references public.projects (id) on delete cascade,
+    sentiment text not null,
+    complexity text not null,
+    topic text not null,
+    topic_count bigint not null default 0,
+    primary key (project_id, sentiment, complexity, topic)
+);
+
+create or replace function public.analytics_sentiment_key(p_sentiment text)
+returns text
+language sql
+immutable
+as $$
+    select coalesce(nullif(lower(trim(p_sentiment)), ''), 'unknown');
+$$;
+
+create or replace function public.analytics_complexity_key(p_analysis jsonb)
+returns text
+language sql
+immutable
+as $$
+    select coalesce(nullif(trim(p_analysis ->> 'complexity_level'), ''), 'unknown');
+$$;
+
+create or replace function public.analytics_topic_key(p_topic text)
+returns text
+language sql
+immutable
+as $$
+    select nullif(lower(trim(p_topic)), '');
+$$;
+
+-- Adds p_delta to the counters of one processed document: its own and those of its topics.
+create or replace function public.apply_document_analytics_delta(
+    p_document_id uuid,
+    p_project_id uuid,
+    p_sentiment text,
+    p_complexity text,
+    p_delta integer
+)
+returns void
+language plpgsql
+as $$
+begin
+    if p_project_id is null then
+        return;
+    end if;
+    insert into public.project_analytics_counts as c (project_id, sentiment, complexity, document_count)
+    values (p_project_id, p_sentiment, p_complexity, p_delta)
+    on conflict (project_id, sentiment, complexity)
+    do update set document_count = c.document_count + excluded.document_count;
+
+    insert into public.project_topic_counts as c (project_id, sentiment, complexity, topic, topic_count)
+    select p_project_id, p_sentiment, p_complexity, topic, count(*) * p_delta
+    from (
+        select public.analytics_topic_key(t.topic_name) as topic
+        from public.document_topics t
+        where t.document_id = p_document_id
+    ) topics
+    where topic is not null
+    group by topic
+    on conflict (project_id, sentiment, complexity, topic)
+    do update set topic_count = c.topic_count + excluded.topic_count;
+end;
+$$;
+
+create or replace function public.documents_analytics_counters()
+returns trigger
+language plpgsql
+as $$
+declare
+    old_counted boolean := false;
+    new_counted boolean := new.status = 'processed';
+begin
+    if tg_op = 'UPDATE' then
+        old_counted := old.status = 'processed';
+    end if;
+    if old_counted and new_counted
+        and old.project_id is not distinct from new.project_id
+        and public.analytics_sentiment_key(old.overall_sentiment)
+            = public.analytics_sentiment_key(new.overall_sentiment)
+        and public.analytics_complexity_key(old.analysis) = public.analytics_complexity_key(new.analysis) then
+        return null;  -- Same counter key: nothing to move
+    end if;
+    if old_counted then
+        perform public.apply_document_analytics_delta(
+            old.id, old.project_id,
+            public.analytics_sentiment_key(old.overall_sentiment), public.analytics_complexity_key(old.analysis), -1
+        );
+    end if;
+    if new_counted then
+        perform public.apply_document_analytics_delta(
+            new.id, new.project_id,
+            public.analytics_sentiment_key(new.overall_sentiment), public.analytics_complexity_key(new.analysis), 1
+        );
+    end if;
+    return null;
+end;
+$$;
+
+-- Runs before the delete so the document's topics (removed by the delete) are still there to subtract
+create or replace function public.documents_analytics_counters_before_delete()
+returns trigger
+language plpgsql
+as $$
+begin
+    if old.status = 'processed' then
+        perform public.apply_document_analytics_delta(
+            old.id, old.project_id,
+            public.analytics_sentiment_key(old.overall_sentiment), public.analytics_complexity_key(old.analysis), -1
+        );
+    end if;
+    return old;
+end;
+$$;
+
+-- Adds p_delta to the counter of one topic row, if its document is processed
+create or replace function public.apply_topic_analytics_delta(p_document_id uuid, p_topic_name text, p_delta integer)
+returns void
+language plpgsql
+as $$
+declare
+    doc record;
+begin
+    if public.analytics_topic_key(p_topic_name) is null then
+        return;
+    end if;
+    -- Documents being deleted are already gone here; their delete trigger subtracted the topics
+    select d.project_id, d.overall_sentiment, d.analysis into doc
+    from public.documents d
+    where d.id = p_document_id and d.status = 'processed' and d.project_id is not null;
+    if not found then
+        return;
+    end if;
+    insert into public.project_topic_counts as c (project_id, sentiment, complexity, topic, topic_count)
+    values (
+        doc.project_id,
+        public.analytics_sentiment_key(doc.overall_sentiment),
+        public.analytics_complexity_key(doc.analysis),
+        public.analytics_topic_key(p_topic_name),
+        p_delta
+    )
+    on conflict (project_id, sentiment, complexity, topic)
+    do update set topic_count = c.topic_count + excluded.topic_count;
+end;
+$$;
+
+create or replace function public.document_topics_analytics_counters()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.apply_topic_analytics_delta(old.document_id, old.topic_name, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform public.apply_topic_analytics_delta(new.document_id, new.topic_name, 1);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists documents_analytics_counters on public.documents;
+create trigger documents_analytics_counters
+    after insert or update of status, project_id, overall_sentiment, analysis on public.documents
+    for each row execute function public.documents_analytics_counters();
+
+drop trigger if exists documents_analytics_counters_before_delete on public.documents;
+create trigger documents_analytics_counters_before_delete
+    before delete on public.documents
+    for each row execute function public.documents_analytics_counters_before_delete();
+
+drop trigger if exists document_topics_analytics_counters on public.document_topics;
+create trigger document_topics_analytics_counters
+    after insert or update of document_id, topic_name or delete on public.document_topics
+    for each row execute function public.document_topics_analytics_counters();
+
+-- Top topics from the counters, optionally for one sentiment and/or complexity.
+create or replace function public.analytics_counter_top_topics(
+    p_project_id uuid default null,
+    p_sentiment text default null,
+    p_complexity text default null,
+    p_limit integer default 10
+)
+returns table (topic text, topic_count bigint)
+language sql
+stable
+as $$
+    select c.topic, sum(c.topic_count)::bigint as topic_count
+    from public.project_topic_counts c
+    where (p_project_id is null or c.project_id = p_project_id)
+      and (p_sentiment is null or c.sentiment = p_sentiment)
+      and (p_complexity is null or c.complexity = p_complexity)
+    group by c.topic
+    having sum(c.topic_count) > 0
+    order by topic_count desc, c.topic
+    limit p_limit;
+$$;
+
+-- Recomputes the counters of one project (or of all projects) from the documents and topics.
+-- The counter tables are locked for the duration, so concurrent writes apply their deltas after it.
+create or replace function public.rebuild_analytics_counts(p_project_id uuid default null)
+returns integer
+language plpgsql
+as $$
+declare
+    documents_counted integer;
+begin
+    lock table public.project_analytics_counts, public.project_topic_counts in exclusive mode;
+
+    delete from public.project_analytics_counts where p_project_id is null or project_id = p_project_id;
+    delete from public.project_topic_counts where p_project_id is null or project_id = p_project_id;
+
+    insert into public.project_analytics_counts (project_id, sentiment, complexity, document_count)
+    select d.project_id,
+           public.analytics_sentiment_key(d.overall_sentiment),
+           public.analytics_complexity_key(d.analysis),
+           count(*)
+    from public.documents d
+    where d.status = 'processed' and d.project_id is not null and (p_project_id is null or d.project_id = p_project_id)
+    group by 1, 2, 3;
+
+    insert into public.project_topic_counts (project_id, sentiment, complexity, topic, topic_count)
+    select d.project_id,
+           public.analytics_sentiment_key(d.overall_sentiment),
+           public.analytics_complexity_key(d.analysis),
+           public.analytics_topic_key(t.topic_name),
+           count(*)
+    from public.documents d
+    join public.document_topics t on t.document_id = d.id
+    where d.status = 'processed' and d.project_id is not null and (p_project_id is null or d.project_id = p_project_id)
+      and public.analytics_topic_key(t.topic_name) is not null
+    group by 1, 2, 3, 4;
+
+    select coalesce(sum(document_count), 0) into documents_counted
+    from public.project_analytics_counts
+    where p_project_id is null or project_id = p_project_id;
+    return documents_counted;
+end;
+$$;
+
+select public.rebuild_analytics_counts();
@@ -0,0 +1,65 @@
+-- Filtered analytics summary computed entirely in Postgres. The filters select the processed
+-- documents once; sentiment, complexity and topic counts are grouped over that set, and only the
+-- grouped counts are returned, so the response size does not depend on the number of documents.
+-- Filters match the previous Python implementation: sentiment equals lower(trim(p_sentiment)),
+-- complexity equals trim(p_complexity), and the topic filter keeps documents with a topic
+-- containing p_topic (case-insensitive).
+
+create index if not exists documents_status_project_idx on public.documents (project_id, status);
+create index if not exists document_topics_document_idx on public.document_topics (document_id);
+
+create or replace function public.analytics_summary(
+    p_project_id uuid default null,
+    p_sentiment text default null,
+    p_complexity text default null,
+    p_topic text default null,
+    p_top_n integer default 10
+)
+returns jsonb
+language sql
+stable
+security invoker
+as $$
+    with filtered as (
+        select d.id,
+               public.analytics_sentiment_key(d.overall_sentiment) as sentiment,
+               public.analytics_complexity_key(d.analysis) as complexity
+        from public.documents d
+        where d.status = 'processed'
+          and (p_project_id is null or d.project_id = p_project_id)
+          and (p_sentiment is null or d.overall_sentiment = lower(trim(p_sentiment)))
+          and (p_complexity is null or d.analysis ->> 'complexity_level' = trim(p_complexity))
+          and (
+              p_topic is null
+              or exists (
+                  select 1
+                  from public.document_topics t
+                  where t.document_id = d.id and t.topic_name ilike '%' || trim(p_topic) || '%'
+              )
+          )
+    ),
+    sentiments as (
+        select sentiment, count(*) as n from filtered group by sentiment
+    ),
+    complexities as (
+        select complexity, count(*) as n from filtered group by complexity
+    ),
+    topics as (
+        select public.analytics_topic_key(t.topic_name) as topic, count(*) as n
+        from filtered f
+        join public.document_topics t on t.document_id = f.id
+        where public.analytics_topic_key(t.topic_name) is not null
+        group by 1
+        order by n desc, topic
+        limit p_top_n
+    )
+    select jsonb_build_object(
+        'total_documents', (select count(*) from filtered),
+        'sentiment_distribution', coalesce((select jsonb_object_agg(sentiment, n) from sentiments), '{}'::jsonb),
+        'complexity_distribution', coalesce((select jsonb_object_agg(complexity, n) from complexities), '{}'::jsonb),
+        'top_topics', coalesce(
+            (select jsonb_agg(jsonb_build_object('topic', topic, 'topic_count', n) order by n desc, topic) from topics),
+            '[]'::jsonb
+        )
+    );
+$$;
@@ -0,0 +1,89 @@
+-- Per-project analytics data version, bumped by every write that can change an analytics summary:
+-- documents (status, project, sentiment or analysis) and document_topics. API workers cache
+-- summaries in memory together with the version they were computed from and compare it with
+-- analytics_data_version() on each request, so a cached summary is never served after a write,
+-- whichever worker handled the write.
+
+create table if not exists public.project_analytics_versions (
+    project_id uuid primary key references public.projects (id) on delete cascade,
+    version bigint not null default 0,
+    updated_at timestamptz not null default now()
+);
+
+create or replace function public.bump_analytics_version(p_project_id uuid)
+returns void
+language sql
+as $$
+    insert into public.project_analytics_versions as v (project_id, version, updated_at)
+    select p_project_id, 1, now()
+    where p_project_id is not null
+    on conflict (project_id)
+    do update set version = v.version + 1, updated_at = now();
+$$;
+
+create or replace function public.documents_analytics_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.bump_analytics_version(old.project_id);
+    end if;
+    if tg_op = 'INSERT' or (tg_op = 'UPDATE' and new.project_id is distinct from old.project_id) then
+        perform public.bump_analytics_version(new.project_id);
+    end if;
+    return null;
+end;
+$$;
+
+create or replace function public.document_topics_analytics_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.bump_analytics_version(d.project_id) from public.documents d where d.id = old.document_id;
+    end if;
+    if tg_op = 'INSERT' or (tg_op = 'UPDATE' and new.document_id is distinct from old.document_id) then
+        perform public.bump_analytics_version(d.project_id) from public.documents d where d.id = new.document_id;
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists documents_analytics_version on public.documents;
+create trigger documents_analytics_version
+    after insert or update of status, project_id, overall_sentiment, analysis or delete on public.documents
+    for each row execute function public.documents_analytics_version();
+
+-- Topics removed by a document delete find no document here; the documents trigger bumps that project
+drop trigger if exists document_topics_analytics_version on public.document_topics;
+create trigger document_topics_analytics_version
+    after insert or update of document_id, topic_name or delete on public.document_topics
+    for each row execute function public.document_topics_analytics_version();
+
+-- Current data version of one project, or of all projects (the sum changes whenever any project's does)
+create or replace function public.analytics_data_version(p_project_id uuid default null)
+returns bigint
+language sql
+stable
+as $$
+    select coalesce(sum(version), 0)::bigint
+    from public.project_analytics_versions
+    where p_project_id is null or project_id = p_project_id;
+$$;
+
+-- Invalidates the cached summaries of one project, or of every project, without a data write
+-- (e.g. after rebuild_analytics_counts repaired drifted counters).
+create or replace function public.invalidate_analytics_summaries(p_project_id uuid default null)
+returns void
+language plpgsql
+as $$
+begin
+    if p_project_id is null then
+        update public.project_analytics_versions set version = version + 1, updated_at = now();
+    else
+        perform public.bump_analytics_version(p_project_id);
+    end if;
+end;
+$$;
@@ -0,0 +1,237 @@
+-- Inverted topic index for the analytics topic filter.
+-- project_topic_terms is a per-project dictionary of normalized topic names (analytics_topic_key),
+-- searchable by substring through a trigram index and by prefix through a btree. topic_postings maps
+-- each term to the documents that mention it, keyed by a compact integer document number
+-- (documents.doc_seq); the (term_id, doc_seq) primary key keeps every posting list sorted and
+-- updatable one row at a time. A topic filter resolves its terms in the dictionary and intersects
+-- their posting lists inside the database, so no document IDs travel through the API.
+
+create extension if not exists pg_trgm;
+
+alter table public.documents add column if not exists doc_seq integer generated by default as identity;
+create unique index if not exists documents_doc_seq_idx on public.documents (doc_seq);
+
+create table if not exists public.project_topic_terms (
+    id bigint generated by default as identity primary key,
+    project_id uuid not null references public.projects (id) on delete cascade,
+    topic text not null,
+    unique (project_id, topic)
+);
+
+create index if not exists project_topic_terms_trgm_idx on public.project_topic_terms using gin (topic gin_trgm_ops);
+create index if not exists project_topic_terms_prefix_idx
+    on public.project_topic_terms (project_id, topic text_pattern_ops);
+
+create table if not exists public.topic_postings (
+    term_id bigint not null references public.project_topic_terms (id) on delete cascade,
+    doc_seq integer not null,
+    topic_rows integer not null default 1,  -- document_topics rows of the document with this normalized topic
+    primary key (term_id, doc_seq)
+);
+
+create index if not exists topic_postings_doc_seq_idx on public.topic_postings (doc_seq);
+
+-- Adds p_delta topic rows to the posting of one document under one topic; drops it when none remain.
+create or replace function public.apply_topic_posting_delta(p_document_id uuid, p_topic_name text, p_delta integer)
+returns void
+language plpgsql
+as $$
+declare
+    v_topic text := public.analytics_topic_key(p_topic_name);
+    v_project_id uuid;
+    v_doc_seq integer;
+    v_term_id bigint;
+begin
+    if v_topic is null then
+        return;
+    end if;
+    -- Documents being deleted are already gone here; their delete trigger removed the postings
+    select d.project_id, d.doc_seq into v_project_id, v_doc_seq
+    from public.documents d
+    where d.id = p_document_id and d.project_id is not null;
+    if not found then
+        return;
+    end if;
+
+    if p_delta > 0 then
+        insert into public.project_topic_terms (project_id, topic)
+        values (v_project_id, v_topic)
+        on conflict (project_id, topic) do nothing;
+    end if;
+    select t.id into v_term_id
+    from public.project_topic_terms t
+    where t.project_id = v_project_id and t.topic = v_topic;
+    if v_term_id is null then
+        return;
+    end if;
+
+    insert into public.topic_postings as p (term_id, doc_seq, topic_rows)
+    values (v_term_id, v_doc_seq, p_delta)
+    on conflict (term_id, doc_seq) do update set topic_rows = p.topic_rows + excluded.topic_rows;
+    delete from public.topic_postings p
+    where p.term_id = v_term_id and p.doc_seq = v_doc_seq and p.topic_rows <= 0;
+end;
+$$;
+
+create or replace function public.document_topics_postings()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.apply_topic_posting_delta(old.document_id, old.topic_name, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform public.apply_topic_posting_delta(new.document_id, new.topic_name, 1);
+    end if;
+    return null;
+end;
+$$;
+
+-- Re-indexes the topics of a document that moved to another project
+create or replace function public.documents_topic_postings()
+returns trigger
+language plpgsql
+as $$
+begin
+    delete from public.topic_postings where doc_seq = old.doc_seq;
+    if tg_op = 'UPDATE' then
+        perform public.apply_topic_posting_delta(t.document_id, t.topic_name, 1)
+        from public.document_topics t
+        where t.document_id = new.id;
+        return null;
+    end if;
+    return old;
+end;
+$$;
+
+drop trigger if exists document_topics_postings on public.document_topics;
+create trigger document_topics_postings
+    after insert or update of document_id, topic_name or delete on public.document_topics
+    for each row execute function public.document_topics_postings();
+
+drop trigger if exists documents_topic_postings_move on public.documents;
+create trigger documents_topic_postings_move
+    after update of project_id on public.documents
+    for each row when (old.project_id is distinct from new.project_id)
+    execute function public.documents_topic_postings();
+
+-- Runs before the delete; the cascaded topic deletes find no document and leave the postings alone
+drop trigger if exists documents_topic_postings_delete on public.documents;
+create trigger documents_topic_postings_delete
+    before delete on public.documents
+    for each row execute function public.documents_topic_postings();
+
+-- Documents (by doc_seq) matching every term: a term matches the dictionary topics containing it,
+-- and a document matches a term if it is in the posting list of any of those topics.
+create or replace function public.topic_filter_documents(p_project_id uuid, p_terms text[])
+returns table (doc_seq integer)
+language sql
+stable
+as $$
+    with terms as (
+        select distinct public.analytics_topic_key(term) as term
+        from unnest(p_terms) as term
+        where public.analytics_topic_key(term) is not null
+    )
+    select p.doc_seq
+    from terms f
+    join public.project_topic_terms t
+      on (p_project_id is null or t.project_id = p_project_id)
+     and t.topic like '%' || f.term || '%'
+    join public.topic_postings p on p.term_id = t.id
+    group by p.doc_seq
+    having count(distinct f.term) = (select count(*) from terms);
+$$;
+
+-- Dictionary search for topic pickers: prefix matches first, then the closest trigram matches.
+create or replace function public.search_project_topics(p_project_id uuid, p_query text, p_limit integer default 20)
+returns table (topic text, document_count bigint, prefix_match boolean)
+language sql
+stable
+as $$
+    with q as (
+        select coalesce(public.analytics_topic_key(p_query), '') as term
+    )
+    select t.topic, count(*)::bigint as document_count, bool_or(t.topic like q.term || '%') as prefix_match
+    from q
+    join public.project_topic_terms t
+      on (p_project_id is null or t.project_id = p_project_id)
+     and (q.term = '' or t.topic like q.term || '%' or t.topic % q.term)
+    join public.topic_postings p on p.term_id = t.id
+    group by t.topic, q.term
+    order by prefix_match desc, max(similarity(t.topic, q.term)) desc, document_count desc, t.topic
+    limit p_limit;
+$$;
+
+-- Summary topic filters now take a list of terms resolved through the index (all must match)
+drop function if exists public.analytics_summary(uuid, text, text, text, integer);
+
+create or replace function public.analytics_summary(
+    p_project_id uuid default null,
+    p_sentiment text default null,
+    p_complexity text default null,
+    p_topics text[] default null,
+    p_top_n integer default 10
+)
+returns jsonb
+language sql
+stable
+security invoker
+as $$
+    with filtered as (
+        select d.id,
+               public.analytics_sentiment_key(d.overall_sentiment) as sentiment,
+               public.analytics_complexity_key(d.analysis) as complexity
+        from public.documents d
+        where d.status = 'processed'
+          and (p_project_id is null or d.project_id = p_project_id)
+          and (p_sentiment is null or d.overall_sentiment = lower(trim(p_sentiment)))
+          and (p_complexity is null or d.analysis ->> 'complexity_level' = trim(p_complexity))
+          and (
+              p_topics is null
+              or d.doc_seq in (select f.doc_seq from public.topic_filter_documents(p_project_id, p_topics) f)
+          )
+    ),
+    sentiments as (
+        select sentiment, count(*) as n from filtered group by sentiment
+    ),
+    complexities as (
+        select complexity, count(*) as n from filtered group by complexity
+    ),
+    topics as (
+        select public.analytics_topic_key(t.topic_name) as topic, count(*) as n
+        from filtered f
+        join public.document_topics t on t.document_id = f.id
+        where public.analytics_topic_key(t.topic_name) is not null
+        group by 1
+        order by n desc, topic
+        limit p_top_n
+    )
+    select jsonb_build_object(
+        'total_documents', (select count(*) from filtered),
+        'sentiment_distribution', coalesce((select jsonb_object_agg(sentiment, n) from sentiments), '{}'::jsonb),
+        'complexity_distribution', coalesce((select jsonb_object_agg(complexity, n) from complexities), '{}'::jsonb),
+        'top_topics', coalesce(
+            (select jsonb_agg(jsonb_build_object('topic', topic, 'topic_count', n) order by n desc, topic) from topics),
+            '[]'::jsonb
+        )
+    );
+$$;
+
+-- Index the existing topics
+insert into public.project_topic_terms (project_id, topic)
+select distinct d.project_id, public.analytics_topic_key(t.topic_name)
+from public.document_topics t
+join public.documents d on d.id = t.document_id
+where d.project_id is not null and public.analytics_topic_key(t.topic_name) is not null
+on conflict (project_id, topic) do nothing;
+
+insert into public.topic_postings (term_id, doc_seq, topic_rows)
+select pt.id, d.doc_seq, count(*)
+from public.document_topics t
+join public.documents d on d.id = t.document_id
+join public.project_topic_terms pt
+  on pt.project_id = d.project_id and pt.topic = public.analytics_topic_key(t.topic_name)
+group by pt.id, d.doc_seq
+on conflict (term_id, doc_seq) do update set topic_rows = excluded.topic_rows;
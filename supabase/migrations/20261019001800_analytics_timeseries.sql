@@ -0,0 +1,362 @@
+-- Daily analytics rollups for the trends view.
+-- Processed documents are counted per project, date basis, day, sentiment and complexity, and their
+-- topics per the same keys plus topic. Two date bases are kept: 'response_date' (analysis->>'response_date',
+-- the date of the submission itself; documents without a valid date are left out) and 'processed_at'
+-- (the UTC day the document was analysed). Triggers on documents and document_topics apply every change
+-- in the same transaction, like the project_analytics_counts counters; analytics_timeseries() reads the
+-- daily rows and rolls them up to weeks or months, so no request touches the documents themselves.
+
+create table if not exists public.project_analytics_daily (
+    project_id uuid not null references public.projects (id) on delete cascade,
+    date_basis text not null check (date_basis in ('response_date', 'processed_at')),
+    bucket_date date not null,
+    sentiment text not null,
+    complexity text not null,
+    document_count bigint not null default 0,
+    primary key (project_id, date_basis, bucket_date, sentiment, complexity)
+);
+
+create table if not exists public.project_topic_daily (
+    project_id uuid not null references public.projects (id) on delete cascade,
+    date_basis text not null check (date_basis in ('response_date', 'processed_at')),
+    bucket_date date not null,
+    sentiment text not null,
+    complexity text not null,
+    topic text not null,
+    topic_count bigint not null default 0,
+    primary key (project_id, date_basis, bucket_date, sentiment, complexity, topic)
+);
+
+-- analysis->>'response_date' as a date, or null when missing or not a valid YYYY-MM-DD date
+create or replace function public.analytics_response_day(p_analysis jsonb)
+returns date
+language plpgsql
+immutable
+as $$
+declare
+    raw text := trim(p_analysis ->> 'response_date');
+begin
+    if raw is null or raw !~ '^\d{4}-\d{2}-\d{2}$' then
+        return null;
+    end if;
+    return raw::date;
+exception when others then
+    return null;
+end;
+$$;
+
+create or replace function public.analytics_processed_day(p_processed_at timestamptz)
+returns date
+language sql
+immutable
+as $$
+    select (p_processed_at at time zone 'UTC')::date;
+$$;
+
+-- Adds p_delta to the daily rollups of one processed document under one date basis: its own and its topics'.
+create or replace function public.apply_document_timeseries_delta(
+    p_document_id uuid,
+    p_project_id uuid,
+    p_date_basis text,
+    p_day date,
+    p_sentiment text,
+    p_complexity text,
+    p_delta integer
+)
+returns void
+language plpgsql
+as $$
+begin
+    if p_project_id is null or p_day is null then
+        return;
+    end if;
+    insert into public.project_analytics_daily as c
+        (project_id, date_basis, bucket_date, sentiment, complexity, document_count)
+    values (p_project_id, p_date_basis, p_day, p_sentiment, p_complexity, p_delta)
+    on conflict (project_id, date_basis, bucket_date, sentiment, complexity)
+    do update set document_count = c.document_count + excluded.document_count;
+
+    insert into public.project_topic_daily as c
+        (project_id, date_basis, bucket_date, sentiment, complexity, topic, topic_count)
+    select p_project_id, p_date_basis, p_day, p_sentiment, p_complexity, topic, count(*) * p_delta
+    from (
+        select public.analytics_topic_key(t.topic_name) as topic
+        from public.document_topics t
+        where t.document_id = p_document_id
+    ) topics
+    where topic is not null
+    group by topic
+    on conflict (project_id, date_basis, bucket_date, sentiment, complexity, topic)
+    do update set topic_count = c.topic_count + excluded.topic_count;
+end;
+$$;
+
+-- Applies p_delta for a document row under both date bases
+create or replace function public.apply_document_timeseries(p_document public.documents, p_delta integer)
+returns void
+language plpgsql
+as $$
+declare
+    sentiment text := public.analytics_sentiment_key(p_document.overall_sentiment);
+    complexity text := public.analytics_complexity_key(p_document.analysis);
+begin
+    perform public.apply_document_timeseries_delta(
+        p_document.id, p_document.project_id, 'response_date',
+        public.analytics_response_day(p_document.analysis), sentiment, complexity, p_delta
+    );
+    perform public.apply_document_timeseries_delta(
+        p_document.id, p_document.project_id, 'processed_at',
+        public.analytics_processed_day(p_document.processed_at), sentiment, complexity, p_delta
+    );
+end;
+$$;
+
+create or replace function public.documents_analytics_timeseries()
+returns trigger
+language plpgsql
+as $$
+declare
+    old_counted boolean := false;
+    new_counted boolean := new.status = 'processed';
+begin
+    if tg_op = 'UPDATE' then
+        old_counted := old.status = 'processed';
+    end if;
+    if old_counted and new_counted
+        and old.project_id is not distinct from new.project_id
+        and public.analytics_sentiment_key(old.overall_sentiment)
+            = public.analytics_sentiment_key(new.overall_sentiment)
+        and public.analytics_complexity_key(old.analysis) = public.analytics_complexity_key(new.analysis)
+        and public.analytics_response_day(old.analysis) is not distinct from public.analytics_response_day(new.analysis)
+        and public.analytics_processed_day(old.processed_at)
+            is not distinct from public.analytics_processed_day(new.processed_at) then
+        return null;  -- Same rollup keys: nothing to move
+    end if;
+    if old_counted then
+        perform public.apply_document_timeseries(old, -1);
+    end if;
+    if new_counted then
+        perform public.apply_document_timeseries(new, 1);
+    end if;
+    return null;
+end;
+$$;
+
+-- Runs before the delete so the document's topics (removed by the delete) are still there to subtract
+create or replace function public.documents_analytics_timeseries_before_delete()
+returns trigger
+language plpgsql
+as $$
+begin
+    if old.status = 'processed' then
+        perform public.apply_document_timeseries(old, -1);
+    end if;
+    return old;
+end;
+$$;
+
+-- Adds p_delta to the daily topic rollups of one topic row, if its document is processed
+create or replace function public.apply_topic_timeseries_delta(p_document_id uuid, p_topic_name text, p_delta integer)
+returns void
+language plpgsql
+as $$
+declare
+    doc record;
+    basis record;
+begin
+    if public.analytics_topic_key(p_topic_name) is null then
+        return;
+    end if;
+    -- Documents being deleted are already gone here; their delete trigger subtracted the topics
+    select d.project_id, d.overall_sentiment, d.analysis, d.processed_at into doc
+    from public.documents d
+    where d.id = p_document_id and d.status = 'processed' and d.project_id is not null;
+    if not found then
+        return;
+    end if;
+    for basis in
+        select 'response_date' as date_basis, public.analytics_response_day(doc.analysis) as day
+        union all
+        select 'processed_at', public.analytics_processed_day(doc.processed_at)
+    loop
+        if basis.day is not null then
+            insert into public.project_topic_daily as c
+                (project_id, date_basis, bucket_date, sentiment, complexity, topic, topic_count)
+            values (
+                doc.project_id,
+                basis.date_basis,
+                basis.day,
+                public.analytics_sentiment_key(doc.overall_sentiment),
+                public.analytics_complexity_key(doc.analysis),
+                public.analytics_topic_key(p_topic_name),
+                p_delta
+            )
+            on conflict (project_id, date_basis, bucket_date, sentiment, complexity, topic)
+            do update set topic_count = c.topic_count + excluded.topic_count;
+        end if;
+    end loop;
+end;
+$$;
+
+create or replace function public.document_topics_analytics_timeseries()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op in ('UPDATE', 'DELETE') then
+        perform public.apply_topic_timeseries_delta(old.document_id, old.topic_name, -1);
+    end if;
+    if tg_op in ('INSERT', 'UPDATE') then
+        perform public.apply_topic_timeseries_delta(new.document_id, new.topic_name, 1);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists documents_analytics_timeseries on public.documents;
+create trigger documents_analytics_timeseries
+    after insert or update of status, project_id, overall_sentiment, analysis, processed_at on public.documents
+    for each row execute function public.documents_analytics_timeseries();
+
+drop trigger if exists documents_analytics_timeseries_before_delete on public.documents;
+create trigger documents_analytics_timeseries_before_delete
+    before delete on public.documents
+    for each row execute function public.documents_analytics_timeseries_before_delete();
+
+drop trigger if exists document_topics_analytics_timeseries on public.document_topics;
+create trigger document_topics_analytics_timeseries
+    after insert or update of document_id, topic_name or delete on public.document_topics
+    for each row execute function public.document_topics_analytics_timeseries();
+
+-- processed_at changes without another analytics column must also invalidate cached trends
+drop trigger if exists documents_analytics_version on public.documents;
+create trigger documents_analytics_version
+    after insert or update of status, project_id, overall_sentiment, analysis, processed_at or delete
+    on public.documents
+    for each row execute function public.documents_analytics_version();
+
+-- Buckets of one resolution ('day', 'week' starting Monday, or 'month') rolled up from the daily rows,
+-- oldest first: [{bucket_start, total_documents, sentiment_distribution, complexity_distribution, top_topics}]
+create or replace function public.analytics_timeseries(
+    p_project_id uuid,
+    p_date_basis text default 'processed_at',
+    p_resolution text default 'week',
+    p_from date default null,
+    p_to date default null,
+    p_sentiment text default null,
+    p_complexity text default null,
+    p_top_n integer default 5
+)
+returns jsonb
+language plpgsql
+stable
+as $$
+declare
+    result jsonb;
+begin
+    if p_resolution not in ('day', 'week', 'month') then
+        raise exception 'Unknown resolution: %', p_resolution;
+    end if;
+
+    with days as (
+        select date_trunc(p_resolution, c.bucket_date::timestamp)::date as bucket,
+               c.sentiment, c.complexity, c.document_count
+        from public.project_analytics_daily c
+        where c.project_id = p_project_id
+          and c.date_basis = p_date_basis
+          and (p_from is null or c.bucket_date >= p_from)
+          and (p_to is null or c.bucket_date <= p_to)
+          and (p_sentiment is null or c.sentiment = p_sentiment)
+          and (p_complexity is null or c.complexity = p_complexity)
+    ),
+    sentiments as (
+        select bucket, sentiment, sum(document_count) as n from days group by 1, 2 having sum(document_count) > 0
+    ),
+    complexities as (
+        select bucket, complexity, sum(document_count) as n from days group by 1, 2 having sum(document_count) > 0
+    ),
+    buckets as (
+        select bucket, sum(n) as total from sentiments group by bucket
+    ),
+    topics as (
+        select bucket, topic, n, row_number() over (partition by bucket order by n desc, topic) as rank
+        from (
+            select date_trunc(p_resolution, c.bucket_date::timestamp)::date as bucket, c.topic, sum(c.topic_count) as n
+            from public.project_topic_daily c
+            where c.project_id = p_project_id
+              and c.date_basis = p_date_basis
+              and (p_from is null or c.bucket_date >= p_from)
+              and (p_to is null or c.bucket_date <= p_to)
+              and (p_sentiment is null or c.sentiment = p_sentiment)
+              and (p_complexity is null or c.complexity = p_complexity)
+            group by 1, 2
+            having sum(c.topic_count) > 0
+        ) grouped
+    )
+    select coalesce(jsonb_agg(
+        jsonb_build_object(
+            'bucket_start', b.bucket,
+            'total_documents', b.total,
+            'sentiment_distribution',
+                (select jsonb_object_agg(s.sentiment, s.n) from sentiments s where s.bucket = b.bucket),
+            'complexity_distribution',
+                (select jsonb_object_agg(x.complexity, x.n) from complexities x where x.bucket = b.bucket),
+            'top_topics', coalesce(
+                (
+                    select jsonb_agg(jsonb_build_object('topic', t.topic, 'topic_count', t.n) order by t.rank)
+                    from topics t
+                    where t.bucket = b.bucket and t.rank <= p_top_n
+                ),
+                '[]'::jsonb
+            )
+        )
+        order by b.bucket
+    ), '[]'::jsonb)
+    into result
+    from buckets b;
+    return result;
+end;
+$$;
+
+-- Recomputes the daily rollups of one project (or of all projects) from the documents and topics.
+create or replace function public.rebuild_analytics_timeseries(p_project_id uuid default null)
+returns void
+language plpgsql
+as $$
+begin
+    lock table public.project_analytics_daily, public.project_topic_daily in exclusive mode;
+
+    delete from public.project_analytics_daily where p_project_id is null or project_id = p_project_id;
+    delete from public.project_topic_daily where p_project_id is null or project_id = p_project_id;
+
+    with docs as (
+        select d.id, d.project_id, basis.date_basis, basis.day,
+               public.analytics_sentiment_key(d.overall_sentiment) as sentiment,
+               public.analytics_complexity_key(d.analysis) as complexity
+        from public.documents d
+        cross join lateral (
+            values ('response_date', public.analytics_response_day(d.analysis)),
+                   ('processed_at', public.analytics_processed_day(d.processed_at))
+        ) as basis (date_basis, day)
+        where d.status = 'processed' and d.project_id is not null and basis.day is not null
+          and (p_project_id is null or d.project_id = p_project_id)
+    ),
+    document_rows as (
+        insert into public.project_analytics_daily
+            (project_id, date_basis, bucket_date, sentiment, complexity, document_count)
+        select project_id, date_basis, day, sentiment, complexity, count(*)
+        from docs
+        group by 1, 2, 3, 4, 5
+    )
+    insert into public.project_topic_daily
+        (project_id, date_basis, bucket_date, sentiment, complexity, topic, topic_count)
+    select docs.project_id, docs.date_basis, docs.day, docs.sentiment, docs.complexity,
+           public.analytics_topic_key(t.topic_name), count(*)
+    from docs
+    join public.document_topics t on t.document_id = docs.id
+    where public.analytics_topic_key(t.topic_name) is not null
+    group by 1, 2, 3, 4, 5, 6;
+end;
+$$;
+
+select public.rebuild_analytics_timeseries();
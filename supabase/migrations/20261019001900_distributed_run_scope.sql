@@ -0,0 +1,62 @@
+-- Distributed runs are scoped to the project and step they were planned for: claims only lease
+-- batches of that step's runs, so a worker started under another step's URL finds nothing to do.
+drop function if exists public.claim_step_run_batch(uuid, text, integer, integer);
+
+create or replace function public.claim_step_run_batch(
+    p_run_id uuid,
+    p_worker text,
+    p_lease_seconds integer default 120,
+    p_max_attempts integer default 3,
+    p_project_id uuid default null,
+    p_step_id uuid default null
+)
+returns setof public.step_run_batches
+language plpgsql
+security invoker
+as $$
+begin
+    update public.step_run_batches
+    set status = 'failed', lease_owner = null, last_error = 'lease expired'
+    where run_id = p_run_id
+      and (p_project_id is null or project_id = p_project_id)
+      and (p_step_id is null or step_id = p_step_id)
+      and status = 'leased'
+      and lease_expires_at < now()
+      and attempts >= p_max_attempts;
+
+    return query
+    update public.step_run_batches b
+    set status = 'leased',
+        lease_owner = p_worker,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        attempts = b.attempts + 1
+    where b.id = (
+        select c.id
+        from public.step_run_batches c
+        where c.run_id = p_run_id
+          and (p_project_id is null or c.project_id = p_project_id)
+          and (p_step_id is null or c.step_id = p_step_id)
+          and (c.status = 'pending' or (c.status = 'leased' and c.lease_expires_at < now()))
+        order by c.batch_index
+        limit 1
+        for update skip locked
+    )
+    returning b.*;
+end;
+$$;
+
+-- Token usage of one run of a step, summed over the usage rows of all its workers. The token budget
+-- of a distributed run is checked against this total, so workers share one budget.
+create or replace function public.step_run_token_usage(p_step_id uuid, p_run_id uuid)
+returns table (prompt_tokens bigint, completion_tokens bigint, cached_tokens bigint, calls bigint)
+language sql
+stable
+security invoker
+as $$
+    select coalesce(sum(u.prompt_tokens), 0)::bigint,
+           coalesce(sum(u.completion_tokens), 0)::bigint,
+           coalesce(sum(u.cached_tokens), 0)::bigint,
+           count(*)::bigint
+    from public.llm_usage_events u
+    where u.step_id = p_step_id and u.run_id = p_run_id;
+$$;
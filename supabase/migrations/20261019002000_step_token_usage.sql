@@ -0,0 +1,75 @@
+-- Token usage of a custom step aggregated in the database: step and project totals, per-run totals
+-- (oldest run first) and the p_document_limit most expensive documents. Only the aggregates travel
+-- to the API, however many usage rows the project has.
+create or replace function public.step_token_usage(
+    p_project_id uuid,
+    p_step_id uuid,
+    p_document_limit integer default 100
+)
+returns jsonb
+language sql
+stable
+security invoker
+as $$
+    with step_rows as (
+        select u.run_id, u.document_id, u.prompt_tokens, u.completion_tokens, u.cached_tokens, u.created_at
+        from public.llm_usage_events u
+        where u.project_id = p_project_id and u.step_id = p_step_id
+    ),
+    runs as (
+        select run_id,
+               sum(prompt_tokens) as prompt_tokens,
+               sum(completion_tokens) as completion_tokens,
+               sum(cached_tokens) as cached_tokens,
+               count(*) as calls,
+               min(created_at) as first_call_at
+        from step_rows
+        group by run_id
+    ),
+    documents as (
+        select document_id,
+               sum(prompt_tokens) as prompt_tokens,
+               sum(completion_tokens) as completion_tokens,
+               sum(cached_tokens) as cached_tokens,
+               count(*) as calls
+        from step_rows
+        group by document_id
+        order by sum(prompt_tokens + completion_tokens) desc, document_id
+        limit p_document_limit
+    )
+    select jsonb_build_object(
+        'step_totals', (
+            select jsonb_build_object(
+                'prompt_tokens', coalesce(sum(prompt_tokens), 0),
+                'completion_tokens', coalesce(sum(completion_tokens), 0),
+                'cached_tokens', coalesce(sum(cached_tokens), 0),
+                'calls', count(*)
+            )
+            from step_rows
+        ),
+        'project_totals', (
+            select jsonb_build_object(
+                'prompt_tokens', coalesce(sum(u.prompt_tokens), 0),
+                'completion_tokens', coalesce(sum(u.completion_tokens), 0),
+                'cached_tokens', coalesce(sum(u.cached_tokens), 0),
+                'calls', count(*)
+            )
+            from public.llm_usage_events u
+            where u.project_id = p_project_id
+        ),
+        'runs', coalesce(
+            (select jsonb_agg(to_jsonb(r) - 'first_call_at' order by r.first_call_at) from runs r),
+            '[]'::jsonb
+        ),
+        'documents', coalesce(
+            (
+                select jsonb_agg(to_jsonb(d) order by d.prompt_tokens + d.completion_tokens desc, d.document_id)
+                from documents d
+            ),
+            '[]'::jsonb
+        )
+    );
+$$;
+
+-- Step usage reads filter by project and step together
+create index if not exists llm_usage_events_project_step_idx on public.llm_usage_events (project_id, step_id);
@@ -0,0 +1,62 @@
+-- The summary's sentiment and complexity filters compare the normalized keys the counters use
+-- (analytics_sentiment_key / analytics_complexity_key), so a filtered summary computed from the
+-- documents matches the counter-based summary for the same filter (e.g. 'Positive ' or a blank
+-- complexity level counted as 'unknown').
+create or replace function public.analytics_summary(
+    p_project_id uuid default null,
+    p_sentiment text default null,
+    p_complexity text default null,
+    p_topics text[] default null,
+    p_top_n integer default 10
+)
+returns jsonb
+language sql
+stable
+security invoker
+as $$
+    with filtered as (
+        select d.id,
+               public.analytics_sentiment_key(d.overall_sentiment) as sentiment,
+               public.analytics_complexity_key(d.analysis) as complexity
+        from public.documents d
+        where d.status = 'processed'
+          and (p_project_id is null or d.project_id = p_project_id)
+          and (
+              p_sentiment is null
+              or public.analytics_sentiment_key(d.overall_sentiment) = public.analytics_sentiment_key(p_sentiment)
+          )
+          and (
+              p_complexity is null
+              or public.analytics_complexity_key(d.analysis)
+                 = public.analytics_complexity_key(jsonb_build_object('complexity_level', p_complexity))
+          )
+          and (
+              p_topics is null
+              or d.doc_seq in (select f.doc_seq from public.topic_filter_documents(p_project_id, p_topics) f)
+          )
+    ),
+    sentiments as (
+        select sentiment, count(*) as n from filtered group by sentiment
+    ),
+    complexities as (
+        select complexity, count(*) as n from filtered group by complexity
+    ),
+    topics as (
+        select public.analytics_topic_key(t.topic_name) as topic, count(*) as n
+        from filtered f
+        join public.document_topics t on t.document_id = f.id
+        where public.analytics_topic_key(t.topic_name) is not null
+        group by 1
+        order by n desc, topic
+        limit p_top_n
+    )
+    select jsonb_build_object(
+        'total_documents', (select count(*) from filtered),
+        'sentiment_distribution', coalesce((select jsonb_object_agg(sentiment, n) from sentiments), '{}'::jsonb),
+        'complexity_distribution', coalesce((select jsonb_object_agg(complexity, n) from complexities), '{}'::jsonb),
+        'top_topics', coalesce(
+            (select jsonb_agg(jsonb_build_object('topic', topic, 'topic_count', n) order by n desc, topic) from topics),
+            '[]'::jsonb
+        )
+    );
+$$;